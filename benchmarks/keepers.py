@@ -0,0 +1,307 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2017-2018 reverendus
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Drives `synchronize_orders()` of the keepers for centralized exchanges against a `SimulatedExchange`.
+
+Usage: python3 -m benchmarks.keepers [--keeper okex ...] [--cycles 200] [--latency 0.05] ...
+
+Each keeper gets created the same way it gets created in production (its API client is replaced with
+a stand-in backed by the simulated exchange), then its `synchronize_orders()` gets called every `--interval`
+seconds while the price moves around 1.0 and other market participants take some of its orders.
+Orders get placed and cancelled by the keeper's own `OrderBookManager` and worker threads, so
+`--refresh-frequency` and `--max-workers` can be tuned against `--latency`, `--error-rate` and `--rate-limit`.
+Reported are orders placed per second, the latency between cancelling an order and placing the order
+replacing it, and the CPU time `synchronize_orders()` takes per cycle.
+"""
+
+import argparse
+import json
+import logging
+import math
+import resource
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from collections import deque
+
+import numpy as np
+
+from market_maker_keeper.keeper_hub import KeeperHub
+from market_maker_keeper.multi_pair_keeper import MultiPairKeeper
+from market_maker_keeper.price_feed import Price, PriceFeed
+from market_maker_keeper.rate_limit import TokenBucket
+from market_maker_keeper.simulated_exchange import SimulatedExchange
+from pymaker.numeric import Wad
+
+API_SERVER = 'http://simulated-exchange'
+API_KEY = 'benchmark'
+
+BANDS = {
+    "buyBands": [{"minMargin": 0.005, "avgMargin": 0.01, "maxMargin": 0.02, "minAmount": 20.0, "avgAmount": 30.0,
+                  "maxAmount": 40.0, "dustCutoff": 0.0},
+                 {"minMargin": 0.02, "avgMargin": 0.03, "maxMargin": 0.04, "minAmount": 20.0, "avgAmount": 30.0,
+                  "maxAmount": 40.0, "dustCutoff": 0.0}],
+    "sellBands": [{"minMargin": 0.005, "avgMargin": 0.01, "maxMargin": 0.02, "minAmount": 20.0, "avgAmount": 30.0,
+                   "maxAmount": 40.0, "dustCutoff": 0.0},
+                  {"minMargin": 0.02, "avgMargin": 0.03, "maxMargin": 0.04, "minAmount": 20.0, "avgAmount": 30.0,
+                   "maxAmount": 40.0, "dustCutoff": 0.0}]
+}
+
+
+class SimulatedApi:
+    """Base class of the stand-ins for `pyexchange` API clients, forwarding to a `SimulatedExchange`.
+
+    Measures the time between a cancellation and the placement of the next order on the same side.
+    """
+
+    def __init__(self, exchange: SimulatedExchange, base_token: str, quote_token: str):
+        self.exchange = exchange
+        self.base_token = base_token
+        self.quote_token = quote_token
+        self.cancel_to_replace = []
+
+        self._sides = {}
+        self._cancelled = {True: deque(), False: deque()}
+        self._lock = threading.Lock()
+
+    def _get_orders(self) -> list:
+        return self.exchange.get_orders()
+
+    def _place_order(self, is_sell: bool, price: Wad, amount: Wad) -> str:
+        order = self.exchange.place_order(is_sell, price, amount)
+
+        with self._lock:
+            self._sides[order.order_id] = is_sell
+            if len(self._cancelled[is_sell]) > 0:
+                self.cancel_to_replace.append(time.perf_counter() - self._cancelled[is_sell].popleft())
+
+        return order.order_id
+
+    def _cancel_order(self, order_id: str) -> bool:
+        result = self.exchange.cancel_order(str(order_id))
+
+        with self._lock:
+            if result and str(order_id) in self._sides:
+                self._cancelled[self._sides.pop(str(order_id))].append(time.perf_counter())
+
+        return result
+
+    def _balances(self) -> dict:
+        balances = self.exchange.get_balances()
+
+        return {self.base_token: str(balances[self.exchange.base_token]),
+                self.quote_token: str(balances[self.exchange.quote_token])}
+
+
+class SimulatedOkexApi(SimulatedApi):
+    def get_orders(self, pair: str) -> list:
+        return self._get_orders()
+
+    def get_balances(self) -> dict:
+        return {'free': self._balances()}
+
+    def place_order(self, pair: str, is_sell: bool, price: Wad, amount: Wad) -> str:
+        return self._place_order(is_sell, price, amount)
+
+    def cancel_order(self, pair: str, order_id: str) -> bool:
+        return self._cancel_order(order_id)
+
+
+class SimulatedGateIOApi(SimulatedOkexApi):
+    def get_balances(self) -> dict:
+        return {'available': self._balances()}
+
+
+class SimulatedKucoinApi(SimulatedApi):
+    def get_orders(self, pair: str) -> list:
+        return self._get_orders()
+
+    def get_balances(self) -> list:
+        return [{'coinType': token, 'balance': balance} for token, balance in self._balances().items()]
+
+    def place_order(self, pair: str, is_sell: bool, price: Wad, amount: Wad) -> str:
+        return self._place_order(is_sell, price, amount)
+
+    def cancel_order(self, order_id: str, is_sell: bool, pair: str) -> bool:
+        return self._cancel_order(order_id)
+
+
+class SimulatedHitBTCApi(SimulatedApi):
+    def get_orders(self, pair: str) -> list:
+        return self._get_orders()
+
+    def get_balances(self) -> list:
+        return [{'currency': token, 'available': balance} for token, balance in self._balances().items()]
+
+    def place_order(self, pair: str, is_sell: bool, price: Wad, amount: Wad) -> str:
+        return self._place_order(is_sell, price, amount)
+
+    def cancel_order(self, order_id: str) -> bool:
+        return self._cancel_order(order_id)
+
+
+class SimulatedEthfinexApi(SimulatedHitBTCApi):
+    pass
+
+
+class SimulatedGOPAXApi(SimulatedHitBTCApi):
+    def get_order(self, order_id: str):
+        return next(filter(lambda order: order.order_id == order_id, self._get_orders()))
+
+    def get_balances(self) -> list:
+        return [{'asset': token, 'avail': balance} for token, balance in self._balances().items()]
+
+
+class SimulatedBiboxApi(SimulatedApi):
+    def get_orders(self, pair: str, retry: bool = False) -> list:
+        return self._get_orders()
+
+    def coin_list(self, retry: bool = False) -> list:
+        return [{'symbol': token, 'balance': balance} for token, balance in self._balances().items()]
+
+    def place_order(self, is_sell: bool, amount: Wad, amount_symbol: str, money: Wad, money_symbol: str) -> str:
+        return self._place_order(is_sell, money / amount, amount)
+
+    def cancel_order(self, order_id: str) -> bool:
+        return self._cancel_order(order_id)
+
+
+# keeper name -> (API stand-in, pair, base token, quote token, name of the secret argument)
+KEEPERS = {
+    'bibox': (SimulatedBiboxApi, 'ETH_DAI', 'ETH', 'DAI', 'bibox-secret'),
+    'ethfinex': (SimulatedEthfinexApi, 'ETHDAI', 'ETH', 'DAI', 'ethfinex-api-secret'),
+    'gateio': (SimulatedGateIOApi, 'eth_dai', 'ETH', 'DAI', 'gateio-secret-key'),
+    'gopax': (SimulatedGOPAXApi, 'ETH-DAI', 'ETH', 'DAI', 'gopax-api-secret'),
+    'hitbtc': (SimulatedHitBTCApi, 'ETHDAI', 'ETH', 'DAI', 'hitbtc-secret-key'),
+    'kucoin': (SimulatedKucoinApi, 'ETH-DAI', 'ETH', 'DAI', 'kucoin-secret-key'),
+    'okex': (SimulatedOkexApi, 'eth_dai', 'eth', 'dai', 'okex-secret-key')
+}
+
+
+class BenchmarkPriceFeed(PriceFeed):
+    def __init__(self):
+        self.price = None
+
+    def get_price(self) -> Price:
+        return Price(buy_price=self.price, sell_price=self.price)
+
+
+def thread_cpu_time() -> float:
+    # CPU time of the calling thread only, so the background threads of the keeper do not count
+    usage = resource.getrusage(resource.RUSAGE_THREAD)
+    return usage.ru_utime + usage.ru_stime
+
+
+def percentile(values: list, percent: float) -> float:
+    return float(np.percentile(values, percent)) if len(values) > 0 else float('nan')
+
+
+def run(name: str, config: str, arguments) -> dict:
+    api_class, pair, base_token, quote_token, secret_argument = KEEPERS[name]
+
+    exchange = SimulatedExchange('eth_dai', {'eth': Wad.from_number(1000), 'dai': Wad.from_number(1000)},
+                                 latency=arguments.latency,
+                                 error_rate=arguments.error_rate,
+                                 rate_limit=TokenBucket(arguments.rate_limit, max(int(arguments.rate_limit), 1))
+                                 if arguments.rate_limit else None,
+                                 seed=0)
+    api = api_class(exchange, base_token, quote_token)
+
+    hub = KeeperHub(max_workers=arguments.max_workers)
+    hub.shared((f'{name}-api', API_SERVER, API_KEY), lambda: api)
+
+    keeper = MultiPairKeeper.keeper_class(name)(MultiPairKeeper.keeper_arguments({
+        f'{name}-api-server': API_SERVER,
+        f'{name}-api-key': API_KEY,
+        secret_argument: API_KEY,
+        'config': config,
+        'price-feed': 'fixed:1.0',
+        'refresh-frequency': arguments.refresh_frequency,
+        'bands-engine': arguments.bands_engine
+    }, pair, {}, arguments.debug), hub)
+
+    if not arguments.debug:
+        logging.getLogger().setLevel(logging.CRITICAL)
+
+    price_feed = BenchmarkPriceFeed()
+    keeper.price_feed = price_feed
+    np.random.seed(0)
+
+    cpu_times = []
+    started = time.perf_counter()
+    for cycle in range(arguments.cycles):
+        price_feed.price = Wad.from_number(1 + 0.02 * math.sin(2 * math.pi * cycle / 50))
+        exchange.take(cycle % 2 == 0, Wad.from_number(5))
+
+        cycle_started = thread_cpu_time()
+        try:
+            keeper.synchronize_orders()
+        except Exception as e:
+            logging.getLogger().debug(f"Synchronization has failed ({e})")
+        cpu_times.append(thread_cpu_time() - cycle_started)
+
+        time.sleep(arguments.interval)
+    elapsed = time.perf_counter() - started
+
+    return {'orders/s': exchange.orders_placed / elapsed,
+            'cancels/s': exchange.orders_cancelled / elapsed,
+            'replace p50 (ms)': percentile(api.cancel_to_replace, 50) * 1000,
+            'replace p95 (ms)': percentile(api.cancel_to_replace, 95) * 1000,
+            'CPU/cycle (ms)': statistics.mean(cpu_times) * 1000,
+            'failed requests': exchange.failed_requests}
+
+
+def main(args: list):
+    parser = argparse.ArgumentParser(prog='benchmarks.keepers')
+    parser.add_argument("--keeper", type=str, nargs='+', default=sorted(KEEPERS), choices=sorted(KEEPERS),
+                        help="Keepers to benchmark (default: all)")
+    parser.add_argument("--cycles", type=int, default=200,
+                        help="Number of calls to `synchronize_orders()` (default: 200)")
+    parser.add_argument("--interval", type=float, default=0.05,
+                        help="Time between the calls (in seconds, default: 0.05)")
+    parser.add_argument("--latency", type=float, default=0.05,
+                        help="Time each exchange API call takes (in seconds, default: 0.05)")
+    parser.add_argument("--error-rate", type=float, default=0.0,
+                        help="Probability of an exchange API call failing (default: 0.0)")
+    parser.add_argument("--rate-limit", type=float,
+                        help="Exchange API calls allowed per second, calls above it fail (default: no limit)")
+    parser.add_argument("--refresh-frequency", type=int, default=1,
+                        help="Order book refresh frequency of the keepers (in seconds, default: 1)")
+    parser.add_argument("--max-workers", type=int, default=5,
+                        help="Number of threads placing and cancelling orders (default: 5)")
+    parser.add_argument("--bands-engine", type=str, default='python', choices=['python', 'numpy'],
+                        help="Implementation of the bands calculations used by the keepers (default: python)")
+    parser.add_argument("--debug", dest='debug', action='store_true',
+                        help="Enable debug output")
+    arguments = parser.parse_args(args)
+
+    with tempfile.NamedTemporaryFile('w', suffix='.json', delete=False) as config:
+        json.dump(BANDS, config)
+
+    results = {name: run(name, config.name, arguments) for name in arguments.keeper}
+    columns = list(next(iter(results.values())).keys())
+
+    print(f"{'keeper':<10}" + ''.join(f"{column:>18}" for column in columns))
+    for name, result in results.items():
+        print(f"{name:<10}" + ''.join(f"{result[column]:>18.2f}" if isinstance(result[column], float)
+                                      else f"{result[column]:>18}" for column in columns))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
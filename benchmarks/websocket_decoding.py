@@ -0,0 +1,123 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2017-2018 reverendus
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Compares the old and the new way of decoding OKEx WebSocket frames in `WebSocketFeed`.
+
+Usage: python3 -m benchmarks.websocket_decoding [capture file] [repetitions]
+
+The capture file has one message per line, either as JSON or in the `receive time<TAB>message` format
+written by the OKEx feeds. Messages get compressed the same way OKEx compresses them before the benchmark
+starts. Without a capture file, a synthetic stream of ticker messages gets used.
+"""
+
+import ast
+import datetime
+import json
+import sys
+import time
+import zlib
+
+from market_maker_keeper.decoding import JSON_BACKENDS, MessageDecoder, json_backend, parse_timestamp
+
+
+def read_messages(filename: str) -> list:
+    messages = []
+    with open(filename) as file:
+        for line in file:
+            message = line.rstrip('\n').split('\t')[-1]
+            if not message:
+                continue
+
+            try:
+                messages.append(json.loads(message))
+            except ValueError:
+                messages.append(ast.literal_eval(message))
+
+    return messages
+
+
+def synthetic_messages(count: int = 1000) -> list:
+    return [{'table': 'spot/ticker',
+             'data': [{'instrument_id': instrument_id, 'last': str(150 + index / 100), 'best_bid': str(150 + index / 100),
+                       'best_ask': str(150.01 + index / 100), 'base_volume_24h': '123456.7',
+                       'timestamp': f"2019-01-06T07:{index // 60 % 60:02d}:{index % 60:02d}.{index % 1000:03d}Z"}
+                      for instrument_id in ['ETH-USDT', 'BTC-USDT', 'MKR-USDT']]}
+            for index in range(count)]
+
+
+def compress(message: dict) -> bytes:
+    compressor = zlib.compressobj(wbits=-zlib.MAX_WBITS)
+    return compressor.compress(json.dumps(message).encode()) + compressor.flush()
+
+
+def decode_old(frame: bytes):
+    decompress = zlib.decompressobj(-zlib.MAX_WBITS)
+    message = (decompress.decompress(frame) + decompress.flush()).decode()
+    message_dict = json.loads(message)
+    if 'data' not in message_dict:
+        return None
+
+    result = None
+    for data in message_dict['data']:
+        if 'timestamp' in data:
+            utc_dt = datetime.datetime.strptime(data['timestamp'], '%Y-%m-%dT%H:%M:%S.%fZ')
+            result = data, (utc_dt - datetime.datetime(1970, 1, 1)).total_seconds()
+
+    return result
+
+
+def decode_new(decoder: MessageDecoder):
+    def decode(frame: bytes):
+        message_dict = decoder.decode(frame)
+        if 'data' not in message_dict or len(message_dict['data']) == 0:
+            return None
+
+        data = message_dict['data'][-1]
+        return (data, parse_timestamp(data['timestamp'])) if 'timestamp' in data else None
+
+    return decode
+
+
+def run(name: str, decode, frames: list, repetitions: int):
+    started = time.perf_counter()
+    for _ in range(repetitions):
+        for frame in frames:
+            decode(frame)
+    elapsed = time.perf_counter() - started
+
+    print(f"{name:<20} {len(frames) * repetitions / elapsed:>12,.0f} frames/s")
+
+
+def main(args: list):
+    messages = read_messages(args[0]) if len(args) > 0 else synthetic_messages()
+    repetitions = int(args[1]) if len(args) > 1 else 10
+    frames = [compress(message) for message in messages]
+
+    print(f"{len(frames)} frames, {sum(map(len, frames)) / len(frames):.0f} bytes on average, {repetitions} repetitions")
+    run('old', decode_old, frames, repetitions)
+    for backend in JSON_BACKENDS:
+        try:
+            json_backend(backend)
+        except ImportError:
+            print(f"{'new (' + backend + ')':<20} {'not installed':>12}")
+            continue
+
+        run(f"new ({backend})", decode_new(MessageDecoder(backend)), frames, repetitions)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -16,12 +16,92 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import math
 from functools import total_ordering, reduce
 from decimal import *
 
 
 _context = Context(prec=1000, rounding=ROUND_DOWN)
 
+# `Decimal` multiplications and divisions (unlike the `quantize()` calls, which use `_context`)
+# are performed in the default decimal context, i.e. rounded to 28 significant digits using
+# the ROUND_HALF_EVEN rounding mode. The integer fast paths below reproduce this rounding exactly.
+_PRECISION = 28
+_POWERS_OF_TEN = [10 ** i for i in range(0, 128)]
+
+
+def _pow10(exponent: int) -> int:
+    return _POWERS_OF_TEN[exponent] if exponent < 128 else 10 ** exponent
+
+
+def _digits(value: int) -> int:
+    """Returns the number of decimal digits of a positive integer."""
+    estimate = (value.bit_length() * 1292913986) >> 32
+    return estimate + 1 if value >= _pow10(estimate) else estimate
+
+
+def _truncate(dividend: int, divisor: int) -> int:
+    """Divides by a positive integer, rounding towards zero (like `ROUND_DOWN` does)."""
+    return dividend // divisor if dividend >= 0 else -(-dividend // divisor)
+
+
+def _round_to_precision(value: int) -> int:
+    """Rounds an integer to `_PRECISION` significant digits, the way `Decimal` arithmetic does."""
+    magnitude = -value if value < 0 else value
+    if magnitude < _POWERS_OF_TEN[_PRECISION]:
+        return value
+
+    unit = _pow10(_digits(magnitude) - _PRECISION)
+    quotient, remainder = divmod(magnitude, unit)
+    half = unit >> 1
+    if remainder > half or (remainder == half and quotient & 1):
+        quotient += 1
+
+    return quotient * unit if value > 0 else -quotient * unit
+
+
+def _divide(dividend: int, divisor: int) -> int:
+    """Returns `dividend / divisor` rounded to `_PRECISION` significant digits the way `Decimal`
+    division does, and then truncated to an integer (like `quantize(1, ROUND_DOWN)` does)."""
+    negative = (dividend < 0) != (divisor < 0)
+    dividend = abs(dividend)
+    divisor = abs(divisor)
+
+    if dividend == 0:
+        return 0
+
+    # If the integer part has fewer than `_PRECISION` digits, rounding only affects the fractional
+    # part, so the result is the integer part unless the fraction gets rounded up to one.
+    quotient, remainder = divmod(dividend, divisor)
+    if quotient < _POWERS_OF_TEN[_PRECISION - 1]:
+        fractional_digits = _PRECISION - (_digits(quotient) if quotient > 0 else 0)
+        if remainder > 0 and 2 * (divisor - remainder) * _POWERS_OF_TEN[fractional_digits] <= divisor:
+            quotient += 1
+
+        return -quotient if negative else quotient
+
+    # Scale the quotient so it has exactly `_PRECISION` digits before the decimal point,
+    # which takes at most one correction of the initial estimate.
+    exponent = _digits(dividend) - _digits(divisor) - _PRECISION
+    while True:
+        if exponent >= 0:
+            denominator = divisor * _pow10(exponent)
+            quotient, remainder = divmod(dividend, denominator)
+        else:
+            denominator = divisor
+            quotient, remainder = divmod(dividend * _pow10(-exponent), denominator)
+
+        if quotient < _POWERS_OF_TEN[_PRECISION]:
+            break
+
+        exponent += 1
+
+    if 2 * remainder > denominator or (2 * remainder == denominator and quotient & 1):
+        quotient += 1
+
+    result = quotient * _pow10(exponent) if exponent >= 0 else quotient // _pow10(-exponent)
+    return -result if negative else result
+
 
 @total_ordering
 class Wad:
@@ -36,6 +116,10 @@ class Wad:
     Notes:
         The internal representation of `Wad` is an unbounded integer, the last 18 digits of it being treated
         as decimal places. It is similar to the representation used in Maker contracts (`uint128`).
+
+        Multiplication and division by `Wad` and `int`, as well as `from_number()` called with `int` and
+        `float` numbers, are calculated using integer arithmetic only. Results are identical to the ones
+        of the `Decimal` based calculation used for the other types.
     """
 
     def __init__(self, value):
@@ -46,7 +130,9 @@ class Wad:
                 of Maker contracts is used which means that passing `1` will create an instance of `Wad`
                 with a value of `0.000000000000000001'.
         """
-        if isinstance(value, Wad):
+        if type(value) is int:
+            self.value = value
+        elif isinstance(value, Wad):
             self.value = value.value
         elif isinstance(value, Ray):
             self.value = int((Decimal(value.value) // (Decimal(10)**Decimal(9))).quantize(1, context=_context))
@@ -61,6 +147,18 @@ class Wad:
     @classmethod
     def from_number(cls, number):
         # assert(number >= 0)
+        if type(number) is int:
+            return Wad(_round_to_precision(number * _POWERS_OF_TEN[18]))
+
+        if type(number) is float and math.isfinite(number):
+            # `str()` gives the shortest representation of the float, at most 17 significant digits,
+            # so scaling it by 10**18 is always exact and only the truncation is left.
+            mantissa, _, exponent = str(number).partition('e')
+            integer_part, _, fractional_part = mantissa.partition('.')
+            digits = int(integer_part + fractional_part)
+            exponent = (int(exponent) if exponent else 0) - len(fractional_part) + 18
+            return Wad(digits * _pow10(exponent) if exponent >= 0 else _truncate(digits, _pow10(-exponent)))
+
         pwr = Decimal(10) ** 18
         dec = Decimal(str(number)) * pwr
         return Wad(int(dec.quantize(1, context=_context)))
@@ -87,8 +185,7 @@ class Wad:
     # z = cast((uint256(x) * y + WAD / 2) / WAD);
     def __mul__(self, other):
         if isinstance(other, Wad):
-            result = Decimal(self.value) * Decimal(other.value) / (Decimal(10) ** Decimal(18))
-            return Wad(int(result.quantize(1, context=_context)))
+            return Wad(_truncate(_round_to_precision(self.value * other.value), _POWERS_OF_TEN[18]))
         elif isinstance(other, Ray):
             result = Decimal(self.value) * Decimal(other.value) / (Decimal(10) ** Decimal(27))
             return Wad(int(result.quantize(1, context=_context)))
@@ -96,13 +193,17 @@ class Wad:
             result = Decimal(self.value) * Decimal(other.value) / (Decimal(10) ** Decimal(45))
             return Wad(int(result.quantize(1, context=_context)))
         elif isinstance(other, int):
-            return Wad(int((Decimal(self.value) * Decimal(other)).quantize(1, context=_context)))
+            return Wad(_round_to_precision(self.value * other))
         else:
             raise ArithmeticError
 
     def __truediv__(self, other):
         if isinstance(other, Wad):
-            return Wad(int((Decimal(self.value) * (Decimal(10) ** Decimal(18)) / Decimal(other.value)).quantize(1, context=_context)))
+            if other.value == 0:
+                # let `Decimal` raise exactly the same exception as it always did
+                return Wad(int((Decimal(self.value) * (Decimal(10) ** Decimal(18)) / Decimal(other.value)).quantize(1, context=_context)))
+
+            return Wad(_divide(_round_to_precision(self.value * _POWERS_OF_TEN[18]), other.value))
         else:
             raise ArithmeticError
 
@@ -3,12 +3,17 @@ from typing import List, Optional
 from pprint import pformat
 
 import logging
+import threading
+import time
 import requests
 import hmac
 import base64
 import datetime
 import json
 
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
 from futures_maker.numeric import Wad
 
 
@@ -49,22 +54,55 @@ class Order:
 
 class OKExSwapApi:
     """OKEx 永续合约API V3
+
+    All requests go through one `requests.Session`, so connections to the API server are kept alive
+    and reused. Requests are signed with the local clock corrected by the offset to the server clock,
+    which gets refreshed in the background every `clock_sync_interval` seconds.
+
+    Attributes:
+        api_server: Base URL of the API server.
+        timeout: Timeout (in seconds) of each HTTP request.
+        pool_size: Maximum number of connections kept alive in the pool.
+        max_retries: How many times failed connections and idempotent requests get retried.
+        clock_sync_interval: How often (in seconds) the offset to the server clock gets refreshed.
     """
 
     logger = logging.getLogger()
 
-    def __init__(self, api_server: str, api_key: str, secret_key: str, passphrase: str, timeout: int):
+    def __init__(self, api_server: str, api_key: str, secret_key: str, passphrase: str, timeout: int,
+                 pool_size: int = 10, max_retries: int = 3, clock_sync_interval: int = 60):
         assert(isinstance(api_server, str))
         assert(isinstance(api_key, str))
         assert(isinstance(secret_key, str))
         assert(isinstance(passphrase, str))
         assert(isinstance(timeout, int))
+        assert(isinstance(pool_size, int))
+        assert(isinstance(max_retries, int))
+        assert(isinstance(clock_sync_interval, int))
 
         self.api_server = api_server
         self.api_key = api_key
         self.secret_key = secret_key
         self.passphrase = passphrase
         self.timeout = timeout
+        self.pool_size = pool_size
+        self.max_retries = max_retries
+        self.clock_sync_interval = clock_sync_interval
+
+        # POST requests (placing and cancelling orders) are not idempotent, so they only get
+        # retried if the connection could not be established, never once they have been sent.
+        adapter = HTTPAdapter(pool_connections=1,
+                              pool_maxsize=pool_size,
+                              max_retries=Retry(total=max_retries, backoff_factor=0.1, status_forcelist=[502, 503, 504]))
+
+        self.session = requests.Session()
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+        self._clock_lock = threading.Lock()
+        self._clock_offset = None
+        self._clock_synced_at = 0.0
+        self._clock_sync_in_progress = False
 
     def ticker(self, instrument_id: str):
         """获取合约的最新成交价、买一价、卖一价和24交易量。
@@ -132,29 +170,46 @@ class OKExSwapApi:
         orders = filter(self._filter_order, result['order_info'])
         return list(map(self._parse_order, orders))
 
-    def place_order(self, instrument_id: str, type: int, price: Wad, size: Wad) -> str:
+    def get_order(self, instrument_id: str, order_id: str) -> Order:
+        """获取单个订单信息，order_id 可以是订单ID或者 client_oid
+        GET /api/swap/v3/orders/<instrument_id>/<order_id>
+        GET /api/swap/v3/orders/<instrument_id>/<client_oid>
+        """
+        assert(isinstance(instrument_id, str))
+        assert(isinstance(order_id, str))
+
+        result = self._http_get(f"/api/swap/v3/orders/{instrument_id}/{order_id}")
+        return self._parse_order(result)
+
+    def place_order(self, instrument_id: str, type: int, price: Wad, size: Wad, client_oid: Optional[str] = None) -> str:
         """下单
         type	String	是	可填参数：1:开多 2:开空 3:平多 4:平空
         match_price	String	否	是否以对手价下单 0:不是 1:是
+        client_oid	String	否	由您设置的订单ID来识别您的订单,字母开头,由字母和数字组成,1-32位
         POST /api/swap/v3/order{"client_oid":"12233456","size":"2","type":"1","match_price":"0","price":"432.11","instrument_id":"BTC-USD-SWAP"}
         """
         assert(isinstance(instrument_id, str))
         assert(isinstance(type, int))
         assert(isinstance(price, Wad))
         assert(isinstance(size, Wad))
+        assert(isinstance(client_oid, str) or (client_oid is None))
         assert((type >= 1) and (type <= 4))
 
         type_descs = {1: '开多', 2: '开空', 3: '平多', 4: '平空'}
         self.logger.info(f"Placing order ({type}-{type_descs[type]}, size {size} of {instrument_id},"
                          f" price {price})...")
 
+        params = {
+            'instrument_id': instrument_id,
+            'type': type,
+            'price': str(price),
+            'size': str(int(size))
+        }
+        if client_oid is not None:
+            params['client_oid'] = client_oid
+
         try:
-            result = self._http_post("/api/swap/v3/order", {
-                'instrument_id': instrument_id,
-                'type': type,
-                'price': str(price),
-                'size': str(int(size))
-            })
+            result = self._http_post("/api/swap/v3/order", params)
             order_id = str(result['order_id'])
             bol_result = bool(result['result'])
 
@@ -239,18 +294,52 @@ class OKExSwapApi:
         return f"{response.status_code} {response.reason} ({text})"
 
     def _get_timestamp(self):
-        now = datetime.datetime.utcnow()
-        t = now.isoformat()
-        return t + "Z"
+        """Returns the current server time in ISO format, estimated from the local clock and the clock offset."""
+        now = datetime.datetime.fromtimestamp(time.time() + self._get_clock_offset(), datetime.timezone.utc)
+        return now.strftime('%Y-%m-%dT%H:%M:%S.%f')[:-3] + "Z"
+
+    def _get_clock_offset(self) -> float:
+        with self._clock_lock:
+            offset = self._clock_offset
+            refresh = not self._clock_sync_in_progress and time.monotonic() - self._clock_synced_at >= self.clock_sync_interval
+            if refresh:
+                self._clock_sync_in_progress = True
+
+        # The first time we have to wait for the offset, later it gets refreshed in the background.
+        if offset is None:
+            self._sync_clock()
+            return self._clock_offset
+
+        if refresh:
+            threading.Thread(target=self._sync_clock, daemon=True).start()
+
+        return offset
+
+    def _sync_clock(self):
+        try:
+            requested_at = time.time()
+            data = self._result(self.session.get(f'{self.api_server}/api/general/v3/time', timeout=self.timeout), False)
+            received_at = time.time()
+
+            offset = float(data['epoch']) - (requested_at + received_at) / 2
+            self.logger.debug(f"Server clock offset is {offset:.3f}s")
+
+        except Exception as e:
+            self.logger.warning(f"Failed to read the server time ({e}), will retry in {self.clock_sync_interval}s")
+            offset = None
+
+        with self._clock_lock:
+            if offset is not None:
+                self._clock_offset = offset
+            elif self._clock_offset is None:
+                self._clock_offset = 0.0
 
-    def _get_server_timestamp(self):
-        data = self._result(requests.get(f'{self.api_server}/api/general/v3/time'), False)
-        return data['iso']
+            self._clock_synced_at = time.monotonic()
+            self._clock_sync_in_progress = False
 
     def _okex_header(self, method, request_path, body=""):
 
-        # timestamp = self._get_timestamp()
-        timestamp = self._get_server_timestamp()
+        timestamp = self._get_timestamp()
 
         """
         OK-ACCESS-SIGN的请求头是对timestamp + method + requestPath + body字符串(+表示字符串连接)，以及secretKey，使用HMAC SHA256方法加密，通过BASE64编码输出而得到的。
@@ -278,9 +367,9 @@ class OKExSwapApi:
         url = f"{self.api_server}{resource}"
         okex_header = self._okex_header('GET', resource)
 
-        return self._result(requests.get(url=url,
-                                         headers=okex_header,
-                                         timeout=self.timeout), check_result)
+        return self._result(self.session.get(url=url,
+                                             headers=okex_header,
+                                             timeout=self.timeout), check_result)
 
     def _http_post(self, resource: str, params: dict):
         assert(isinstance(resource, str))
@@ -290,10 +379,10 @@ class OKExSwapApi:
         body = str(params)
         okex_header = self._okex_header('POST', resource, body)
 
-        return self._result(requests.post(url=url,
-                                          data=body,
-                                          headers=okex_header,
-                                          timeout=self.timeout), True)
+        return self._result(self.session.post(url=url,
+                                              data=body,
+                                              headers=okex_header,
+                                              timeout=self.timeout), True)
 
 
 class OKExSwapApiFactory:
@@ -305,7 +394,9 @@ class OKExSwapApiFactory:
                               api_key=config["OKEX_API_KEY"],
                               secret_key=config["OKEX_API_SECRET"],
                               passphrase=config["OKEX_PASSPHRASE"],
-                              timeout=10)
+                              timeout=10,
+                              pool_size=int(config.get("OKEX_POOL_SIZE", 10)),
+                              max_retries=int(config.get("OKEX_MAX_RETRIES", 3)))
 
         return okexapi
 
@@ -2,10 +2,13 @@
 #
 
 from futures_maker.okex_api import OKExSwapApiFactory
+from futures_maker.order_executor import OrderExecutor
 from futures_maker.okex_websocket_feed import OkexWebSocketFeed
 from futures_maker.strategy import TrandStrategy
 from pymaker.lifecycle import Lifecycle
+from market_maker_keeper.capture import CaptureWriter
 from market_maker_keeper.util import setup_logging
+from market_maker_keeper.websocket_connection import WebSocketConnectionManager
 
 import json
 import logging
@@ -55,21 +58,30 @@ class OKExFuturesMaker:
         open_message = str(open_message_obj)
         open_message = open_message.replace("'", '"')
         logging.info(f"send subscribe {open_message}")
+
+        # 采集行情数据，用于离线回放（python3 -m market_maker_keeper.replay strategy ...）
+        if self.config.get("CAPTURE_FILE"):
+            WebSocketConnectionManager.default().capture_with(CaptureWriter(self.config["CAPTURE_FILE"]))
+
         self.okex_websocket_feed = OkexWebSocketFeed(self.config["OKEX_WEBSOCKET_URL"], open_message)
 
         self.strategy = TrandStrategy(self.instrument_id)
         self.strategy.set_api(self.okex_api)
 
+        self.order_executor = OrderExecutor(self.okex_api)
+        self.strategy.set_executor(self.order_executor)
+
         self.okex_websocket_feed.set_callback(self.strategy.run)
 
     def sync(self):
+        self.order_executor.check_fills()
         self.strategy.load_position()
         self.strategy.cancel_unfill_orders()
         pass
 
     def shutdown(self):
         logging.info(f"shutdown")
-        pass
+        self.order_executor.stop()
 
     def main(self):
         with Lifecycle() as lifecycle:
@@ -0,0 +1,199 @@
+# 异步下单执行层
+import logging
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+from futures_maker.numeric import Wad
+
+
+class PendingOrder:
+    """An order submitted through `OrderExecutor`, tracked until it gets filled or fails.
+
+    Attributes:
+        client_oid: Our own id of the order, sent to the exchange so the order can be placed idempotently.
+        order_id: Exchange id of the order, `None` until the order gets acknowledged.
+        state: One of `PENDING` (queued or being placed), `OPEN` (acknowledged), `FILLED` or `FAILED`
+            (rejected, cancelled or its placement failed).
+    """
+
+    PENDING = 'pending'
+    OPEN = 'open'
+    FILLED = 'filled'
+    FAILED = 'failed'
+
+    def __init__(self, client_oid: str, instrument_id: str, type: int, price: Wad, size: Wad,
+                 on_ack=None, on_fill=None, on_failure=None):
+        assert(isinstance(client_oid, str))
+        assert(isinstance(instrument_id, str))
+        assert(isinstance(type, int))
+        assert(isinstance(price, Wad))
+        assert(isinstance(size, Wad))
+        assert(callable(on_ack) or (on_ack is None))
+        assert(callable(on_fill) or (on_fill is None))
+        assert(callable(on_failure) or (on_failure is None))
+
+        self.client_oid = client_oid
+        self.instrument_id = instrument_id
+        self.type = type
+        self.price = price
+        self.size = size
+        self.order_id = None
+        self.state = PendingOrder.PENDING
+
+        self.on_ack = on_ack
+        self.on_fill = on_fill
+        self.on_failure = on_failure
+
+    def is_active(self) -> bool:
+        return self.state in [PendingOrder.PENDING, PendingOrder.OPEN]
+
+    def __repr__(self):
+        return f"PendingOrder(client_oid={self.client_oid}, order_id={self.order_id}, type={self.type}," \
+               f" price={self.price}, size={self.size}, state={self.state})"
+
+
+class OrderExecutor:
+    """Places and cancels orders on a worker pool, so the strategy never waits for the exchange API.
+
+    `place_order()` returns immediately with a `PendingOrder`. Orders get placed by `max_workers` worker
+    threads, each of them with a unique `client_oid`. If the outcome of a placement is unknown (i.e. the
+    request timed out), the order gets looked up by its `client_oid` instead of being placed again.
+    `on_ack` gets called once the exchange accepts the order, `on_failure` if it does not. Acknowledged
+    orders get checked by `check_fills()`, which calls `on_fill` once they are fully filled and `on_failure`
+    if they got cancelled. Callbacks are called on worker threads, with the `PendingOrder` as the only argument.
+
+    Attributes:
+        api: The `OKExSwapApi` to place orders with.
+        max_workers: Number of worker threads.
+        max_pending_orders: Maximum number of orders pending or open at the same time,
+            orders above this number get rejected straight away.
+    """
+
+    logger = logging.getLogger()
+
+    def __init__(self, api, max_workers: int = 4, max_pending_orders: int = 20):
+        assert(isinstance(max_workers, int))
+        assert(isinstance(max_pending_orders, int))
+
+        self.api = api
+        self.max_workers = max_workers
+        self.max_pending_orders = max_pending_orders
+
+        self._lock = threading.Lock()
+        self._orders = {}
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+
+    def place_order(self, instrument_id: str, type: int, price: Wad, size: Wad,
+                    on_ack=None, on_fill=None, on_failure=None) -> Optional[PendingOrder]:
+        """Queues a new order for placement.
+
+        Returns:
+            The `PendingOrder`, or `None` if there are already `max_pending_orders` active orders.
+        """
+        order = PendingOrder(client_oid=self._new_client_oid(), instrument_id=instrument_id, type=type,
+                             price=price, size=size, on_ack=on_ack, on_fill=on_fill, on_failure=on_failure)
+
+        with self._lock:
+            if len(self._orders) >= self.max_pending_orders:
+                self.logger.warning(f"Too many pending orders, not placing {order}")
+                return None
+
+            self._orders[order.client_oid] = order
+
+        self._executor.submit(self._thread_place_order, order)
+        return order
+
+    def cancel_order(self, instrument_id: str, order_id: str):
+        """Queues cancellation of an order."""
+        assert(isinstance(instrument_id, str))
+        assert(isinstance(order_id, str))
+
+        self._executor.submit(self._thread_cancel_order, instrument_id, order_id)
+
+    def active_orders(self, instrument_id: Optional[str] = None) -> list:
+        """Returns orders which are either pending or open, optionally only the ones for `instrument_id`."""
+        with self._lock:
+            return [order for order in self._orders.values()
+                    if order.is_active() and (instrument_id is None or order.instrument_id == instrument_id)]
+
+    def has_active_order(self, instrument_id: str, type: int) -> bool:
+        """Checks if there is a pending or open order of `type` for `instrument_id`."""
+        return any(order.type == type for order in self.active_orders(instrument_id))
+
+    def check_fills(self):
+        """Checks the state of all open orders on the exchange, calling `on_fill` or `on_failure` when it has changed.
+
+        Supposed to be called periodically, it blocks for one API call per open order.
+        """
+        for order in self.active_orders():
+            if order.state != PendingOrder.OPEN:
+                continue
+
+            try:
+                status = self.api.get_order(order.instrument_id, order.order_id).status
+            except Exception as e:
+                self.logger.warning(f"Failed to check the state of {order} ({e})")
+                continue
+
+            if status == 2:
+                self._complete(order, PendingOrder.FILLED, order.on_fill)
+            elif status < 0:
+                self._complete(order, PendingOrder.FAILED, order.on_failure)
+
+    def stop(self):
+        """Waits for all queued orders and cancellations to be sent."""
+        self._executor.shutdown(wait=True)
+
+    @staticmethod
+    def _new_client_oid() -> str:
+        # OKEx requires `client_oid` to start with a letter and to be at most 32 alphanumeric characters long
+        return 'mm' + uuid.uuid4().hex[:30]
+
+    def _thread_place_order(self, order: PendingOrder):
+        try:
+            order_id = self.api.place_order(order.instrument_id, order.type, order.price, order.size, client_oid=order.client_oid)
+        except Exception as e:
+            self.logger.warning(f"Failed to place {order} ({e})")
+            order_id = None
+
+        if order_id is None or order_id == -1:
+            order_id = self._find_order_id(order)
+
+        if order_id is None:
+            self._complete(order, PendingOrder.FAILED, order.on_failure)
+            return
+
+        with self._lock:
+            order.order_id = str(order_id)
+            order.state = PendingOrder.OPEN
+
+        self._notify(order.on_ack, order)
+
+    def _find_order_id(self, order: PendingOrder) -> Optional[str]:
+        """Looks up an order with an unknown outcome by its `client_oid`, as it might have been placed nevertheless."""
+        try:
+            return self.api.get_order(order.instrument_id, order.client_oid).order_id
+        except Exception:
+            return None
+
+    def _thread_cancel_order(self, instrument_id: str, order_id: str):
+        try:
+            self.api.cancel_order(instrument_id, order_id)
+        except Exception as e:
+            self.logger.warning(f"Failed to cancel order #{order_id} ({e})")
+
+    def _complete(self, order: PendingOrder, state: str, callback):
+        with self._lock:
+            order.state = state
+            self._orders.pop(order.client_oid, None)
+
+        self._notify(callback, order)
+
+    def _notify(self, callback, order: PendingOrder):
+        if callback is not None:
+            try:
+                callback(order)
+            except Exception as e:
+                self.logger.exception(f"Order callback has failed ({e})")
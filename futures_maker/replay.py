@@ -0,0 +1,155 @@
+# 策略回放：把采集的行情按模拟时间回放给策略，用模拟交易所撮合订单
+
+import itertools
+import logging
+
+import futures_maker.strategy
+from futures_maker.numeric import Wad
+from futures_maker.okex_api import Order
+from futures_maker.strategy import Strategy, TrandStrategy
+from market_maker_keeper.capture import CaptureRecord
+from market_maker_keeper.replay import Replay, SimulatedClock
+
+
+class SimulatedSwapApi:
+    """Stand-in for `OKExSwapApi`, filling the orders of the strategy against the replayed swap ticker.
+
+    Buy orders (`ENTER_LONG`, `EXIT_SHORT`) get filled at their own price as soon as the best ask drops to
+    their price, sell orders (`ENTER_SHORT`, `EXIT_LONG`) as soon as the best bid rises to it. PnL is the
+    price difference times the number of contracts, contract value and fees are not taken into account.
+    """
+
+    logger = logging.getLogger()
+
+    def __init__(self, instrument_id: str, clock: SimulatedClock):
+        self.instrument_id = instrument_id
+        self.clock = clock
+        self.orders = {}
+        self.holdings = {'long': [Wad(0), Wad(0)], 'short': [Wad(0), Wad(0)]}
+        self.realized_pnl = Wad(0)
+        self.orders_placed = 0
+        self.orders_filled = 0
+
+        self._order_ids = itertools.count(1)
+
+    def place_order(self, instrument_id: str, type: int, price: Wad, size: Wad, client_oid: str = None) -> str:
+        order = Order(order_id=str(next(self._order_ids)), timestamp=self._timestamp(), instrument_id=instrument_id,
+                      type=type, price=price, size=size, filled_qty=Wad(0), fee=0.0, status=0, contract_val=0.0)
+        order.client_oid = client_oid
+        self.orders[order.order_id] = order
+        self.orders_placed += 1
+
+        return order.order_id
+
+    def get_orders(self, instrument_id: str) -> list:
+        return [order for order in self.orders.values() if order.status == 0 and order.instrument_id == instrument_id]
+
+    def get_order(self, instrument_id: str, order_id: str) -> Order:
+        for order in self.orders.values():
+            if order_id in [order.order_id, order.client_oid]:
+                return order
+
+        raise Exception(f"Order {order_id} does not exist")
+
+    def cancel_order(self, instrument_id: str, order_id: str) -> bool:
+        order = self.orders.get(order_id)
+        if order is None or order.status != 0:
+            return False
+
+        order.status = -1
+        return True
+
+    def position(self, instrument_id: str) -> dict:
+        return {'margin_mode': 'crossed',
+                'holding': [{'side': side,
+                             'avg_cost': str(avg_cost),
+                             'position': str(int(float(size))),
+                             'realized_pnl': str(self.realized_pnl),
+                             'timestamp': self._timestamp()}
+                            for side, (avg_cost, size) in self.holdings.items() if size > Wad(0)]}
+
+    def match(self, best_bid: Wad, best_ask: Wad):
+        """按最新盘口撮合未成交订单"""
+        for order in self.get_orders(self.instrument_id):
+            is_buy = order.type in [Strategy.ENTER_LONG, Strategy.EXIT_SHORT]
+            if (is_buy and order.price >= best_ask) or (not is_buy and order.price <= best_bid):
+                self._fill(order)
+
+    def unrealized_pnl(self, last_price: Wad) -> Wad:
+        long_cost, long_size = self.holdings['long']
+        short_cost, short_size = self.holdings['short']
+
+        return (last_price - long_cost) * long_size + (short_cost - last_price) * short_size
+
+    def _fill(self, order: Order):
+        side = 'long' if order.type in [Strategy.ENTER_LONG, Strategy.EXIT_LONG] else 'short'
+        avg_cost, size = self.holdings[side]
+
+        if order.type in [Strategy.ENTER_LONG, Strategy.ENTER_SHORT]:
+            self.holdings[side] = [(avg_cost * size + order.price * order.size) / (size + order.size), size + order.size]
+        else:
+            closed = min(size, order.size)
+            if side == 'long':
+                self.realized_pnl += (order.price - avg_cost) * closed
+            else:
+                self.realized_pnl += (avg_cost - order.price) * closed
+
+            self.holdings[side] = [avg_cost if size > closed else Wad(0), size - closed]
+
+        order.filled_qty = order.size
+        order.status = 2
+        self.orders_filled += 1
+
+    def _timestamp(self) -> str:
+        return self.clock.utcnow().strftime('%Y-%m-%dT%H:%M:%S.%fZ')
+
+
+class StrategyReplay(Replay):
+    """Replays captured OKEx messages into a strategy (`TrandStrategy` by default) trading on a `SimulatedSwapApi`.
+
+    Every `sync_interval` simulated seconds the positions get reloaded and the unfilled orders cancelled,
+    the same way `OKExFuturesMaker.sync()` does it.
+    """
+
+    logger = logging.getLogger()
+
+    def __init__(self, instrument_id: str, sync_interval: float = 12.0, strategy_class=TrandStrategy):
+        super().__init__(sync_interval)
+
+        self.instrument_id = instrument_id
+        self.datetime_modules = [futures_maker.strategy]
+        self.api = SimulatedSwapApi(instrument_id, self.clock)
+        self.strategy = strategy_class(instrument_id)
+        self.strategy.set_api(self.api)
+        self.last_price = None
+        self.errors = 0
+
+    def push(self, record: CaptureRecord):
+        message = record.message
+
+        if message.get('table') == 'swap/ticker':
+            for data in message['data']:
+                if data.get('instrument_id') == self.instrument_id:
+                    self.last_price = Wad.from_number(data['last'])
+                    self.api.match(Wad.from_number(data['best_bid']), Wad.from_number(data['best_ask']))
+
+        try:
+            self.strategy.run(message)
+        except Exception as e:
+            # 行情不完整时（例如还没有收到 swap/ticker）策略会抛异常，实盘中这些异常同样只会被记录
+            self.errors += 1
+            self.logger.debug(f"Strategy failed to process message ({e})")
+
+    def synchronize(self):
+        self.strategy.load_position()
+        self.strategy.cancel_unfill_orders()
+
+    def pnl(self) -> Wad:
+        unrealized_pnl = self.api.unrealized_pnl(self.last_price) if self.last_price is not None else Wad(0)
+        return self.api.realized_pnl + unrealized_pnl
+
+    def statistics(self) -> dict:
+        return {'orders placed': self.api.orders_placed,
+                'orders filled': self.api.orders_filled,
+                'strategy errors': self.errors,
+                'holdings': {side: f"{size} @ {avg_cost}" for side, (avg_cost, size) in self.api.holdings.items()}}
@@ -20,6 +20,7 @@ class Strategy:
     def __init__(self, instrument_id: str):
         self.instrument_id = instrument_id
         self.api = None
+        self.executor = None
         self.websocket_feed = None
         # 杠杆倍数
         self.leverage = 30
@@ -38,12 +39,29 @@ class Strategy:
     def set_api(self, api):
         self.api = api
 
+    def set_executor(self, executor):
+        """下单不阻塞行情处理：订单交给 `OrderExecutor` 异步执行"""
+        self.executor = executor
+
     def set_websocket_feed(self, websocket_feed):
         self.websocket_feed = websocket_feed
 
     def run(self, item: dict):
         raise NotImplementedError()
 
+    def has_active_order(self, type: int) -> bool:
+        """是否有尚未完成的同方向订单，避免重复下单"""
+        return self.executor is not None and self.executor.has_active_order(self.instrument_id, type)
+
+    def place_order(self, type: int, price: Wad, size: Wad, on_ack=None):
+        """下单。有 executor 时异步执行，订单被交易所接受后回调 `on_ack`"""
+        if self.executor is not None:
+            self.executor.place_order(self.instrument_id, type, price, size, on_ack=on_ack)
+        else:
+            order_id = self.api.place_order(self.instrument_id, type, price, size)
+            if order_id and order_id != -1 and on_ack is not None:
+                on_ack(None)
+
     def cancel_unfill_orders(self):
         """未成交开仓订单取消"""
         if self.api is not None:
@@ -109,7 +127,7 @@ class TrandStrategy(Strategy):
                           f"last_price:{self.swap_ticker_last['last']}, best_bid:{self.swap_ticker_last['best_bid']}, best_ask:{self.swap_ticker_last['best_ask']}"
                           f"is_enter_long:{self.is_enter_long}, is_enter_short:{self.is_enter_short}")
 
-        if self.do_long and (not self.is_enter_long) and \
+        if self.do_long and (not self.is_enter_long) and (not self.has_active_order(Strategy.ENTER_LONG)) and \
                 self.spot_candle60s_last['percent'] >= Wad.from_number(0.003) and \
                 self.spot_candle60s_last['volume'] >= Wad.from_number(2000):
             enter_price = self.swap_ticker_last['best_ask']
@@ -117,7 +135,7 @@ class TrandStrategy(Strategy):
                              f"enter_price:{enter_price}, enter_size:{enter_size}")
             return Strategy.ENTER_LONG, enter_price, enter_size
 
-        if self.do_short and (not self.is_enter_short) and \
+        if self.do_short and (not self.is_enter_short) and (not self.has_active_order(Strategy.ENTER_SHORT)) and \
                 self.spot_candle60s_last['percent'] <= Wad.from_number(-0.003) and \
                 self.spot_candle60s_last['volume'] >= Wad.from_number(2000):
             enter_price = self.swap_ticker_last['best_bid']
@@ -131,7 +149,7 @@ class TrandStrategy(Strategy):
     def match_exit_position(self):
 
         # check long position
-        if self.is_enter_long:
+        if self.is_enter_long and not self.has_active_order(Strategy.EXIT_LONG):
             enter_price, enter_size, enter_time = self.enter_long_info
             exit_price = self.swap_ticker_last['best_bid']
             exit_size = enter_size
@@ -144,7 +162,7 @@ class TrandStrategy(Strategy):
                 return Strategy.EXIT_LONG, exit_price, exit_size
 
         # check short position
-        if self.is_enter_short:
+        if self.is_enter_short and not self.has_active_order(Strategy.EXIT_SHORT):
             enter_price, enter_size, enter_time = self.enter_short_info
             exit_price = self.swap_ticker_last['best_ask']
             exit_size = enter_size
@@ -186,22 +204,30 @@ class TrandStrategy(Strategy):
         enter_long_or_short, enter_price, enter_size = self.match_enter_position()
         timestamp = datetime.datetime.utcnow()
         if enter_long_or_short > 0 and enter_price > Wad(0) and enter_size > Wad(0):
-            order_id = self.api.place_order(self.instrument_id, enter_long_or_short, enter_price, enter_size)
-            if order_id:
-                if enter_long_or_short == Strategy.ENTER_LONG:
-                    self.enter_long_info = (enter_price, enter_size, timestamp)
-                    self.is_enter_long = True
-                elif enter_long_or_short == Strategy.ENTER_SHORT:
-                    self.enter_short_info = (enter_price, enter_size, timestamp)
-                    self.is_enter_short = True
+            self.place_order(enter_long_or_short, enter_price, enter_size,
+                             on_ack=lambda order, type=enter_long_or_short, info=(enter_price, enter_size, timestamp):
+                             self.on_enter_order_ack(type, info))
 
         # 2、check if exit position
         exit_long_or_short, exit_price, exit_size = self.match_exit_position()
         if exit_long_or_short > 0 and exit_price > Wad(0) and exit_size > Wad(0):
-            if enter_long_or_short == Strategy.ENTER_LONG:
-                self.enter_long_info = Wad(0), Wad(0), timestamp
-                self.is_enter_long = False
-            elif enter_long_or_short == Strategy.ENTER_SHORT:
-                self.enter_short_info = Wad(0), Wad(0), timestamp
-                self.is_enter_short = False
-            self.api.place_order(self.instrument_id, exit_long_or_short, exit_price, exit_size)
+            self.place_order(exit_long_or_short, exit_price, exit_size,
+                             on_ack=lambda order, type=exit_long_or_short: self.on_exit_order_ack(type, timestamp))
+
+    def on_enter_order_ack(self, type: int, info: tuple):
+        """开仓订单已被接受"""
+        if type == Strategy.ENTER_LONG:
+            self.enter_long_info = info
+            self.is_enter_long = True
+        elif type == Strategy.ENTER_SHORT:
+            self.enter_short_info = info
+            self.is_enter_short = True
+
+    def on_exit_order_ack(self, type: int, timestamp: datetime.datetime):
+        """平仓订单已被接受"""
+        if type == Strategy.EXIT_LONG:
+            self.enter_long_info = Wad(0), Wad(0), timestamp
+            self.is_enter_long = False
+        elif type == Strategy.EXIT_SHORT:
+            self.enter_short_info = Wad(0), Wad(0), timestamp
+            self.is_enter_short = False
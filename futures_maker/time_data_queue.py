@@ -1,17 +1,112 @@
-from datetime import datetime
-from dateutil import parser
-import pandas as pd
+from typing import Optional
+
+import numpy as np
+
+
+class CandleBuffer:
+    """Fixed-capacity columnar ring buffer of candles of one granularity.
+
+    Every row is written twice, at `position` and at `position + capacity`, so the last `capacity`
+    rows are always one contiguous slice of each column and `view()` can return them without copying.
+    Pushing a candle is O(1). A candle with the same timestamp as the last one (OKEx keeps sending
+    the candle in progress) replaces it instead of being appended. Total volumes are kept up to date
+    incrementally.
+    """
+
+    COLUMNS = ['open', 'high', 'low', 'close', 'volume', 'currency_volume', 'percent']
+
+    def __init__(self, capacity: int):
+        assert(isinstance(capacity, int))
+        assert(capacity > 0)
+
+        self.capacity = capacity
+        self.size = 0
+        self.volume = 0.0
+        self.currency_volume = 0.0
+
+        self._position = 0
+        self._timestamps = np.zeros(2 * capacity, dtype='datetime64[ms]')
+        self._columns = {column: np.zeros(2 * capacity, dtype=np.float64) for column in self.COLUMNS}
+        self._max_percent_index = None
+
+    def push(self, timestamp: np.datetime64, candle: dict):
+        assert(isinstance(candle, dict))
+
+        last_index = (self._position - 1) % self.capacity
+        if self.size > 0 and self._timestamps[last_index] == timestamp:
+            index = last_index
+        else:
+            index = self._position
+            self._position = (self._position + 1) % self.capacity
+            self.size = min(self.size + 1, self.capacity)
+
+        # removes either the volumes of the candle being replaced or of the oldest candle being evicted
+        self._subtract_volumes(index)
+
+        for row in [index, index + self.capacity]:
+            self._timestamps[row] = timestamp
+            for column in self.COLUMNS:
+                self._columns[column][row] = candle[column]
+
+        self.volume += candle['volume']
+        self.currency_volume += candle['currency_volume']
+        self._max_percent_index = None
+
+        # recalculate the totals every time the buffer wraps, so rounding errors do not accumulate
+        if self._position == 0:
+            view = self.view()
+            self.volume = float(np.sum(view['volume']))
+            self.currency_volume = float(np.sum(view['currency_volume']))
+
+    def view(self) -> dict:
+        """Returns the candles, oldest first, as a dictionary of read-only column views (no copying)."""
+        start = self._position if self.size == self.capacity else 0
+        end = start + self.size
+
+        columns = {'timestamp': self._timestamps[start:end]}
+        columns.update({column: self._columns[column][start:end] for column in self.COLUMNS})
+        for values in columns.values():
+            values.flags.writeable = False
+
+        return columns
+
+    def max_percent_row(self) -> Optional[dict]:
+        """Returns the candle with the highest `percent`, or `None` if the buffer is empty."""
+        if self.size == 0:
+            return None
+
+        view = self.view()
+        if self._max_percent_index is None:
+            self._max_percent_index = int(np.argmax(view['percent']))
+
+        return {column: values[self._max_percent_index] for column, values in view.items()}
+
+    def filter_percent(self, lowest_percent: float) -> dict:
+        """Returns the candles with `percent` above `lowest_percent`, as a dictionary of columns."""
+        view = self.view()
+        mask = view['percent'] > lowest_percent
+
+        return {column: values[mask] for column, values in view.items()}
+
+    def _subtract_volumes(self, index: int):
+        self.volume -= self._columns['volume'][index]
+        self.currency_volume -= self._columns['currency_volume'][index]
 
 
 class TimeSeriesData:
+    """Keeps the last `number_limit` candles of each granularity (60s, 300s, 900s) of one instrument."""
+
+    CANDLE_TABLES = {
+        "swap/candle60s": 60,
+        "swap/candle300s": 300,
+        "swap/candle900s": 900,
+    }
 
     def __init__(self, instrument_id: str, number_limit: int):
         self.number_limit = number_limit
         self.instrument_id = instrument_id
 
-        self.candle_df = pd.DataFrame(data=None,
-                                           columns=['timestamp', 'open', 'high', 'low',
-                                                    'close', 'volume', 'currency_volume', 'percent'])
+        self.candles = {granularity: CandleBuffer(number_limit) for granularity in self.CANDLE_TABLES.values()}
 
     def push(self, item: dict, receive_time: str = None):
         """{'table': 'swap/candle60s', 'data': [
@@ -20,25 +115,17 @@ class TimeSeriesData:
                                 }
                             ]
             }"""
-        if receive_time is None:
-            receive_time = datetime.utcnow().isoformat() + 'Z'
-
-        candle_pipes = {
-            "swap/candle60s",
-            "swap/candle300s",
-            "swap/candle900s",
-        }
-        if item['table'] not in candle_pipes:
+        granularity = self.CANDLE_TABLES.get(item['table'])
+        if granularity is None:
             return
 
         for row in item['data']:
             if row['instrument_id'] == self.instrument_id:
                 candle = list(row['candle'])
-                if len(candle) < 6:
+                if len(candle) < 7:
                     continue
 
                 candle_new = {}
-                candle_new['timestamp'] = str(candle[0])
                 candle_new['open'] = float(candle[1])
                 candle_new['high'] = float(candle[2])
                 candle_new['low'] = float(candle[3])
@@ -46,35 +133,27 @@ class TimeSeriesData:
                 candle_new['volume'] = float(candle[5])
                 candle_new['currency_volume'] = float(candle[6])
                 candle_new['percent'] = (candle_new['close'] - candle_new['open'])/candle_new['open']
-                self.candle_df.loc[receive_time] = candle_new
-
-        pass
+                self.candles[granularity].push(np.datetime64(str(candle[0]).rstrip('Z'), 'ms'), candle_new)
 
     def __str__(self):
-        return self.candle_df
+        return str({granularity: candles.view() for granularity, candles in self.candles.items()})
 
-    def max_percent_row(self):
-        return self.candle_df.loc[self.candle_df['percent'].idxmax()]
+    def max_percent_row(self, granularity: int = 60) -> Optional[dict]:
+        return self.candles[granularity].max_percent_row()
 
-    def filter_percent(self, lowest_percent: float):
-        return self.candle_df[self.candle_df['percent'] > lowest_percent]
+    def filter_percent(self, lowest_percent: float, granularity: int = 60) -> dict:
+        return self.candles[granularity].filter_percent(lowest_percent)
 
 
 if __name__ == '__main__':
-    import json
+    import sys
+    from market_maker_keeper.capture import read_capture
 
-    kline = TimeSeriesData('ETH-USD-SWAP', 100)
-    with open("swap.data", newline="\n") as f:
-        line = f.readline()
-        while line:
-            row = line.split('\t')
-            item = json.loads(row[1].replace('\'', '"'))
-            kline.push(item, row[0])
-            line = f.readline()
+    # 回放采集的行情文件，见 `CaptureWriter`
+    kline = TimeSeriesData(sys.argv[2] if len(sys.argv) > 2 else 'ETH-USD-SWAP', 100)
+    for record in read_capture(sys.argv[1]):
+        kline.push(record.message)
 
     print(kline.max_percent_row())
 
     print(kline.filter_percent(0.0043))
-
-
-
@@ -18,6 +18,7 @@
 import itertools
 import logging
 import operator
+from bisect import bisect_left
 from functools import reduce
 from pprint import pformat
 from typing import Tuple, Optional
@@ -27,6 +28,7 @@ import time
 
 from market_maker_keeper.feed import Feed
 from market_maker_keeper.limit import SideLimits, History
+from market_maker_keeper.metrics import timed_stage
 from market_maker_keeper.price_feed import Price
 from market_maker_keeper.reloadable_config import ReloadableConfig
 from pymaker.numeric import Wad
@@ -60,6 +62,8 @@ class Band:
         self.dust_cutoff = dust_cutoff
         self.params = params
 
+        self._boundaries = None
+
         assert(self.min_amount >= Wad(0))
         assert(self.avg_amount >= Wad(0))
         assert(self.max_amount >= Wad(0))
@@ -74,6 +78,22 @@ class Band:
         raise NotImplemented()
 
     def includes(self, order, target_price: Wad) -> bool:
+        lower, upper = self.boundaries(target_price)
+        return lower < self.order_price(order) <= upper
+
+    def boundaries(self, target_price: Wad) -> Tuple[Wad, Wad]:
+        """Return the `(lower, upper)` price boundaries of the band, orders with `lower < price <= upper` belong to it.
+
+        Boundaries are calculated once for each `target_price` and then reused.
+        """
+        assert(isinstance(target_price, Wad))
+
+        if self._boundaries is None or self._boundaries[0] != target_price:
+            self._boundaries = (target_price,) + self._calculate_boundaries(target_price)
+
+        return self._boundaries[1], self._boundaries[2]
+
+    def _calculate_boundaries(self, target_price: Wad) -> Tuple[Wad, Wad]:
         raise NotImplemented()
 
     def type(self) -> str:
@@ -108,15 +128,17 @@ class Band:
             orders_to_leave.pop()
 
         result = set(orders_in_band) - set(orders_to_leave)
+        self._log_excessive_orders(orders_total, result)
 
+        return result
+
+    def _log_excessive_orders(self, orders_total: Wad, result: set):
         if len(result) > 0:
             logger = logging.getLogger()
             logger.info(f"{self.type().capitalize()} band (spread <{self.min_margin}, {self.max_margin}>,"
                         f" amount <{self.min_amount}, {self.max_amount}>) has amount {orders_total}, scheduling"
                         f" {len(result)} order(s) for cancellation: {', '.join(map(lambda o: '#' + str(o.order_id), result))}")
 
-        return result
-
 
 class BuyBand(Band):
     def __init__(self, dictionary: dict):
@@ -132,12 +154,10 @@ class BuyBand(Band):
     def order_price(self, order) -> Wad:
         return order.sell_to_buy_price
 
-    def includes(self, order, target_price: Wad) -> bool:
-        price = self.order_price(order)
+    def _calculate_boundaries(self, target_price: Wad) -> Tuple[Wad, Wad]:
         price_min = self._apply_margin(target_price, self.min_margin)
         price_max = self._apply_margin(target_price, self.max_margin)
-        # logging.info(f"check includes, price:{price}, price_min:{price_min}, price_max:{price_max}")
-        return (price > price_max) and (price <= price_min)
+        return price_max, price_min
 
     def type(self) -> str:
         return "buy"
@@ -164,11 +184,10 @@ class SellBand(Band):
     def order_price(self, order) -> Wad:
         return order.buy_to_sell_price
 
-    def includes(self, order, target_price: Wad) -> bool:
-        price = self.order_price(order)
+    def _calculate_boundaries(self, target_price: Wad) -> Tuple[Wad, Wad]:
         price_min = self._apply_margin(target_price, self.min_margin)
         price_max = self._apply_margin(target_price, self.max_margin)
-        return (price > price_min) and (price <= price_max)
+        return price_min, price_max
 
     def type(self) -> str:
         return "sell"
@@ -206,24 +225,61 @@ class NewOrder:
         return pformat(vars(self))
 
 
+class Reconciliation:
+    """Changes turning the current orders of a keeper into the ladder described by its bands.
+
+    See `Bands.reconcile()`. Orders which are not listed in `cancellations` are kept as they are,
+    so the cancellations and new orders together are the minimal set of changes to apply.
+
+    Attributes:
+        cancellations: Orders to cancel, as they are outside of any band or in excess of band maximums.
+        new_orders: Orders to place (`NewOrder` instances), to bring the bands back above their minimums.
+            They can be placed straight away, the balance available already covers them.
+        orders_after_cancellations: Orders to place only once `cancellations` have been confirmed,
+            as they use the balance locked in the orders being cancelled.
+        missing_buy_amount: Buy amount which could not be placed because of too low balance.
+        missing_sell_amount: Sell amount which could not be placed because of too low balance.
+    """
+
+    def __init__(self, cancellations: list, new_orders: list, missing_buy_amount: Wad, missing_sell_amount: Wad,
+                 orders_after_cancellations: Optional[list] = None):
+        assert(isinstance(cancellations, list))
+        assert(isinstance(new_orders, list))
+        assert(isinstance(missing_buy_amount, Wad))
+        assert(isinstance(missing_sell_amount, Wad))
+        assert(isinstance(orders_after_cancellations, list) or (orders_after_cancellations is None))
+
+        self.cancellations = cancellations
+        self.new_orders = new_orders
+        self.orders_after_cancellations = orders_after_cancellations if orders_after_cancellations is not None else []
+        self.missing_buy_amount = missing_buy_amount
+        self.missing_sell_amount = missing_sell_amount
+
+    def __repr__(self):
+        return pformat(vars(self))
+
+
 class Bands:
     logger = logging.getLogger()
 
-    @staticmethod
-    def read(reloadable_config: ReloadableConfig, spread_feed: Feed, control_feed: Feed, history: History):
+    @classmethod
+    @timed_stage('bands_read')
+    def read(cls, reloadable_config: ReloadableConfig, spread_feed: Feed, control_feed: Feed, history: History):
         assert(isinstance(reloadable_config, ReloadableConfig))
         assert(isinstance(spread_feed, Feed))
         assert(isinstance(control_feed, Feed))
         assert(isinstance(history, History))
 
         try:
-            config = reloadable_config.get_config(spread_feed.get()[0])
+            # Bands get parsed again only if the evaluated config has changed.
+            buy_bands, buy_limits, sell_bands, sell_limits = reloadable_config.get_parsed_config(spread_feed.get()[0],
+                                                                                                 Bands._parse_config)
             control_feed_value = control_feed.get()[0]
 
-            buy_bands = list(map(BuyBand, config['buyBands']))
-            buy_limits = SideLimits(config['buyLimits'] if 'buyLimits' in config else [], history.buy_history)
-            sell_bands = list(map(SellBand, config['sellBands']))
-            sell_limits = SideLimits(config['sellLimits'] if 'sellLimits' in config else [], history.sell_history)
+            buy_bands = list(buy_bands)
+            buy_limits = SideLimits(buy_limits, history.buy_history)
+            sell_bands = list(sell_bands)
+            sell_limits = SideLimits(sell_limits, history.sell_history)
 
             if 'canBuy' not in control_feed_value or 'canSell' not in control_feed_value:
                 logging.getLogger().warning("Control feed expired. Assuming no buy bands and no sell bands.")
@@ -246,9 +302,16 @@ class Bands:
             buy_bands = []
             buy_limits = SideLimits([], history.buy_history)
             sell_bands = []
-            sell_limits = SideLimits([], history.buy_history)
+            sell_limits = SideLimits([], history.sell_history)
+
+        return cls(buy_bands=buy_bands, buy_limits=buy_limits, sell_bands=sell_bands, sell_limits=sell_limits)
 
-        return Bands(buy_bands=buy_bands, buy_limits=buy_limits, sell_bands=sell_bands, sell_limits=sell_limits)
+    @staticmethod
+    def _parse_config(config: dict) -> tuple:
+        return list(map(BuyBand, config['buyBands'])), \
+               config['buyLimits'] if 'buyLimits' in config else [], \
+               list(map(SellBand, config['sellBands'])), \
+               config['sellLimits'] if 'sellLimits' in config else []
 
     def __init__(self, buy_bands: list, buy_limits: SideLimits, sell_bands: list, sell_limits: SideLimits):
         assert(isinstance(buy_bands, list))
@@ -261,6 +324,8 @@ class Bands:
         self.sell_bands = sell_bands
         self.sell_limits = sell_limits
 
+        self._assignments = {}
+
         if self._bands_overlap(self.buy_bands) or self._bands_overlap(self.sell_bands):
             self.logger.warning("Bands in the config file overlap. Treating the config file as it has no bands.")
 
@@ -273,9 +338,10 @@ class Bands:
         assert(isinstance(target_price, Wad))
 
         bands = self.sell_bands
+        orders_in_bands, _ = self._assign_orders(our_sell_orders, bands, target_price)
 
-        for band in bands:
-            for order in band.excessive_orders(our_sell_orders, target_price, band == bands[0], band == bands[-1]):
+        for band, orders_in_band in zip(bands, orders_in_bands):
+            for order in band.excessive_orders(orders_in_band, target_price, band == bands[0], band == bands[-1]):
                 yield order
 
     def _excessive_buy_orders(self, our_buy_orders: list, target_price: Wad):
@@ -284,9 +350,10 @@ class Bands:
         assert(isinstance(target_price, Wad))
 
         bands = self.buy_bands
+        orders_in_bands, _ = self._assign_orders(our_buy_orders, bands, target_price)
 
-        for band in bands:
-            for order in band.excessive_orders(our_buy_orders, target_price, band == bands[0], band == bands[-1]):
+        for band, orders_in_band in zip(bands, orders_in_bands):
+            for order in band.excessive_orders(orders_in_band, target_price, band == bands[0], band == bands[-1]):
                 yield order
 
     def _outside_any_band_orders(self, orders: list, bands: list, target_price: Wad):
@@ -295,12 +362,74 @@ class Bands:
         assert(isinstance(bands, list))
         assert(isinstance(target_price, Wad))
 
+        _, orders_outside_bands = self._assign_orders(orders, bands, target_price)
+
+        for order in orders_outside_bands:
+            self.logger.info(f"Order #{order.order_id} doesn't belong to any band, scheduling it for cancellation")
+
+            yield order
+
+    def _assign_orders(self, orders: list, bands: list, target_price: Wad) -> Tuple[list, list]:
+        """Assign buy or sell orders to bands they belong to.
+
+        Band boundaries are sorted once and each order is then assigned to its band by bisection.
+        The assignment is cached, so `cancellable_orders()` and `new_orders()` called for the same
+        orders and the same `target_price` within one keeper cycle evaluate it only once.
+
+        Returns:
+            A tuple of a list of orders belonging to each band (in the same order as `bands`)
+            and a list of orders which do not belong to any band.
+        """
+        assert(isinstance(orders, list))
+        assert(isinstance(bands, list))
+        assert(isinstance(target_price, Wad))
+
+        cached = self._assignments.get(id(bands))
+        if cached is not None:
+            cached_bands, cached_target_price, cached_orders, cached_result = cached
+            if cached_bands is bands \
+                    and cached_target_price == target_price \
+                    and len(cached_orders) == len(orders) \
+                    and all(cached_order is order for cached_order, order in zip(cached_orders, orders)):
+                return cached_result
+
+        # Bands do not overlap, so after sorting them by their lower boundaries an order can only
+        # belong to the last band with the lower boundary below the order price.
+        boundaries = sorted((lower.value, upper.value, index)
+                            for index, (lower, upper) in enumerate(band.boundaries(target_price) for band in bands)
+                            if lower < upper)
+        lower_boundaries = [boundary[0] for boundary in boundaries]
+
+        orders_in_bands = [[] for _ in bands]
+        orders_outside_bands = []
+
         for order in orders:
-            if not any(band.includes(order, target_price) for band in bands):
-                self.logger.info(f"Order #{order.order_id} doesn't belong to any band, scheduling it for cancellation")
+            price = bands[0].order_price(order).value if len(bands) > 0 else None
+            position = bisect_left(lower_boundaries, price) - 1 if price is not None else -1
 
-                yield order
+            if position >= 0 and price <= boundaries[position][1]:
+                orders_in_bands[boundaries[position][2]].append(order)
+            else:
+                orders_outside_bands.append(order)
+
+        result = orders_in_bands, orders_outside_bands
+        self._assignments[id(bands)] = (bands, target_price, tuple(orders), result)
+
+        return result
+
+    def _total_amounts(self, orders: list, bands: list, target_price: Wad, amount: str) -> list:
+        """Return the total `amount` (`remaining_sell_amount` or `remaining_buy_amount`) of orders in each band."""
+        assert(isinstance(orders, list))
+        assert(isinstance(bands, list))
+        assert(isinstance(target_price, Wad))
+        assert(isinstance(amount, str))
+
+        orders_in_bands, _ = self._assign_orders(orders, bands, target_price)
+
+        return [reduce(operator.add, map(operator.attrgetter(amount), orders_in_band), Wad(0))
+                for orders_in_band in orders_in_bands]
 
+    @timed_stage('cancellable_orders')
     def cancellable_orders(self, our_buy_orders: list, our_sell_orders: list, target_price: Price) -> list:
         assert(isinstance(our_buy_orders, list))
         assert(isinstance(our_sell_orders, list))
@@ -324,6 +453,7 @@ class Bands:
 
         return buy_orders_to_cancel + sell_orders_to_cancel
 
+    @timed_stage('new_orders')
     def new_orders(self, our_buy_orders: list, our_sell_orders: list, our_buy_balance: Wad, our_sell_balance: Wad, target_price: Price) -> Tuple[list, Wad, Wad]:
         assert(isinstance(our_buy_orders, list))
         assert(isinstance(our_sell_orders, list))
@@ -345,6 +475,78 @@ class Bands:
         else:
             return [], Wad(0), Wad(0)
 
+    def reconcile(self, our_buy_orders: list, our_sell_orders: list, our_buy_balance: Wad, our_sell_balance: Wad,
+                  target_price: Price, place_new_orders: bool = True, reuse_cancelled_balances: bool = True) -> Reconciliation:
+        """Plans the cancellations and the new orders bringing our orders back into the bands, in one go.
+
+        New orders are calculated as if the cancellations had already happened, so orders leaving
+        the bands after a price move get replaced in the same keeper cycle instead of the next one.
+        New orders which need the balance locked in the orders being cancelled are returned separately
+        (as `orders_after_cancellations`), so keepers can hold them back until the cancellations
+        have been confirmed by the exchange.
+
+        Args:
+            our_buy_orders: Our current buy orders.
+            our_sell_orders: Our current sell orders.
+            our_buy_balance: Balance available for new buy orders.
+            our_sell_balance: Balance available for new sell orders.
+            target_price: The current price.
+            place_new_orders: If `False`, only cancellations get planned. Keepers pass `False` if the
+                order book state is not confirmed yet.
+            reuse_cancelled_balances: If `True`, amounts locked in orders being cancelled are considered
+                available for new orders placed after the cancellations. If `False`, all new orders
+                fit in the balance available.
+
+        Returns:
+            A `Reconciliation` instance.
+        """
+        assert(isinstance(place_new_orders, bool))
+        assert(isinstance(reuse_cancelled_balances, bool))
+
+        cancellations = self.cancellable_orders(our_buy_orders=our_buy_orders,
+                                                our_sell_orders=our_sell_orders,
+                                                target_price=target_price)
+
+        if not place_new_orders:
+            return Reconciliation(cancellations, [], Wad(0), Wad(0))
+
+        cancelled_ids = set(order.order_id for order in cancellations)
+        cancelled_buy_orders = [order for order in our_buy_orders if order.order_id in cancelled_ids]
+        cancelled_sell_orders = [order for order in our_sell_orders if order.order_id in cancelled_ids]
+
+        total_buy_balance = our_buy_balance
+        total_sell_balance = our_sell_balance
+        if reuse_cancelled_balances:
+            total_buy_balance = total_buy_balance + self.total_amount(cancelled_buy_orders)
+            total_sell_balance = total_sell_balance + self.total_amount(cancelled_sell_orders)
+
+        new_orders, missing_buy_amount, missing_sell_amount = \
+            self.new_orders(our_buy_orders=[order for order in our_buy_orders if order.order_id not in cancelled_ids],
+                            our_sell_orders=[order for order in our_sell_orders if order.order_id not in cancelled_ids],
+                            our_buy_balance=total_buy_balance,
+                            our_sell_balance=total_sell_balance,
+                            target_price=target_price)
+
+        new_orders, orders_after_cancellations = self._split_by_balance(new_orders, our_buy_balance, our_sell_balance)
+
+        return Reconciliation(cancellations, new_orders, missing_buy_amount, missing_sell_amount, orders_after_cancellations)
+
+    @staticmethod
+    def _split_by_balance(new_orders: list, our_buy_balance: Wad, our_sell_balance: Wad) -> Tuple[list, list]:
+        """Splits new orders into the ones the balances cover and the ones which need more than that."""
+        balances = {False: our_buy_balance, True: our_sell_balance}
+        orders_within_balance = []
+        orders_beyond_balance = []
+
+        for new_order in new_orders:
+            if new_order.pay_amount <= balances[new_order.is_sell]:
+                balances[new_order.is_sell] = balances[new_order.is_sell] - new_order.pay_amount
+                orders_within_balance.append(new_order)
+            else:
+                orders_beyond_balance.append(new_order)
+
+        return orders_within_balance, orders_beyond_balance
+
     def _new_sell_orders(self, our_sell_orders: list, our_sell_balance: Wad, target_price: Wad):
         """Return sell orders which need to be placed to bring total amounts within all sell bands above minimums."""
         assert(isinstance(our_sell_orders, list))
@@ -355,9 +557,9 @@ class Bands:
         limit_amount = self.sell_limits.available_limit(time.time())
         missing_amount = Wad(0)
 
-        for band in self.sell_bands:
-            orders = [order for order in our_sell_orders if band.includes(order, target_price)]
-            total_amount = self.total_amount(orders)
+        total_amounts = self._total_amounts(our_sell_orders, self.sell_bands, target_price, 'remaining_sell_amount')
+
+        for band, total_amount in zip(self.sell_bands, total_amounts):
             if total_amount < band.min_amount:
                 price = band.avg_price(target_price)
                 pay_amount = Wad.from_number(np.random.uniform(float(band.min_amount), float(band.max_amount)))
@@ -395,10 +597,9 @@ class Bands:
         limit_buy_amount = self.buy_limits.available_limit(time.time())
         missing_buy_amount = Wad(0)
 
-        for band in self.buy_bands:
-            orders = [order for order in our_buy_orders if band.includes(order, target_price)]
-            total_buy_amount = self.total_buy_amount(orders)
+        total_buy_amounts = self._total_amounts(our_buy_orders, self.buy_bands, target_price, 'remaining_buy_amount')
 
+        for band, total_buy_amount in zip(self.buy_bands, total_buy_amounts):
             if total_buy_amount < band.min_amount:
                 price = band.avg_price(target_price)
 
@@ -0,0 +1,176 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2017-2018 reverendus
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import gzip
+import json
+import logging
+import threading
+import time
+import zlib
+from typing import Iterator, NamedTuple, Optional
+
+
+GZIP_HEADER = b'\x1f\x8b\x08'
+
+CHUNK_SIZE = 65536
+
+
+class CaptureRecord(NamedTuple):
+    time: float
+    source: str
+    message: dict
+
+
+class CaptureWriter:
+    """Appends received market data messages to a capture file, so they can be replayed later.
+
+    The file is a gzip-compressed sequence of JSON lines, one line per message:
+
+        {"time": 1546758300.123, "source": "wss://real.okex.com:10442/ws/v3#{...}", "message": {...}}
+
+    where `time` is the time the message has been received at and `source` identifies the subscription
+    it has been received by. Each time the writer gets opened a new gzip member is appended to the file,
+    so restarting the keeper never overwrites what has been captured before. The compressed stream gets
+    flushed at most every `flush_interval` seconds.
+
+    Attributes:
+        filename: Name of the capture file.
+        flush_interval: Maximum time (in seconds) a message stays in the buffer before it gets written to disk.
+    """
+
+    logger = logging.getLogger()
+
+    def __init__(self, filename: str, flush_interval: float = 1.0):
+        assert(isinstance(filename, str))
+        assert(isinstance(flush_interval, float) or isinstance(flush_interval, int))
+
+        self.filename = filename
+        self.flush_interval = flush_interval
+
+        self._file = gzip.open(filename, 'at', encoding='utf-8')
+        self._lock = threading.Lock()
+        self._last_flush = time.time()
+
+    def write(self, source: str, message: dict, receive_time: Optional[float] = None):
+        assert(isinstance(source, str))
+        assert(isinstance(message, dict))
+
+        record = json.dumps({'time': receive_time if receive_time is not None else time.time(),
+                             'source': source,
+                             'message': message}, separators=(',', ':'))
+
+        with self._lock:
+            if self._file is None:
+                return
+
+            self._file.write(record + '\n')
+
+            if time.time() - self._last_flush >= self.flush_interval:
+                self._file.flush()
+                self._last_flush = time.time()
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+def read_capture(filename: str, sources: Optional[set] = None) -> Iterator[CaptureRecord]:
+    """Reads the records of a capture file written by `CaptureWriter`, in the order they have been written.
+
+    Only records of `sources` get returned, if given. If a keeper writing the file has been killed,
+    its gzip member has no trailer and the next run appends a new member right after it. All the records
+    flushed before the kill get returned, then reading carries on with the next gzip member.
+    """
+    assert(isinstance(filename, str))
+    assert(isinstance(sources, set) or (sources is None))
+
+    for line in _read_lines(filename):
+        try:
+            record = json.loads(line.decode('utf-8'))
+        except ValueError:
+            # lines written just before the keeper got killed can be incomplete
+            continue
+
+        if sources is None or record['source'] in sources:
+            yield CaptureRecord(time=record['time'], source=record['source'], message=record['message'])
+
+
+def _read_lines(filename: str) -> Iterator[bytes]:
+    decompressor = None
+    pending = b''
+
+    with open(filename, 'rb') as file:
+        for segment in _segments(file):
+            if segment.startswith(GZIP_HEADER) and (decompressor is None or decompressor.eof or _ends_before(decompressor, segment)):
+                yield pending
+                decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+                pending = b''
+
+            if decompressor is None:
+                continue
+
+            try:
+                lines = (pending + decompressor.decompress(segment)).split(b'\n')
+            except zlib.error:
+                # the data is corrupted, so we skip it until the next gzip member starts
+                decompressor = None
+                pending = b''
+                continue
+
+            pending = lines.pop()
+            yield from lines
+
+    yield pending
+
+
+def _ends_before(decompressor, segment: bytes) -> bool:
+    # the stream of a member which has not been closed stops after the last flush, on a byte boundary,
+    # where the gzip header of the next member can not be read as a deflate block. a header which appears
+    # inside the compressed data by chance gets read just fine
+    try:
+        decompressor.copy().decompress(segment)
+        return False
+    except zlib.error:
+        return True
+
+
+def _segments(file) -> Iterator[bytes]:
+    # splits the file so every gzip header starts a new segment
+    data = b''
+    keep = len(GZIP_HEADER) - 1
+
+    while True:
+        chunk = file.read(CHUNK_SIZE)
+        if len(chunk) == 0:
+            if len(data) > 0:
+                yield data
+            return
+
+        data += chunk
+
+        index = data.find(GZIP_HEADER, 1)
+        while index > 0:
+            yield data[:index]
+            data = data[index:]
+            index = data.find(GZIP_HEADER, 1)
+
+        # a header can be split between two chunks, so the end of the data waits for the next one
+        if len(data) >= keep + len(GZIP_HEADER):
+            yield data[:-keep]
+            data = data[-keep:]
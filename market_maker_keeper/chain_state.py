@@ -0,0 +1,235 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2018 reverendus
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import logging
+import threading
+from typing import Callable, Optional
+
+import requests
+from web3 import Web3
+
+from pymaker import Address
+from pymaker.numeric import Wad
+
+# Function selectors of the few constant calls the on-chain keepers make every block.
+ERC20_BALANCE_OF = '0x70a08231'       # balanceOf(address)
+ETHERDELTA_BALANCE_OF = '0xf7888aec'  # balanceOf(address,address)
+OASIS_IS_CLOSED = '0xc2b6b58c'        # isClosed()
+
+
+def encode_address(address: Address) -> str:
+    """ABI-encodes an address as a 32-byte call argument, without the `0x` prefix."""
+    assert(isinstance(address, Address))
+
+    return address.address[2:].lower().rjust(64, '0')
+
+
+def to_int(value) -> int:
+    """Converts a JSON-RPC result to an integer, whether the middleware has already decoded it or not."""
+    if isinstance(value, int):
+        return value
+    elif isinstance(value, (bytes, bytearray)):
+        return int.from_bytes(value, byteorder='big')
+    elif value in ('0x', ''):
+        return 0
+    else:
+        return int(value, 16)
+
+
+class JsonRpcBatch:
+    """Sends a number of JSON-RPC calls to an Ethereum node in a single batch request.
+
+    Batch requests are only possible over HTTP. With any other provider (IPC, eth-tester)
+    the calls are made one by one, so the results are the same but the round trips are not saved.
+
+    Attributes:
+        web3: Web3 instance to send the calls through.
+    """
+
+    def __init__(self, web3: Web3):
+        assert(isinstance(web3, Web3))
+
+        self.web3 = web3
+        self.calls = []
+
+    def add(self, method: str, params: list) -> int:
+        """Adds a call to the batch. Returns the index of its result in the list returned by `execute()`."""
+        assert(isinstance(method, str))
+        assert(isinstance(params, list))
+
+        self.calls.append((method, params))
+        return len(self.calls) - 1
+
+    def execute(self) -> list:
+        """Makes all the calls added to the batch. Raises `ValueError` if any of them fails."""
+        if len(self.calls) == 0:
+            return []
+
+        provider = self.web3.providers[0]
+        if hasattr(provider, 'endpoint_uri') and hasattr(provider, 'get_request_kwargs'):
+            return self._execute_over_http(provider)
+        else:
+            return [self.web3.manager.request_blocking(method, params) for method, params in self.calls]
+
+    def _execute_over_http(self, provider) -> list:
+        payload = [{'jsonrpc': '2.0', 'method': method, 'params': params, 'id': index}
+                   for index, (method, params) in enumerate(self.calls)]
+
+        response = requests.post(provider.endpoint_uri, json=payload, **dict(provider.get_request_kwargs()))
+        response.raise_for_status()
+
+        results = {}
+        for item in response.json():
+            if 'error' in item:
+                raise ValueError(f"JSON-RPC call {self.calls[item['id']][0]} failed: {item['error']}")
+
+            results[item['id']] = item['result']
+
+        return [results[index] for index in range(len(self.calls))]
+
+
+class BlockState:
+    """On-chain state of the keeper as of one block.
+
+    Attributes:
+        block_number: Number of the block the state has been read at.
+        eth_balance: ETH balance of the keeper account.
+        results: Results of the tracked calls, by name.
+    """
+
+    def __init__(self, block_number: int, eth_balance: Wad, results: dict):
+        assert(isinstance(block_number, int))
+        assert(isinstance(eth_balance, Wad))
+        assert(isinstance(results, dict))
+
+        self.block_number = block_number
+        self.eth_balance = eth_balance
+        self.results = results
+
+    def call(self, name: str) -> int:
+        return self.results[name]
+
+    def balance(self, token: Address) -> Wad:
+        assert(isinstance(token, Address))
+
+        return Wad(self.results[f"balance:{token.address.lower()}"])
+
+    def __repr__(self):
+        return f"BlockState(block_number={self.block_number}, eth_balance={self.eth_balance}, results={self.results})"
+
+
+class BlockStateCache:
+    """Reads the on-chain state the keeper needs once per block and reuses it until the next one.
+
+    Each call to `get()` costs a single `eth_blockNumber` call. Only if a new block has been mined
+    since the last call, the ETH balance and all the tracked calls (token balances, market status)
+    are read again, all in one JSON-RPC batch request and all at that exact block so they are consistent
+    with each other. Values which cannot be read with a constant call (like the list of our orders)
+    can be cached for the duration of a block with `cached()`.
+
+    Attributes:
+        web3: Web3 instance to read the state through.
+        our_address: Address of the keeper account.
+    """
+
+    logger = logging.getLogger()
+
+    def __init__(self, web3: Web3, our_address: Address):
+        assert(isinstance(web3, Web3))
+        assert(isinstance(our_address, Address))
+
+        self.web3 = web3
+        self.our_address = our_address
+        self.calls = {}
+
+        self._lock = threading.RLock()
+        self._state = None
+        self._cached = {}
+
+    def track_call(self, name: str, address: Address, data: str):
+        """Reads the result of a constant call returning an `uint256` (or a `bool`) every block."""
+        assert(isinstance(name, str))
+        assert(isinstance(address, Address))
+        assert(isinstance(data, str))
+
+        with self._lock:
+            self.calls[name] = (address, data)
+            self._state = None
+
+    def track_balance(self, token: Address):
+        """Reads the ERC20 token balance of the keeper account every block."""
+        assert(isinstance(token, Address))
+
+        self.track_call(f"balance:{token.address.lower()}", token, ERC20_BALANCE_OF + encode_address(self.our_address))
+
+    def block_number(self) -> int:
+        return to_int(self.web3.manager.request_blocking('eth_blockNumber', []))
+
+    def get(self, block_number: Optional[int] = None) -> BlockState:
+        """Returns the state as of the latest block (or as of `block_number`, if already known by the caller)."""
+        assert(isinstance(block_number, int) or (block_number is None))
+
+        if block_number is None:
+            block_number = self.block_number()
+
+        with self._lock:
+            return self._refresh(block_number)
+
+    def cached(self, name: str, function: Callable):
+        """Returns the result of `function`, calling it at most once per block."""
+        assert(isinstance(name, str))
+        assert(callable(function))
+
+        block_number = self.block_number()
+
+        with self._lock:
+            self._refresh(block_number)
+
+            if name in self._cached:
+                return self._cached[name]
+
+        # the lock is not held while `function` runs, so it does not hold up readers of the state
+        value = function()
+
+        with self._lock:
+            if self._state is not None and self._state.block_number == block_number:
+                self._cached[name] = value
+
+        return value
+
+    def _refresh(self, block_number: int) -> BlockState:
+        if self._state is None or self._state.block_number != block_number:
+            self._state = self._read(block_number)
+            self._cached = {}
+
+        return self._state
+
+    def _read(self, block_number: int) -> BlockState:
+        block = hex(block_number)
+        batch = JsonRpcBatch(self.web3)
+
+        eth_balance_index = batch.add('eth_getBalance', [self.our_address.address, block])
+        call_indices = {name: batch.add('eth_call', [{'to': address.address, 'data': data}, block])
+                        for name, (address, data) in self.calls.items()}
+
+        results = batch.execute()
+        state = BlockState(block_number=block_number,
+                           eth_balance=Wad(to_int(results[eth_balance_index])),
+                           results={name: to_int(results[index]) for name, index in call_indices.items()})
+
+        self.logger.debug(f"Read on-chain state at block #{block_number} in one batch of {len(batch.calls)} calls")
+        return state
@@ -18,6 +18,7 @@
 import argparse
 import logging
 import sys
+from typing import Optional
 
 from retry import retry
 from web3 import Web3, HTTPProvider
@@ -25,11 +26,13 @@ from web3 import Web3, HTTPProvider
 from market_maker_keeper.band import Bands
 from market_maker_keeper.control_feed import create_control_feed
 from market_maker_keeper.gas import GasPriceFactory
-from market_maker_keeper.limit import History
+from market_maker_keeper.keeper_hub import KeeperHub
+from market_maker_keeper.metrics import MetricsMixin
 from market_maker_keeper.order_book import OrderBookManager
 from market_maker_keeper.order_history_reporter import create_order_history_reporter
 from market_maker_keeper.price_feed import PriceFeedFactory
 from market_maker_keeper.reloadable_config import ReloadableConfig
+from market_maker_keeper.scheduler import ReactiveScheduler
 from market_maker_keeper.spread_feed import create_spread_feed
 from market_maker_keeper.util import setup_logging
 from pyexchange.ddex import DdexApi, Order
@@ -43,7 +46,7 @@ from pymaker.util import eth_balance
 from pymaker.zrx import ZrxExchange
 
 
-class DdexMarketMakerKeeper:
+class DdexMarketMakerKeeper(MetricsMixin):
     """Keeper acting as a market maker on Ddex."""
 
     logger = logging.getLogger()
@@ -93,6 +96,9 @@ class DdexMarketMakerKeeper:
         parser.add_argument("--price-feed-expiry", type=int, default=120,
                             help="Maximum age of the price feed (in seconds, default: 120)")
 
+        parser.add_argument("--setzer-http-sources", dest='setzer_http_sources', action='store_true',
+                            help="Fetch the `setzer` price sources available over HTTP directly instead of running `setzer`")
+
         parser.add_argument("--spread-feed", type=str,
                             help="Source of spread feed")
 
@@ -111,6 +117,15 @@ class DdexMarketMakerKeeper:
         parser.add_argument("--order-history-every", type=int, default=30,
                             help="Frequency of reporting active orders (in seconds, default: 30)")
 
+        parser.add_argument("--order-history-gzip", dest='order_history_gzip', action='store_true',
+                            help="Gzip the reports of active orders")
+
+        parser.add_argument("--order-history-delta", dest='order_history_delta', action='store_true',
+                            help="Only report the orders added and removed since the last successful report")
+
+        parser.add_argument("--order-history-spool", type=str,
+                            help="File to keep the reports of active orders in while the endpoint is down")
+
         parser.add_argument("--gas-price", type=int, default=0,
                             help="Gas price (in Wei)")
 
@@ -123,6 +138,9 @@ class DdexMarketMakerKeeper:
         parser.add_argument("--debug", dest='debug', action='store_true',
                             help="Enable debug output")
 
+        self.add_metrics_arguments(parser)
+        KeeperHub.add_bands_arguments(parser)
+
         self.arguments = parser.parse_args(args)
         setup_logging(self.arguments)
 
@@ -138,13 +156,14 @@ class DdexMarketMakerKeeper:
         self.bands_config = ReloadableConfig(self.arguments.config)
         self.price_max_decimals = None
         self.amount_max_decimals = None
-        self.gas_price = GasPriceFactory().create_gas_price(self.arguments)
+        self.gas_price = GasPriceFactory().create_gas_price(self.arguments, self.web3)
         self.price_feed = PriceFeedFactory().create_price_feed(self.arguments)
         self.spread_feed = create_spread_feed(self.arguments)
         self.control_feed = create_control_feed(self.arguments)
         self.order_history_reporter = create_order_history_reporter(self.arguments)
 
-        self.history = History()
+        self.history = KeeperHub.history(self.arguments)
+        self.bands_engine = KeeperHub.bands_engine(self.arguments)
         self.zrx_exchange = ZrxExchange(web3=self.web3, address=Address(self.arguments.exchange_address))
         self.ddex_api = DdexApi(self.web3,
                                 self.arguments.ddex_api_server,
@@ -156,11 +175,20 @@ class DdexMarketMakerKeeper:
         self.order_book_manager.enable_history_reporting(self.order_history_reporter, self.our_buy_orders, self.our_sell_orders)
         self.order_book_manager.start()
 
+        self.enable_metrics()
+
+        self.synchronize_scheduler = ReactiveScheduler(self.synchronize_orders)
+        self.synchronize_scheduler.listen_to(self.price_feed)
+        self.synchronize_scheduler.listen_to(self.spread_feed)
+        self.synchronize_scheduler.listen_to(self.control_feed)
+        self.synchronize_scheduler.listen_to(self.bands_config)
+        self.synchronize_scheduler.listen_to(self.order_book_manager)
+
     def main(self):
         with Lifecycle(self.web3) as lifecycle:
             lifecycle.initial_delay(10)
             lifecycle.on_startup(self.startup)
-            lifecycle.every(1, self.synchronize_orders)
+            lifecycle.every(1, self.synchronize_scheduler.watchdog)
             lifecycle.on_shutdown(self.shutdown)
 
     def startup(self):
@@ -175,6 +203,7 @@ class DdexMarketMakerKeeper:
         self.amount_max_decimals = market['amountDecimals']
 
     def shutdown(self):
+        self.synchronize_scheduler.stop()
         self.order_book_manager.cancel_all_orders()
 
     def approve(self):
@@ -190,36 +219,31 @@ class DdexMarketMakerKeeper:
         return list(filter(lambda order: not order.is_sell, our_orders))
 
     def synchronize_orders(self):
-        bands = Bands.read(self.bands_config, self.spread_feed, self.control_feed, self.history)
+        bands = self.bands_engine.read(self.bands_config, self.spread_feed, self.control_feed, self.history)
         order_book = self.order_book_manager.get_order_book()
         target_price = self.price_feed.get_price()
 
-        # Cancel orders
-        cancellable_orders = bands.cancellable_orders(our_buy_orders=self.our_buy_orders(order_book.orders),
-                                                      our_sell_orders=self.our_sell_orders(order_book.orders),
-                                                      target_price=target_price)
-        if len(cancellable_orders) > 0:
-            self.order_book_manager.cancel_orders(cancellable_orders)
-            return
-
-        # Do not place new orders if order book state is not confirmed
-        if order_book.orders_being_placed or order_book.orders_being_cancelled:
-            self.logger.debug("Order book is in progress, not placing new orders")
-            return
-
         # In case of Ddex, balances returned by `our_total_balance` still contain amounts "locked"
         # by currently open orders, so we need to explicitly subtract these amounts.
         our_buy_balance = self.our_total_balance(self.token_buy) - Bands.total_amount(self.our_buy_orders(order_book.orders))
         our_sell_balance = self.our_total_balance(self.token_sell) - Bands.total_amount(self.our_sell_orders(order_book.orders))
 
-        # Place new orders
-        self.place_orders(bands.new_orders(our_buy_orders=self.our_buy_orders(order_book.orders),
-                                           our_sell_orders=self.our_sell_orders(order_book.orders),
-                                           our_buy_balance=our_buy_balance,
-                                           our_sell_balance=our_sell_balance,
-                                           target_price=target_price)[0])
+        # Cancel orders and place new ones at the same time, new orders being calculated as if
+        # the cancellations had already happened, so orders leaving the bands get replaced straight away
+        reconciliation = bands.reconcile(our_buy_orders=self.our_buy_orders(order_book.orders),
+                                         our_sell_orders=self.our_sell_orders(order_book.orders),
+                                         our_buy_balance=our_buy_balance,
+                                         our_sell_balance=our_sell_balance,
+                                         target_price=target_price,
+                                         place_new_orders=not (order_book.orders_being_placed or order_book.orders_being_cancelled))
+
+        if len(reconciliation.cancellations) > 0:
+            self.order_book_manager.cancel_orders(reconciliation.cancellations)
+
+        self.place_orders(reconciliation.new_orders)
+        self.place_orders(reconciliation.orders_after_cancellations, reconciliation.cancellations)
 
-    def place_orders(self, new_orders):
+    def place_orders(self, new_orders, after_cancellations: Optional[list] = None):
         def place_order_function(new_order_to_be_placed):
             price = round(new_order_to_be_placed.price, self.price_max_decimals)
             amount = new_order_to_be_placed.pay_amount if new_order_to_be_placed.is_sell else new_order_to_be_placed.buy_amount
@@ -232,7 +256,7 @@ class DdexMarketMakerKeeper:
             return Order(order_id, self.pair, new_order_to_be_placed.is_sell, price, amount, amount)
 
         for new_order in new_orders:
-            self.order_book_manager.place_order(lambda new_order=new_order: place_order_function(new_order))
+            self.order_book_manager.place_order(lambda new_order=new_order: place_order_function(new_order), after_cancellations)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,117 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2017-2018 reverendus
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import calendar
+import datetime
+import importlib
+import json
+import logging
+import zlib
+from typing import Optional
+
+
+JSON_BACKENDS = ['orjson', 'ujson', 'json']
+
+
+def json_backend(name: Optional[str] = None):
+    """Returns the `loads` function of the JSON library `name`.
+
+    `orjson` and `ujson` are optional dependencies. If `name` is not given, the first one of
+    `JSON_BACKENDS` which is installed gets used, falling back to the standard `json` module.
+    """
+    assert(name in JSON_BACKENDS or (name is None))
+
+    for backend in [name] if name is not None else JSON_BACKENDS:
+        try:
+            return importlib.import_module(backend).loads
+        except ImportError:
+            if name is not None:
+                raise
+
+    return json.loads
+
+
+class MessageDecoder:
+    """Decodes WebSocket frames into dictionaries.
+
+    Binary frames are expected to be compressed with raw deflate (as OKEx does), text frames get decoded
+    as they are. Every OKEx frame is a complete deflate stream, so the frame gets inflated with one
+    `zlib.decompress()` call and the resulting bytes get passed to the JSON library without decoding
+    them to `str` first.
+
+    Attributes:
+        json_backend: Name of the JSON library to use, see `json_backend()`.
+    """
+
+    logger = logging.getLogger()
+
+    def __init__(self, json_backend_name: Optional[str] = None):
+        self.json_backend = json_backend_name
+        self._loads = json_backend(json_backend_name)
+
+    def inflate(self, frame) -> bytes:
+        return zlib.decompress(frame, -zlib.MAX_WBITS)
+
+    def decode(self, frame) -> dict:
+        if isinstance(frame, (bytes, bytearray)):
+            frame = self.inflate(frame)
+
+        return self._loads(frame)
+
+
+_EPOCH = datetime.datetime(1970, 1, 1)
+_midnights = {}
+
+
+def parse_timestamp(value: str) -> float:
+    """Parses an UTC timestamp in the `%Y-%m-%dT%H:%M:%S.%fZ` format (i.e. `2019-01-06T07:05:00.123Z`) into
+    seconds since the epoch.
+
+    Returns exactly the same value as `strptime()`, but it only parses the date part once per day.
+    Timestamps in any other format are handled by `strptime()`, which raises a `ValueError` if they are invalid.
+    """
+    if len(value) < 22 or value[10] != 'T' or value[13] != ':' or value[16] != ':' or value[19] != '.' \
+            or value[-1] != 'Z' or len(value) > 27:
+        return _parse_timestamp_slow(value)
+
+    date = value[:10]
+    midnight = _midnights.get(date)
+    if midnight is None:
+        if len(_midnights) > 16:
+            _midnights.clear()
+
+        midnight = calendar.timegm(datetime.datetime.strptime(date, '%Y-%m-%d').timetuple())
+        _midnights[date] = midnight
+
+    clock, fraction = value[11:13] + value[14:16] + value[17:19], value[20:-1]
+    if not (clock.isdigit() and fraction.isdigit()):
+        return _parse_timestamp_slow(value)
+
+    try:
+        hours, minutes, seconds, microseconds = int(clock[0:2]), int(clock[2:4]), int(clock[4:6]), int(fraction.ljust(6, '0'))
+    except ValueError:
+        return _parse_timestamp_slow(value)
+
+    if hours > 23 or minutes > 59 or seconds > 59:
+        return _parse_timestamp_slow(value)
+
+    # the same division `timedelta.total_seconds()` does, so the result is identical to the one of `strptime()`
+    return ((midnight + hours * 3600 + minutes * 60 + seconds) * 10**6 + microseconds) / 10**6
+
+
+def _parse_timestamp_slow(value: str) -> float:
+    return (datetime.datetime.strptime(value, '%Y-%m-%dT%H:%M:%S.%fZ') - _EPOCH).total_seconds()
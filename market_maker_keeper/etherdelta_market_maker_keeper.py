@@ -24,13 +24,16 @@ from retry import retry
 from web3 import Web3, HTTPProvider
 
 from market_maker_keeper.band import Bands
+from market_maker_keeper.chain_state import BlockState, BlockStateCache, ETHERDELTA_BALANCE_OF, encode_address
 from market_maker_keeper.control_feed import create_control_feed
 from market_maker_keeper.gas import GasPriceFactory
-from market_maker_keeper.limit import History
+from market_maker_keeper.keeper_hub import KeeperHub
+from market_maker_keeper.metrics import MetricsMixin
 from market_maker_keeper.order_history_reporter import create_order_history_reporter
 from market_maker_keeper.price_feed import PriceFeedFactory
 from market_maker_keeper.reloadable_config import ReloadableConfig
 from market_maker_keeper.spread_feed import create_spread_feed
+from market_maker_keeper.transaction_pipeline import TransactionPipeline
 from market_maker_keeper.util import setup_logging
 from pymaker import Address, synchronize
 from pymaker.approval import directly
@@ -40,10 +43,9 @@ from pymaker.lifecycle import Lifecycle
 from pymaker.numeric import Wad
 from pymaker.sai import Tub
 from pymaker.token import ERC20Token
-from pymaker.util import eth_balance
 
 
-class EtherDeltaMarketMakerKeeper:
+class EtherDeltaMarketMakerKeeper(MetricsMixin):
     """Keeper acting as a market maker on EtherDelta, on the ETH/SAI pair."""
 
     logger = logging.getLogger()
@@ -93,6 +95,9 @@ class EtherDeltaMarketMakerKeeper:
         parser.add_argument("--price-feed-expiry", type=int, default=120,
                             help="Maximum age of the price feed (in seconds, default: 120)")
 
+        parser.add_argument("--setzer-http-sources", dest='setzer_http_sources', action='store_true',
+                            help="Fetch the `setzer` price sources available over HTTP directly instead of running `setzer`")
+
         parser.add_argument("--spread-feed", type=str,
                             help="Source of spread feed")
 
@@ -111,6 +116,15 @@ class EtherDeltaMarketMakerKeeper:
         parser.add_argument("--order-history-every", type=int, default=30,
                             help="Frequency of reporting active orders (in seconds, default: 30)")
 
+        parser.add_argument("--order-history-gzip", dest='order_history_gzip', action='store_true',
+                            help="Gzip the reports of active orders")
+
+        parser.add_argument("--order-history-delta", dest='order_history_delta', action='store_true',
+                            help="Only report the orders added and removed since the last successful report")
+
+        parser.add_argument("--order-history-spool", type=str,
+                            help="File to keep the reports of active orders in while the endpoint is down")
+
         parser.add_argument("--order-age", type=int, required=True,
                             help="Age of created orders (in blocks)")
 
@@ -151,6 +165,9 @@ class EtherDeltaMarketMakerKeeper:
 
         parser.set_defaults(cancel_on_shutdown=False, withdraw_on_shutdown=False)
 
+        self.add_metrics_arguments(parser)
+        KeeperHub.add_bands_arguments(parser)
+
         self.arguments = parser.parse_args(args)
         setup_logging(self.arguments)
 
@@ -169,7 +186,8 @@ class EtherDeltaMarketMakerKeeper:
         self.min_eth_balance = Wad.from_number(self.arguments.min_eth_balance)
         self.min_eth_deposit = Wad.from_number(self.arguments.min_eth_deposit)
         self.min_sai_deposit = Wad.from_number(self.arguments.min_sai_deposit)
-        self.gas_price = GasPriceFactory().create_gas_price(self.arguments)
+        self.gas_price = GasPriceFactory().create_gas_price(self.arguments, self.web3)
+        self.transactions = TransactionPipeline(self.web3, self.our_address, self.gas_price)
         self.price_feed = PriceFeedFactory().create_price_feed(self.arguments, self.tub)
         self.spread_feed = create_spread_feed(self.arguments)
         self.control_feed = create_control_feed(self.arguments)
@@ -181,7 +199,8 @@ class EtherDeltaMarketMakerKeeper:
         assert(self.arguments.order_expiry_threshold >= 0)
         assert(self.arguments.order_no_cancel_threshold >= self.arguments.order_expiry_threshold)
 
-        self.history = History()
+        self.history = KeeperHub.history(self.arguments)
+        self.bands_engine = KeeperHub.bands_engine(self.arguments)
         self.etherdelta = EtherDelta(web3=self.web3, address=Address(self.arguments.etherdelta_address))
         self.etherdelta_api = EtherDeltaApi(client_tool_directory="lib/pymaker/utils/etherdelta-client",
                                             client_tool_command="node main.js",
@@ -190,8 +209,16 @@ class EtherDeltaMarketMakerKeeper:
                                             retry_interval=self.arguments.etherdelta_retry_interval,
                                             timeout=self.arguments.etherdelta_timeout)
 
+        self.chain_state = BlockStateCache(self.web3, self.our_address)
+        self.chain_state.track_balance(self.sai.address)
+        for token in [EtherDelta.ETH_TOKEN, self.sai.address]:
+            self.chain_state.track_call(f"etherdelta:{token.address.lower()}", self.etherdelta.address,
+                                        ETHERDELTA_BALANCE_OF + encode_address(token) + encode_address(self.our_address))
+
         self.our_orders = list()
 
+        self.enable_metrics()
+
     def main(self):
         with Lifecycle(self.web3) as lifecycle:
             lifecycle.initial_delay(10)
@@ -226,11 +253,8 @@ class EtherDeltaMarketMakerKeeper:
     def token_buy(self) -> Address:
         return self.sai.address
 
-    def our_total_balance(self, token: Address) -> Wad:
-        if token == EtherDelta.ETH_TOKEN:
-            return self.etherdelta.balance_of(self.our_address)
-        else:
-            return self.etherdelta.balance_of_token(token, self.our_address)
+    def our_total_balance(self, state: BlockState, token: Address) -> Wad:
+        return Wad(state.call(f"etherdelta:{token.address.lower()}"))
 
     def our_sell_orders(self):
         return list(filter(lambda order: order.buy_token == self.token_buy() and
@@ -241,23 +265,27 @@ class EtherDeltaMarketMakerKeeper:
                                          order.pay_token == self.token_buy(), self.our_orders))
 
     def synchronize_orders(self):
+        # Balances and the block number are read once per block, in one batch request,
+        # and reused throughout the whole cycle.
+        state = self.chain_state.get()
+
         # If keeper balance is below `--min-eth-balance`, cancel all orders but do not terminate
         # the keeper, keep processing blocks as the moment the keeper gets a top-up it should
         # resume activity straight away, without the need to restart it.
         #
         # The exception is when we can withdraw some ETH from EtherDelta. Then we do it and carry on.
-        if eth_balance(self.web3, self.our_address) < self.min_eth_balance:
-            if self.etherdelta.balance_of(self.our_address) > self.eth_reserve:
+        if state.eth_balance < self.min_eth_balance:
+            if self.our_total_balance(state, EtherDelta.ETH_TOKEN) > self.eth_reserve:
                 self.logger.warning(f"Keeper ETH balance below minimum, withdrawing {self.eth_reserve}.")
                 self.etherdelta.withdraw(self.eth_reserve).transact()
             else:
                 self.logger.warning(f"Keeper ETH balance below minimum, cannot withdraw. Cancelling all orders.")
-                self.cancel_all_orders()
+                self.cancel_orders(self.our_orders, state.block_number)
 
             return
 
-        bands = Bands.read(self.bands_config, self.spread_feed, self.control_feed, self.history)
-        block_number = self.web3.eth.blockNumber
+        bands = self.bands_engine.read(self.bands_config, self.spread_feed, self.control_feed, self.history)
+        block_number = state.block_number
         target_price = self.price_feed.get_price()
 
         # Remove expired orders from the local order list
@@ -271,8 +299,8 @@ class EtherDeltaMarketMakerKeeper:
 
         # In case of EtherDelta, balances returned by `our_total_balance` still contain amounts "locked"
         # by currently open orders, so we need to explicitly subtract these amounts.
-        our_buy_balance = self.our_total_balance(self.token_buy()) - Bands.total_amount(self.our_buy_orders())
-        our_sell_balance = self.our_total_balance(self.token_sell()) - Bands.total_amount(self.our_sell_orders())
+        our_buy_balance = self.our_total_balance(state, self.token_buy()) - Bands.total_amount(self.our_buy_orders())
+        our_sell_balance = self.our_total_balance(state, self.token_sell()) - Bands.total_amount(self.our_sell_orders())
 
         # Evaluate if we need to create new orders, and how much do we need to deposit
         new_orders, missing_buy_amount, missing_sell_amount = bands.new_orders(our_buy_orders=self.our_buy_orders(),
@@ -286,17 +314,17 @@ class EtherDeltaMarketMakerKeeper:
         made_deposit = False
 
         if missing_buy_amount > Wad(0):
-            if self.deposit_for_buy_order():
+            if self.deposit_for_buy_order(state):
                 made_deposit = True
 
         if missing_sell_amount > Wad(0):
-            if self.deposit_for_sell_order():
+            if self.deposit_for_sell_order(state):
                 made_deposit = True
 
         # If we managed to deposit something, do not do anything so we can reevaluate new orders to be created.
         # Otherwise, create new orders.
         if not made_deposit:
-            self.place_orders(new_orders)
+            self.place_orders(new_orders, block_number)
 
     @staticmethod
     def is_order_age_above_threshold(order: Order, block_number: int, threshold: int):
@@ -321,7 +349,7 @@ class EtherDeltaMarketMakerKeeper:
     def cancel_all_orders(self):
         self.cancel_orders(self.our_orders, self.web3.eth.blockNumber)
 
-    def place_orders(self, new_orders):
+    def place_orders(self, new_orders, block_number: int):
         # EtherDelta sometimes rejects orders when the amounts are not rounded. Choice of choosing
         # rounding to 9 decimal digits is completely arbitrary as it's not documented anywhere.
         for new_order in new_orders:
@@ -330,13 +358,13 @@ class EtherDeltaMarketMakerKeeper:
                                                      pay_amount=round(new_order.pay_amount, 9),
                                                      buy_token=self.token_buy(),
                                                      buy_amount=round(new_order.buy_amount, 9),
-                                                     expires=self.web3.eth.blockNumber + self.arguments.order_age)
+                                                     expires=block_number + self.arguments.order_age)
             else:
                 order = self.etherdelta.create_order(pay_token=self.token_buy(),
                                                      pay_amount=round(new_order.pay_amount, 9),
                                                      buy_token=self.token_sell(),
                                                      buy_amount=round(new_order.buy_amount, 9),
-                                                     expires=self.web3.eth.blockNumber + self.arguments.order_age)
+                                                     expires=block_number + self.arguments.order_age)
 
             self.place_order(order)
 
@@ -351,23 +379,25 @@ class EtherDeltaMarketMakerKeeper:
         if sai_balance > Wad(0):
             self.etherdelta.withdraw_token(self.sai.address, sai_balance).transact()
 
-    def depositable_balance(self, token: Address) -> Wad:
+    def depositable_balance(self, state: BlockState, token: Address) -> Wad:
         if token == EtherDelta.ETH_TOKEN:
-            return Wad.max(eth_balance(self.web3, self.our_address) - self.eth_reserve, Wad(0))
+            return Wad.max(state.eth_balance - self.eth_reserve, Wad(0))
         else:
-            return ERC20Token(web3=self.web3, address=token).balance_of(self.our_address)
+            return state.balance(token)
 
-    def deposit_for_sell_order(self):
-        depositable_eth = self.depositable_balance(self.token_sell())
+    def deposit_for_sell_order(self, state: BlockState):
+        depositable_eth = self.depositable_balance(state, self.token_sell())
         if depositable_eth > self.min_eth_deposit:
-            return self.etherdelta.deposit(depositable_eth).transact(gas_price=self.gas_price).successful
+            receipt = self.transactions.transact(self.etherdelta.deposit(depositable_eth))
+            return receipt is not None and receipt.successful
         else:
             return False
 
-    def deposit_for_buy_order(self):
-        depositable_sai = self.depositable_balance(self.token_buy())
+    def deposit_for_buy_order(self, state: BlockState):
+        depositable_sai = self.depositable_balance(state, self.token_buy())
         if depositable_sai > self.min_sai_deposit:
-            return self.etherdelta.deposit_token(self.token_buy(), depositable_sai).transact(gas_price=self.gas_price).successful
+            receipt = self.transactions.transact(self.etherdelta.deposit_token(self.token_buy(), depositable_sai))
+            return receipt is not None and receipt.successful
         else:
             return False
 
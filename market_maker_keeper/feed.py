@@ -15,20 +15,13 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
-import json
 import logging
 import threading
 import time
-from base64 import b64encode
-from typing import Tuple
-import zlib
+from typing import Optional, Tuple
 
-from urllib.parse import urlparse
-
-import websocket
-import datetime
-
-from market_maker_keeper.util import sanitize_url
+from market_maker_keeper.decoding import parse_timestamp
+from market_maker_keeper.websocket_connection import WebSocketConnectionManager
 
 
 class Feed(object):
@@ -43,6 +36,10 @@ class EmptyFeed(Feed):
     def get(self) -> Tuple[dict, float]:
         return {}, 0.0
 
+    def on_update(self, on_update_function):
+        # the feed never changes, so it never reports any updates
+        pass
+
 
 class FixedFeed(Feed):
     def __init__(self, value: dict):
@@ -53,13 +50,24 @@ class FixedFeed(Feed):
     def get(self) -> Tuple[dict, float]:
         return self.value, time.time()
 
+    def on_update(self, on_update_function):
+        # the feed never changes, so it never reports any updates
+        pass
+
 
 class WebSocketFeed(Feed):
+    """Feed of the latest entry received from a WebSocket endpoint.
+
+    The part of `ws_url` after `#`, if present, is the message subscribing to the channels of this feed.
+    All feeds pointing to the same endpoint share one connection, see `WebSocketConnectionManager`.
+    """
+
     logger = logging.getLogger()
 
-    def __init__(self, ws_url: str, reconnect_delay: int):
+    def __init__(self, ws_url: str, reconnect_delay: int, connection_manager: Optional[WebSocketConnectionManager] = None):
         assert(isinstance(ws_url, str))
         assert(isinstance(reconnect_delay, int))
+        assert(isinstance(connection_manager, WebSocketConnectionManager) or (connection_manager is None))
 
         wsurls = ws_url.split('#')
         self.ws_url = wsurls[0]
@@ -67,76 +75,25 @@ class WebSocketFeed(Feed):
 
         self.open_event = wsurls[1] if len(wsurls) > 1 else None
 
-        self._header = self._get_header(self.ws_url)
-        self._sanitized_url = sanitize_url(self.ws_url)
         self._last = {}, 0.0
         self._lock = threading.Lock()
-        self._on_update_function = None
-
-        threading.Thread(target=self._background_run, daemon=True).start()
-
-    @staticmethod
-    def _get_header(ws_url: str):
-        parsed_url = urlparse(ws_url)
-
-        if parsed_url.username is not None and parsed_url.password is not None:
-            basic_header = b64encode(bytes(parsed_url.username + ":" + parsed_url.password, "utf-8")).decode("utf-8")
-            return ["Authorization: Basic %s" % basic_header]
-        return None
-
-    def _background_run(self):
-        while True:
-            ws = websocket.WebSocketApp(url=self.ws_url,
-                                        header=self._header,
-                                        on_message=self._on_message,
-                                        on_error=self._on_error,
-                                        on_open=self._on_open,
-                                        on_close=self._on_close)
-            ws.run_forever(ping_interval=15, ping_timeout=10)
-            time.sleep(self.reconnect_delay)
-
-    def _on_open(self, ws):
-        self.logger.info(f"WebSocket '{self._sanitized_url}' connected")
-        if self.open_event:
-            ws.send(self.open_event)
-            self.logger.info(f"message {self.open_event} sended")
-
-    def _on_close(self, ws):
-        self.logger.info(f"WebSocket '{self._sanitized_url}' disconnected")
-
-    @staticmethod
-    def inflate(data):
-        decompress = zlib.decompressobj(
-            -zlib.MAX_WBITS  # see above
-        )
-        inflated = decompress.decompress(data)
-        inflated += decompress.flush()
-        return inflated
-
-    def _on_message(self, ws, message):
-        try:
-            # for okex format
-            message = self.inflate(message).decode()
-            message_dict = json.loads(message)
-            if 'data' not in message_dict:
-                self.logger.debug(f"ReceivedMsg '{message}', do nothing")
-                return
-
-            for data in message_dict['data']:
-                utc_dt = datetime.datetime.strptime(data['timestamp'], '%Y-%m-%dT%H:%M:%S.%fZ')
-                timestamp = (utc_dt - datetime.datetime(1970, 1, 1)).total_seconds()
-                with self._lock:
-                    self._last = data, timestamp
-
-            if self._on_update_function is not None:
-                self._on_update_function()
-
-            self.logger.debug(f"WebSocket '{self._sanitized_url}' received message: '{message}'")
-        except:
-            self.logger.warning(f"WebSocket '{self._sanitized_url}' received invalid message: '{message}'")
-
-    def _on_error(self, ws, error):
-        self.logger.info(f"WebSocket '{self._sanitized_url}' error: '{error}'")
+        self._on_update_functions = []
+
+        connection_manager = connection_manager if connection_manager is not None else WebSocketConnectionManager.default()
+        self.connection = connection_manager.subscribe(self.ws_url, self.open_event, self._on_message, reconnect_delay)
+
+    def _on_message(self, message: dict):
+        if len(message['data']) == 0:
+            return
+
+        # only the last entry is kept, so there is no point in parsing the other ones
+        data = message['data'][-1]
+        timestamp = parse_timestamp(data['timestamp'])
+        with self._lock:
+            self._last = data, timestamp
+
+        for on_update_function in self._on_update_functions:
+            on_update_function()
 
     def get(self) -> Tuple[dict, float]:
         with self._lock:
@@ -145,7 +102,8 @@ class WebSocketFeed(Feed):
     def on_update(self, on_update_function):
         assert(callable(on_update_function))
 
-        self._on_update_function = on_update_function
+        # the same feed can be shared by many keepers, each of them registering its own function
+        self._on_update_functions.append(on_update_function)
 
 
 class ExpiringFeed(Feed):
@@ -15,10 +15,145 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
-from typing import Optional
+import logging
+import threading
+import time
+from collections import deque
+from typing import Callable, Optional
 
 from ethgasstation_client import EthGasStation
-from pymaker.gas import GasPrice, IncreasingGasPrice, FixedGasPrice, DefaultGasPrice
+from web3 import Web3
+
+from market_maker_keeper.chain_state import JsonRpcBatch, to_int
+from pymaker.gas import GasPrice, FixedGasPrice, DefaultGasPrice
+
+
+class LocalGasStation:
+    """Local stand-in for the EthGasStation feed, for testing without network access.
+
+    Attributes:
+        price: Fast gas price (in Wei) to hand out, `None` pretends the feed is down.
+    """
+
+    def __init__(self, price: Optional[int] = None):
+        assert(isinstance(price, int) or (price is None))
+
+        self.price = price
+
+    def fast_price(self) -> Optional[int]:
+        return self.price
+
+
+class GasOracle:
+    """Keeps the fast gas price up to date in the background and pushes it to its subscribers.
+
+    The price comes from the EthGasStation feed. If it is unavailable, the price gets calculated
+    locally from the blocks recently mined, as a percentile of the lowest gas price accepted in each
+    of them (the same way `geth` estimates gas prices, but aiming higher). Only blocks mined since
+    the previous refresh get fetched, all of them in one JSON-RPC batch request.
+
+    Attributes:
+        gas_station: Source of the fast gas price, an `EthGasStation` or a `LocalGasStation`.
+        web3: Web3 instance to read recent blocks through, `None` disables the local calculation.
+        refresh_interval: Frequency of refreshing the gas price (in seconds).
+        expiry: Age after which the gas price is not handed out anymore (in seconds).
+        blocks: Number of recent blocks to calculate the gas price from.
+        percentile: Percentile of the lowest gas prices accepted in recent blocks to use.
+    """
+
+    logger = logging.getLogger()
+
+    def __init__(self, gas_station, web3: Optional[Web3] = None, refresh_interval: int = 60, expiry: int = 600,
+                 blocks: int = 20, percentile: int = 90):
+        assert(callable(getattr(gas_station, 'fast_price', None)))
+        assert(isinstance(web3, Web3) or (web3 is None))
+        assert(isinstance(refresh_interval, int))
+        assert(isinstance(expiry, int))
+        assert(isinstance(blocks, int))
+        assert(isinstance(percentile, int))
+
+        self.gas_station = gas_station
+        self.web3 = web3
+        self.refresh_interval = refresh_interval
+        self.expiry = expiry
+        self.blocks = blocks
+        self.percentile = percentile
+
+        self._lock = threading.Lock()
+        self._price = None
+        self._updated_at = None
+        self._block_prices = deque(maxlen=blocks)
+        self._subscribers = []
+        self._thread = None
+
+    def fast_price(self) -> Optional[int]:
+        with self._lock:
+            if self._updated_at is not None and time.time() - self._updated_at <= self.expiry:
+                return self._price
+            else:
+                return None
+
+    def subscribe(self, callback: Callable):
+        """Calls `callback` with the fast gas price (or `None` if unknown) now and on every refresh."""
+        assert(callable(callback))
+
+        callback(self.fast_price())
+
+        with self._lock:
+            self._subscribers.append(callback)
+
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._refresh_forever, daemon=True)
+                self._thread.start()
+
+    def refresh(self):
+        price = self.gas_station.fast_price()
+        if price is None and self.web3 is not None:
+            price = self._local_price()
+
+        if price is not None:
+            with self._lock:
+                self._price = price
+                self._updated_at = time.time()
+
+        fast_price = self.fast_price()
+        with self._lock:
+            subscribers = list(self._subscribers)
+
+        for subscriber in subscribers:
+            subscriber(fast_price)
+
+    def _refresh_forever(self):
+        while True:
+            try:
+                self.refresh()
+            except Exception as e:
+                self.logger.warning(f"Failed to refresh the gas price: {e}")
+
+            time.sleep(self.refresh_interval)
+
+    def _local_price(self) -> Optional[int]:
+        latest_block = to_int(self.web3.manager.request_blocking('eth_blockNumber', []))
+        first_block = max(latest_block - self.blocks + 1, self._block_prices[-1][0] + 1 if self._block_prices else 0)
+
+        batch = JsonRpcBatch(self.web3)
+        for number in range(first_block, latest_block + 1):
+            batch.add('eth_getBlockByNumber', [hex(number), True])
+
+        for number, block in zip(range(first_block, latest_block + 1), batch.execute()):
+            gas_prices = [to_int(tx['gasPrice']) for tx in block['transactions']] if block is not None else []
+            gas_prices = list(filter(lambda gas_price: gas_price > 0, gas_prices))
+            if len(gas_prices) > 0:
+                self._block_prices.append((number, min(gas_prices)))
+
+        if len(self._block_prices) == 0:
+            return None
+
+        lowest_prices = sorted(price for _, price in self._block_prices)
+        price = lowest_prices[min(len(lowest_prices) * self.percentile // 100, len(lowest_prices) - 1)]
+
+        self.logger.debug(f"Calculated the fast gas price of {price} from {len(lowest_prices)} recent blocks")
+        return price
 
 
 class SmartGasPrice(GasPrice):
@@ -27,33 +162,42 @@ class SmartGasPrice(GasPrice):
     Uses an EthGasStation feed. Starts with fast+10GWei, adding another 10GWei each 60 seconds
     up to fast+50GWei maximum. Falls back to a default scenario (incremental as well) if
     the EthGasStation feed unavailable for more than 10 minutes.
+
+    The fast gas price is pushed by a `GasOracle` whenever it gets refreshed, so the whole escalation
+    schedule gets calculated once per refresh and `get_gas_price` only looks the price up in it.
     """
 
     GWEI = 1000000000
 
-    def __init__(self):
-        self.gas_station = EthGasStation(refresh_interval=60, expiry=600)
+    # default gas pricing when EthGasStation feed is down
+    DEFAULT_SCHEDULE = (50*GWEI, 60*GWEI, 70*GWEI, 80*GWEI, 90*GWEI, 100*GWEI)
 
-    def get_gas_price(self, time_elapsed: int) -> Optional[int]:
-        fast_price = self.gas_station.fast_price()
+    def __init__(self, gas_oracle: Optional[GasOracle] = None):
+        assert(isinstance(gas_oracle, GasOracle) or (gas_oracle is None))
+
+        self.schedule = self.DEFAULT_SCHEDULE
+        self.gas_oracle = gas_oracle if gas_oracle is not None else GasOracle(EthGasStation(refresh_interval=60, expiry=600))
+        self.gas_oracle.subscribe(self.update_schedule)
+
+    def update_schedule(self, fast_price: Optional[int]):
         if fast_price is not None:
             # start from fast_price + 10 GWei
             # increase by 10 GWei every 60 seconds
             # max is fast_price + 50 GWei
-            return min(int(fast_price*1.1) + int(time_elapsed/60)*(10*self.GWEI), int(fast_price*1.1)+(50*self.GWEI))
+            self.schedule = tuple(int(fast_price*1.1) + step*(10*self.GWEI) for step in range(6))
         else:
-            # default gas pricing when EthGasStation feed is down
-            return IncreasingGasPrice(initial_price=50*self.GWEI,
-                                      increase_by=10*self.GWEI,
-                                      every_secs=60,
-                                      max_price=100*self.GWEI).get_gas_price(time_elapsed)
+            self.schedule = self.DEFAULT_SCHEDULE
+
+    def get_gas_price(self, time_elapsed: int) -> Optional[int]:
+        schedule = self.schedule
+        return schedule[min(int(time_elapsed/60), len(schedule)-1)]
 
 
 class GasPriceFactory:
     @staticmethod
-    def create_gas_price(arguments) -> GasPrice:
+    def create_gas_price(arguments, web3: Optional[Web3] = None) -> GasPrice:
         if arguments.smart_gas_price:
-            return SmartGasPrice()
+            return SmartGasPrice(GasOracle(EthGasStation(refresh_interval=60, expiry=600), web3))
         elif arguments.gas_price:
             return FixedGasPrice(arguments.gas_price)
         else:
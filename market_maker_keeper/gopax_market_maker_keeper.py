@@ -18,26 +18,25 @@
 import argparse
 import logging
 import sys
+from typing import Optional
 
-from market_maker_keeper.band import Bands
-from market_maker_keeper.control_feed import create_control_feed
-from market_maker_keeper.limit import History
+from market_maker_keeper.keeper_hub import KeeperHub
+from market_maker_keeper.metrics import MetricsMixin
 from market_maker_keeper.order_book import OrderBookManager
 from market_maker_keeper.order_history_reporter import create_order_history_reporter
-from market_maker_keeper.price_feed import PriceFeedFactory
 from market_maker_keeper.reloadable_config import ReloadableConfig
-from market_maker_keeper.spread_feed import create_spread_feed
+from market_maker_keeper.scheduler import ReactiveScheduler
 from market_maker_keeper.util import setup_logging
 from pyexchange.gopax import GOPAXApi, Order
 from pymaker.lifecycle import Lifecycle
 from pymaker.numeric import Wad
 
 
-class GOPAXMarketMakerKeeper:
+class GOPAXMarketMakerKeeper(MetricsMixin):
 
     logger = logging.getLogger()
 
-    def __init__(self, args: list):
+    def __init__(self, args: list, hub: Optional[KeeperHub] = None):
         parser = argparse.ArgumentParser(prog='gopax-market-maker-keeper')
 
         parser.add_argument("--gopax-api-server", type=str, default="https://api.gopax.co.kr",
@@ -64,6 +63,9 @@ class GOPAXMarketMakerKeeper:
         parser.add_argument("--price-feed-expiry", type=int, default=120,
                             help="Maximum age of the price feed (in seconds, default: 120)")
 
+        parser.add_argument("--setzer-http-sources", dest='setzer_http_sources', action='store_true',
+                            help="Fetch the `setzer` price sources available over HTTP directly instead of running `setzer`")
+
         parser.add_argument("--spread-feed", type=str,
                             help="Source of spread feed")
 
@@ -82,41 +84,73 @@ class GOPAXMarketMakerKeeper:
         parser.add_argument("--order-history-every", type=int, default=30,
                             help="Frequency of reporting active orders (in seconds, default: 30)")
 
+        parser.add_argument("--order-history-gzip", dest='order_history_gzip', action='store_true',
+                            help="Gzip the reports of active orders")
+
+        parser.add_argument("--order-history-delta", dest='order_history_delta', action='store_true',
+                            help="Only report the orders added and removed since the last successful report")
+
+        parser.add_argument("--order-history-spool", type=str,
+                            help="File to keep the reports of active orders in while the endpoint is down")
+
         parser.add_argument("--refresh-frequency", type=int, default=3,
                             help="Order book refresh frequency (in seconds, default: 3)")
 
+        parser.add_argument("--capture-file", type=str,
+                            help="File to record the received market data to, so it can be replayed later")
+
         parser.add_argument("--debug", dest='debug', action='store_true',
                             help="Enable debug output")
 
+        self.add_metrics_arguments(parser)
+        KeeperHub.add_bands_arguments(parser)
+
         self.arguments = parser.parse_args(args)
         setup_logging(self.arguments)
 
-        self.history = History()
-        self.gopax_api = GOPAXApi(api_server=self.arguments.gopax_api_server,
-                                  api_key=self.arguments.gopax_api_key,
-                                  api_secret=self.arguments.gopax_api_secret,
-                                  timeout=self.arguments.gopax_timeout)
+        self.hub = hub if hub is not None else KeeperHub()
+        self.hub.capture(self.arguments)
+
+        self.history = KeeperHub.history(self.arguments)
+        self.bands_engine = KeeperHub.bands_engine(self.arguments)
+        self.gopax_api = self.hub.shared(('gopax-api', self.arguments.gopax_api_server, self.arguments.gopax_api_key),
+                                         lambda: GOPAXApi(api_server=self.arguments.gopax_api_server,
+                                                          api_key=self.arguments.gopax_api_key,
+                                                          api_secret=self.arguments.gopax_api_secret,
+                                                          timeout=self.arguments.gopax_timeout))
 
         self.bands_config = ReloadableConfig(self.arguments.config)
-        self.price_feed = PriceFeedFactory().create_price_feed(self.arguments)
-        self.spread_feed = create_spread_feed(self.arguments)
-        self.control_feed = create_control_feed(self.arguments)
+        self.price_feed = self.hub.price_feed(self.arguments)
+        self.spread_feed = self.hub.spread_feed(self.arguments)
+        self.control_feed = self.hub.control_feed(self.arguments)
         self.order_history_reporter = create_order_history_reporter(self.arguments)
 
-        self.order_book_manager = OrderBookManager(refresh_frequency=self.arguments.refresh_frequency, max_workers=1)
+        self.order_book_manager = OrderBookManager(refresh_frequency=self.arguments.refresh_frequency,
+                                                   executor=self.hub.executor(('gopax', self.arguments.gopax_api_key),
+                                                                              max_workers=1))
         self.order_book_manager.get_orders_with(self.get_orders)
         self.order_book_manager.get_balances_with(lambda: self.gopax_api.get_balances())
         self.order_book_manager.cancel_orders_with(lambda order: self.gopax_api.cancel_order(order.order_id))
         self.order_book_manager.enable_history_reporting(self.order_history_reporter, self.our_buy_orders, self.our_sell_orders)
         self.order_book_manager.start()
 
+        self.enable_metrics()
+
+        self.synchronize_scheduler = ReactiveScheduler(self.synchronize_orders)
+        self.synchronize_scheduler.listen_to(self.price_feed)
+        self.synchronize_scheduler.listen_to(self.spread_feed)
+        self.synchronize_scheduler.listen_to(self.control_feed)
+        self.synchronize_scheduler.listen_to(self.bands_config)
+        self.synchronize_scheduler.listen_to(self.order_book_manager)
+
     def main(self):
         with Lifecycle() as lifecycle:
             lifecycle.initial_delay(10)
-            lifecycle.every(1, self.synchronize_orders)
+            lifecycle.every(1, self.synchronize_scheduler.watchdog)
             lifecycle.on_shutdown(self.shutdown)
 
     def shutdown(self):
+        self.synchronize_scheduler.stop()
         self.order_book_manager.cancel_all_orders()
 
     def pair(self):
@@ -141,31 +175,26 @@ class GOPAXMarketMakerKeeper:
         return list(filter(lambda order: not order.is_sell, our_orders))
 
     def synchronize_orders(self):
-        bands = Bands.read(self.bands_config, self.spread_feed, self.control_feed, self.history)
+        bands = self.bands_engine.read(self.bands_config, self.spread_feed, self.control_feed, self.history)
         order_book = self.order_book_manager.get_order_book()
         target_price = self.price_feed.get_price()
 
-        # Cancel orders
-        cancellable_orders = bands.cancellable_orders(our_buy_orders=self.our_buy_orders(order_book.orders),
-                                                      our_sell_orders=self.our_sell_orders(order_book.orders),
-                                                      target_price=target_price)
-        if len(cancellable_orders) > 0:
-            self.order_book_manager.cancel_orders(cancellable_orders)
-            return
-
-        # Do not place new orders if order book state is not confirmed
-        if order_book.orders_being_placed or order_book.orders_being_cancelled:
-            self.logger.debug("Order book is in progress, not placing new orders")
-            return
-
-        # Place new orders
-        self.place_orders(bands.new_orders(our_buy_orders=self.our_buy_orders(order_book.orders),
-                                           our_sell_orders=self.our_sell_orders(order_book.orders),
-                                           our_buy_balance=self.our_available_balance(order_book.balances, self.token_buy()),
-                                           our_sell_balance=self.our_available_balance(order_book.balances, self.token_sell()),
-                                           target_price=target_price)[0])
-
-    def place_orders(self, new_orders):
+        # Cancel orders and place new ones at the same time, new orders being calculated as if
+        # the cancellations had already happened, so orders leaving the bands get replaced straight away
+        reconciliation = bands.reconcile(our_buy_orders=self.our_buy_orders(order_book.orders),
+                                         our_sell_orders=self.our_sell_orders(order_book.orders),
+                                         our_buy_balance=self.our_available_balance(order_book.balances, self.token_buy()),
+                                         our_sell_balance=self.our_available_balance(order_book.balances, self.token_sell()),
+                                         target_price=target_price,
+                                         place_new_orders=not (order_book.orders_being_placed or order_book.orders_being_cancelled))
+
+        if len(reconciliation.cancellations) > 0:
+            self.order_book_manager.cancel_orders(reconciliation.cancellations)
+
+        self.place_orders(reconciliation.new_orders)
+        self.place_orders(reconciliation.orders_after_cancellations, reconciliation.cancellations)
+
+    def place_orders(self, new_orders, after_cancellations: Optional[list] = None):
         def place_order_function(new_order_to_be_placed):
             pair = self.pair()
             is_sell = new_order_to_be_placed.is_sell
@@ -191,7 +220,7 @@ class GOPAXMarketMakerKeeper:
                          amount_remaining=amount)
 
         for new_order in new_orders:
-            self.order_book_manager.place_order(lambda new_order=new_order: place_order_function(new_order))
+            self.order_book_manager.place_order(lambda new_order=new_order: place_order_function(new_order), after_cancellations)
 
 
 if __name__ == '__main__':
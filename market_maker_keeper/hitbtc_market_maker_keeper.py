@@ -18,30 +18,29 @@
 import argparse
 import logging
 import sys
-from typing import List
+from typing import List, Optional
 
 import time
 
-from market_maker_keeper.band import Bands, NewOrder
-from market_maker_keeper.control_feed import create_control_feed
-from market_maker_keeper.limit import History
+from market_maker_keeper.band import NewOrder
+from market_maker_keeper.keeper_hub import KeeperHub
+from market_maker_keeper.metrics import MetricsMixin
 from market_maker_keeper.order_book import OrderBookManager
 from market_maker_keeper.order_history_reporter import create_order_history_reporter
-from market_maker_keeper.price_feed import PriceFeedFactory
 from market_maker_keeper.reloadable_config import ReloadableConfig
-from market_maker_keeper.spread_feed import create_spread_feed
+from market_maker_keeper.scheduler import ReactiveScheduler
 from market_maker_keeper.util import setup_logging
 from pyexchange.hitbtc import HitBTCApi, Order
 from pymaker.lifecycle import Lifecycle
 from pymaker.numeric import Wad
 
 
-class HitBTCMarketMakerKeeper:
+class HitBTCMarketMakerKeeper(MetricsMixin):
     """Keeper acting as a market maker on HitBTC."""
 
     logger = logging.getLogger()
 
-    def __init__(self, args: list):
+    def __init__(self, args: list, hub: Optional[KeeperHub] = None):
         parser = argparse.ArgumentParser(prog='hitbtc-market-maker-keeper')
 
         parser.add_argument("--hitbtc-api-server", type=str, default="https://api.hitbtc.com",
@@ -68,6 +67,9 @@ class HitBTCMarketMakerKeeper:
         parser.add_argument("--price-feed-expiry", type=int, default=120,
                             help="Maximum age of the price feed (in seconds, default: 120)")
 
+        parser.add_argument("--setzer-http-sources", dest='setzer_http_sources', action='store_true',
+                            help="Fetch the `setzer` price sources available over HTTP directly instead of running `setzer`")
+
         parser.add_argument("--spread-feed", type=str,
                             help="Source of spread feed")
 
@@ -86,41 +88,72 @@ class HitBTCMarketMakerKeeper:
         parser.add_argument("--order-history-every", type=int, default=30,
                             help="Frequency of reporting active orders (in seconds, default: 30)")
 
+        parser.add_argument("--order-history-gzip", dest='order_history_gzip', action='store_true',
+                            help="Gzip the reports of active orders")
+
+        parser.add_argument("--order-history-delta", dest='order_history_delta', action='store_true',
+                            help="Only report the orders added and removed since the last successful report")
+
+        parser.add_argument("--order-history-spool", type=str,
+                            help="File to keep the reports of active orders in while the endpoint is down")
+
         parser.add_argument("--refresh-frequency", type=int, default=3,
                             help="Order book refresh frequency (in seconds, default: 3)")
 
+        parser.add_argument("--capture-file", type=str,
+                            help="File to record the received market data to, so it can be replayed later")
+
         parser.add_argument("--debug", dest='debug', action='store_true',
                             help="Enable debug output")
 
+        self.add_metrics_arguments(parser)
+        KeeperHub.add_bands_arguments(parser)
+
         self.arguments = parser.parse_args(args)
         setup_logging(self.arguments)
 
+        self.hub = hub if hub is not None else KeeperHub()
+        self.hub.capture(self.arguments)
+
         self.bands_config = ReloadableConfig(self.arguments.config)
-        self.price_feed = PriceFeedFactory().create_price_feed(self.arguments)
-        self.spread_feed = create_spread_feed(self.arguments)
-        self.control_feed = create_control_feed(self.arguments)
+        self.price_feed = self.hub.price_feed(self.arguments)
+        self.spread_feed = self.hub.spread_feed(self.arguments)
+        self.control_feed = self.hub.control_feed(self.arguments)
         self.order_history_reporter = create_order_history_reporter(self.arguments)
 
-        self.history = History()
-        self.hitbtc_api = HitBTCApi(api_server=self.arguments.hitbtc_api_server,
-                                    api_key=self.arguments.hitbtc_api_key,
-                                    secret_key=self.arguments.hitbtc_secret_key,
-                                    timeout=self.arguments.hitbtc_timeout)
+        self.history = KeeperHub.history(self.arguments)
+        self.bands_engine = KeeperHub.bands_engine(self.arguments)
+        self.hitbtc_api = self.hub.shared(('hitbtc-api', self.arguments.hitbtc_api_server, self.arguments.hitbtc_api_key),
+                                          lambda: HitBTCApi(api_server=self.arguments.hitbtc_api_server,
+                                                            api_key=self.arguments.hitbtc_api_key,
+                                                            secret_key=self.arguments.hitbtc_secret_key,
+                                                            timeout=self.arguments.hitbtc_timeout))
 
-        self.order_book_manager = OrderBookManager(refresh_frequency=self.arguments.refresh_frequency)
+        self.order_book_manager = OrderBookManager(refresh_frequency=self.arguments.refresh_frequency,
+                                                   executor=self.hub.executor())
         self.order_book_manager.get_orders_with(lambda: self.hitbtc_api.get_orders(self.pair()))
         self.order_book_manager.get_balances_with(lambda: self.hitbtc_api.get_balances())
         self.order_book_manager.cancel_orders_with(lambda order: self.hitbtc_api.cancel_order(order.order_id))
         self.order_book_manager.enable_history_reporting(self.order_history_reporter, self.our_buy_orders, self.our_sell_orders)
         self.order_book_manager.start()
 
+        self.enable_metrics()
+
+        self.synchronize_scheduler = ReactiveScheduler(self.synchronize_orders)
+        self.synchronize_scheduler.listen_to(self.price_feed)
+        self.synchronize_scheduler.listen_to(self.spread_feed)
+        self.synchronize_scheduler.listen_to(self.control_feed)
+        self.synchronize_scheduler.listen_to(self.bands_config)
+        self.synchronize_scheduler.listen_to(self.order_book_manager)
+
     def main(self):
         with Lifecycle() as lifecycle:
             lifecycle.initial_delay(10)
-            lifecycle.every(1, self.synchronize_orders)
+            lifecycle.every(1, self.synchronize_scheduler.watchdog)
             lifecycle.on_shutdown(self.shutdown)
 
     def shutdown(self):
+        self.synchronize_scheduler.stop()
         self.order_book_manager.cancel_all_orders()
 
     def pair(self):
@@ -149,33 +182,26 @@ class HitBTCMarketMakerKeeper:
         return list(filter(lambda order: not order.is_sell, our_orders))
 
     def synchronize_orders(self):
-        bands = Bands.read(self.bands_config, self.spread_feed, self.control_feed, self.history)
+        bands = self.bands_engine.read(self.bands_config, self.spread_feed, self.control_feed, self.history)
         order_book = self.order_book_manager.get_order_book()
         target_price = self.price_feed.get_price()
 
-        # Cancel orders
-        cancellable_orders = bands.cancellable_orders(our_buy_orders=self.our_buy_orders(order_book.orders),
-                                                      our_sell_orders=self.our_sell_orders(order_book.orders),
-                                                      target_price=target_price)
-        if len(cancellable_orders) > 0:
-            self.order_book_manager.cancel_orders(cancellable_orders)
-            return
-
-        # Do not place new orders if order book state is not confirmed
-        if order_book.orders_being_placed or order_book.orders_being_cancelled:
-            self.logger.debug("Order book is in progress, not placing new orders")
-            return
-
-        # Place new orders
-        new_orders = bands.new_orders(our_buy_orders=self.our_buy_orders(order_book.orders),
-                                      our_sell_orders=self.our_sell_orders(order_book.orders),
-                                      our_buy_balance=self.our_available_balance(order_book.balances, self.token_buy()),
-                                      our_sell_balance=self.our_available_balance(order_book.balances, self.token_sell()),
-                                      target_price=target_price)[0]
-
-        self.place_orders(new_orders)
-
-    def place_orders(self, new_orders: List[NewOrder]):
+        # Cancel orders and place new ones at the same time, new orders being calculated as if
+        # the cancellations had already happened, so orders leaving the bands get replaced straight away
+        reconciliation = bands.reconcile(our_buy_orders=self.our_buy_orders(order_book.orders),
+                                         our_sell_orders=self.our_sell_orders(order_book.orders),
+                                         our_buy_balance=self.our_available_balance(order_book.balances, self.token_buy()),
+                                         our_sell_balance=self.our_available_balance(order_book.balances, self.token_sell()),
+                                         target_price=target_price,
+                                         place_new_orders=not (order_book.orders_being_placed or order_book.orders_being_cancelled))
+
+        if len(reconciliation.cancellations) > 0:
+            self.order_book_manager.cancel_orders(reconciliation.cancellations)
+
+        self.place_orders(reconciliation.new_orders)
+        self.place_orders(reconciliation.orders_after_cancellations, reconciliation.cancellations)
+
+    def place_orders(self, new_orders: List[NewOrder], after_cancellations: Optional[list] = None):
         def place_order_function(new_order_to_be_placed):
             amount = new_order_to_be_placed.pay_amount if new_order_to_be_placed.is_sell else new_order_to_be_placed.buy_amount
             order_id = self.hitbtc_api.place_order(self.pair(), new_order_to_be_placed.is_sell, new_order_to_be_placed.price, amount)
@@ -190,7 +216,7 @@ class HitBTCMarketMakerKeeper:
                          filled_amount=Wad(0))
 
         for new_order in new_orders:
-            self.order_book_manager.place_order(lambda new_order=new_order: place_order_function(new_order))
+            self.order_book_manager.place_order(lambda new_order=new_order: place_order_function(new_order), after_cancellations)
 
 
 if __name__ == '__main__':
@@ -22,14 +22,15 @@ import sys
 from retry import retry
 from web3 import Web3, HTTPProvider
 
-from market_maker_keeper.band import Bands
 from market_maker_keeper.control_feed import create_control_feed
 from market_maker_keeper.gas import GasPriceFactory
-from market_maker_keeper.limit import History
+from market_maker_keeper.keeper_hub import KeeperHub
+from market_maker_keeper.metrics import MetricsMixin
 from market_maker_keeper.order_history_reporter import create_order_history_reporter
 from market_maker_keeper.price_feed import PriceFeedFactory
 from market_maker_keeper.reloadable_config import ReloadableConfig
 from market_maker_keeper.spread_feed import create_spread_feed
+from market_maker_keeper.transaction_pipeline import TransactionPipeline
 from market_maker_keeper.util import setup_logging
 from pyexchange.idex import IDEX, IDEXApi
 from pymaker import Address
@@ -43,7 +44,7 @@ from pymaker.token import ERC20Token
 from pymaker.util import eth_balance
 
 
-class IdexMarketMakerKeeper:
+class IdexMarketMakerKeeper(MetricsMixin):
     """Keeper acting as a market maker on IDEX, on the ETH/SAI pair."""
 
     logger = logging.getLogger()
@@ -87,6 +88,9 @@ class IdexMarketMakerKeeper:
         parser.add_argument("--price-feed-expiry", type=int, default=120,
                             help="Maximum age of the price feed (in seconds, default: 120)")
 
+        parser.add_argument("--setzer-http-sources", dest='setzer_http_sources', action='store_true',
+                            help="Fetch the `setzer` price sources available over HTTP directly instead of running `setzer`")
+
         parser.add_argument("--spread-feed", type=str,
                             help="Source of spread feed")
 
@@ -105,6 +109,15 @@ class IdexMarketMakerKeeper:
         parser.add_argument("--order-history-every", type=int, default=30,
                             help="Frequency of reporting active orders (in seconds, default: 30)")
 
+        parser.add_argument("--order-history-gzip", dest='order_history_gzip', action='store_true',
+                            help="Gzip the reports of active orders")
+
+        parser.add_argument("--order-history-delta", dest='order_history_delta', action='store_true',
+                            help="Only report the orders added and removed since the last successful report")
+
+        parser.add_argument("--order-history-spool", type=str,
+                            help="File to keep the reports of active orders in while the endpoint is down")
+
         parser.add_argument("--eth-reserve", type=float, required=True,
                             help="Amount of ETH which will never be deposited so the keeper can cover gas")
 
@@ -128,6 +141,9 @@ class IdexMarketMakerKeeper:
 
         parser.set_defaults(cancel_on_shutdown=False, withdraw_on_shutdown=False)
 
+        self.add_metrics_arguments(parser)
+        KeeperHub.add_bands_arguments(parser)
+
         self.arguments = parser.parse_args(args)
         setup_logging(self.arguments)
 
@@ -146,7 +162,8 @@ class IdexMarketMakerKeeper:
         self.min_eth_balance = Wad.from_number(self.arguments.min_eth_balance)
         self.min_eth_deposit = Wad.from_number(self.arguments.min_eth_deposit)
         self.min_sai_deposit = Wad.from_number(self.arguments.min_sai_deposit)
-        self.gas_price = GasPriceFactory().create_gas_price(self.arguments)
+        self.gas_price = GasPriceFactory().create_gas_price(self.arguments, self.web3)
+        self.transactions = TransactionPipeline(self.web3, self.our_address, self.gas_price)
         self.price_feed = PriceFeedFactory().create_price_feed(self.arguments, self.tub)
         self.spread_feed = create_spread_feed(self.arguments)
         self.control_feed = create_control_feed(self.arguments)
@@ -155,10 +172,13 @@ class IdexMarketMakerKeeper:
         if self.eth_reserve <= self.min_eth_balance:
             raise Exception("--eth-reserve must be higher than --min-eth-balance")
 
-        self.history = History()
+        self.history = KeeperHub.history(self.arguments)
+        self.bands_engine = KeeperHub.bands_engine(self.arguments)
         self.idex = IDEX(self.web3, Address(self.arguments.idex_address))
         self.idex_api = IDEXApi(self.idex, self.arguments.idex_api_server, self.arguments.idex_timeout)
 
+        self.enable_metrics()
+
     def main(self):
         with Lifecycle(self.web3) as lifecycle:
             lifecycle.initial_delay(10)
@@ -226,7 +246,7 @@ class IdexMarketMakerKeeper:
 
             return
 
-        bands = Bands.read(self.bands_config, self.spread_feed, self.control_feed, self.history)
+        bands = self.bands_engine.read(self.bands_config, self.spread_feed, self.control_feed, self.history)
         our_balances = self.our_balances()
         our_orders = self.our_orders()
         target_price = self.price_feed.get_price()
@@ -305,7 +325,7 @@ class IdexMarketMakerKeeper:
 
         # If we still can deposit something, and it's at least `min_eth_deposit`, then we do deposit.
         if missing_sell_amount > Wad(0) and missing_sell_amount >= self.min_eth_deposit:
-            receipt = self.idex.deposit(missing_sell_amount).transact(gas_price=self.gas_price)
+            receipt = self.transactions.transact(self.idex.deposit(missing_sell_amount))
             return receipt is not None and receipt.successful
         else:
             return False
@@ -322,7 +342,7 @@ class IdexMarketMakerKeeper:
 
         # If we still can deposit something, and it's at least `min_sai_deposit`, then we do deposit.
         if missing_buy_amount > Wad(0) and missing_buy_amount >= self.min_sai_deposit:
-            receipt = self.idex.deposit_token(self.sai.address, missing_buy_amount).transact(gas_price=self.gas_price)
+            receipt = self.transactions.transact(self.idex.deposit_token(self.sai.address, missing_buy_amount))
             return receipt is not None and receipt.successful
         else:
             return False
@@ -0,0 +1,132 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2017-2018 reverendus
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import atexit
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+from market_maker_keeper.band import Bands
+from market_maker_keeper.capture import CaptureWriter
+from market_maker_keeper.control_feed import create_control_feed
+from market_maker_keeper.feed import Feed
+from market_maker_keeper.limit import History
+from market_maker_keeper.price_feed import PriceFeed, PriceFeedFactory
+from market_maker_keeper.spread_feed import create_spread_feed
+from market_maker_keeper.vectorized_band import VectorizedBands
+from market_maker_keeper.websocket_connection import WebSocketConnectionManager
+
+
+BANDS_ENGINES = {'python': Bands, 'numpy': VectorizedBands}
+
+
+class KeeperHub:
+    """Resources shared by all keepers running in one process.
+
+    Keepers ask the hub for their price, spread and control feeds, their exchange API clients and
+    their worker pools instead of creating them on their own. Every resource is identified by a key
+    built from the arguments it gets created from, so keepers configured with the same feed or with
+    the same API credentials share one instance of it (one set of WebSocket connections, one HTTP
+    connection pool). A keeper running on its own gets a private hub, in which case nothing is shared.
+
+    Attributes:
+        max_workers: Default number of threads in a worker pool, see `executor()`.
+    """
+
+    logger = logging.getLogger()
+
+    def __init__(self, max_workers: int = 5):
+        assert(isinstance(max_workers, int))
+
+        self.max_workers = max_workers
+
+        self._resources = {}
+        self._lock = threading.Lock()
+
+    def shared(self, key: tuple, create_function):
+        """Returns the resource identified by `key`, calling `create_function` to create it the first time."""
+        assert(isinstance(key, tuple))
+        assert(callable(create_function))
+
+        with self._lock:
+            if key not in self._resources:
+                self.logger.debug(f"Creating shared resource {key[0]}")
+                self._resources[key] = create_function()
+
+            return self._resources[key]
+
+    @staticmethod
+    def add_bands_arguments(parser):
+        parser.add_argument("--bands-engine", type=str, choices=sorted(BANDS_ENGINES.keys()), default='python',
+                            help="Implementation of the bands calculations, `numpy` being faster for keepers"
+                                 " with many orders (default: python)")
+
+        parser.add_argument("--limits-log", type=str,
+                            help="Prefix of the files to log amounts used by the order rate limits to, so the limits"
+                                 " survive keeper restarts (`<prefix>-buy.log` and `<prefix>-sell.log`)")
+
+    @staticmethod
+    def bands_engine(arguments) -> type:
+        """Returns the `Bands` class selected with `--bands-engine`, see `add_bands_arguments()`."""
+        return BANDS_ENGINES[arguments.bands_engine]
+
+    @staticmethod
+    def history(arguments) -> History:
+        """Returns the order rate limits `History`, logged to the files selected with `--limits-log`."""
+        if arguments.limits_log is None:
+            return History()
+
+        return History(buy_log_file=f"{arguments.limits_log}-buy.log", sell_log_file=f"{arguments.limits_log}-sell.log")
+
+    def price_feed(self, arguments) -> PriceFeed:
+        return self.shared(('price-feed', arguments.price_feed, arguments.price_feed_expiry, arguments.setzer_http_sources),
+                           lambda: PriceFeedFactory().create_price_feed(arguments))
+
+    def spread_feed(self, arguments) -> Feed:
+        return self.shared(('spread-feed', arguments.spread_feed, arguments.spread_feed_expiry),
+                           lambda: create_spread_feed(arguments))
+
+    def control_feed(self, arguments) -> Feed:
+        return self.shared(('control-feed', arguments.control_feed, arguments.control_feed_expiry),
+                           lambda: create_control_feed(arguments))
+
+    def capture(self, arguments):
+        """Starts recording the messages received by all WebSocket feeds to `--capture-file`, if configured."""
+        if arguments.capture_file:
+            capture = self.shared(('capture', arguments.capture_file), lambda: self._create_capture(arguments.capture_file))
+            WebSocketConnectionManager.default().capture_with(capture)
+
+    @staticmethod
+    def _create_capture(filename: str) -> CaptureWriter:
+        # the capture file is shared by all keepers in the process, so it gets closed when the process exits
+        # rather than when the first of them shuts down
+        capture = CaptureWriter(filename)
+        atexit.register(capture.close)
+        return capture
+
+    def executor(self, key: tuple = (), max_workers: Optional[int] = None) -> ThreadPoolExecutor:
+        """Returns the worker pool identified by `key`.
+
+        All keepers share the default pool. Keepers which need their requests to be sent one by one
+        (i.e. because the exchange requires increasing nonces) ask for a separate pool per API key.
+        """
+        assert(isinstance(key, tuple))
+        assert(isinstance(max_workers, int) or (max_workers is None))
+
+        max_workers = max_workers if max_workers is not None else self.max_workers
+        return self.shared(('executor', max_workers) + key, lambda: ThreadPoolExecutor(max_workers=max_workers))
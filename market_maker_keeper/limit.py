@@ -15,33 +15,184 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import json
 import logging
+import os
 import threading
-from functools import reduce
+import time
+from bisect import bisect_right, insort
+from typing import Optional
 
 from pymaker.numeric import Wad
 
 
 class History:
-    def __init__(self):
-        self.buy_history = SideHistory()
-        self.sell_history = SideHistory()
+    def __init__(self, buy_log_file: Optional[str] = None, sell_log_file: Optional[str] = None):
+        self.buy_history = SideHistory(log_file=buy_log_file)
+        self.sell_history = SideHistory(log_file=sell_log_file)
 
 
 class SideHistory:
-    def __init__(self):
-        self.items = []
+    """History of amounts used on one side of the order book, used to enforce `SideLimits`.
+
+    Items are kept in timestamp order together with running totals of their amounts, so the amount
+    used in any time window is a difference of two running totals. Windows of each limit period are
+    tracked with a pair of cursors, which only move forward as time goes by, which makes
+    `used_amount()` O(1) amortised for increasing timestamps. Queries for earlier timestamps use bisection.
+
+    Items older than the longest period tracked (see `track_periods()`), or than `default_retention`
+    if no period is tracked, relative to the newest item get evicted. Only periods of the current
+    limits are tracked, so periods of limits removed from the config stop holding items back.
+
+    If `log_file` is given, all items get appended to it, and the items still within the retention
+    period get loaded from it on startup, so limits survive keeper restarts. The log gets compacted
+    on startup.
+
+    Attributes:
+        log_file: Optional path of the append-only log file.
+        default_retention: Retention (in seconds) used until a limit period gets tracked.
+    """
+
+    logger = logging.getLogger()
+
+    def __init__(self, log_file: Optional[str] = None, default_retention: int = 7*86400):
+        assert(isinstance(log_file, str) or (log_file is None))
+        assert(isinstance(default_retention, int))
+
+        self.log_file = log_file
+        self.default_retention = default_retention
+
         self._lock = threading.Lock()
+        self._timestamps = []
+        self._amounts = []
+        self._totals = []
+        self._offset = 0
+        self._evicted_total = 0
+        self._periods = set()
+        self._windows = {}
+
+        if self.log_file is not None:
+            self._load_log()
+
+    @property
+    def items(self) -> list:
+        return self.get_items()
+
+    def track_periods(self, periods: list):
+        """Makes sure items are retained for the longest of `periods`, so windows of these lengths can be queried.
+
+        Replaces periods tracked so far, windows of periods which are not tracked anymore get discarded.
+        """
+        assert(isinstance(periods, list))
+        assert(all(isinstance(seconds, int) for seconds in periods))
+
+        with self._lock:
+            self._periods = set(periods)
+            self._windows = {seconds: window for seconds, window in self._windows.items() if seconds in self._periods}
 
     def add_item(self, item: dict):
         assert(isinstance(item, dict))
 
         with self._lock:
-            self.items.append(item)
+            self._add(item['timestamp'], item['amount'].value)
+            self._evict()
+
+        if self.log_file is not None:
+            with open(self.log_file, 'a') as file:
+                file.write(json.dumps({'timestamp': item['timestamp'], 'amount': str(item['amount'].value)}) + '\n')
 
     def get_items(self) -> list:
         with self._lock:
-            return list(self.items)
+            return [{'timestamp': timestamp, 'amount': Wad(amount)} for timestamp, amount in zip(self._timestamps, self._amounts)]
+
+    def used_amount(self, timestamp, seconds: int) -> Wad:
+        """Returns the total amount of items with `timestamp - seconds < item['timestamp'] <= timestamp`."""
+        assert(isinstance(seconds, int))
+
+        with self._lock:
+            window = self._windows.get(seconds)
+
+            if window is None or timestamp < window[0]:
+                lower = bisect_right(self._timestamps, timestamp - seconds) + self._offset
+                upper = bisect_right(self._timestamps, timestamp) + self._offset
+            else:
+                _, lower, upper = window
+                lower = max(lower, self._offset)
+                upper = max(upper, self._offset)
+                end = len(self._timestamps) + self._offset
+
+                while upper < end and self._timestamps[upper - self._offset] <= timestamp:
+                    upper += 1
+                while lower < upper and self._timestamps[lower - self._offset] <= timestamp - seconds:
+                    lower += 1
+
+            # windows are only kept for tracked periods, so ad-hoc queries do not pile them up
+            if seconds in self._periods and (window is None or timestamp >= window[0]):
+                self._windows[seconds] = (timestamp, lower, upper)
+
+            return Wad(self._total_before(upper) - self._total_before(lower))
+
+    def _total_before(self, index: int) -> int:
+        return self._totals[index - self._offset - 1] if index > self._offset else self._evicted_total
+
+    def _add(self, timestamp, amount: int):
+        if len(self._timestamps) == 0 or timestamp >= self._timestamps[-1]:
+            self._timestamps.append(timestamp)
+            self._amounts.append(amount)
+            self._totals.append(self._total_before(len(self._timestamps) - 1 + self._offset) + amount)
+
+        else:
+            # Items are expected to come in order, an out-of-order item invalidates the windows and totals.
+            position = bisect_right(self._timestamps, timestamp)
+            self._timestamps.insert(position, timestamp)
+            self._amounts.insert(position, amount)
+
+            total = self._total_before(position + self._offset)
+            self._totals[position:] = []
+            for item_amount in self._amounts[position:]:
+                total += item_amount
+                self._totals.append(total)
+
+            self._windows = {}
+
+    def _evict(self):
+        retention = max(self._periods) if len(self._periods) > 0 else self.default_retention
+        count = bisect_right(self._timestamps, self._timestamps[-1] - retention)
+
+        if count > 0:
+            self._evicted_total = self._totals[count - 1]
+            self._offset += count
+            del self._timestamps[:count]
+            del self._amounts[:count]
+            del self._totals[:count]
+
+    def _load_log(self):
+        if not os.path.isfile(self.log_file):
+            return
+
+        items = []
+        with open(self.log_file, 'r') as file:
+            for line in file:
+                try:
+                    data = json.loads(line)
+                    items.append((data['timestamp'], int(data['amount'])))
+                except Exception:
+                    self.logger.warning(f"Ignoring invalid line in '{self.log_file}': {line.strip()}")
+
+        oldest = time.time() - self.default_retention
+        items = sorted(item for item in items if item[0] > oldest)
+
+        with self._lock:
+            for timestamp, amount in items:
+                self._add(timestamp, amount)
+
+        temporary_file = self.log_file + '.tmp'
+        with open(temporary_file, 'w') as file:
+            for timestamp, amount in items:
+                file.write(json.dumps({'timestamp': timestamp, 'amount': str(amount)}) + '\n')
+
+        os.replace(temporary_file, self.log_file)
+        self.logger.info(f"Loaded {len(items)} item(s) from '{self.log_file}'")
 
 
 class SideLimits:
@@ -54,6 +205,8 @@ class SideLimits:
         self.side_limits = list(map(SideLimit, limits))
         self.side_history = side_history
 
+        self.side_history.track_periods([side_limit.seconds for side_limit in self.side_limits])
+
     def available_limit(self, timestamp: int):
         if len(self.side_limits) > 0:
             return Wad.min(*map(lambda limit: limit.available_limit(timestamp, self.side_history), self.side_limits))
@@ -79,7 +232,6 @@ class SideLimit:
     def available_limit(self, timestamp: int, side_history: SideHistory):
         assert(isinstance(side_history, SideHistory))
 
-        items = filter(lambda item: timestamp - self.seconds < item['timestamp'] <= timestamp, side_history.get_items())
-        used_amount = reduce(Wad.__add__, map(lambda item: item['amount'], items), Wad(0))
+        used_amount = side_history.used_amount(timestamp, self.seconds)
 
         return Wad.max(self.amount - used_amount, Wad(0))
@@ -0,0 +1,439 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2017-2018 reverendus
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import functools
+import logging
+import sys
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from typing import Optional
+
+from market_maker_keeper.price_feed import Price, PriceFeed
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class LatencyHistogram:
+    """Histogram of latencies (in seconds), with HDR-style logarithmic buckets.
+
+    Values below `2 * SUB_BUCKETS` microseconds get their own bucket, above that every power of two
+    is split into `SUB_BUCKETS` buckets, so each value is known with a relative precision better than
+    `1 / SUB_BUCKETS` (about 1.6%). Recording is O(1) and the memory taken does not depend on the
+    number of values recorded. Values above `highest` get recorded as `highest`.
+
+    Attributes:
+        highest: Highest value (in seconds) which can be recorded.
+    """
+
+    SUB_BUCKETS = 64
+    UNIT = 0.000001
+
+    def __init__(self, highest: float = 3600.0):
+        assert(isinstance(highest, float) or isinstance(highest, int))
+
+        self.highest = highest
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+        self._counts = [0] * (self._index(int(highest / self.UNIT)) + 1)
+        self._lock = threading.Lock()
+
+    def record(self, value: float):
+        value = min(max(value, 0.0), self.highest)
+        index = self._index(int(value / self.UNIT))
+
+        with self._lock:
+            self._counts[index] += 1
+            self.count += 1
+            self.sum += value
+            self.max = max(self.max, value)
+
+    def percentile(self, percent: float) -> float:
+        """Returns the value (in seconds) below which `percent` percent of the recorded values are."""
+        assert(0 <= percent <= 100)
+
+        with self._lock:
+            if self.count == 0:
+                return 0.0
+
+            target = max(1, int(round(self.count * percent / 100)))
+            seen = 0
+            for index, count in enumerate(self._counts):
+                seen += count
+                if seen >= target:
+                    return min(self._upper_bound(index) * self.UNIT, self.max)
+
+        return self.max
+
+    @classmethod
+    def _index(cls, units: int) -> int:
+        if units < 2 * cls.SUB_BUCKETS:
+            return units
+
+        shift = units.bit_length() - cls.SUB_BUCKETS.bit_length()
+        return (shift + 1) * cls.SUB_BUCKETS + (units >> shift) - cls.SUB_BUCKETS
+
+    @classmethod
+    def _upper_bound(cls, index: int) -> int:
+        if index < 2 * cls.SUB_BUCKETS:
+            return index
+
+        shift = index // cls.SUB_BUCKETS - 1
+        return ((index % cls.SUB_BUCKETS + cls.SUB_BUCKETS + 1) << shift) - 1
+
+
+class Metrics:
+    """Registry of latency histograms, exposed in the Prometheus text format.
+
+    Histograms are identified by their name and labels. `serve()` starts an HTTP server exposing
+    all of them on `/metrics` (as Prometheus summaries) and the samples taken by the profiler,
+    if there is one, on `/profile`. Keepers running in one process share the `default()` registry.
+    """
+
+    QUANTILES = [0.5, 0.9, 0.99, 0.999]
+
+    logger = logging.getLogger()
+
+    _default = None
+    _default_lock = threading.Lock()
+
+    def __init__(self):
+        self.profiler = None
+
+        self._histograms = {}
+        self._servers = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def default():
+        with Metrics._default_lock:
+            if Metrics._default is None:
+                Metrics._default = Metrics()
+
+            return Metrics._default
+
+    def histogram(self, name: str, **labels) -> LatencyHistogram:
+        key = (name, tuple(sorted(labels.items())))
+        histogram = self._histograms.get(key)
+        if histogram is None:
+            with self._lock:
+                histogram = self._histograms.setdefault(key, LatencyHistogram())
+
+        return histogram
+
+    @contextmanager
+    def timer(self, name: str, **labels):
+        """Records the time the `with` block takes in the `name` histogram."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.histogram(name, **labels).record(time.perf_counter() - started)
+
+    def render(self) -> str:
+        """Returns all the histograms in the Prometheus text exposition format."""
+        with self._lock:
+            histograms = sorted(self._histograms.items())
+
+        lines = []
+        for index, ((name, labels), histogram) in enumerate(histograms):
+            if index == 0 or histograms[index - 1][0][0] != name:
+                lines.append(f"# TYPE {name} summary")
+
+            for quantile in self.QUANTILES:
+                lines.append(f"{name}{self._labels(labels + (('quantile', str(quantile)),))} {histogram.percentile(quantile * 100)}")
+
+            lines.append(f"{name}_sum{self._labels(labels)} {histogram.sum}")
+            lines.append(f"{name}_count{self._labels(labels)} {histogram.count}")
+
+        return '\n'.join(lines) + '\n'
+
+    def serve(self, port: int, host: str = '0.0.0.0'):
+        """Starts exposing the histograms on `http://host:port/metrics`, unless already exposed on `port`."""
+        assert(isinstance(port, int))
+
+        with self._lock:
+            if port in self._servers:
+                return
+
+            metrics = self
+
+            class Handler(BaseHTTPRequestHandler):
+                def do_GET(self):
+                    if self.path == '/metrics':
+                        body, content_type = metrics.render(), 'text/plain; version=0.0.4'
+                    elif self.path == '/profile' and metrics.profiler is not None:
+                        body, content_type = metrics.profiler.collapsed(), 'text/plain'
+                    else:
+                        self.send_error(404)
+                        return
+
+                    self.send_response(200)
+                    self.send_header('Content-Type', content_type)
+                    self.end_headers()
+                    self.wfile.write(body.encode())
+
+                def log_message(self, format, *args):
+                    pass
+
+            server = ThreadingHTTPServer((host, port), Handler)
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+            self._servers[port] = server
+
+        self.logger.info(f"Exposing metrics on port {port}")
+
+    def start_profiler(self, interval: float) -> 'SamplingProfiler':
+        """Starts sampling synchronization cycles, unless already started, and exposes the samples on `/profile`."""
+        with self._lock:
+            if self.profiler is None:
+                self.profiler = SamplingProfiler(interval=interval)
+                self.profiler.start()
+
+            return self.profiler
+
+    def shutdown(self):
+        with self._lock:
+            for server in self._servers.values():
+                server.shutdown()
+                server.server_close()
+
+            self._servers = {}
+
+    @staticmethod
+    def _labels(labels: tuple) -> str:
+        if len(labels) == 0:
+            return ''
+
+        escaped = [(name, str(value).replace('\\', '\\\\').replace('"', '\\"')) for name, value in labels]
+        return '{' + ','.join(f'{name}="{value}"' for name, value in escaped) + '}'
+
+
+class SamplingProfiler:
+    """Statistical profiler of the synchronization cycles of keepers.
+
+    Every `interval` seconds a background thread takes a snapshot of the stacks of the threads
+    which are inside an `active()` block at that moment, so its cost does not depend on how much
+    code the keepers run and idle threads (waiting for websockets, for the exchange...) do not show up.
+    Samples are aggregated by stack and can be rendered with `collapsed()` in the format used by
+    flame graph tools.
+
+    Attributes:
+        interval: Time (in seconds) between samples.
+        max_depth: Maximum number of frames of a stack.
+    """
+
+    def __init__(self, interval: float = 0.01, max_depth: int = 64):
+        assert(isinstance(interval, float) or isinstance(interval, int))
+        assert(isinstance(max_depth, int))
+
+        self.interval = interval
+        self.max_depth = max_depth
+        self.samples = 0
+
+        self._active_threads = defaultdict(int)
+        self._stacks = defaultdict(int)
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._background_run, daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+
+    @contextmanager
+    def active(self):
+        """Makes the profiler sample the current thread while in the `with` block."""
+        thread_id = threading.get_ident()
+        with self._lock:
+            self._active_threads[thread_id] += 1
+
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._active_threads[thread_id] -= 1
+                if self._active_threads[thread_id] == 0:
+                    del self._active_threads[thread_id]
+
+    def sample(self):
+        with self._lock:
+            thread_ids = set(self._active_threads.keys())
+
+        if len(thread_ids) == 0:
+            return
+
+        frames = sys._current_frames()
+        for thread_id in thread_ids:
+            frame = frames.get(thread_id)
+            stack = []
+            while frame is not None and len(stack) < self.max_depth:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({code.co_filename.rsplit('/', 1)[-1]}:{code.co_firstlineno})")
+                frame = frame.f_back
+
+            if len(stack) > 0:
+                with self._lock:
+                    self._stacks[';'.join(reversed(stack))] += 1
+                    self.samples += 1
+
+    def collapsed(self) -> str:
+        """Returns the samples taken, one `stack count` line per distinct stack, most frequent first."""
+        with self._lock:
+            stacks = sorted(self._stacks.items(), key=lambda item: item[1], reverse=True)
+
+        return ''.join(f"{stack} {count}\n" for stack, count in stacks)
+
+    def _background_run(self):
+        while not self._stopped.wait(self.interval):
+            self.sample()
+
+
+# labels of the synchronization cycle being run by the current thread, see `timed_stage()`
+_cycle = threading.local()
+
+
+def timed_stage(stage: str):
+    """Decorator recording the time a function takes as `stage` of the synchronization cycle it gets called from.
+
+    Functions called outside of a cycle of a keeper with metrics enabled (see `MetricsMixin`) are not
+    measured, so the only cost in that case is one thread-local lookup.
+    """
+    assert(isinstance(stage, str))
+
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            cycle = getattr(_cycle, 'current', None)
+            if cycle is None:
+                return function(*args, **kwargs)
+
+            metrics, labels = cycle
+            with metrics.timer('keeper_stage_seconds', stage=stage, **labels):
+                return function(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+class InstrumentedPriceFeed(PriceFeed):
+    """Price feed measuring the time `get_price()` of another price feed takes."""
+
+    def __init__(self, price_feed: PriceFeed):
+        assert(isinstance(price_feed, PriceFeed))
+
+        self.price_feed = price_feed
+
+    @timed_stage('get_price')
+    def get_price(self) -> Price:
+        return self.price_feed.get_price()
+
+    def timestamp(self) -> Optional[float]:
+        return self.price_feed.timestamp()
+
+    def on_update(self, on_update_function):
+        self.price_feed.on_update(on_update_function)
+
+
+class MetricsMixin:
+    """Instrumentation of the synchronization cycle, shared by all market maker keepers.
+
+    Keepers add the `--metrics-port` and `--profile-interval` arguments with `add_metrics_arguments()`
+    and call `enable_metrics()` once their feeds and order book manager are created, but before
+    `synchronize_orders` gets passed to a scheduler. If either argument is set, latency histograms of:
+
+    * the whole `synchronize_orders()` and each of its stages (reading bands, getting the order book
+      and the price, calculating orders to cancel and to place, placing them),
+    * each exchange call made by the order book manager (`get_orders`, `get_balances`, `place_order`,
+      `cancel_order`, `cancel_orders`),
+    * the age of the price, spread and control feeds at the start of each cycle,
+
+    get exposed on `http://localhost:<metrics port>/metrics`, labelled with the keeper and the pair.
+    With `--profile-interval`, the cycles are also sampled by a `SamplingProfiler`, see `/profile`.
+    """
+
+    @staticmethod
+    def add_metrics_arguments(parser):
+        parser.add_argument("--metrics-port", type=int,
+                            help="Port to expose latency histograms on, in the Prometheus format (default: disabled)")
+
+        parser.add_argument("--profile-interval", type=float,
+                            help="Sample the stacks of synchronization cycles every so many seconds,"
+                                 " exposed on `/profile` of the metrics port (default: disabled)")
+
+    def enable_metrics(self):
+        if self.arguments.metrics_port is None and self.arguments.profile_interval is None:
+            return
+
+        metrics = Metrics.default()
+        if self.arguments.metrics_port is not None:
+            metrics.serve(self.arguments.metrics_port)
+
+        profiler = metrics.start_profiler(self.arguments.profile_interval) if self.arguments.profile_interval else None
+
+        labels = {'keeper': type(self).__name__.replace('MarketMakerKeeper', '').lower(),
+                  'pair': getattr(self.arguments, 'pair', None) or ''}
+
+        if getattr(self, 'order_book_manager', None) is not None:
+            self.order_book_manager.enable_metrics(metrics, labels)
+
+        if isinstance(getattr(self, 'price_feed', None), PriceFeed):
+            self.price_feed = InstrumentedPriceFeed(self.price_feed)
+
+        if callable(getattr(self, 'place_orders', None)):
+            self.place_orders = timed_stage('place_orders')(self.place_orders)
+
+        synchronize_orders = timed_stage('synchronize_orders')(self.synchronize_orders)
+
+        @functools.wraps(synchronize_orders)
+        def instrumented_synchronize_orders(*args, **kwargs):
+            previous_cycle = getattr(_cycle, 'current', None)
+            _cycle.current = (metrics, labels)
+            try:
+                self._record_feed_ages(metrics, labels)
+
+                if profiler is not None:
+                    with profiler.active():
+                        return synchronize_orders(*args, **kwargs)
+                else:
+                    return synchronize_orders(*args, **kwargs)
+            finally:
+                _cycle.current = previous_cycle
+
+        self.synchronize_orders = instrumented_synchronize_orders
+
+    def _record_feed_ages(self, metrics: Metrics, labels: dict):
+        now = time.time()
+        timestamps = {'price': self.price_feed.timestamp() if isinstance(getattr(self, 'price_feed', None), PriceFeed) else None}
+        for feed in ['spread', 'control']:
+            if getattr(self, f'{feed}_feed', None) is not None:
+                timestamps[feed] = getattr(self, f'{feed}_feed').get()[1]
+
+        for feed, timestamp in timestamps.items():
+            if timestamp:
+                metrics.histogram('keeper_feed_age_seconds', feed=feed, **labels).record(now - timestamp)
@@ -0,0 +1,144 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2017-2018 reverendus
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import argparse
+import importlib
+import json
+import logging
+import sys
+import threading
+
+from market_maker_keeper.keeper_hub import KeeperHub
+from market_maker_keeper.util import setup_logging
+from pymaker.lifecycle import Lifecycle
+
+
+class MultiPairKeeper:
+    """Runs market maker keepers for many pairs of one exchange in one process.
+
+    The pairs are read from a JSON file:
+
+        {
+            "keeper": "okex",
+            "arguments": {"okex-api-key": "...", "okex-secret-key": "...", "price-feed-expiry": 60},
+            "pairs": {
+                "mkr_eth": {"config": "mkr_eth-bands.json", "price-feed": "ws://.../mkr_eth"},
+                "dai_eth": {"config": "dai_eth-bands.json", "price-feed": "ws://.../dai_eth"}
+            }
+        }
+
+    Every pair gets its own keeper, created with the command-line arguments of its single-pair version:
+    the common `arguments` overridden by the ones of the pair, plus `--pair`. Arguments with the value
+    `true` become flags. All keepers share one `KeeperHub`, so pairs with the same feeds or the same
+    API credentials share the same feed subscriptions and API clients, and all of them place and cancel
+    orders from one worker pool. Every keeper keeps its own order book manager and its own scheduler,
+    so the pairs get synchronized independently of each other.
+    """
+
+    logger = logging.getLogger()
+
+    KEEPERS = {
+        'bibox': 'market_maker_keeper.bibox_market_maker_keeper.BiboxMarketMakerKeeper',
+        'ethfinex': 'market_maker_keeper.ethfinex_market_maker_keeper.EthfinexMarketMakerKeeper',
+        'gateio': 'market_maker_keeper.gateio_market_maker_keeper.GateIOMarketMakerKeeper',
+        'gopax': 'market_maker_keeper.gopax_market_maker_keeper.GOPAXMarketMakerKeeper',
+        'hitbtc': 'market_maker_keeper.hitbtc_market_maker_keeper.HitBTCMarketMakerKeeper',
+        'kucoin': 'market_maker_keeper.kucoin_market_maker_keeper.KucoinMarketMakerKeeper',
+        'okex': 'market_maker_keeper.okex_market_maker_keeper.OkexMarketMakerKeeper'
+    }
+
+    def __init__(self, args: list):
+        parser = argparse.ArgumentParser(prog='multi-pair-market-maker-keeper')
+
+        parser.add_argument("--config", type=str, required=True,
+                            help="Pairs configuration file")
+
+        parser.add_argument("--max-workers", type=int, default=10,
+                            help="Number of threads placing and cancelling orders for all pairs (default: 10)")
+
+        parser.add_argument("--debug", dest='debug', action='store_true',
+                            help="Enable debug output")
+
+        self.arguments = parser.parse_args(args)
+        setup_logging(self.arguments)
+
+        with open(self.arguments.config) as file:
+            config = json.load(file)
+
+        self.hub = KeeperHub(max_workers=self.arguments.max_workers)
+        self.keepers = self.create_keepers(config, self.hub, self.arguments.debug)
+
+    @staticmethod
+    def keeper_class(name: str):
+        if name not in MultiPairKeeper.KEEPERS:
+            raise ValueError(f"Unknown keeper '{name}', supported keepers: {', '.join(sorted(MultiPairKeeper.KEEPERS))}")
+
+        module_name, class_name = MultiPairKeeper.KEEPERS[name].rsplit('.', 1)
+        return getattr(importlib.import_module(module_name), class_name)
+
+    @staticmethod
+    def keeper_arguments(common_arguments: dict, pair: str, pair_arguments: dict, debug: bool) -> list:
+        arguments = {**common_arguments, **pair_arguments}
+        arguments.setdefault('pair', pair)
+        if debug:
+            arguments['debug'] = True
+
+        result = []
+        for name, value in arguments.items():
+            if value is True:
+                result.append(f"--{name}")
+            elif value is not None and value is not False:
+                result += [f"--{name}", str(value)]
+
+        return result
+
+    @staticmethod
+    def create_keepers(config: dict, hub: KeeperHub, debug: bool = False) -> list:
+        assert(isinstance(config, dict))
+        assert(isinstance(hub, KeeperHub))
+
+        keeper_class = MultiPairKeeper.keeper_class(config['keeper'])
+
+        return [keeper_class(MultiPairKeeper.keeper_arguments(config.get('arguments', {}), pair, pair_arguments or {}, debug), hub)
+                for pair, pair_arguments in config['pairs'].items()]
+
+    def main(self):
+        self.logger.info(f"Running {len(self.keepers)} keepers in one process")
+
+        with Lifecycle() as lifecycle:
+            lifecycle.initial_delay(10)
+            lifecycle.every(1, self.watchdog)
+            lifecycle.on_shutdown(self.shutdown)
+
+    def watchdog(self):
+        for keeper in self.keepers:
+            keeper.synchronize_scheduler.watchdog()
+
+    def shutdown(self):
+        # stop all the pairs first, so none of them places new orders while the others are cancelling theirs
+        for keeper in self.keepers:
+            keeper.synchronize_scheduler.stop()
+
+        threads = [threading.Thread(target=keeper.shutdown) for keeper in self.keepers]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+
+if __name__ == '__main__':
+    MultiPairKeeper(sys.argv[1:]).main()
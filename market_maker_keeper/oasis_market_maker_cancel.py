@@ -21,6 +21,7 @@ import sys
 
 from web3 import Web3, HTTPProvider
 
+from market_maker_keeper.oasis_order_index import OasisOrderIndex
 from pymaker import Address
 from pymaker.gas import FixedGasPrice, DefaultGasPrice
 from pymaker.keys import register_keys
@@ -39,6 +40,8 @@ class OasisMarketMakerCancel:
         parser.add_argument("--eth-from", help="Ethereum account from which to send transactions", required=True, type=str)
         parser.add_argument("--eth-key", type=str, nargs='*', help="Ethereum private key(s) to use")
         parser.add_argument("--oasis-address", help="Ethereum address of the OasisDEX contract", required=True, type=str)
+        parser.add_argument("--order-index", help="File the keeper keeps the index of our orders in", type=str)
+        parser.add_argument("--order-index-from-block", help="Block to start building the index of our orders from (default: walk the order book)", type=int)
         parser.add_argument("--gas-price", help="Gas price in Wei (default: node default)", default=0, type=int)
         self.arguments = parser.parse_args(args)
 
@@ -48,11 +51,14 @@ class OasisMarketMakerCancel:
         self.our_address = Address(self.arguments.eth_from)
         register_keys(self.web3, self.arguments.eth_key)
         self.otc = MatchingMarket(web3=self.web3, address=Address(self.arguments.oasis_address))
+        self.order_index = OasisOrderIndex(self.otc, self.our_address,
+                                           from_block=self.arguments.order_index_from_block,
+                                           state_file=self.arguments.order_index)
 
         logging.basicConfig(format='%(asctime)-15s %(levelname)-8s %(message)s', level=logging.INFO)
 
     def main(self):
-        self.cancel_orders(self.our_orders(self.otc.get_orders()))
+        self.cancel_orders(self.our_orders(self.order_index.get_orders()))
 
     def our_orders(self, orders: list):
         return list(filter(lambda order: order.maker == self.our_address, orders))
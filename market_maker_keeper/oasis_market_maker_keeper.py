@@ -21,15 +21,19 @@ import sys
 
 from web3 import Web3, HTTPProvider
 
-from market_maker_keeper.band import Bands, NewOrder
+from market_maker_keeper.band import NewOrder
+from market_maker_keeper.chain_state import BlockStateCache, OASIS_IS_CLOSED
 from market_maker_keeper.control_feed import create_control_feed
 from market_maker_keeper.gas import GasPriceFactory
-from market_maker_keeper.limit import History
+from market_maker_keeper.keeper_hub import KeeperHub
+from market_maker_keeper.metrics import MetricsMixin
+from market_maker_keeper.oasis_order_index import OasisOrderIndex
 from market_maker_keeper.order_book import OrderBookManager
 from market_maker_keeper.order_history_reporter import create_order_history_reporter
 from market_maker_keeper.price_feed import PriceFeedFactory
 from market_maker_keeper.reloadable_config import ReloadableConfig
 from market_maker_keeper.spread_feed import create_spread_feed
+from market_maker_keeper.transaction_pipeline import TransactionPipeline
 from market_maker_keeper.util import setup_logging
 from pymaker import Address
 from pymaker.approval import directly
@@ -40,10 +44,9 @@ from pymaker.oasis import Order, MatchingMarket
 from pymaker.sai import Tub
 from pymaker.token import ERC20Token
 from pymaker.transactional import TxManager
-from pymaker.util import eth_balance
 
 
-class OasisMarketMakerKeeper:
+class OasisMarketMakerKeeper(MetricsMixin):
     """Keeper acting as a market maker on OasisDEX."""
 
     logger = logging.getLogger()
@@ -75,6 +78,12 @@ class OasisMarketMakerKeeper:
         parser.add_argument("--oasis-support-address", type=str, required=False,
                             help="Ethereum address of the OasisDEX support contract")
 
+        parser.add_argument("--order-index", type=str,
+                            help="File to keep the index of our orders in between keeper restarts")
+
+        parser.add_argument("--order-index-from-block", type=int,
+                            help="Block to start building the index of our orders from (default: walk the order book)")
+
         parser.add_argument("--buy-token-address", type=str, required=True,
                             help="Ethereum address of the buy token")
 
@@ -90,6 +99,9 @@ class OasisMarketMakerKeeper:
         parser.add_argument("--price-feed-expiry", type=int, default=120,
                             help="Maximum age of the price feed (in seconds, default: 120)")
 
+        parser.add_argument("--setzer-http-sources", dest='setzer_http_sources', action='store_true',
+                            help="Fetch the `setzer` price sources available over HTTP directly instead of running `setzer`")
+
         parser.add_argument("--spread-feed", type=str,
                             help="Source of spread feed")
 
@@ -108,6 +120,15 @@ class OasisMarketMakerKeeper:
         parser.add_argument("--order-history-every", type=int, default=30,
                             help="Frequency of reporting active orders (in seconds, default: 30)")
 
+        parser.add_argument("--order-history-gzip", dest='order_history_gzip', action='store_true',
+                            help="Gzip the reports of active orders")
+
+        parser.add_argument("--order-history-delta", dest='order_history_delta', action='store_true',
+                            help="Only report the orders added and removed since the last successful report")
+
+        parser.add_argument("--order-history-spool", type=str,
+                            help="File to keep the reports of active orders in while the endpoint is down")
+
         parser.add_argument("--round-places", type=int, default=2,
                             help="Number of decimal places to round order prices to (default=2)")
 
@@ -126,6 +147,9 @@ class OasisMarketMakerKeeper:
         parser.add_argument("--debug", dest='debug', action='store_true',
                             help="Enable debug output")
 
+        self.add_metrics_arguments(parser)
+        KeeperHub.add_bands_arguments(parser)
+
         self.arguments = parser.parse_args(args)
         setup_logging(self.arguments)
 
@@ -145,14 +169,23 @@ class OasisMarketMakerKeeper:
         self.token_buy = ERC20Token(web3=self.web3, address=Address(self.arguments.buy_token_address))
         self.token_sell = ERC20Token(web3=self.web3, address=Address(self.arguments.sell_token_address))
         self.min_eth_balance = Wad.from_number(self.arguments.min_eth_balance)
+        self.chain_state = BlockStateCache(self.web3, self.our_address)
+        self.chain_state.track_call('is_closed', self.otc.address, OASIS_IS_CLOSED)
+        self.chain_state.track_balance(self.token_buy.address)
+        self.chain_state.track_balance(self.token_sell.address)
+        self.order_index = OasisOrderIndex(self.otc, self.our_address,
+                                           from_block=self.arguments.order_index_from_block,
+                                           state_file=self.arguments.order_index)
         self.bands_config = ReloadableConfig(self.arguments.config)
-        self.gas_price = GasPriceFactory().create_gas_price(self.arguments)
+        self.gas_price = GasPriceFactory().create_gas_price(self.arguments, self.web3)
+        self.transactions = TransactionPipeline(self.web3, self.our_address, self.gas_price)
         self.price_feed = PriceFeedFactory().create_price_feed(self.arguments, tub)
         self.spread_feed = create_spread_feed(self.arguments)
         self.control_feed = create_control_feed(self.arguments)
         self.order_history_reporter = create_order_history_reporter(self.arguments)
 
-        self.history = History()
+        self.history = KeeperHub.history(self.arguments)
+        self.bands_engine = KeeperHub.bands_engine(self.arguments)
         self.order_book_manager = OrderBookManager(refresh_frequency=self.arguments.refresh_frequency)
         self.order_book_manager.get_orders_with(lambda: self.our_orders())
         self.order_book_manager.place_orders_with(self.place_order_function)
@@ -160,6 +193,8 @@ class OasisMarketMakerKeeper:
         self.order_book_manager.enable_history_reporting(self.order_history_reporter, self.our_buy_orders, self.our_sell_orders)
         self.order_book_manager.start()
 
+        self.enable_metrics()
+
     def main(self):
         with Lifecycle(self.web3) as lifecycle:
             lifecycle.initial_delay(10)
@@ -178,12 +213,12 @@ class OasisMarketMakerKeeper:
         self.otc.approve([self.token_sell, self.token_buy], directly(gas_price=self.gas_price))
 
     def our_available_balance(self, token: ERC20Token) -> Wad:
-        return token.balance_of(self.our_address)
+        return self.chain_state.get().balance(token.address)
 
     def our_orders(self):
-        return list(filter(lambda order: order.maker == self.our_address,
-                           self.otc.get_orders(self.token_sell.address, self.token_buy.address) +
-                           self.otc.get_orders(self.token_buy.address, self.token_sell.address)))
+        # Our orders come from the event-log index, which gets updated at most once per block
+        our_orders = self.order_index.get_orders(self.chain_state.get().block_number)
+        return self.our_sell_orders(our_orders) + self.our_buy_orders(our_orders)
 
     def our_sell_orders(self, our_orders: list):
         return list(filter(lambda order: order.buy_token == self.token_buy.address and
@@ -194,8 +229,11 @@ class OasisMarketMakerKeeper:
                                          order.pay_token == self.token_buy.address, our_orders))
 
     def synchronize_orders(self):
+        # Balances and market status are read once per block, in one batch request, however often we get called
+        state = self.chain_state.get()
+
         # If market is closed, cancel all orders but do not terminate the keeper.
-        if self.otc.is_closed():
+        if state.call('is_closed'):
             self.logger.warning("Market is closed. Cancelling all orders.")
             self.order_book_manager.cancel_all_orders()
             return
@@ -203,37 +241,30 @@ class OasisMarketMakerKeeper:
         # If keeper balance is below `--min-eth-balance`, cancel all orders but do not terminate
         # the keeper, keep processing blocks as the moment the keeper gets a top-up it should
         # resume activity straight away, without the need to restart it.
-        if eth_balance(self.web3, self.our_address) < self.min_eth_balance:
+        if state.eth_balance < self.min_eth_balance:
             self.logger.warning("Keeper ETH balance below minimum. Cancelling all orders.")
             self.order_book_manager.cancel_all_orders()
             return
 
-        bands = Bands.read(self.bands_config, self.spread_feed, self.control_feed, self.history)
+        bands = self.bands_engine.read(self.bands_config, self.spread_feed, self.control_feed, self.history)
         order_book = self.order_book_manager.get_order_book()
         target_price = self.price_feed.get_price()
 
-        # Cancel orders
-        cancellable_orders = bands.cancellable_orders(our_buy_orders=self.our_buy_orders(order_book.orders),
-                                                      our_sell_orders=self.our_sell_orders(order_book.orders),
-                                                      target_price=target_price)
-        if len(cancellable_orders) > 0:
-            self.order_book_manager.cancel_orders(cancellable_orders)
-            return
-
-        # Do not place new orders if other new orders are being placed. In contrary to other keepers,
-        # we allow placing new orders when other orders are being cancelled. This is because Ethereum
-        # transactions are ordered so we are sure that the order placement will not 'overtake'
-        # order cancellation.
-        if order_book.orders_being_placed:
-            self.logger.debug("Other orders are being placed, not placing new orders")
-            return
-
-        # Place new orders
-        self.order_book_manager.place_orders(bands.new_orders(our_buy_orders=self.our_buy_orders(order_book.orders),
-                                                              our_sell_orders=self.our_sell_orders(order_book.orders),
-                                                              our_buy_balance=self.our_available_balance(self.token_buy),
-                                                              our_sell_balance=self.our_available_balance(self.token_sell),
-                                                              target_price=target_price)[0])
+        # Cancel orders and place new ones at the same time, new orders being calculated as if
+        # the cancellations had already happened, so orders leaving the bands get replaced straight away
+        # (without using the balances locked in orders being cancelled, as their cancellation may still fail).
+        # In contrary to other keepers, we allow placing new orders when other orders are being cancelled.
+        # This is because Ethereum transactions are ordered so we are sure that the order placement
+        # will not 'overtake' order cancellation.
+        reconciliation = bands.reconcile(our_buy_orders=self.our_buy_orders(order_book.orders),
+                                         our_sell_orders=self.our_sell_orders(order_book.orders),
+                                         our_buy_balance=state.balance(self.token_buy.address),
+                                         our_sell_balance=state.balance(self.token_sell.address),
+                                         target_price=target_price,
+                                         place_new_orders=not order_book.orders_being_placed,
+                                         reuse_cancelled_balances=False)
+
+        self.order_book_manager.replace_orders(reconciliation.cancellations, reconciliation.new_orders)
 
     def place_order_function(self, new_order: NewOrder):
         assert(isinstance(new_order, NewOrder))
@@ -245,12 +276,14 @@ class OasisMarketMakerKeeper:
             pay_token = self.token_buy.address
             buy_token = self.token_sell.address
 
-        transact = self.otc.make(pay_token=pay_token, pay_amount=new_order.pay_amount,
-                                 buy_token=buy_token, buy_amount=new_order.buy_amount).transact(gas_price=self.gas_price)
+        # Orders are placed and cancelled concurrently by the order book manager, the transaction
+        # pipeline takes care of assigning nonces to them and of escalating their gas prices.
+        receipt = self.transactions.transact(self.otc.make(pay_token=pay_token, pay_amount=new_order.pay_amount,
+                                                           buy_token=buy_token, buy_amount=new_order.buy_amount))
 
-        if transact is not None and transact.successful and transact.result is not None:
+        if receipt is not None and receipt.successful and receipt.result is not None:
             return Order(market=self.otc,
-                         order_id=transact.result,
+                         order_id=receipt.result,
                          maker=self.our_address,
                          pay_token=pay_token,
                          pay_amount=new_order.pay_amount,
@@ -261,8 +294,8 @@ class OasisMarketMakerKeeper:
             return None
 
     def cancel_order_function(self, order):
-        transact = self.otc.kill(order.order_id).transact(gas_price=self.gas_price)
-        return transact is not None and transact.successful
+        receipt = self.transactions.transact(self.otc.kill(order.order_id))
+        return receipt is not None and receipt.successful
 
 
 if __name__ == '__main__':
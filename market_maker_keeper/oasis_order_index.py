@@ -0,0 +1,250 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2018 reverendus
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import json
+import logging
+import os
+import threading
+from typing import Optional
+
+from pymaker import Address
+from pymaker.numeric import Wad
+from pymaker.oasis import MatchingMarket, Order
+
+# Topics of the OasisDEX events which change the set of our orders.
+LOG_MAKE = '0x773ff502687307abfa024ac9f62f9752a0d210dac2ffd9a29e38e12e2ea82c82'  # LogMake(bytes32,bytes32,address,address,address,uint128,uint128,uint64)
+LOG_KILL = '0x9577941d28fff863bfbee4694a6a4a56fb09e169619189d2eaa750b5b4819995'  # LogKill(bytes32,bytes32,address,address,address,uint128,uint128,uint64)
+LOG_TAKE = '0x3383e3357c77fd2e3a4b30deea81179bc70a795d053d14d5b7f2f01d0fd4596f'  # LogTake(bytes32,bytes32,address,address,address,address,uint128,uint128,uint64)
+
+
+def _hex(value) -> str:
+    if isinstance(value, (bytes, bytearray)):
+        return '0x' + bytes(value).hex()
+    else:
+        return value.lower()
+
+
+def _words(data) -> list:
+    data = _hex(data)[2:]
+    return [data[index:index+64] for index in range(0, len(data), 64)]
+
+
+def _address(word: str) -> str:
+    return '0x' + word[-40:]
+
+
+class OasisOrderIndex:
+    """Index of our open orders on OasisDEX, kept up to date with `LogMake`, `LogTake` and `LogKill` events.
+
+    Instead of walking the whole on-chain order book and discarding orders of other makers,
+    each refresh asks the node for the market events emitted since the last one, which costs
+    a single `eth_getLogs` call whatever the size of the order book.
+
+    Events are only considered final once they are `confirmations` blocks deep. Events from the more
+    recent blocks are applied on top of the confirmed index every time it gets refreshed, so the index
+    survives chain reorganizations which are not deeper than that.
+
+    The confirmed index can be persisted in a local file, so it does not have to be rebuilt every
+    time the keeper starts. If there is no such file, the index gets built by replaying events from
+    `from_block` or, if it has not been specified, by walking the order book once.
+
+    Attributes:
+        otc: The OasisDEX market.
+        our_address: The maker whose orders we are interested in.
+        from_block: Block to start replaying events from if the index has not been persisted yet.
+        confirmations: Number of blocks after which events are considered final.
+        state_file: Optional file to persist the confirmed index in.
+    """
+
+    logger = logging.getLogger()
+
+    # maximum number of blocks to ask the node for events from in one call, used when catching up only
+    MAX_BLOCK_RANGE = 10000
+
+    def __init__(self, otc: MatchingMarket, our_address: Address, from_block: Optional[int] = None,
+                 confirmations: int = 12, state_file: Optional[str] = None):
+        assert(isinstance(otc, MatchingMarket))
+        assert(isinstance(our_address, Address))
+        assert(isinstance(from_block, int) or (from_block is None))
+        assert(isinstance(confirmations, int))
+        assert(isinstance(state_file, str) or (state_file is None))
+
+        self.otc = otc
+        self.web3 = otc.web3
+        self.our_address = our_address
+        self.from_block = from_block
+        self.confirmations = confirmations
+        self.state_file = state_file
+
+        self._lock = threading.Lock()
+        self._confirmed_block = None
+        self._confirmed_orders = None
+        self._last_block = None
+        self._last_orders = None
+
+    def get_orders(self, block_number: Optional[int] = None) -> list:
+        """Returns our open orders as of the latest block (or as of `block_number`, if already known by the caller)."""
+        assert(isinstance(block_number, int) or (block_number is None))
+
+        if block_number is None:
+            block_number = self.web3.eth.blockNumber
+
+        with self._lock:
+            if self._last_block != block_number:
+                self._last_orders = self._refresh(block_number)
+                self._last_block = block_number
+
+            return [self._order(record) for record in self._last_orders.values()]
+
+    def _refresh(self, block_number: int) -> dict:
+        if self._confirmed_orders is None:
+            self._initialize(block_number)
+
+        logs = self._logs(self._confirmed_block + 1, block_number)
+
+        # events deep enough in the chain get applied to the confirmed index permanently,
+        # the most recent ones only to the view returned this time
+        confirmed_block = max(self._confirmed_block, block_number - self.confirmations)
+        confirmed_logs = list(filter(lambda log: log['blockNumber'] <= confirmed_block, logs))
+        recent_logs = list(filter(lambda log: log['blockNumber'] > confirmed_block, logs))
+
+        if confirmed_block > self._confirmed_block:
+            self._apply(self._confirmed_orders, confirmed_logs)
+            self._confirmed_block = confirmed_block
+            self._save()
+
+        orders = dict(self._confirmed_orders)
+        self._apply(orders, recent_logs)
+        return orders
+
+    def _initialize(self, block_number: int):
+        if self._load():
+            return
+
+        if self.from_block is not None:
+            self.logger.info(f"Building the index of our orders from events since block #{self.from_block}")
+            self._confirmed_block = self.from_block - 1
+            self._confirmed_orders = {}
+
+        else:
+            # The order book changes while we walk it, so the events from the blocks mined in the meantime
+            # may or may not be reflected in what we read. We have to assume they are, as applying a take
+            # twice would be worse than missing one.
+            self.logger.info(f"Building the index of our orders from the order book, it may take a while")
+            orders = list(filter(lambda order: order.maker == self.our_address, self.otc.get_orders()))
+            self._confirmed_block = max(self.web3.eth.blockNumber, block_number)
+            self._confirmed_orders = {order.order_id: {'order_id': order.order_id,
+                                                       'pay_token': order.pay_token.address.lower(),
+                                                       'pay_amount': order.pay_amount.value,
+                                                       'buy_token': order.buy_token.address.lower(),
+                                                       'buy_amount': order.buy_amount.value,
+                                                       'timestamp': order.timestamp} for order in orders}
+            self._save()
+
+    def _logs(self, from_block: int, to_block: int) -> list:
+        logs = []
+        while from_block <= to_block:
+            last_block = min(from_block + self.MAX_BLOCK_RANGE - 1, to_block)
+            logs += self.web3.eth.getLogs({'fromBlock': from_block,
+                                           'toBlock': last_block,
+                                           'address': self.otc.address.address,
+                                           'topics': [[LOG_MAKE, LOG_KILL, LOG_TAKE]]})
+
+            from_block = last_block + 1
+
+        return sorted(logs, key=lambda log: (log['blockNumber'], log['logIndex']))
+
+    def _apply(self, orders: dict, logs: list):
+        our_address = self.our_address.address.lower()
+
+        for log in logs:
+            topics = [_hex(topic) for topic in log['topics']]
+            words = _words(log['data'])
+
+            if topics[0] == LOG_MAKE and _address(topics[3]) == our_address:
+                order_id = int(topics[1], 16)
+                orders[order_id] = {'order_id': order_id,
+                                    'pay_token': _address(words[0]),
+                                    'pay_amount': int(words[2], 16),
+                                    'buy_token': _address(words[1]),
+                                    'buy_amount': int(words[3], 16),
+                                    'timestamp': int(words[4], 16)}
+
+            elif topics[0] == LOG_KILL and _address(topics[3]) == our_address:
+                orders.pop(int(topics[1], 16), None)
+
+            elif topics[0] == LOG_TAKE and _address(topics[2]) == our_address:
+                order_id = int(words[0], 16)
+                if order_id in orders:
+                    record = dict(orders[order_id])
+                    record['pay_amount'] -= int(words[3], 16)
+                    record['buy_amount'] -= int(words[4], 16)
+
+                    # fully taken orders get deleted by OasisDEX without emitting `LogKill`
+                    if record['pay_amount'] > 0:
+                        orders[order_id] = record
+                    else:
+                        del orders[order_id]
+
+    def _order(self, record: dict) -> Order:
+        return Order(market=self.otc,
+                     order_id=record['order_id'],
+                     maker=self.our_address,
+                     pay_token=Address(record['pay_token']),
+                     pay_amount=Wad(record['pay_amount']),
+                     buy_token=Address(record['buy_token']),
+                     buy_amount=Wad(record['buy_amount']),
+                     timestamp=record['timestamp'])
+
+    def _load(self) -> bool:
+        if self.state_file is None or not os.path.isfile(self.state_file):
+            return False
+
+        try:
+            with open(self.state_file, 'r') as file:
+                state = json.load(file)
+
+            if state['market'] != self.otc.address.address.lower() or state['maker'] != self.our_address.address.lower():
+                self.logger.warning(f"Order index in '{self.state_file}' is for a different market or maker, ignoring it")
+                return False
+
+            self._confirmed_block = state['block']
+            self._confirmed_orders = {record['order_id']: record for record in state['orders']}
+            self.logger.info(f"Loaded the index of our orders as of block #{self._confirmed_block} from '{self.state_file}'")
+            return True
+
+        except Exception as e:
+            self.logger.warning(f"Failed to load the order index from '{self.state_file}': {e}")
+            return False
+
+    def _save(self):
+        if self.state_file is None:
+            return
+
+        state = {'market': self.otc.address.address.lower(),
+                 'maker': self.our_address.address.lower(),
+                 'block': self._confirmed_block,
+                 'orders': list(self._confirmed_orders.values())}
+
+        try:
+            with open(self.state_file + '.tmp', 'w') as file:
+                json.dump(state, file)
+
+            os.replace(self.state_file + '.tmp', self.state_file)
+
+        except Exception as e:
+            self.logger.warning(f"Failed to save the order index to '{self.state_file}': {e}")
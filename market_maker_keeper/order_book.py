@@ -17,12 +17,22 @@
 
 import logging
 import threading
+from collections import deque
+from contextlib import contextmanager
+from typing import Optional
 
 import time
 from concurrent.futures import ThreadPoolExecutor
 from functools import partial
 
+from market_maker_keeper.metrics import timed_stage
 from market_maker_keeper.order_history_reporter import OrderHistoryReporter
+from market_maker_keeper.rate_limit import TokenBucket
+
+
+@contextmanager
+def _no_timer():
+    yield
 
 
 class OrderBook:
@@ -49,19 +59,78 @@ class OrderBook:
             Orders which are currently being cancelled are immediately removed from `orders`. Having said that,
             they will 'reappear' there again if the cancellation fails. It's the keepers responsibility
             to notice them and try to cancel them again.
+
+        cancellations_queued: Number of orders waiting for their cancellation to be sent to the exchange,
+            i.e. held back by the cancellation rate limit.
+
+        cancellations_in_flight: Number of orders for which the cancellation has been sent to the exchange,
+            but has not completed yet.
+
+        refresh_count: Number of successful background order book refreshes which took place before
+            this snapshot has been taken.
+
+        version: Monotonically increasing number identifying the state of the order book manager this
+            snapshot has been taken from. Two snapshots with the same `version` are identical.
+
+    Snapshots are immutable and are shared between callers, `OrderBookManager.get_order_book()`
+    returns the very same instance for as long as nothing changes in the manager state.
     """
     def __init__(self,
                  orders,
                  balances,
                  orders_being_placed: bool,
-                 orders_being_cancelled: bool):
+                 orders_being_cancelled: bool,
+                 cancellations_queued: int = 0,
+                 cancellations_in_flight: int = 0,
+                 refresh_count: int = 0,
+                 version: int = 0):
         assert(isinstance(orders_being_placed, bool))
         assert(isinstance(orders_being_cancelled, bool))
+        assert(isinstance(cancellations_queued, int))
+        assert(isinstance(cancellations_in_flight, int))
+        assert(isinstance(refresh_count, int))
+        assert(isinstance(version, int))
 
-        self.orders = orders
+        self._orders = tuple(orders)
         self.balances = balances
         self.orders_being_placed = orders_being_placed
         self.orders_being_cancelled = orders_being_cancelled
+        self.cancellations_queued = cancellations_queued
+        self.cancellations_in_flight = cancellations_in_flight
+        self.refresh_count = refresh_count
+        self.version = version
+
+    @property
+    def orders(self) -> list:
+        return list(self._orders)
+
+
+class PendingPlacement:
+    """Order placement waiting for cancellations of the orders it needs the balance of.
+
+    Cancellations get confirmed one by one, and the order book manager forgets about cancelled orders
+    on the next refresh, so each placement keeps track of its own cancellations still to be confirmed.
+
+    Attributes:
+        place_order_function: Function used to place the order.
+        order_ids_cancelling: Ids of orders whose cancellation has not been confirmed yet.
+        failed: `True` if the cancellation of any of the orders has failed.
+    """
+
+    def __init__(self, place_order_function, order_ids_cancelling: set, failed: bool = False):
+        assert(callable(place_order_function))
+        assert(isinstance(order_ids_cancelling, set))
+        assert(isinstance(failed, bool))
+
+        self.place_order_function = place_order_function
+        self.order_ids_cancelling = order_ids_cancelling
+        self.failed = failed
+
+    def complete_cancellations(self, order_ids: list, cancelled_order_ids: set):
+        for order_id in order_ids:
+            if order_id in self.order_ids_cancelling:
+                self.order_ids_cancelling.discard(order_id)
+                self.failed = self.failed or order_id not in cancelled_order_ids
 
 
 class OrderBookManager:
@@ -84,36 +153,66 @@ class OrderBookManager:
     Order book manager can also optionally query the balances and include them in the snapshot,
     along querying the order book.
 
+    Order cancellations are never sent from the caller thread. They get queued and a background
+    dispatcher sends them to the exchange as fast as `cancel_rate_limit` allows, either one by one
+    or in batches if a bulk cancellation function has been configured with `cancel_orders_in_batches_with()`.
+
     Attributes:
         refresh_frequency: Frequency (in seconds) of how often background order book (and balances)
             refresh takes place.
+        cancel_rate_limit: Rate limit applied to cancellation requests sent to the exchange. Each request
+            takes one token, regardless of whether it cancels one order or a batch of them. Defaults to
+            one request per second with bursts of five requests.
+        executor: Worker pool to place and cancel orders from. Keepers running in one process can
+            share one pool, by default the order book manager creates its own with `max_workers` threads.
     """
 
     logger = logging.getLogger()
 
-    def __init__(self, refresh_frequency: int, max_workers: int = 5):
+    def __init__(self, refresh_frequency: int, max_workers: int = 5, cancel_rate_limit: Optional[TokenBucket] = None,
+                 executor: Optional[ThreadPoolExecutor] = None):
         assert(isinstance(refresh_frequency, int))
         assert(isinstance(max_workers, int))
+        assert(isinstance(cancel_rate_limit, TokenBucket) or (cancel_rate_limit is None))
+        assert(isinstance(executor, ThreadPoolExecutor) or (executor is None))
 
         self.refresh_frequency = refresh_frequency
+        self.cancel_rate_limit = cancel_rate_limit if cancel_rate_limit is not None else TokenBucket(rate=1.0, capacity=5)
         self.get_orders_function = None
         self.get_balances_function = None
         self.place_order_function = None
         self.cancel_order_function = None
+        self.cancel_orders_function = None
+        self.cancel_batch_size = 1
         self.order_history_reporter = None
         self.buy_filter_function = None
         self.sell_filter_function = None
-        self.on_update_function = None
+        self.metrics = None
+        self.metrics_labels = {}
+        self._on_update_functions = []
 
-        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+        self._executor = executor if executor is not None else ThreadPoolExecutor(max_workers=max_workers)
         self._lock = threading.Lock()
         self._state = None
         self._refresh_count = 0
         self._currently_placing_orders = 0
-        self._orders_placed = list()
+        self._orders_placed = dict()
         self._order_ids_cancelling = set()
         self._order_ids_cancelled = set()
 
+        # Index of orders which will be returned in the next snapshot (`order_id` -> `order`),
+        # maintained incrementally as orders get placed, cancelled and the order book gets refreshed.
+        self._orders_live = dict()
+        self._version = 0
+        self._snapshot = None
+
+        self._cancel_queue = deque()
+        self._cancel_queue_condition = threading.Condition(self._lock)
+        self._cancellations_in_flight = 0
+
+        # Placements waiting for cancellations to complete, see `PendingPlacement`.
+        self._placements_after_cancellations = []
+
     def get_orders_with(self, get_orders_function):
         """Configures the function used to fetch active keeper orders.
 
@@ -157,6 +256,24 @@ class OrderBookManager:
 
         self.cancel_order_function = cancel_order_function
 
+    def cancel_orders_in_batches_with(self, cancel_orders_function, batch_size: int):
+        """Configures the (optional) function used to cancel multiple orders with one request.
+
+        Only makes sense for exchanges which offer a bulk cancellation API. If configured, it takes
+        precedence over the function configured with `cancel_orders_with()`.
+
+        Args:
+            cancel_orders_function: The function which will be called with a list of at most `batch_size`
+                orders to cancel. It has to return the list of ids of orders which have been cancelled.
+            batch_size: Maximum number of orders the exchange accepts in one bulk cancellation request.
+        """
+        assert(callable(cancel_orders_function))
+        assert(isinstance(batch_size, int))
+        assert(batch_size > 0)
+
+        self.cancel_orders_function = cancel_orders_function
+        self.cancel_batch_size = batch_size
+
     def enable_history_reporting(self, order_history_reporter: OrderHistoryReporter, buy_filter_function, sell_filter_function):
         assert(isinstance(order_history_reporter, OrderHistoryReporter) or (order_history_reporter is None))
         assert(callable(buy_filter_function))
@@ -167,15 +284,29 @@ class OrderBookManager:
             self.buy_filter_function = buy_filter_function
             self.sell_filter_function = sell_filter_function
 
+    def enable_metrics(self, metrics, labels: dict):
+        """Makes the order book manager record the time each exchange call takes, see `MetricsMixin`.
+
+        Args:
+            metrics: The `Metrics` registry to record the `exchange_call_seconds` histograms in.
+            labels: Labels of the histograms, i.e. the keeper and the pair.
+        """
+        assert(isinstance(labels, dict))
+
+        self.metrics = metrics
+        self.metrics_labels = labels
+
     def on_update(self, on_update_function):
         assert(callable(on_update_function))
 
-        self.on_update_function = on_update_function
+        self._on_update_functions.append(on_update_function)
 
     def start(self):
-        """Start the background refresh of active keeper orders."""
+        """Start the background refresh of active keeper orders and the cancellation dispatcher."""
         threading.Thread(target=self._thread_refresh_order_book, daemon=True).start()
+        threading.Thread(target=self._thread_dispatch_cancellations, daemon=True).start()
 
+    @timed_stage('get_order_book')
     def get_order_book(self) -> OrderBook:
         """Returns the current snapshot of the active keeper orders and balances.
 
@@ -188,52 +319,60 @@ class OrderBookManager:
             self.logger.info("Waiting for the order book to become available...")
             time.sleep(0.5)
 
+        # TODO: below we remove orders which are being or have been cancelled, and orders
+        # which have been placed, but we to not update the balances accordingly. it will
+        # work correctly as long as the market maker keeper has enough balance available.
+        # when it will get low on balance, order placement may fail or too tiny replacement
+        # orders may get created for a while.
         with self._lock:
-            self.logger.debug(f"Getting the order book")
-            self.logger.debug(f"Orders retrieved last time: {[order.order_id for order in self._state['orders']]}")
-            self.logger.debug(f"Orders placed since then: {[order.order_id for order in self._orders_placed]}")
-            self.logger.debug(f"Orders cancelled since then: {[order_id for order_id in self._order_ids_cancelled]}")
-            self.logger.debug(f"Orders being cancelled: {[order_id for order_id in self._order_ids_cancelling]}")
-            self.logger.debug(f"Orders being placed: {self._currently_placing_orders} order(s)")
-
-            # TODO: below we remove orders which are being or have been cancelled, and orders
-            # which have been placed, but we to not update the balances accordingly. it will
-            # work correctly as long as the market maker keeper has enough balance available.
-            # when it will get low on balance, order placement may fail or too tiny replacement
-            # orders may get created for a while.
-
-            # Add orders which have been placed.
-            orders = list(self._state['orders'])
-            for order in self._orders_placed:
-                if order.order_id not in list(map(lambda order: order.order_id, orders)):
-                    orders.append(order)
-
-            # Remove orders being cancelled and already cancelled.
-            orders = list(filter(lambda order: order.order_id not in self._order_ids_cancelling and
-                                               order.order_id not in self._order_ids_cancelled, orders))
-
-            self.logger.debug(f"Returned orders: {[order.order_id for order in orders]}")
-
-        return OrderBook(orders=orders,
-                         balances=self._state['balances'],
-                         orders_being_placed=self._currently_placing_orders > 0,
-                         orders_being_cancelled=len(self._order_ids_cancelling) > 0)
-
-    def place_order(self, place_order_function):
+            if self._snapshot is None:
+                self._snapshot = OrderBook(orders=self._orders_live.values(),
+                                           balances=self._state['balances'],
+                                           orders_being_placed=self._currently_placing_orders > 0,
+                                           orders_being_cancelled=len(self._order_ids_cancelling) > 0,
+                                           cancellations_queued=len(self._cancel_queue),
+                                           cancellations_in_flight=self._cancellations_in_flight,
+                                           refresh_count=self._refresh_count,
+                                           version=self._version)
+
+            order_book = self._snapshot
+
+        if self.logger.isEnabledFor(logging.DEBUG):
+            self.logger.debug(f"Returned order book #{order_book.version}"
+                              f" (orders: {[order.order_id for order in order_book.orders]},"
+                              f" being placed: {order_book.orders_being_placed},"
+                              f" being cancelled: {order_book.orders_being_cancelled})")
+
+        return order_book
+
+    def place_order(self, place_order_function, after_cancellations: Optional[list] = None):
         """Places new order. Order placement will happen in a background thread.
 
         Args:
             place_order_function: Function used to place the order.
+            after_cancellations: Orders which have to be cancelled before the new order gets placed,
+                as it uses the balance locked in them. The new order does not get placed at all
+                if any of these cancellations fails.
         """
         assert(callable(place_order_function))
+        assert(isinstance(after_cancellations, list) or (after_cancellations is None))
 
         with self._lock:
             self._currently_placing_orders += 1
+            self._invalidate_snapshot()
+
+            if after_cancellations:
+                self._placements_after_cancellations.append(self._pending_placement(after_cancellations, place_order_function))
+                place_order_functions = self._release_placements_after_cancellations()
+            else:
+                place_order_functions = [place_order_function]
 
         self._report_order_book_updated()
 
-        self._executor.submit(self._thread_place_order(place_order_function))
+        for place_order_function in place_order_functions:
+            self._executor.submit(self._thread_place_order(place_order_function))
 
+    @timed_stage('place_orders')
     def place_orders(self, new_orders: list):
         """Places new orders. Order placement will happen in a background thread.
 
@@ -245,6 +384,7 @@ class OrderBookManager:
 
         with self._lock:
             self._currently_placing_orders += len(new_orders)
+            self._invalidate_snapshot()
 
         self._report_order_book_updated()
 
@@ -254,52 +394,55 @@ class OrderBookManager:
     def cancel_orders(self, orders: list):
         """Cancels existing orders. Order cancellation will happen in a background thread.
 
+        This method never blocks. Cancellations get queued and are sent to the exchange
+        as fast as `cancel_rate_limit` allows.
+
         Args:
             orders: List of orders to cancel.
         """
         assert(isinstance(orders, list))
-        assert(callable(self.cancel_order_function))
-
-        with self._lock:
-            for order in orders:
-                self._order_ids_cancelling.add(order.order_id)
+        assert(callable(self.cancel_order_function) or callable(self.cancel_orders_function))
 
+        self._queue_cancellations(orders)
         self._report_order_book_updated()
 
-        i = 0
-        while i < len(orders):
-            j = i + 5
-            for order in orders[i:j]:
-                self._executor.submit(self._thread_cancel_order(order.order_id, partial(self.cancel_order_function, order)))
-            i = j
-            time.sleep(5)
-
-    def replace_orders(self, orders: list, new_orders: list):
+    def replace_orders(self, orders: list, new_orders: list, orders_after_cancellations: Optional[list] = None):
         """Replaces existing orders with new ones.
 
         Args:
             orders: List of orders to cancel.
-            new_orders: List of new orders to place.
+            new_orders: List of new orders to place straight away.
+            orders_after_cancellations: List of new orders to place once all `orders` have been cancelled,
+                as they use the balance locked in them. See `Reconciliation`.
         """
         assert(isinstance(orders, list))
         assert(isinstance(new_orders, list))
+        assert(isinstance(orders_after_cancellations, list) or (orders_after_cancellations is None))
         assert(callable(self.place_order_function))
-        assert(callable(self.cancel_order_function))
+        assert(callable(self.cancel_order_function) or callable(self.cancel_orders_function))
+
+        orders_after_cancellations = orders_after_cancellations if orders_after_cancellations is not None else []
 
         with self._lock:
-            for order in orders:
-                self._order_ids_cancelling.add(order.order_id)
+            self._currently_placing_orders += len(new_orders) + len(orders_after_cancellations)
+            self._invalidate_snapshot()
 
-            self._currently_placing_orders += len(new_orders)
+        self._queue_cancellations(orders)
 
-        self._report_order_book_updated()
+        with self._lock:
+            for new_order in orders_after_cancellations:
+                self._placements_after_cancellations.append(self._pending_placement(orders, partial(self.place_order_function, new_order)))
+
+            place_order_functions = self._release_placements_after_cancellations()
 
-        for order in orders:
-            self._executor.submit(self._thread_cancel_order(order.order_id, partial(self.cancel_order_function, order)))
+        self._report_order_book_updated()
 
         for new_order in new_orders:
             self._executor.submit(self._thread_place_order(partial(self.place_order_function, new_order)))
 
+        for place_order_function in place_order_functions:
+            self._executor.submit(self._thread_place_order(place_order_function))
+
     def cancel_all_orders(self, final_wait_time: int = None):
         # Cancel all orders straight away, repeat until the internal order book state confirms
         # that there are no open orders left.
@@ -374,64 +517,187 @@ class OrderBookManager:
                 break
             time.sleep(0.1)
 
+    def _queue_cancellations(self, orders: list):
+        with self._lock:
+            for order in orders:
+                # Orders already being cancelled do not get queued again.
+                if order.order_id in self._order_ids_cancelling:
+                    continue
+
+                self._order_ids_cancelling.add(order.order_id)
+                self._orders_live.pop(order.order_id, None)
+                self._cancel_queue.append(order)
+
+            self._invalidate_snapshot()
+            self._cancel_queue_condition.notify()
+
+    def _pending_placement(self, orders: list, place_order_function) -> PendingPlacement:
+        # Has to be called with `self._lock` held. Orders neither being cancelled nor live anymore have
+        # already been cancelled, even if a refresh has made us forget about it. Orders still live
+        # are the ones whose cancellation has failed.
+        return PendingPlacement(place_order_function,
+                                order_ids_cancelling=set(order.order_id for order in orders
+                                                         if order.order_id in self._order_ids_cancelling),
+                                failed=any(order.order_id not in self._order_ids_cancelling
+                                           and order.order_id in self._orders_live for order in orders))
+
+    def _release_placements_after_cancellations(self) -> list:
+        # Has to be called with `self._lock` held. Returns the place order functions which can be submitted,
+        # which has to happen after the lock gets released.
+        ready = []
+        still_waiting = []
+        for placement in self._placements_after_cancellations:
+            if placement.failed:
+                self.logger.info("Not placing an order as the cancellation of orders it needs the balance of has failed")
+                self._currently_placing_orders -= 1
+                self._invalidate_snapshot()
+
+            elif len(placement.order_ids_cancelling) > 0:
+                still_waiting.append(placement)
+
+            else:
+                ready.append(placement.place_order_function)
+
+        self._placements_after_cancellations = still_waiting
+        return ready
+
+    def _invalidate_snapshot(self):
+        # Has to be called with `self._lock` held.
+        self._version += 1
+        self._snapshot = None
+
+    def _is_live(self, order_id) -> bool:
+        # Has to be called with `self._lock` held.
+        return order_id not in self._order_ids_cancelling and order_id not in self._order_ids_cancelled
+
+    def _rebuild_orders_live(self):
+        # Has to be called with `self._lock` held.
+        orders_live = dict()
+        for order in self._state['orders']:
+            if self._is_live(order.order_id):
+                orders_live[order.order_id] = order
+
+        for order_id, order in self._orders_placed.items():
+            if order_id not in orders_live and self._is_live(order_id):
+                orders_live[order_id] = order
+
+        self._orders_live = orders_live
+
     def _report_order_book_updated(self):
-        if self.on_update_function is not None:
-            self.on_update_function()
+        for on_update_function in self._on_update_functions:
+            on_update_function()
 
-    def _thread_refresh_order_book(self):
-        while True:
-            try:
-                with self._lock:
-                    orders_already_cancelled_before = set(self._order_ids_cancelled)
-                    orders_already_placed_before = set(self._orders_placed)
+    def refresh_order_book(self):
+        """Fetches the orders (and balances) once, updating the order book snapshot.
 
-                # get orders, get balances
-                orders = self.get_orders_function()
-                balances = self.get_balances_function() if self.get_balances_function is not None else None
+        Called periodically by the background thread started by `start()`. Simulations which drive
+        the order book manager without starting it (see `market_maker_keeper.replay`) call it directly.
+        """
+        with self._lock:
+            orders_already_cancelled_before = set(self._order_ids_cancelled)
+            orders_already_placed_before = set(self._orders_placed.keys())
 
-                # self.logger.debug(f"Fetched orders {orders}")
+        # get orders, get balances
+        with self._timer('get_orders'):
+            orders = self.get_orders_function()
 
-                if self.order_history_reporter:
-                    orders_buy = self.buy_filter_function(orders)
-                    orders_sell = self.sell_filter_function(orders)
+        balances = None
+        if self.get_balances_function is not None:
+            with self._timer('get_balances'):
+                balances = self.get_balances_function()
 
-                    self.order_history_reporter.report_orders(orders_buy, orders_sell)
+        # self.logger.debug(f"Fetched orders {orders}")
 
-                with self._lock:
-                    self._order_ids_cancelled = self._order_ids_cancelled - orders_already_cancelled_before
-                    for order in orders_already_placed_before:
-                        self._orders_placed.remove(order)
+        if self.order_history_reporter:
+            orders_buy = self.buy_filter_function(orders)
+            orders_sell = self.sell_filter_function(orders)
 
-                    if self._state is None:
-                        self.logger.info("Order book became available")
+            self.order_history_reporter.report_orders(orders_buy, orders_sell)
 
-                    self._state = {'orders': orders, 'balances': balances}
-                    self._refresh_count += 1
+        with self._lock:
+            self._order_ids_cancelled = self._order_ids_cancelled - orders_already_cancelled_before
+            for order_id in orders_already_placed_before:
+                self._orders_placed.pop(order_id, None)
 
-                self._report_order_book_updated()
+            if self._state is None:
+                self.logger.info("Order book became available")
+
+            self._state = {'orders': orders, 'balances': balances}
+            self._refresh_count += 1
+            self._rebuild_orders_live()
+            self._invalidate_snapshot()
+
+        self._report_order_book_updated()
+
+        self.logger.debug(f"Fetched the order book"
+                          f" (orders: {[order.order_id for order in orders]})")
+
+    def dispatch_cancellations(self):
+        """Sends all queued cancellations straight away, ignoring `cancel_rate_limit`.
 
-                self.logger.debug(f"Fetched the order book"
-                                  f" (orders: {[order.order_id for order in orders]})")
+        Meant for simulations which drive the order book manager without starting it, the background
+        dispatcher started by `start()` sends the cancellations on its own.
+        """
+        while self._dispatch_cancellation_batch():
+            pass
+
+    def _dispatch_cancellation_batch(self) -> bool:
+        with self._lock:
+            if len(self._cancel_queue) == 0:
+                return False
+
+            batch_size = self.cancel_batch_size if self.cancel_orders_function is not None else 1
+            orders = [self._cancel_queue.popleft() for _ in range(min(batch_size, len(self._cancel_queue)))]
+
+            self._cancellations_in_flight += len(orders)
+            self._invalidate_snapshot()
+
+        if self.cancel_orders_function is not None:
+            self._executor.submit(self._thread_cancel_orders(orders, partial(self.cancel_orders_function, orders)))
+        else:
+            for order in orders:
+                self._executor.submit(self._thread_cancel_order(order.order_id, partial(self.cancel_order_function, order)))
+
+        return True
+
+    def _thread_refresh_order_book(self):
+        while True:
+            try:
+                self.refresh_order_book()
             except Exception as e:
                 self.logger.info(f"Failed to fetch the order book ({e})")
 
             time.sleep(self.refresh_frequency)
 
+    def _thread_dispatch_cancellations(self):
+        while True:
+            with self._lock:
+                while len(self._cancel_queue) == 0:
+                    self._cancel_queue_condition.wait()
+
+            self.cancel_rate_limit.acquire()
+            self._dispatch_cancellation_batch()
+
     def _thread_place_order(self, place_order_function):
         assert(callable(place_order_function))
 
         def func():
             try:
-                new_order = place_order_function()
+                with self._timer('place_order'):
+                    new_order = place_order_function()
 
                 if new_order is not None:
                     with self._lock:
-                        self._orders_placed.append(new_order)
+                        self._orders_placed[new_order.order_id] = new_order
+
+                        if self._state is not None and self._is_live(new_order.order_id):
+                            self._orders_live.setdefault(new_order.order_id, new_order)
             except BaseException as exception:
                 self.logger.exception(exception)
             finally:
                 with self._lock:
                     self._currently_placing_orders -= 1
+                    self._invalidate_snapshot()
 
                 self._report_order_book_updated()
 
@@ -441,20 +707,63 @@ class OrderBookManager:
         assert(callable(cancel_order_function))
 
         def func():
+            cancelled = False
             try:
-                if cancel_order_function():
-                    with self._lock:
-                        self._order_ids_cancelled.add(order_id)
-                        self._order_ids_cancelling.remove(order_id)
+                with self._timer('cancel_order'):
+                    cancelled = bool(cancel_order_function())
             except BaseException as exception:
                 self.logger.exception(exception)
             finally:
-                with self._lock:
-                    try:
-                        self._order_ids_cancelling.remove(order_id)
-                    except KeyError:
-                        pass
+                self._complete_cancellations([order_id], {order_id} if cancelled else set())
 
-                self._report_order_book_updated()
+        return func
+
+    def _thread_cancel_orders(self, orders: list, cancel_orders_function):
+        assert(isinstance(orders, list))
+        assert(callable(cancel_orders_function))
+
+        def func():
+            cancelled_order_ids = set()
+            try:
+                with self._timer('cancel_orders'):
+                    cancelled_order_ids = set(cancel_orders_function())
+            except BaseException as exception:
+                self.logger.exception(exception)
+            finally:
+                self._complete_cancellations([order.order_id for order in orders], cancelled_order_ids)
 
         return func
+
+    def _timer(self, call: str):
+        if self.metrics is None:
+            return _no_timer()
+
+        return self.metrics.timer('exchange_call_seconds', call=call, **self.metrics_labels)
+
+    def _complete_cancellations(self, order_ids: list, cancelled_order_ids: set):
+        with self._lock:
+            self._cancellations_in_flight -= len(order_ids)
+
+            failed = False
+            for order_id in order_ids:
+                self._order_ids_cancelling.discard(order_id)
+
+                if order_id in cancelled_order_ids:
+                    self._order_ids_cancelled.add(order_id)
+                else:
+                    failed = True
+
+            # Cancellation has failed, so the orders 'reappear' in the order book.
+            if failed and self._state is not None:
+                self._rebuild_orders_live()
+
+            for placement in self._placements_after_cancellations:
+                placement.complete_cancellations(order_ids, cancelled_order_ids)
+
+            place_order_functions = self._release_placements_after_cancellations()
+            self._invalidate_snapshot()
+
+        self._report_order_book_updated()
+
+        for place_order_function in place_order_functions:
+            self._executor.submit(self._thread_place_order(place_order_function))
@@ -15,30 +15,85 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import gzip
+import json
 import logging
+import os
 import threading
+from collections import Counter, deque
 
 import time
 from typing import Optional
 
 import requests
+from requests.adapters import HTTPAdapter
 
 from market_maker_keeper.util import sanitize_url
 
 
 class OrderHistoryReporter:
+    """Reports snapshots of active keeper orders to an HTTP endpoint.
+
+    Snapshots get posted by a single background worker, so a slow endpoint never makes reporting
+    threads pile up. Snapshots are queued in a bounded queue which only keeps the most recent
+    `queue_size` of them: if the worker falls behind, older snapshots are dropped in favour of
+    the latest one. All reports go through one keep-alive session.
+
+    With `enable_gzip()` the payloads get gzip'd (`Content-Encoding: gzip`). With `enable_delta_encoding()`
+    each report only carries the orders `added` and `removed` since the last successful report, identified
+    by its timestamp in `base`. With `enable_spooling()` reports which could not be delivered get appended
+    to a local file and are sent, oldest first, as soon as the endpoint is back.
+
+    Attributes:
+        endpoint: URL to post the reports to.
+        frequency: Minimum time (in seconds) between two reports.
+        queue_size: Maximum number of snapshots waiting to be reported.
+        timeout: Timeout (in seconds) of each post.
+    """
 
     logger = logging.getLogger()
 
-    def __init__(self, endpoint: str, frequency: int):
+    def __init__(self, endpoint: str, frequency: int, queue_size: int = 1, timeout: float = 15.5):
         assert(isinstance(endpoint, str))
         assert(isinstance(frequency, int))
+        assert(isinstance(queue_size, int))
+        assert(queue_size > 0)
+        assert(isinstance(timeout, float) or isinstance(timeout, int))
 
         self.endpoint = endpoint
         self.sanitized_endpoint = sanitize_url(endpoint)
         self.frequency = frequency
+        self.timeout = timeout
+        self.gzip = False
+        self.delta_encoding = False
+        self.spool_file = None
+        self.reported = 0
+        self.dropped = 0
         self._last_reported = 0
 
+        self._queue = deque(maxlen=queue_size)
+        self._busy = False
+        self._condition = threading.Condition()
+        self._thread = None
+
+        self._base_timestamp = None
+        self._base_orders = None
+
+        self._session = requests.Session()
+        self._session.mount('http://', HTTPAdapter(pool_connections=1, pool_maxsize=1))
+        self._session.mount('https://', HTTPAdapter(pool_connections=1, pool_maxsize=1))
+
+    def enable_gzip(self):
+        self.gzip = True
+
+    def enable_delta_encoding(self):
+        self.delta_encoding = True
+
+    def enable_spooling(self, spool_file: str):
+        assert(isinstance(spool_file, str))
+
+        self.spool_file = spool_file
+
     def report_orders(self, our_buy_orders: list, our_sell_orders: list):
         assert(isinstance(our_buy_orders, list))
         assert(isinstance(our_sell_orders, list))
@@ -48,14 +103,45 @@ class OrderHistoryReporter:
 
         self._last_reported = time.time()
 
-        threading.Thread(target=self._thread_report_function(time.time(), our_buy_orders, our_sell_orders), daemon=True).start()
+        with self._condition:
+            if len(self._queue) == self._queue.maxlen:
+                self.dropped += 1
 
-    def _thread_report_function(self, timestamp: float, buy_orders: list, sell_orders: list):
-        assert(isinstance(timestamp, float))
-        assert(isinstance(buy_orders, list))
-        assert(isinstance(sell_orders, list))
+            self._queue.append((time.time(), our_buy_orders, our_sell_orders))
+            self._condition.notify()
 
-        orders = list(map(lambda order: {
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._background_run, daemon=True)
+                self._thread.start()
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """Waits until all the queued snapshots have been reported, or failed to be reported.
+
+        Returns:
+            `True` if the queue got drained, `False` if `timeout` expired first.
+        """
+        with self._condition:
+            return self._condition.wait_for(lambda: len(self._queue) == 0 and not self._busy, timeout)
+
+    def _background_run(self):
+        while True:
+            with self._condition:
+                self._condition.wait_for(lambda: len(self._queue) > 0)
+                timestamp, buy_orders, sell_orders = self._queue.popleft()
+                self._busy = True
+
+            try:
+                self._report(timestamp, self._orders(buy_orders, sell_orders))
+            except BaseException as exception:
+                self.logger.exception(exception)
+            finally:
+                with self._condition:
+                    self._busy = False
+                    self._condition.notify_all()
+
+    @staticmethod
+    def _orders(buy_orders: list, sell_orders: list) -> list:
+        return list(map(lambda order: {
             "amount": str(order.remaining_buy_amount),
             "price": str(order.sell_to_buy_price),
             "type": "buy"
@@ -65,25 +151,109 @@ class OrderHistoryReporter:
             "type": "sell"
         }, sell_orders))
 
+    def _report(self, timestamp: float, orders: list):
         record = {
             "timestamp": timestamp,
             "orders": orders
         }
 
-        def _func():
-            result = requests.post(url=self.endpoint, json=record, timeout=15.5)
+        # spooled reports go first, so the endpoint receives the reports in chronological order
+        if not self._send_spooled():
+            self._spool(record)
+            return
+
+        if self._post(self._delta(record)):
+            self.logger.debug(f"Successfully reported {len(orders)} orders to '{self.sanitized_endpoint}'")
+            self._base_timestamp = timestamp
+            self._base_orders = Counter(self._key(order) for order in orders)
+        else:
+            self._spool(record)
+
+    def _delta(self, record: dict) -> dict:
+        if not self.delta_encoding or self._base_orders is None:
+            return record
+
+        orders = Counter(self._key(order) for order in record['orders'])
+
+        return {
+            "timestamp": record['timestamp'],
+            "base": self._base_timestamp,
+            "added": [self._order(key) for key in (orders - self._base_orders).elements()],
+            "removed": [self._order(key) for key in (self._base_orders - orders).elements()]
+        }
+
+    @staticmethod
+    def _key(order: dict) -> tuple:
+        return order['type'], order['price'], order['amount']
+
+    @staticmethod
+    def _order(key: tuple) -> dict:
+        return {"amount": key[2], "price": key[1], "type": key[0]}
+
+    def _post(self, record: dict) -> bool:
+        data = json.dumps(record).encode('utf-8')
+        headers = {'Content-Type': 'application/json'}
+        if self.gzip:
+            data = gzip.compress(data)
+            headers['Content-Encoding'] = 'gzip'
+
+        try:
+            result = self._session.post(url=self.endpoint, data=data, headers=headers, timeout=self.timeout)
+        except Exception as exception:
+            self.logger.warning(f"Failed to report orders to '{self.sanitized_endpoint}': {exception}")
+            return False
+
+        if not result.ok:
+            self.logger.warning(f"Failed to report orders to '{self.sanitized_endpoint}': {result.status_code} {result.text}")
+            return False
+
+        self.reported += 1
+        return True
+
+    def _spool(self, record: dict):
+        if self.spool_file is None:
+            return
 
-            if result.ok:
-                self.logger.debug(f"Successfully reported {len(orders)} orders to '{self.sanitized_endpoint}'")
-            else:
-                self.logger.warning(f"Failed to report orders to '{self.sanitized_endpoint}': {result.status_code} {result.text}")
+        # the endpoint may have lost the last successful report, so the next one has to be complete
+        self._base_timestamp = None
+        self._base_orders = None
 
-        return _func
+        with open(self.spool_file, 'a') as file:
+            file.write(json.dumps(record) + '\n')
+
+    def _send_spooled(self) -> bool:
+        if self.spool_file is None or not os.path.exists(self.spool_file):
+            return True
+
+        with open(self.spool_file, 'r') as file:
+            records = [json.loads(line) for line in file if line.strip()]
+
+        for index, record in enumerate(records):
+            if not self._post(record):
+                with open(self.spool_file, 'w') as file:
+                    file.writelines(json.dumps(record) + '\n' for record in records[index:])
+
+                return False
+
+        os.remove(self.spool_file)
+        self.logger.info(f"Reported {len(records)} spooled snapshots to '{self.sanitized_endpoint}'")
+        return True
 
 
 def create_order_history_reporter(arguments) -> Optional[OrderHistoryReporter]:
     if arguments.order_history:
-        return OrderHistoryReporter(arguments.order_history, 30)
+        order_history_reporter = OrderHistoryReporter(arguments.order_history, getattr(arguments, 'order_history_every', 30))
+
+        if getattr(arguments, 'order_history_gzip', False):
+            order_history_reporter.enable_gzip()
+
+        if getattr(arguments, 'order_history_delta', False):
+            order_history_reporter.enable_delta_encoding()
+
+        if getattr(arguments, 'order_history_spool', None):
+            order_history_reporter.enable_spooling(arguments.order_history_spool)
+
+        return order_history_reporter
 
     else:
         return None
@@ -19,13 +19,13 @@ import json
 import logging
 import threading
 import time
-from typing import Optional, List
+from typing import Optional, List, Tuple
 
 import websocket
 
 from gdax_client.price import GdaxPriceClient, GDAX_WS_URL
 from market_maker_keeper.feed import ExpiringFeed, WebSocketFeed, Feed
-from market_maker_keeper.setzer import Setzer
+from market_maker_keeper.setzer import SetzerDaemon
 from pymaker.feed import DSValue
 from pymaker.numeric import Wad
 from pymaker.sai import Tub
@@ -46,6 +46,26 @@ class PriceFeed(object):
     def get_price(self) -> Price:
         raise NotImplementedError("Please implement this method")
 
+    def timestamp(self) -> Optional[float]:
+        """Returns the time the price has been received at, `None` if unknown."""
+        return None
+
+    def variance(self) -> Optional[float]:
+        """Returns the variance of relative price changes, `None` if unknown. See `CachedPriceFeed`."""
+        return None
+
+    def volume(self) -> Optional[float]:
+        """Returns the volume traded at the price source, `None` if unknown."""
+        return None
+
+    def on_update(self, on_update_function):
+        """Registers a function to be called every time the price changes.
+
+        Price feeds which are not able to tell when the price changes do not report
+        any updates, that's why this method does nothing by default.
+        """
+        assert(callable(on_update_function))
+
 
 class FixedPriceFeed(PriceFeed):
     logger = logging.getLogger()
@@ -73,44 +93,38 @@ class TubPriceFeed(PriceFeed):
 
 
 class SetzerPriceFeed(PriceFeed):
+    """Price feed using a `setzer` price source, fetched in the background by a `SetzerDaemon`.
+
+    All the Setzer price feeds of a process share the `SetzerDaemon.default()` daemon unless told otherwise,
+    so each source gets fetched only once no matter how many feeds use it.
+    """
+
     logger = logging.getLogger()
 
-    def __init__(self, source: str, expiry: int):
+    def __init__(self, source: str, expiry: int, setzer_daemon: Optional[SetzerDaemon] = None):
         assert(isinstance(source, str))
         assert(isinstance(expiry, int))
+        assert(isinstance(setzer_daemon, SetzerDaemon) or setzer_daemon is None)
 
         self.source = source
         self.expiry = expiry
-        self._price = None
-        self._retries = 0
-        self._timestamp = 0
+        self.setzer_daemon = setzer_daemon if setzer_daemon is not None else SetzerDaemon.default()
         self._expired = True
-        threading.Thread(target=self._background_run, daemon=True).start()
-
-    def _fetch_price(self):
-        try:
-            self._price = Setzer().price(self.source)
-            self._retries = 0
-            self._timestamp = time.time()
+        self._on_update_functions = []
+        self.setzer_daemon.subscribe(source, expiry, self._on_fetched)
 
-            self.logger.debug(f"Fetched price from {self.source}: {self._price}")
+    def _on_fetched(self):
+        if self._expired:
+            self.logger.info(f"Price feed from 'setzer' ({self.source}) became available")
+            self._expired = False
 
-            if self._expired:
-                self.logger.info(f"Price feed from 'setzer' ({self.source}) became available")
-                self._expired = False
-        except:
-            self._retries += 1
-            if self._retries > 10:
-                self.logger.warning(f"Failed to get price from 'setzer' ({self.source}), tried {self._retries} times")
-                self.logger.warning(f"Please check if 'setzer' is installed and working correctly")
-
-    def _background_run(self):
-        while True:
-            self._fetch_price()
-            time.sleep(60)
+        for on_update_function in self._on_update_functions:
+            on_update_function()
 
     def get_price(self) -> Price:
-        if time.time() - self._timestamp > self.expiry:
+        price, timestamp = self.setzer_daemon.price(self.source)
+
+        if timestamp is None or time.time() - timestamp > self.expiry:
             if not self._expired:
                 self.logger.warning(f"Price feed from 'setzer' ({self.source}) has expired")
                 self._expired = True
@@ -118,8 +132,15 @@ class SetzerPriceFeed(PriceFeed):
             return Price(buy_price=None, sell_price=None)
 
         else:
-            value = self._price
-            return Price(buy_price=value, sell_price=value)
+            return Price(buy_price=price, sell_price=price)
+
+    def timestamp(self) -> Optional[float]:
+        return self.setzer_daemon.price(self.source)[1]
+
+    def on_update(self, on_update_function):
+        assert(callable(on_update_function))
+
+        self._on_update_functions.append(on_update_function)
 
 
 class GdaxPriceFeed(PriceFeed):
@@ -186,33 +207,224 @@ class WebSocketPriceFeed(PriceFeed):
 
         return Price(buy_price=buy_price, sell_price=sell_price)
 
+    def timestamp(self) -> Optional[float]:
+        return self.feed.get()[1] or None
 
-class AveragePriceFeed(PriceFeed):
-    def __init__(self, feeds: List[PriceFeed]):
-        assert(isinstance(feeds, list))
-        self.feeds = feeds
+    def volume(self) -> Optional[float]:
+        try:
+            return float(self.feed.get()[0]['volume'])
+        except:
+            return None
+
+    def on_update(self, on_update_function):
+        self.feed.on_update(on_update_function)
+
+
+class CachedPriceFeed(PriceFeed):
+    """Keeps the last good price of another price feed, refreshed by a background thread.
+
+    `get_price()` returns straight away, no matter how slow `get_price()` of the underlying price
+    feed is (`TubPriceFeed` for example reads the price from the chain). The price gets refreshed
+    every `refresh_frequency` seconds, and as soon as the underlying price feed reports an update.
+    A price which has not been refreshed successfully for `expiry` seconds is not returned anymore.
+
+    The variance of relative price changes between refreshes is tracked as an exponentially
+    weighted moving average, so composite price feeds can ignore unstable sources.
+
+    Attributes:
+        price_feed: The underlying price feed.
+        refresh_frequency: Time (in seconds) between two refreshes.
+        expiry: Time (in seconds) after which the last good price expires, `None` for never.
+    """
+
+    logger = logging.getLogger()
+
+    # weight of the latest relative price change in the moving average of the variance
+    VARIANCE_WEIGHT = 0.1
+
+    def __init__(self, price_feed: PriceFeed, refresh_frequency: float = 1.0, expiry: Optional[float] = None):
+        assert(isinstance(price_feed, PriceFeed))
+        assert(isinstance(refresh_frequency, float) or isinstance(refresh_frequency, int))
+        assert(isinstance(expiry, float) or isinstance(expiry, int) or expiry is None)
+
+        self.price_feed = price_feed
+        self.refresh_frequency = refresh_frequency
+        self.expiry = expiry
+
+        self._price = Price(buy_price=None, sell_price=None)
+        self._timestamp = None
+        self._volume = None
+        self._variance = None
+        self._lock = threading.Lock()
+        self._refresh_requested = threading.Event()
+        self._on_update_functions = []
+
+        self.price_feed.on_update(self._refresh_requested.set)
+        threading.Thread(target=self._background_run, daemon=True).start()
+
+    def refresh(self):
+        """Fetches the price from the underlying price feed. The last good price is kept if that fails."""
+        try:
+            price = self.price_feed.get_price()
+            timestamp = self.price_feed.timestamp() or time.time()
+            volume = self.price_feed.volume()
+        except Exception as exception:
+            self.logger.warning(f"Failed to refresh price feed {type(self.price_feed).__name__}: {exception}")
+            return
+
+        with self._lock:
+            changed = self._mid_price(price) != self._mid_price(self._price)
+            self._update_variance(price)
+            self._price = price
+
+            # no price means the underlying price feed considers its price expired, so it is not kept
+            if price.buy_price is not None or price.sell_price is not None:
+                self._timestamp = timestamp
+                self._volume = volume
+
+        if changed:
+            for on_update_function in self._on_update_functions:
+                on_update_function()
 
     def get_price(self) -> Price:
-        total_buy = Wad.from_number(0)
-        count_buy = 0
+        with self._lock:
+            if self._expired():
+                return Price(buy_price=None, sell_price=None)
+
+            return self._price
+
+    def timestamp(self) -> Optional[float]:
+        return self._timestamp
+
+    def variance(self) -> Optional[float]:
+        return self._variance
 
-        total_sell = Wad.from_number(0)
-        count_sell = 0
+    def volume(self) -> Optional[float]:
+        return self._volume
+
+    def on_update(self, on_update_function):
+        assert(callable(on_update_function))
+
+        self._on_update_functions.append(on_update_function)
+
+    def _expired(self) -> bool:
+        return self.expiry is not None and self._timestamp is not None and time.time() - self._timestamp > self.expiry
+
+    def _update_variance(self, price: Price):
+        previous, current = self._mid_price(self._price), self._mid_price(price)
+        if previous is None or current is None or previous == 0:
+            return
+
+        change = (current - previous) / previous
+        if self._variance is None:
+            self._variance = change * change
+        else:
+            self._variance += self.VARIANCE_WEIGHT * (change * change - self._variance)
 
+    @staticmethod
+    def _mid_price(price: Price) -> Optional[float]:
+        prices = [float(value) for value in [price.buy_price, price.sell_price] if value is not None]
+        return sum(prices) / len(prices) if len(prices) > 0 else None
+
+    def _background_run(self):
+        while True:
+            self._refresh_requested.clear()
+            self.refresh()
+            self._refresh_requested.wait(self.refresh_frequency)
+
+
+class CompositePriceFeed(PriceFeed):
+    """Base class of price feeds combining the prices of several other price feeds.
+
+    Prices older than `max_age` seconds, and prices of feeds whose variance (see `CachedPriceFeed`) is
+    above `max_variance`, are ignored. Feeds which do not know when their price has been received or
+    how stable it is are never ignored. With `refresh_frequency`, each feed gets wrapped in a
+    `CachedPriceFeed`, so `get_price()` only reads the last good prices and never waits for a source.
+
+    Attributes:
+        feeds: The price feeds to combine.
+        max_age: Maximum age (in seconds) of a price to take it into account, `None` for no limit.
+        max_variance: Maximum variance of a price feed to take it into account, `None` for no limit.
+    """
+
+    def __init__(self, feeds: List[PriceFeed], max_age: Optional[float] = None, max_variance: Optional[float] = None,
+                 refresh_frequency: Optional[float] = None):
+        assert(isinstance(feeds, list))
+        assert(isinstance(max_age, float) or isinstance(max_age, int) or max_age is None)
+        assert(isinstance(max_variance, float) or isinstance(max_variance, int) or max_variance is None)
+        assert(isinstance(refresh_frequency, float) or isinstance(refresh_frequency, int) or refresh_frequency is None)
+
+        self.feeds = feeds if refresh_frequency is None else [CachedPriceFeed(feed, refresh_frequency) for feed in feeds]
+        self.max_age = max_age
+        self.max_variance = max_variance
+
+    def on_update(self, on_update_function):
         for feed in self.feeds:
-            price = feed.get_price()
-            if price.buy_price is not None:
-                total_buy += price.buy_price
-                count_buy += 1
+            feed.on_update(on_update_function)
 
-            if price.sell_price is not None:
-                total_sell += price.sell_price
-                count_sell += 1
+    def _prices(self):
+        """Yields the `(feed, price)` pairs of the feeds which can be taken into account, in order."""
+        now = time.time()
+        for feed in self.feeds:
+            if self.max_age is not None:
+                timestamp = feed.timestamp()
+                if timestamp is not None and now - timestamp > self.max_age:
+                    continue
 
-        buy_price = total_buy / Wad.from_number(count_buy) if count_buy > 0 else None
-        sell_price = total_sell / Wad.from_number(count_sell) if count_sell > 0 else None
+            if self.max_variance is not None:
+                variance = feed.variance()
+                if variance is not None and variance > self.max_variance:
+                    continue
 
-        return Price(buy_price=buy_price, sell_price=sell_price)
+            yield feed, feed.get_price()
+
+
+class AveragePriceFeed(CompositePriceFeed):
+    """Price feed averaging the buy and sell prices of several price feeds.
+
+    In the `mean` mode (the default) prices get averaged, in the `median` mode the median price is
+    used and in the `volume-weighted` mode prices get weighted by the volume of their feeds (feeds not
+    reporting any volume being ignored, unless none of them does). See `CompositePriceFeed` for
+    the other arguments.
+    """
+
+    MODES = ['mean', 'median', 'volume-weighted']
+
+    def __init__(self, feeds: List[PriceFeed], mode: str = 'mean', max_age: Optional[float] = None,
+                 max_variance: Optional[float] = None, refresh_frequency: Optional[float] = None):
+        assert(mode in self.MODES)
+
+        super().__init__(feeds, max_age=max_age, max_variance=max_variance, refresh_frequency=refresh_frequency)
+        self.mode = mode
+
+    def get_price(self) -> Price:
+        prices = list(self._prices())
+
+        return Price(buy_price=self._aggregate([(feed, price.buy_price) for feed, price in prices]),
+                     sell_price=self._aggregate([(feed, price.sell_price) for feed, price in prices]))
+
+    def timestamp(self) -> Optional[float]:
+        timestamps = list(filter(None, [feed.timestamp() for feed in self.feeds]))
+        return min(timestamps) if len(timestamps) > 0 else None
+
+    def _aggregate(self, values: list) -> Optional[Wad]:
+        values = [(feed, value) for feed, value in values if value is not None]
+        if len(values) == 0:
+            return None
+
+        if self.mode == 'median':
+            ordered = sorted(value for feed, value in values)
+            middle = len(ordered) // 2
+            return ordered[middle] if len(ordered) % 2 == 1 else (ordered[middle - 1] + ordered[middle]) / Wad.from_number(2)
+
+        if self.mode == 'volume-weighted':
+            volumes = [(feed.volume(), value) for feed, value in values]
+            volumes = [(volume, value) for volume, value in volumes if volume is not None and volume > 0]
+            if len(volumes) > 0:
+                total_volume = Wad.from_number(sum(volume for volume, value in volumes))
+                return sum((value * Wad.from_number(volume) for volume, value in volumes), Wad.from_number(0)) / total_volume
+
+        return sum((value for feed, value in values), Wad.from_number(0)) / Wad.from_number(len(values))
 
 
 class ReversePriceFeed(PriceFeed):
@@ -227,46 +439,116 @@ class ReversePriceFeed(PriceFeed):
         sell_price = Wad.from_number(1) / parent_price.sell_price if parent_price.sell_price is not None else None
         return Price(buy_price=buy_price, sell_price=sell_price)
 
+    def timestamp(self) -> Optional[float]:
+        return self.price_feed.timestamp()
 
-class BackupPriceFeed(PriceFeed):
-    logger = logging.getLogger()
+    def on_update(self, on_update_function):
+        self.price_feed.on_update(on_update_function)
 
-    def __init__(self, feeds: List[PriceFeed]):
-        assert(isinstance(feeds, list))
-        self.feeds = feeds
+
+class BackupPriceFeed(CompositePriceFeed):
+    """Price feed using the price of the first of several price feeds which has one.
+
+    See `CompositePriceFeed` for the arguments.
+    """
+
+    logger = logging.getLogger()
 
     def get_price(self) -> Price:
-        for feed in self.feeds:
-            price = feed.get_price()
+        return self._first()[1]
+
+    def timestamp(self) -> Optional[float]:
+        feed = self._first()[0]
+        return feed.timestamp() if feed is not None else None
+
+    def _first(self) -> tuple:
+        for feed, price in self._prices():
             if price.buy_price is not None or price.sell_price is not None:
-                return price
+                return feed, price
 
-        return Price(buy_price=None, sell_price=None)
+        return None, Price(buy_price=None, sell_price=None)
 
 
 class PriceFeedFactory:
+    """Creates price feeds from the `--price-feed` and `--price-feed-expiry` keeper arguments.
+
+    `--price-feed` is a `;`-separated list of price feeds, optionally preceded by the way of combining
+    them and options of the composite price feed, i.e. `median,max-age=30,max-variance=0.0001:wss://...;wss://...`.
+    The price feeds get combined with `BackupPriceFeed` (`backup`, the default) or with `AveragePriceFeed`
+    (`mean`, `median` or `volume-weighted`). If there is more than one of them, each one gets refreshed
+    in the background every `refresh-frequency` seconds (`REFRESH_FREQUENCY` by default), and prices older
+    than `max-age` seconds (`--price-feed-expiry` by default) are ignored.
+
+    `setzer` price sources get fetched over HTTP instead of running `setzer` if `--setzer-http-sources`
+    is given, see `SetzerDaemon`.
+    """
+
+    MODES = ['backup'] + AveragePriceFeed.MODES
+    OPTIONS = ['max-age', 'max-variance', 'refresh-frequency']
+
+    REFRESH_FREQUENCY = 1.0
+
     @staticmethod
     def create_price_feed(arguments, tub: Tub = None) -> PriceFeed:
-        return BackupPriceFeed([PriceFeedFactory._create_price_feed(price_feed, arguments.price_feed_expiry, tub)
-                                for price_feed in arguments.price_feed.split(";")])
+        mode, options, price_feed_arguments = PriceFeedFactory._parse(arguments.price_feed)
+        feeds = [PriceFeedFactory._create_price_feed(price_feed, arguments.price_feed_expiry, tub, arguments.setzer_http_sources)
+                 for price_feed in price_feed_arguments]
+
+        # with more than one price feed, each one gets queried in the background so `get_price()`
+        # of the composite price feed does not query them one after another
+        refresh_frequency = options.get('refresh-frequency', PriceFeedFactory.REFRESH_FREQUENCY if len(feeds) > 1 else None)
+        max_age = options.get('max-age', arguments.price_feed_expiry if refresh_frequency is not None else None)
+        max_variance = options.get('max-variance')
+
+        if mode == 'backup':
+            return BackupPriceFeed(feeds, max_age=max_age, max_variance=max_variance, refresh_frequency=refresh_frequency)
+        else:
+            return AveragePriceFeed(feeds, mode=mode, max_age=max_age, max_variance=max_variance,
+                                    refresh_frequency=refresh_frequency)
+
+    @staticmethod
+    def _parse(price_feed_argument: str) -> Tuple[str, dict, list]:
+        assert(isinstance(price_feed_argument, str))
+
+        # price feeds themselves can contain colons (i.e. `fixed:1.56` or `wss://...`), so the part before
+        # the first colon is only taken as the mode and options if it starts with a mode
+        head, separator, tail = price_feed_argument.partition(':')
+        settings = head.split(',')
+        if not separator or settings[0] not in PriceFeedFactory.MODES:
+            return 'backup', {}, price_feed_argument.split(';')
+
+        options = {}
+        for setting in settings[1:]:
+            name, equals, value = setting.partition('=')
+            if name not in PriceFeedFactory.OPTIONS or not equals:
+                raise Exception(f"'--price-feed {price_feed_argument}' option '{setting}' unknown")
+
+            options[name] = float(value)
+
+        return settings[0], options, tail.split(';')
 
     @staticmethod
-    def _create_price_feed(price_feed_argument: str, price_feed_expiry_argument: int, tub: Optional[Tub]):
+    def _create_price_feed(price_feed_argument: str, price_feed_expiry_argument: int, tub: Optional[Tub],
+                           setzer_http_sources: bool):
         assert(isinstance(price_feed_argument, str))
         assert(isinstance(price_feed_expiry_argument, int))
         assert(isinstance(tub, Tub) or tub is None)
+        assert(isinstance(setzer_http_sources, bool))
 
         if price_feed_argument == 'eth_dai':
             return GdaxPriceFeed(product_id="ETH-USD",
                                  expiry=price_feed_expiry_argument)
 
         elif price_feed_argument == 'eth_dai-setzer':
-            return AveragePriceFeed([SetzerPriceFeed('kraken', expiry=price_feed_expiry_argument),
-                                     SetzerPriceFeed('gemini', expiry=price_feed_expiry_argument)])
+            setzer_daemon = SetzerDaemon.default(http_sources=setzer_http_sources)
+            return AveragePriceFeed([SetzerPriceFeed('kraken', expiry=price_feed_expiry_argument, setzer_daemon=setzer_daemon),
+                                     SetzerPriceFeed('gemini', expiry=price_feed_expiry_argument, setzer_daemon=setzer_daemon)],
+                                    refresh_frequency=PriceFeedFactory.REFRESH_FREQUENCY)
 
         elif price_feed_argument == 'eth_dai-tub':
             if tub is not None:
-                price_feed = TubPriceFeed(tub)
+                # reading the price from the chain can take a while, so it happens in the background
+                price_feed = CachedPriceFeed(TubPriceFeed(tub), expiry=price_feed_expiry_argument)
             else:
                 raise Exception(f"'--price-feed eth_dai-tub' cannot be used as this keeper does not know about 'Tub'")
 
@@ -275,16 +557,16 @@ class PriceFeedFactory:
                                  expiry=price_feed_expiry_argument)
 
         elif price_feed_argument == 'dai_eth':
-            return ReversePriceFeed(PriceFeedFactory._create_price_feed('eth_dai', price_feed_expiry_argument, tub))
+            return ReversePriceFeed(PriceFeedFactory._create_price_feed('eth_dai', price_feed_expiry_argument, tub, setzer_http_sources))
 
         elif price_feed_argument == 'dai_eth-setzer':
-            return ReversePriceFeed(PriceFeedFactory._create_price_feed('eth_dai-setzer', price_feed_expiry_argument, tub))
+            return ReversePriceFeed(PriceFeedFactory._create_price_feed('eth_dai-setzer', price_feed_expiry_argument, tub, setzer_http_sources))
 
         elif price_feed_argument == 'dai_eth-tub':
-            return ReversePriceFeed(PriceFeedFactory._create_price_feed('eth_dai-tub', price_feed_expiry_argument, tub))
+            return ReversePriceFeed(PriceFeedFactory._create_price_feed('eth_dai-tub', price_feed_expiry_argument, tub, setzer_http_sources))
 
         elif price_feed_argument == 'dai_btc':
-            return ReversePriceFeed(PriceFeedFactory._create_price_feed('btc_dai', price_feed_expiry_argument, tub))
+            return ReversePriceFeed(PriceFeedFactory._create_price_feed('btc_dai', price_feed_expiry_argument, tub, setzer_http_sources))
 
         elif price_feed_argument.startswith("fixed:"):
             price_feed = FixedPriceFeed(Wad.from_number(price_feed_argument[6:]))
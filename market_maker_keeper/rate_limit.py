@@ -0,0 +1,78 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2017-2018 reverendus
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import threading
+import time
+
+
+class TokenBucket:
+    """Token bucket rate limiter, used to stay within exchange API request limits.
+
+    The bucket holds at most `capacity` tokens and gets refilled with `rate` tokens per second.
+    Each request takes one token out of the bucket, so up to `capacity` requests can be sent
+    in a burst and after that requests can be sent at `rate` requests per second.
+
+    Attributes:
+        rate: Number of tokens added to the bucket every second.
+        capacity: Maximum number of tokens the bucket can hold.
+    """
+
+    def __init__(self, rate: float, capacity: int):
+        assert(isinstance(rate, float) or isinstance(rate, int))
+        assert(isinstance(capacity, int))
+        assert(rate > 0)
+        assert(capacity > 0)
+
+        self.rate = float(rate)
+        self.capacity = capacity
+
+        self._lock = threading.Lock()
+        self._tokens = float(capacity)
+        self._last_refill = time.monotonic()
+
+    def try_acquire(self, tokens: int = 1) -> float:
+        """Takes `tokens` out of the bucket if they are available.
+
+        Returns:
+            `0.0` if the tokens have been taken, otherwise the number of seconds after which
+            they are expected to become available.
+        """
+        assert(isinstance(tokens, int))
+        assert(0 < tokens <= self.capacity)
+
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(float(self.capacity), self._tokens + (now - self._last_refill) * self.rate)
+            self._last_refill = now
+
+            if self._tokens >= tokens:
+                self._tokens -= tokens
+                return 0.0
+            else:
+                return (tokens - self._tokens) / self.rate
+
+    def acquire(self, tokens: int = 1):
+        """Takes `tokens` out of the bucket, waiting for them to become available if necessary."""
+        while True:
+            wait_time = self.try_acquire(tokens)
+            if wait_time == 0.0:
+                break
+
+            time.sleep(wait_time)
+
+    def __repr__(self):
+        return f"TokenBucket(rate={self.rate}, capacity={self.capacity})"
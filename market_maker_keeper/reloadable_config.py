@@ -19,7 +19,10 @@ import _jsonnet
 import json
 import logging
 import os
+import threading
+import time
 import zlib
+from collections import OrderedDict
 from typing import Optional, List
 
 
@@ -30,25 +33,66 @@ class ReloadableConfig:
     on each call to `get_config()`. In addition to that, whenever the config file changes,
     a log event is emitted.
 
+    Evaluating the config takes around ~ 30ms, so evaluated configs are cached. The cache is keyed
+    by checksums of the config file and all files imported by it, and by the spread feed values
+    rounded to `spread_feed_precision` decimal places. As long as none of them changes, `get_config()`
+    returns the very same object, so consumers can cache whatever they derive from it (see
+    `get_parsed_config()`).
+
+    Once a callback gets registered with `on_update()`, the config files are watched by a background
+    thread, which reports their changes to the callback. From then on `get_config()` does not check
+    the files on disk anymore, it relies on the watcher instead.
+
     This reader uses _jsonnet_ data templating language, so the JSON config files can use
     some advanced expressions documented here: <https://github.com/google/jsonnet>.
 
     Attributes:
         filename: Filename of the configuration file.
+        cache_size: Maximum number of evaluated configs kept in the cache.
+        spread_feed_precision: Number of decimal places spread feed values are rounded to.
+        watch_interval: How often (in seconds) the watcher checks the config files for changes.
     """
 
     logger = logging.getLogger()
 
-    def __init__(self, filename: str):
+    def __init__(self, filename: str, cache_size: int = 64, spread_feed_precision: int = 6, watch_interval: float = 1.0):
         assert(isinstance(filename, str))
+        assert(isinstance(cache_size, int))
+        assert(isinstance(spread_feed_precision, int))
+        assert(isinstance(watch_interval, float) or isinstance(watch_interval, int))
 
         self.filename = filename
+        self.cache_size = cache_size
+        self.spread_feed_precision = spread_feed_precision
+        self.watch_interval = watch_interval
+
+        self._lock = threading.RLock()
         self._checksum_file = None
         self._checksum_config = None
-        self._config = None
+        self._content_file = None
         self._mtime = None
         self._imported_paths_to_mtimes = {}
-        self._spread_feed = None
+        self._imported_paths_to_checksums = {}
+        self._cache = OrderedDict()
+        self._parsed_configs = OrderedDict()
+
+        self._on_update_functions = []
+        self._watcher = None
+        self._files_changed = threading.Event()
+
+    def on_update(self, on_update_function):
+        """Calls `on_update_function` every time the config file or any of the files imported by it changes.
+
+        Starts the background watcher when called for the first time.
+        """
+        assert(callable(on_update_function))
+
+        with self._lock:
+            self._on_update_functions.append(on_update_function)
+
+            if self._watcher is None:
+                self._watcher = threading.Thread(target=self._watch, daemon=True)
+                self._watcher.start()
 
     def _import_callback(self, paths: list, spread_feed: dict):
         assert(isinstance(spread_feed, dict))
@@ -76,6 +120,46 @@ class ReloadableConfig:
         except:
             return True
 
+    def _load_checksums(self, imported_paths: List[str]) -> dict:
+        checksums = {}
+        for path in imported_paths:
+            with open(path, 'rb') as file_obj:
+                checksums[path] = zlib.crc32(file_obj.read())
+
+        return checksums
+
+    def _files_modified(self) -> bool:
+        try:
+            return os.path.getmtime(self.filename) != self._mtime or self._mtimes_changed(self._imported_paths_to_mtimes)
+
+        except:
+            return True
+
+    def _watch(self):
+        while True:
+            time.sleep(self.watch_interval)
+
+            with self._lock:
+                modified = self._content_file is not None and self._files_modified()
+
+            if modified:
+                self._files_changed.set()
+
+                for on_update_function in list(self._on_update_functions):
+                    try:
+                        on_update_function()
+                    except:
+                        self.logger.exception("Config update callback has failed")
+
+    def _quantize(self, spread_feed: dict) -> dict:
+        def quantize(value):
+            try:
+                return round(float(value), self.spread_feed_precision)
+            except (TypeError, ValueError):
+                return value
+
+        return {key: quantize(value) for key, value in spread_feed.items()}
+
     def get_config(self, spread_feed: dict):
         """Reads the JSON config file from disk and returns it as a Python object.
 
@@ -84,48 +168,110 @@ class ReloadableConfig:
         """
         assert(isinstance(spread_feed, dict))
 
-        mtime = os.path.getmtime(self.filename)
-
-        # If the modification time has not changed since the last time we have read the file,
-        # we return the last content without opening and parsing it. It saves us around ~ 30ms.
-        #
-        # Ultimately something like `watchdog` (<https://pythonhosted.org/watchdog/index.html>)
-        # should be used to watch the filesystem changes asynchronously.
-        if self._config is not None and self._mtime is not None:
-            if mtime == self._mtime \
-                    and spread_feed == self._spread_feed \
-                    and not self._mtimes_changed(self._imported_paths_to_mtimes):
-                return self._config
-
-        with open(self.filename) as data_file:
-            imported_paths = []
-
-            content_file = data_file.read()
-            content_config = _jsonnet.evaluate_snippet("snippet", content_file, ext_vars={},
-                                                       import_callback=self._import_callback(imported_paths, spread_feed))
-            result = json.loads(content_config)
-
-            # Report if file has been newly loaded or reloaded
-            checksum_file = zlib.crc32(content_file.encode('utf-8'))
-            checksum_config = zlib.crc32(content_config.encode('utf-8'))
-            if self._checksum_file is None:
-                self.logger.info(f"Loaded configuration from '{self.filename}'")
-                self.logger.debug(f"Config file is: " + json.dumps(result, indent=4))
-            elif self._checksum_file != checksum_file:
-                self.logger.info(f"Reloaded configuration from '{self.filename}'")
-                self.logger.debug(f"Reloaded config file is: " + json.dumps(result, indent=4))
-            elif self._imported_paths_to_mtimes != self._load_mtimes(imported_paths):
-                self.logger.info(f"Reloaded configuration from '{self.filename}' (due to imported file changed)")
-                self.logger.debug(f"Reloaded config file is: " + json.dumps(result, indent=4))
-            elif self._checksum_config != checksum_config:
-                self.logger.debug(f"Parsed configuration from '{self.filename}'")
-                self.logger.debug(f"Parsed config file is: " + json.dumps(result, indent=4))
-
-            self._checksum_file = checksum_file
-            self._checksum_config = checksum_config
-            self._config = result
-            self._mtime = mtime
-            self._imported_paths_to_mtimes = self._load_mtimes(imported_paths)
-            self._spread_feed = spread_feed
-
-            return result
+        with self._lock:
+            imported_paths_to_checksums = self._imported_paths_to_checksums
+
+            # Without the watcher we have to check the modification times on each call,
+            # but then we only read the files again if they have actually been modified.
+            if self._watcher is None:
+                files_changed = self._content_file is None or self._files_modified()
+            else:
+                files_changed = self._content_file is None or self._files_changed.is_set()
+                self._files_changed.clear()
+
+            if files_changed:
+                self._mtime = os.path.getmtime(self.filename)
+                with open(self.filename) as data_file:
+                    self._content_file = data_file.read()
+
+                # Imported files are read again here too, so their modification times have to be refreshed as well.
+                # Otherwise a change which does not need a new evaluation (i.e. the content went back to one
+                # already cached) would keep being reported as a modification forever.
+                imported_paths = list(self._imported_paths_to_mtimes.keys())
+                self._imported_paths_to_mtimes = self._load_mtimes(imported_paths)
+                self._imported_paths_to_checksums = self._load_checksums(imported_paths)
+
+            spread_feed = self._quantize(spread_feed)
+            key = (zlib.crc32(self._content_file.encode('utf-8')),
+                   tuple(sorted(self._imported_paths_to_checksums.items())),
+                   tuple(sorted(spread_feed.items())))
+
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                return self._cache[key][1]
+
+            return self._evaluate(key, spread_feed, imported_paths_to_checksums)
+
+    def _evaluate(self, key: tuple, spread_feed: dict, previous_imported_paths_to_checksums: dict):
+        imported_paths = []
+
+        content_file = self._content_file
+        content_config = _jsonnet.evaluate_snippet("snippet", content_file, ext_vars={},
+                                                   import_callback=self._import_callback(imported_paths, spread_feed))
+        result = json.loads(content_config)
+
+        # Report if file has been newly loaded or reloaded
+        checksum_file = zlib.crc32(content_file.encode('utf-8'))
+        checksum_config = zlib.crc32(content_config.encode('utf-8'))
+        imported_paths_to_checksums = self._load_checksums(imported_paths)
+        if self._checksum_file is None:
+            self.logger.info(f"Loaded configuration from '{self.filename}'")
+            self.logger.debug(f"Config file is: " + json.dumps(result, indent=4))
+        elif self._checksum_file != checksum_file:
+            self.logger.info(f"Reloaded configuration from '{self.filename}'")
+            self.logger.debug(f"Reloaded config file is: " + json.dumps(result, indent=4))
+        elif previous_imported_paths_to_checksums != imported_paths_to_checksums:
+            self.logger.info(f"Reloaded configuration from '{self.filename}' (due to imported file changed)")
+            self.logger.debug(f"Reloaded config file is: " + json.dumps(result, indent=4))
+        elif self._checksum_config != checksum_config:
+            self.logger.debug(f"Parsed configuration from '{self.filename}'")
+            self.logger.debug(f"Parsed config file is: " + json.dumps(result, indent=4))
+
+        # If the same output is already cached (i.e. only the spreads have changed and they are not used),
+        # we return the same object as before.
+        for cached_content_config, cached_result in self._cache.values():
+            if cached_content_config == content_config:
+                result = cached_result
+                break
+
+        self._checksum_file = checksum_file
+        self._checksum_config = checksum_config
+        self._imported_paths_to_mtimes = self._load_mtimes(imported_paths)
+        self._imported_paths_to_checksums = imported_paths_to_checksums
+
+        # The set of imported files is only known after the evaluation, so the key may need to be updated.
+        key = key[:1] + (tuple(sorted(imported_paths_to_checksums.items())),) + key[2:]
+
+        self._cache[key] = (content_config, result)
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+        return result
+
+    def get_parsed_config(self, spread_feed: dict, parse_function):
+        """Returns `parse_function(config)`, calling `parse_function` only when the config has changed.
+
+        Results are cached per config object returned by `get_config()`, so as long as the evaluated
+        config stays the same, the same parsed object is returned.
+        """
+        assert(isinstance(spread_feed, dict))
+        assert(callable(parse_function))
+
+        config = self.get_config(spread_feed)
+
+        with self._lock:
+            key = (id(config), parse_function)
+            cached = self._parsed_configs.get(key)
+            if cached is not None and cached[0] is config:
+                self._parsed_configs.move_to_end(key)
+                return cached[1]
+
+        parsed = parse_function(config)
+
+        with self._lock:
+            self._parsed_configs[key] = (config, parsed)
+            while len(self._parsed_configs) > self.cache_size:
+                self._parsed_configs.popitem(last=False)
+
+        return parsed
@@ -0,0 +1,378 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2017-2018 reverendus
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import argparse
+import contextlib
+import datetime
+import logging
+import sys
+import time
+import types
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Iterable, Optional, Tuple
+from unittest import mock
+
+import numpy as np
+
+from market_maker_keeper.band import Bands
+from market_maker_keeper.capture import CaptureRecord, read_capture
+from market_maker_keeper.decoding import parse_timestamp
+from market_maker_keeper.feed import EmptyFeed, Feed, FixedFeed
+from market_maker_keeper.limit import History
+from market_maker_keeper.order_book import OrderBookManager
+from market_maker_keeper.price_feed import WebSocketPriceFeed
+from market_maker_keeper.reloadable_config import ReloadableConfig
+from market_maker_keeper.simulated_exchange import SimulatedExchange
+from market_maker_keeper.util import setup_logging
+from pymaker.numeric import Wad
+
+
+class SimulatedClock:
+    """Clock of a replay, moving forward only when told to.
+
+    While `installed()`, `time.time()` returns the simulated time, so everything depending on the
+    time (order limits, expiring feeds...) behaves the same way it behaved when the data got captured.
+    So does `datetime.datetime.utcnow()` called from any of `datetime_modules`.
+    """
+
+    def __init__(self, start: float = 0.0):
+        self._now = start
+
+    def time(self) -> float:
+        return self._now
+
+    def utcnow(self) -> datetime.datetime:
+        return datetime.datetime(1970, 1, 1) + datetime.timedelta(seconds=self._now)
+
+    def advance_to(self, timestamp: float):
+        self._now = max(self._now, timestamp)
+
+    @contextmanager
+    def installed(self, datetime_modules: list = ()):
+        clock = self
+
+        class SimulatedDatetime(datetime.datetime):
+            @classmethod
+            def utcnow(cls):
+                return clock.utcnow()
+
+        simulated_datetime = types.SimpleNamespace(**{name: getattr(datetime, name) for name in dir(datetime)
+                                                      if not name.startswith('_')})
+        simulated_datetime.datetime = SimulatedDatetime
+
+        with contextlib.ExitStack() as stack:
+            stack.enter_context(mock.patch('time.time', self.time))
+            for module in datetime_modules:
+                stack.enter_context(mock.patch.object(module, 'datetime', simulated_datetime))
+
+            yield self
+
+
+class InlineExecutor(ThreadPoolExecutor):
+    """Executor running submitted functions straight away in the calling thread.
+
+    Makes `OrderBookManager` place and cancel orders synchronously, so replays are deterministic.
+    """
+
+    def __init__(self):
+        super().__init__(max_workers=1)
+
+    def submit(self, fn, *args, **kwargs) -> Future:
+        future = Future()
+        try:
+            future.set_result(fn(*args, **kwargs))
+        except BaseException as exception:
+            future.set_exception(exception)
+
+        return future
+
+
+class ReplayFeed(Feed):
+    """Feed of the latest entry of the captured messages pushed into it, see `WebSocketFeed`."""
+
+    def __init__(self):
+        self._last = {}, 0.0
+        self._on_update_functions = []
+
+    def push(self, message: dict):
+        if len(message.get('data', [])) == 0:
+            return
+
+        data = message['data'][-1]
+        self._last = data, parse_timestamp(data['timestamp'])
+
+        for on_update_function in self._on_update_functions:
+            on_update_function()
+
+    def get(self) -> Tuple[dict, float]:
+        return self._last
+
+    def on_update(self, on_update_function):
+        assert(callable(on_update_function))
+
+        self._on_update_functions.append(on_update_function)
+
+
+class ReplayResult:
+    """Outcome of a replay.
+
+    Attributes:
+        records: Number of captured messages replayed.
+        cycles: Number of times the keeper (or the strategy) has been synchronized.
+        simulated_time: Time span (in seconds) of the replayed data.
+        wall_time: Time (in seconds) the replay took.
+        cpu_time: CPU time (in seconds) the replay took.
+        pnl: Profit (or loss) made during the replay, see the replay classes for its unit.
+        statistics: Other counters, name -> value.
+    """
+
+    def __init__(self, records: int, cycles: int, simulated_time: float, wall_time: float, cpu_time: float,
+                 pnl: Optional[Wad], statistics: dict):
+        self.records = records
+        self.cycles = cycles
+        self.simulated_time = simulated_time
+        self.wall_time = wall_time
+        self.cpu_time = cpu_time
+        self.pnl = pnl
+        self.statistics = statistics
+
+    @property
+    def speedup(self) -> float:
+        return self.simulated_time / self.wall_time if self.wall_time > 0 else float('inf')
+
+    @property
+    def cpu_time_per_cycle(self) -> float:
+        return self.cpu_time / self.cycles if self.cycles > 0 else 0.0
+
+    def __str__(self):
+        lines = [f"Replayed {self.records} messages spanning {self.simulated_time:.0f}s in {self.wall_time:.2f}s"
+                 f" ({self.speedup:.0f}x faster than real time)",
+                 f"Synchronized {self.cycles} times, {self.cpu_time_per_cycle * 1000:.3f}ms of CPU time per cycle",
+                 f"PnL: {self.pnl}"]
+        lines += [f"{name}: {value}" for name, value in self.statistics.items()]
+
+        return '\n'.join(lines)
+
+
+class Replay:
+    """Base class of replays: pushes captured messages into the feeds on simulated time and synchronizes
+    every `sync_interval` simulated seconds.
+
+    Subclasses route the messages in `push()` and do their work in `synchronize()`. Modules using
+    `datetime.datetime.utcnow()` have to be listed in `datetime_modules`, see `SimulatedClock`.
+    As bands pick random order amounts, numpy's random generator gets seeded with `seed` first.
+    """
+
+    def __init__(self, sync_interval: float, seed: int = 0):
+        assert(isinstance(sync_interval, float) or isinstance(sync_interval, int))
+        assert(isinstance(seed, int))
+
+        self.sync_interval = sync_interval
+        self.seed = seed
+        self.clock = SimulatedClock()
+        self.datetime_modules = []
+
+    def push(self, record: CaptureRecord):
+        raise NotImplementedError()
+
+    def synchronize(self):
+        raise NotImplementedError()
+
+    def pnl(self) -> Optional[Wad]:
+        return None
+
+    def statistics(self) -> dict:
+        return {}
+
+    def run(self, records: Iterable[CaptureRecord]) -> ReplayResult:
+        started_wall, started_cpu = time.perf_counter(), time.process_time()
+        first_time, last_sync, count, cycles = None, None, 0, 0
+        np.random.seed(self.seed)
+
+        with self.clock.installed(self.datetime_modules):
+            for record in records:
+                self.clock.advance_to(record.time)
+                first_time = record.time if first_time is None else first_time
+                count += 1
+
+                self.push(record)
+
+                if last_sync is None or record.time - last_sync >= self.sync_interval:
+                    self.synchronize()
+                    last_sync = record.time
+                    cycles += 1
+
+        return ReplayResult(records=count,
+                            cycles=cycles,
+                            simulated_time=self.clock.time() - first_time if first_time is not None else 0.0,
+                            wall_time=time.perf_counter() - started_wall,
+                            cpu_time=time.process_time() - started_cpu,
+                            pnl=self.pnl(),
+                            statistics=self.statistics())
+
+
+class BandsReplay(Replay):
+    """Replays captured feeds into `Bands`, placing and cancelling orders on a `SimulatedExchange` through
+    an `OrderBookManager`, the same way the market maker keepers for centralized exchanges do.
+
+    Orders get filled as soon as the price feed crosses them. The PnL is the change of the value of all
+    the balances, in the quote token, valued at the last price.
+
+    Attributes:
+        config: Bands configuration file.
+        pair: The pair being traded, i.e. `eth_dai`.
+        balances: Initial balances, token name -> amount.
+        price_feed: Capture source of the price feed (the `--price-feed` argument of the keeper).
+        spread_feed: Capture source of the spread feed, if any.
+        control_feed: Capture source of the control feed, if any.
+    """
+
+    logger = logging.getLogger()
+
+    def __init__(self, config: str, pair: str, balances: dict, price_feed: str,
+                 spread_feed: Optional[str] = None, control_feed: Optional[str] = None, sync_interval: float = 1.0):
+        super().__init__(sync_interval)
+
+        self.feeds = {price_feed: ReplayFeed()}
+        self.price_feed = WebSocketPriceFeed(self.feeds[price_feed])
+        self.spread_feed = self.feeds.setdefault(spread_feed, ReplayFeed()) if spread_feed else EmptyFeed()
+        self.control_feed = self.feeds.setdefault(control_feed, ReplayFeed()) if control_feed \
+            else FixedFeed({'canBuy': True, 'canSell': True})
+
+        self.bands_config = ReloadableConfig(config)
+        self.history = History()
+        self.exchange = SimulatedExchange(pair, balances, clock=self.clock.time)
+        self.last_price = None
+
+        self.order_book_manager = OrderBookManager(refresh_frequency=1, executor=InlineExecutor())
+        self.exchange.attach(self.order_book_manager)
+
+    def sources(self) -> set:
+        return set(self.feeds.keys())
+
+    def push(self, record: CaptureRecord):
+        if record.source not in self.feeds:
+            return
+
+        self.feeds[record.source].push(record.message)
+
+        price = self.price_feed.get_price()
+        if price.buy_price is not None and price.sell_price is not None:
+            self.last_price = (price.buy_price + price.sell_price) / Wad.from_number(2)
+            self.exchange.match(self.last_price)
+
+    def synchronize(self):
+        self.order_book_manager.refresh_order_book()
+
+        bands = Bands.read(self.bands_config, self.spread_feed, self.control_feed, self.history)
+        order_book = self.order_book_manager.get_order_book()
+        target_price = self.price_feed.get_price()
+        our_buy_orders = [order for order in order_book.orders if not order.is_sell]
+        our_sell_orders = [order for order in order_book.orders if order.is_sell]
+
+        reconciliation = bands.reconcile(our_buy_orders=our_buy_orders,
+                                         our_sell_orders=our_sell_orders,
+                                         our_buy_balance=order_book.balances[self.exchange.quote_token],
+                                         our_sell_balance=order_book.balances[self.exchange.base_token],
+                                         target_price=target_price)
+
+        self.order_book_manager.replace_orders(reconciliation.cancellations, reconciliation.new_orders,
+                                               reconciliation.orders_after_cancellations)
+        self.order_book_manager.dispatch_cancellations()
+
+    def pnl(self) -> Optional[Wad]:
+        if self.last_price is None:
+            return None
+
+        return self.exchange.value(self.last_price) - self.exchange.initial_value(self.last_price)
+
+    def statistics(self) -> dict:
+        return {'orders placed': self.exchange.orders_placed,
+                'orders cancelled': self.exchange.orders_cancelled,
+                'orders filled': self.exchange.orders_filled,
+                'balances': {token: str(amount) for token, amount in self.exchange.balances.items()}}
+
+
+def parse_balances(balances: list) -> dict:
+    result = {}
+    for balance in balances:
+        token, amount = balance.split('=')
+        result[token] = Wad.from_number(amount)
+
+    return result
+
+
+def main(args: list):
+    parser = argparse.ArgumentParser(prog='market-maker-replay')
+    subparsers = parser.add_subparsers(dest='replay')
+
+    bands_parser = subparsers.add_parser('bands', help="Replay captured feeds into bands trading on a simulated exchange")
+    bands_parser.add_argument("--config", type=str, required=True,
+                              help="Bands configuration file")
+    bands_parser.add_argument("--pair", type=str, required=True,
+                              help="Token pair (sell/buy) on which the keeper will operate")
+    bands_parser.add_argument("--balance", type=str, nargs='+', required=True,
+                              help="Initial balances, i.e. `eth=10 dai=2000`")
+    bands_parser.add_argument("--price-feed", type=str, required=True,
+                              help="Source of price feed, as it has been captured")
+    bands_parser.add_argument("--spread-feed", type=str,
+                              help="Source of spread feed, as it has been captured")
+    bands_parser.add_argument("--control-feed", type=str,
+                              help="Source of control feed, as it has been captured")
+    bands_parser.add_argument("--sync-interval", type=float, default=1.0,
+                              help="Simulated time (in seconds) between synchronizations (default: 1.0)")
+
+    strategy_parser = subparsers.add_parser('strategy', help="Replay captured OKEx data into the futures strategy")
+    strategy_parser.add_argument("--pair", type=str, required=True,
+                                 help="Swap instrument the strategy trades, i.e. `ETH-USD-SWAP`")
+    strategy_parser.add_argument("--sync-interval", type=float, default=12.0,
+                                 help="Simulated time (in seconds) between position checks (default: 12.0)")
+
+    for subparser in [bands_parser, strategy_parser]:
+        subparser.add_argument("--capture-file", type=str, required=True,
+                               help="File the market data has been captured to")
+        subparser.add_argument("--debug", dest='debug', action='store_true',
+                               help="Enable debug output")
+
+    arguments = parser.parse_args(args)
+    if arguments.replay is None:
+        parser.error("choose the replay to run")
+
+    setup_logging(arguments)
+
+    if arguments.replay == 'bands':
+        replay = BandsReplay(config=arguments.config,
+                             pair=arguments.pair,
+                             balances=parse_balances(arguments.balance),
+                             price_feed=arguments.price_feed,
+                             spread_feed=arguments.spread_feed,
+                             control_feed=arguments.control_feed,
+                             sync_interval=arguments.sync_interval)
+        records = read_capture(arguments.capture_file, replay.sources())
+
+    else:
+        from futures_maker.replay import StrategyReplay
+
+        replay = StrategyReplay(instrument_id=arguments.pair, sync_interval=arguments.sync_interval)
+        records = read_capture(arguments.capture_file)
+
+    print(replay.run(records))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,112 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2017-2018 reverendus
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import logging
+import threading
+import time
+
+
+class ReactiveScheduler:
+    """Runs a keeper function whenever one of its inputs changes, instead of on a fixed interval.
+
+    Sources (price feeds, spread and control feeds, the order book manager...) notify the
+    scheduler through their `on_update()` callbacks. Notifications arriving in quick succession
+    get coalesced into one invocation of `function`, and two invocations never start less
+    than `min_interval` seconds apart. Invocations never overlap.
+
+    Sources which are not able to notify about their changes are covered by the watchdog.
+    `watchdog()` is supposed to be called periodically from `Lifecycle.every()`, it starts
+    the scheduler the first time it gets called and triggers an invocation if `function`
+    has not run for `max_interval` seconds.
+
+    Attributes:
+        function: The function to run, usually `synchronize_orders`.
+        min_interval: Minimum time (in seconds) between two consecutive invocations.
+        max_interval: Maximum time (in seconds) without an invocation, enforced by the watchdog.
+    """
+
+    logger = logging.getLogger()
+
+    def __init__(self, function, min_interval: float = 0.1, max_interval: float = 1.0):
+        assert(callable(function))
+        assert(isinstance(min_interval, float) or isinstance(min_interval, int))
+        assert(isinstance(max_interval, float) or isinstance(max_interval, int))
+        assert(min_interval <= max_interval)
+
+        self.function = function
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+
+        self._event = threading.Event()
+        self._run_lock = threading.Lock()
+        self._thread = None
+        self._stopped = False
+        self._last_run = 0.0
+
+    def listen_to(self, source):
+        """Triggers the function every time `source` reports an update.
+
+        Args:
+            source: Any object exposing an `on_update(callback)` method, like `Feed`, `PriceFeed`
+                or `OrderBookManager`.
+        """
+        source.on_update(self.trigger)
+
+    def trigger(self):
+        """Requests the function to be run as soon as `min_interval` allows."""
+        self._event.set()
+
+    def watchdog(self):
+        """Starts the scheduler and triggers the function if it has not run for `max_interval` seconds."""
+        if self._stopped:
+            return
+
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._background_run, daemon=True)
+            self._thread.start()
+
+        if time.time() - self._last_run >= self.max_interval:
+            self.trigger()
+
+    def stop(self):
+        """Stops the scheduler, waiting for the invocation in progress (if any) to finish."""
+        self._stopped = True
+        self._event.set()
+
+        with self._run_lock:
+            pass
+
+    def _background_run(self):
+        while True:
+            self._event.wait()
+
+            delay = self._last_run + self.min_interval - time.time()
+            if delay > 0:
+                time.sleep(delay)
+
+            self._event.clear()
+
+            with self._run_lock:
+                if self._stopped:
+                    break
+
+                self._last_run = time.time()
+
+                try:
+                    self.function()
+                except Exception as e:
+                    self.logger.exception(f"Scheduled function has failed ({e})")
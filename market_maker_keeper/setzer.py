@@ -15,7 +15,14 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import logging
 import subprocess
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Tuple
+
+import requests
 
 from pymaker.numeric import Wad
 
@@ -31,11 +38,15 @@ class Setzer():
 
     Attributes:
         command: The full path to the `setzer` tool.
+        timeout: Time (in seconds) after which `setzer` gets killed, `None` for no limit.
     """
 
-    def __init__(self, command: str = 'setzer'):
+    def __init__(self, command: str = 'setzer', timeout: Optional[float] = None):
         assert(isinstance(command, str))
+        assert(isinstance(timeout, float) or isinstance(timeout, int) or timeout is None)
+
         self.command = command
+        self.timeout = timeout
 
     def price(self, source: str) -> Wad:
         """Get the current price from `source` using `setzer`.
@@ -46,13 +57,7 @@ class Setzer():
         """
         assert(isinstance(source, str))
 
-        line = f"{self.command} price {source}"
-        process = subprocess.Popen(line.split(), stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        output, error = process.communicate()
-        if len(error) > 0:
-            raise ValueError(f'Error invoking setzer via {line}: {error}')
-
-        return Wad.from_number(float(output))
+        return self._run(f"{self.command} price {source}")
 
     def volume(self, source: str) -> Wad:
         """Get the current volume from `source` using `setzer`.
@@ -63,9 +68,17 @@ class Setzer():
         """
         assert(isinstance(source, str))
 
-        line = f"{self.command} volume {source}"
+        return self._run(f"{self.command} volume {source}")
+
+    def _run(self, line: str) -> Wad:
         process = subprocess.Popen(line.split(), stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        output, error = process.communicate()
+        try:
+            output, error = process.communicate(timeout=self.timeout)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.communicate()
+            raise ValueError(f'Timed out invoking setzer via {line}')
+
         if len(error) > 0:
             raise ValueError(f'Error invoking setzer via {line}: {error}')
 
@@ -73,3 +86,174 @@ class Setzer():
 
     def __repr__(self):
         return f"Setzer()"
+
+
+# ETH/USD price sources of `setzer` which can be fetched without running it: the same public ticker
+# endpoints `setzer price <source>` queries, each with a function extracting the price from the response
+HTTP_SOURCES = {
+    'bitfinex': ("https://api.bitfinex.com/v1/pubticker/ethusd", lambda data: data['last_price']),
+    'bitstamp': ("https://www.bitstamp.net/api/v2/ticker/ethusd/", lambda data: data['last']),
+    'gdax': ("https://api.pro.coinbase.com/products/ETH-USD/ticker", lambda data: data['price']),
+    'gemini': ("https://api.gemini.com/v1/pubticker/ethusd", lambda data: data['last']),
+    'kraken': ("https://api.kraken.com/0/public/Ticker?pair=ETHUSD", lambda data: data['result']['XETHZUSD']['c'][0])
+}
+
+
+class SetzerDaemon:
+    """Fetches the prices of all the `setzer` sources used by a process, from one background worker.
+
+    Each source gets fetched every `expiry / 2` seconds, `expiry` being the shortest expiry it has
+    been subscribed with, so a price gets refreshed well before it expires. Failed fetches get retried
+    with an exponential backoff, never waiting more than `expiry / 2`. Fetches due at the same time run
+    concurrently, each one limited to `timeout` seconds. Sources listed in `http_sources` (none by default)
+    get fetched directly over a keep-alive HTTP session, the other ones are fetched by running `setzer`.
+
+    Attributes:
+        setzer: The `setzer` client used for sources which are not fetched over HTTP.
+        http_sources: Sources to fetch over HTTP instead of running `setzer`, see `HTTP_SOURCES`.
+        timeout: Time (in seconds) after which a fetch is considered failed.
+    """
+
+    logger = logging.getLogger()
+
+    _defaults = {}
+    _default_lock = threading.Lock()
+
+    def __init__(self, setzer: Optional[Setzer] = None, http_sources: Optional[dict] = None, timeout: float = 10.0,
+                 max_workers: int = 4):
+        assert(isinstance(setzer, Setzer) or setzer is None)
+        assert(isinstance(http_sources, dict) or http_sources is None)
+        assert(isinstance(timeout, float) or isinstance(timeout, int))
+        assert(isinstance(max_workers, int))
+
+        self.setzer = setzer if setzer is not None else Setzer(timeout=timeout)
+        self.http_sources = http_sources if http_sources is not None else {}
+        self.timeout = timeout
+
+        self._sources = {}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+        self._session = requests.Session()
+        self._thread = None
+
+    @staticmethod
+    def default(http_sources: bool = False) -> 'SetzerDaemon':
+        """Returns the daemon shared by the whole process, fetching `HTTP_SOURCES` over HTTP if `http_sources`."""
+        assert(isinstance(http_sources, bool))
+
+        with SetzerDaemon._default_lock:
+            if http_sources not in SetzerDaemon._defaults:
+                SetzerDaemon._defaults[http_sources] = SetzerDaemon(http_sources=HTTP_SOURCES if http_sources else {})
+
+            return SetzerDaemon._defaults[http_sources]
+
+    def subscribe(self, source: str, expiry: float, on_update_function=None):
+        """Starts fetching `source`, if not fetched yet, at least as often as needed by `expiry`.
+
+        Args:
+            source: Name of the `setzer` price source.
+            expiry: Time (in seconds) after which a price of this source is considered expired.
+            on_update_function: Function to be called every time a new price of `source` gets fetched.
+        """
+        assert(isinstance(source, str))
+        assert(isinstance(expiry, float) or isinstance(expiry, int))
+        assert(callable(on_update_function) or on_update_function is None)
+
+        with self._lock:
+            state = self._sources.setdefault(source, _SourceState())
+            state.interval = min(state.interval, expiry / 2)
+            state.next_fetch = min(state.next_fetch, (state.timestamp or 0) + state.interval)
+            if on_update_function is not None:
+                state.on_update_functions.append(on_update_function)
+
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._background_run, daemon=True)
+                self._thread.start()
+
+            self._wakeup.set()
+
+    def price(self, source: str) -> Tuple[Optional[Wad], Optional[float]]:
+        """Returns the last price fetched from `source` and the time it has been fetched at."""
+        assert(isinstance(source, str))
+
+        with self._lock:
+            state = self._sources.get(source)
+            return (state.price, state.timestamp) if state is not None else (None, None)
+
+    def fetch(self, source: str) -> Wad:
+        """Fetches the current price from `source`, over HTTP if possible or by running `setzer` otherwise."""
+        assert(isinstance(source, str))
+
+        if source in self.http_sources:
+            url, extract_price = self.http_sources[source]
+            response = self._session.get(url, timeout=self.timeout)
+            response.raise_for_status()
+
+            return Wad.from_number(float(extract_price(response.json())))
+
+        return self.setzer.price(source)
+
+    def fetch_due(self) -> float:
+        """Starts fetching the sources which are due, returns the time until the next source is due."""
+        now = time.time()
+        with self._lock:
+            due = [source for source, state in self._sources.items() if not state.fetching and state.next_fetch <= now]
+            for source in due:
+                self._sources[source].fetching = True
+
+            next_fetches = [state.next_fetch for state in self._sources.values() if not state.fetching]
+
+        for source in due:
+            self._executor.submit(self._fetch, source)
+
+        return min(next_fetches) - now if len(next_fetches) > 0 else 60.0
+
+    def _fetch(self, source: str):
+        try:
+            price = self.fetch(source)
+        except Exception as exception:
+            with self._lock:
+                state = self._sources[source]
+                state.retries += 1
+                state.next_fetch = time.time() + min(2 ** state.retries, state.interval)
+                state.fetching = False
+                retries = state.retries
+                self._wakeup.set()
+
+            if retries > 10:
+                self.logger.warning(f"Failed to get price from 'setzer' ({source}), tried {retries} times: {exception}")
+                self.logger.warning(f"Please check if 'setzer' is installed and working correctly")
+
+            return
+
+        self.logger.debug(f"Fetched price from {source}: {price}")
+
+        with self._lock:
+            state = self._sources[source]
+            state.price = price
+            state.timestamp = time.time()
+            state.retries = 0
+            state.next_fetch = state.timestamp + state.interval
+            state.fetching = False
+            on_update_functions = list(state.on_update_functions)
+            self._wakeup.set()
+
+        for on_update_function in on_update_functions:
+            on_update_function()
+
+    def _background_run(self):
+        while True:
+            self._wakeup.clear()
+            self._wakeup.wait(max(self.fetch_due(), 0.01))
+
+
+class _SourceState:
+    def __init__(self):
+        self.price = None
+        self.timestamp = None
+        self.interval = float('inf')
+        self.next_fetch = float('inf')
+        self.retries = 0
+        self.fetching = False
+        self.on_update_functions = []
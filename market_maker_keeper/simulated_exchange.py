@@ -0,0 +1,314 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2017-2018 reverendus
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import bisect
+import itertools
+import logging
+import random
+import threading
+import time
+from pprint import pformat
+from typing import Optional
+
+from market_maker_keeper.rate_limit import TokenBucket
+from pymaker.numeric import Wad
+
+
+class SimulatedOrder:
+    """Order on the `SimulatedExchange`, with the same fields the orders returned by `pyexchange` APIs have."""
+
+    def __init__(self, order_id: str, timestamp: float, pair: str, is_sell: bool, price: Wad, amount: Wad):
+        assert(isinstance(order_id, str))
+        assert(isinstance(timestamp, float) or isinstance(timestamp, int))
+        assert(isinstance(pair, str))
+        assert(isinstance(is_sell, bool))
+        assert(isinstance(price, Wad))
+        assert(isinstance(amount, Wad))
+
+        self.order_id = order_id
+        self.timestamp = timestamp
+        self.pair = pair
+        self.is_sell = is_sell
+        self.price = price
+        self.amount = amount
+        self.filled_amount = Wad(0)
+
+    @property
+    def remaining_amount(self) -> Wad:
+        return self.amount - self.filled_amount
+
+    @property
+    def sell_to_buy_price(self) -> Wad:
+        return self.price
+
+    @property
+    def buy_to_sell_price(self) -> Wad:
+        return self.price
+
+    @property
+    def remaining_buy_amount(self) -> Wad:
+        return self.remaining_amount * self.price if self.is_sell else self.remaining_amount
+
+    @property
+    def remaining_sell_amount(self) -> Wad:
+        return self.remaining_amount if self.is_sell else self.remaining_amount * self.price
+
+    def __eq__(self, other):
+        return isinstance(other, SimulatedOrder) and self.order_id == other.order_id
+
+    def __hash__(self):
+        return hash(self.order_id)
+
+    def __repr__(self):
+        return pformat(vars(self))
+
+
+class SimulatedExchangeError(Exception):
+    """Error returned by the `SimulatedExchange` API, like a failed HTTP request to a real exchange."""
+    pass
+
+
+class SimulatedExchange:
+    """Exchange living in memory, standing in for the API of a centralized exchange in simulations.
+
+    Keeps the orders and the balances of one account trading one pair (`<base token>_<quote token>`).
+    Placing an order locks the tokens it sells, so it fails the same way a real exchange would if the
+    balance is not sufficient. Orders are kept in a price-time priority book: `match()` fills the orders
+    the market price has crossed, `take()` fills them with an order of another market participant,
+    in both cases at their own price. Times come from `clock`, so simulations can run on simulated time.
+
+    API calls (`get_orders()`, `get_balances()`, `place_order()` and `cancel_order()`) take `latency`
+    seconds each, fail with `SimulatedExchangeError` with `error_rate` probability and, if `rate_limit`
+    is set, get rejected once it has been exceeded. `attach()` plugs them into an `OrderBookManager`.
+
+    Attributes:
+        pair: The pair being traded, i.e. `eth_dai`.
+        balances: Initial balances, token name -> amount.
+        latency: Time (in seconds) each API call takes.
+        error_rate: Probability of an API call failing.
+        rate_limit: Limit of API calls, calls above it fail instead of waiting.
+        seed: Seed of the generator deciding which API calls fail.
+    """
+
+    logger = logging.getLogger()
+
+    def __init__(self, pair: str, balances: dict, clock=time.time, latency: float = 0.0, error_rate: float = 0.0,
+                 rate_limit: Optional[TokenBucket] = None, seed: Optional[int] = None):
+        assert(isinstance(pair, str))
+        assert(isinstance(balances, dict))
+        assert(callable(clock))
+        assert(isinstance(latency, float) or isinstance(latency, int))
+        assert(isinstance(error_rate, float) or isinstance(error_rate, int))
+        assert(0 <= error_rate <= 1)
+        assert(isinstance(rate_limit, TokenBucket) or (rate_limit is None))
+        assert(isinstance(seed, int) or (seed is None))
+
+        self.pair = pair
+        self.base_token, self.quote_token = pair.lower().split('_')
+        self.clock = clock
+        self.latency = latency
+        self.error_rate = error_rate
+        self.rate_limit = rate_limit
+
+        self.balances = {token: Wad(0) for token in [self.base_token, self.quote_token]}
+        self.balances.update({token.lower(): amount for token, amount in balances.items()})
+        self.initial_balances = dict(self.balances)
+
+        self.requests = 0
+        self.failed_requests = 0
+        self.orders_placed = 0
+        self.orders_cancelled = 0
+        self.orders_filled = 0
+
+        self._orders = {}
+        self._bids = []
+        self._asks = []
+        self._order_ids = itertools.count(1)
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def attach(self, order_book_manager):
+        """Makes `order_book_manager` fetch, place and cancel orders on this exchange."""
+        order_book_manager.get_orders_with(self.get_orders)
+        order_book_manager.get_balances_with(self.get_balances)
+        order_book_manager.place_orders_with(lambda new_order: self.place_order(new_order.is_sell, new_order.price,
+                                                                                new_order.pay_amount if new_order.is_sell
+                                                                                else new_order.buy_amount))
+        order_book_manager.cancel_orders_with(lambda order: self.cancel_order(order.order_id))
+
+    def get_orders(self) -> list:
+        """Returns the open orders, bids and asks each in price-time priority."""
+        self._request('get_orders')
+
+        with self._lock:
+            return [entry[-1] for entry in self._bids] + [entry[-1] for entry in self._asks]
+
+    def get_balances(self) -> dict:
+        """Returns the balances available for new orders, i.e. not locked in open orders."""
+        self._request('get_balances')
+
+        with self._lock:
+            return self._free_balances()
+
+    def place_order(self, is_sell: bool, price: Wad, amount: Wad) -> SimulatedOrder:
+        assert(isinstance(is_sell, bool))
+        assert(isinstance(price, Wad))
+        assert(isinstance(amount, Wad))
+
+        self._request('place_order')
+
+        with self._lock:
+            token, locked = (self.base_token, amount) if is_sell else (self.quote_token, amount * price)
+            if amount <= Wad(0) or price <= Wad(0):
+                raise SimulatedExchangeError(f"Invalid order (price: {price}, amount: {amount})")
+            if self._free_balances()[token] < locked:
+                raise SimulatedExchangeError(f"Insufficient {token} balance to place order (price: {price}, amount: {amount})")
+
+            order = SimulatedOrder(str(next(self._order_ids)), self.clock(), self.pair, is_sell, price, amount)
+            self._orders[order.order_id] = order
+            bisect.insort(self._book(order), self._entry(order))
+            self.orders_placed += 1
+
+            return order
+
+    def cancel_order(self, order_id: str) -> bool:
+        assert(isinstance(order_id, str))
+
+        self._request('cancel_order')
+
+        with self._lock:
+            order = self._orders.get(order_id)
+            if order is None:
+                return False
+
+            self._remove(order)
+            self.orders_cancelled += 1
+            return True
+
+    def match(self, market_price: Wad) -> list:
+        """Fills all buy orders priced at or above `market_price` and all sell orders priced at or below it.
+
+        Returns:
+            List of the orders which have been filled, in price-time priority.
+        """
+        assert(isinstance(market_price, Wad))
+
+        with self._lock:
+            filled = [entry[-1] for entry in itertools.takewhile(lambda entry: entry[-1].price >= market_price, self._bids)] + \
+                     [entry[-1] for entry in itertools.takewhile(lambda entry: entry[-1].price <= market_price, self._asks)]
+
+            for order in filled:
+                self._fill(order, order.remaining_amount)
+
+            return filled
+
+    def take(self, is_sell: bool, amount: Wad, limit_price: Optional[Wad] = None) -> list:
+        """Fills our orders with an order of another market participant, in price-time priority.
+
+        A sell (`is_sell`) takes our buy orders, a buy takes our sell orders, until `amount`
+        (in the base token) gets filled or there are no more orders priced within `limit_price`.
+        Orders can get filled partially.
+
+        Returns:
+            List of `(order, filled amount)` tuples.
+        """
+        assert(isinstance(is_sell, bool))
+        assert(isinstance(amount, Wad))
+        assert(isinstance(limit_price, Wad) or (limit_price is None))
+
+        with self._lock:
+            book = self._bids if is_sell else self._asks
+            result = []
+
+            while amount > Wad(0) and len(book) > 0:
+                order = book[0][-1]
+                if limit_price is not None and ((is_sell and order.price < limit_price) or
+                                                (not is_sell and order.price > limit_price)):
+                    break
+
+                filled_amount = Wad.min(amount, order.remaining_amount)
+                self._fill(order, filled_amount)
+                amount -= filled_amount
+                result.append((order, filled_amount))
+
+            return result
+
+    def value(self, price: Wad) -> Wad:
+        """Total value of the balances (including the ones locked in orders), in the quote token."""
+        assert(isinstance(price, Wad))
+
+        with self._lock:
+            return self.balances[self.base_token] * price + self.balances[self.quote_token]
+
+    def initial_value(self, price: Wad) -> Wad:
+        return self.initial_balances[self.base_token] * price + self.initial_balances[self.quote_token]
+
+    def _request(self, name: str):
+        if self.latency > 0:
+            time.sleep(self.latency)
+
+        with self._lock:
+            self.requests += 1
+
+            if self.rate_limit is not None and self.rate_limit.try_acquire() > 0:
+                self.failed_requests += 1
+                raise SimulatedExchangeError(f"Rate limit exceeded ({name})")
+
+            if self.error_rate > 0 and self._random.random() < self.error_rate:
+                self.failed_requests += 1
+                raise SimulatedExchangeError(f"Simulated error ({name})")
+
+    @staticmethod
+    def _entry(order: SimulatedOrder) -> tuple:
+        # Best price first, then the oldest order first. Order ids are increasing, so they break ties.
+        price = order.price.value if order.is_sell else -order.price.value
+        return price, int(order.order_id), order
+
+    def _book(self, order: SimulatedOrder) -> list:
+        return self._asks if order.is_sell else self._bids
+
+    def _remove(self, order: SimulatedOrder):
+        # Has to be called with `self._lock` held.
+        book = self._book(order)
+        entry = self._entry(order)
+        del book[bisect.bisect_left(book, entry[:2])]
+        del self._orders[order.order_id]
+
+    def _fill(self, order: SimulatedOrder, amount: Wad):
+        # Has to be called with `self._lock` held.
+        if order.is_sell:
+            self.balances[self.base_token] -= amount
+            self.balances[self.quote_token] += amount * order.price
+        else:
+            self.balances[self.base_token] += amount
+            self.balances[self.quote_token] -= amount * order.price
+
+        order.filled_amount += amount
+        if order.remaining_amount <= Wad(0):
+            self._remove(order)
+            self.orders_filled += 1
+
+    def _free_balances(self) -> dict:
+        # Has to be called with `self._lock` held.
+        free = dict(self.balances)
+        for order in self._orders.values():
+            if order.is_sell:
+                free[self.base_token] -= order.remaining_amount
+            else:
+                free[self.quote_token] -= order.remaining_amount * order.price
+
+        return free
@@ -0,0 +1,230 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2018 reverendus
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import logging
+import threading
+import time
+from concurrent.futures import Future
+from typing import Optional
+
+from web3 import Web3
+
+from market_maker_keeper.chain_state import JsonRpcBatch, to_int
+from pymaker import Address, Receipt, Transact
+from pymaker.gas import GasPrice
+
+
+class PendingTransaction:
+    """Transaction sent by the `TransactionPipeline`, waiting to get mined.
+
+    Attributes:
+        transact: The transaction.
+        nonce: Nonce the transaction (and all its replacements) has been sent with.
+        tx: Parameters the transaction has been sent with, apart from the nonce and the gas price.
+        future: Future which gets resolved with the `Receipt`, or with `None` if the transaction failed.
+    """
+
+    def __init__(self, transact: Transact, nonce: int, tx: dict, future: Future):
+        self.transact = transact
+        self.nonce = nonce
+        self.tx = tx
+        self.future = future
+        self.gas_price = tx['gasPrice']
+        self.tx_hashes = []
+        self.started_at = time.time()
+        self.nonce_used_polls = 0
+
+    def name(self) -> str:
+        return f"{self.transact.name()} with nonce={self.nonce}"
+
+
+class TransactionPipeline:
+    """Sends transactions without waiting for one to get mined before sending the next one.
+
+    Nonces are assigned locally and in order (never lower than the node's pending transaction count,
+    so it recovers from transactions sent by other means), which means any number of threads can submit
+    transactions at the same time without racing each other for a nonce. Waiting for receipts happens
+    on a single background thread, which asks the node about all pending transactions in one
+    JSON-RPC batch request per poll.
+
+    Transactions which do not get mined quickly enough get replaced (same nonce, higher gas price)
+    following the `gas_price` strategy, the same way `pymaker` does it for a single transaction.
+
+    Attributes:
+        web3: Web3 instance to send the transactions through.
+        our_address: Account to send the transactions from.
+        gas_price: Gas price strategy, usually the keeper `SmartGasPrice`.
+        poll_interval: Frequency of checking for receipts (in seconds).
+        gas_buffer: Amount of gas to add to the estimate.
+    """
+
+    logger = logging.getLogger()
+
+    # nodes do not accept a replacement transaction unless its gas price is higher by at least 10% (geth)
+    # or 12.5% (parity), so we always go for the latter
+    MIN_GAS_PRICE_BUMP = 1.125
+
+    # number of polls after which a transaction whose nonce has been used by another one is considered failed
+    NONCE_USED_POLLS = 3
+
+    def __init__(self, web3: Web3, our_address: Address, gas_price: GasPrice, poll_interval: float = 1.0, gas_buffer: int = 100000):
+        assert(isinstance(web3, Web3))
+        assert(isinstance(our_address, Address))
+        assert(isinstance(gas_price, GasPrice))
+        assert(isinstance(poll_interval, float) or isinstance(poll_interval, int))
+        assert(isinstance(gas_buffer, int))
+
+        self.web3 = web3
+        self.our_address = our_address
+        self.gas_price = gas_price
+        self.poll_interval = poll_interval
+        self.gas_buffer = gas_buffer
+
+        self._nonce_lock = threading.Lock()
+        self._next_nonce = 0
+        self._lock = threading.Lock()
+        self._pending = []
+        self._thread = None
+
+    def submit(self, transact: Transact) -> Future:
+        """Sends a transaction. Returns a future resolved with its `Receipt` (or `None` if it failed)."""
+        assert(isinstance(transact, Transact))
+
+        future = Future()
+
+        try:
+            # gas estimation is the slow part, it can happen concurrently for all transactions being submitted
+            tx = {'from': self.our_address.address,
+                  'to': transact.address.address,
+                  'data': transact.contract.encodeABI(fn_name=transact.function_name, args=transact.parameters),
+                  'value': (transact.extra or {}).get('value', 0),
+                  'gas': transact.estimated_gas(self.our_address) + self.gas_buffer,
+                  'gasPrice': self._gas_price(0)}
+
+            with self._nonce_lock:
+                nonce = max(self._next_nonce, self.web3.eth.getTransactionCount(self.our_address.address, 'pending'))
+                pending_transaction = PendingTransaction(transact, nonce, tx, future)
+                self._send(pending_transaction)
+                self._next_nonce = nonce + 1
+
+        except Exception as e:
+            self.logger.warning(f"Failed to send {transact.name()}: {e}")
+            future.set_result(None)
+            return future
+
+        with self._lock:
+            self._pending.append(pending_transaction)
+
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._poll_forever, daemon=True)
+                self._thread.start()
+
+        return future
+
+    def transact(self, transact: Transact) -> Optional[Receipt]:
+        """Sends a transaction and waits for it to get mined."""
+        return self.submit(transact).result()
+
+    def pending(self) -> int:
+        with self._lock:
+            return len(self._pending)
+
+    def _gas_price(self, time_elapsed: int) -> int:
+        gas_price = self.gas_price.get_gas_price(time_elapsed)
+        return gas_price if gas_price is not None else self.web3.eth.gasPrice
+
+    def _send(self, pending_transaction: PendingTransaction):
+        tx = dict(pending_transaction.tx, nonce=pending_transaction.nonce, gasPrice=pending_transaction.gas_price)
+        tx_hash = self.web3.eth.sendTransaction(tx)
+        tx_hash = tx_hash if isinstance(tx_hash, str) else '0x' + bytes(tx_hash).hex()
+
+        pending_transaction.tx_hashes.append(tx_hash)
+        self.logger.info(f"Sent transaction {pending_transaction.name()}, gas_price={pending_transaction.gas_price},"
+                         f" tx_hash={tx_hash}")
+
+    def _poll_forever(self):
+        while True:
+            time.sleep(self.poll_interval)
+
+            try:
+                self._poll()
+            except Exception as e:
+                self.logger.warning(f"Failed to poll for transaction receipts: {e}")
+
+    def _poll(self):
+        with self._lock:
+            pending = list(self._pending)
+
+        if len(pending) == 0:
+            return
+
+        # one batch request for the receipts of all the transactions (and their replacements)
+        batch = JsonRpcBatch(self.web3)
+        nonce_index = batch.add('eth_getTransactionCount', [self.our_address.address, 'latest'])
+        receipt_indices = [[batch.add('eth_getTransactionReceipt', [tx_hash]) for tx_hash in pending_transaction.tx_hashes]
+                           for pending_transaction in pending]
+        results = batch.execute()
+        mined_nonce = to_int(results[nonce_index])
+
+        for pending_transaction, indices in zip(pending, receipt_indices):
+            mined_hashes = [pending_transaction.tx_hashes[number] for number, index in enumerate(indices)
+                            if results[index] is not None and results[index]['blockNumber'] is not None]
+
+            if len(mined_hashes) > 0:
+                self._complete(pending_transaction, self.web3.eth.getTransactionReceipt(mined_hashes[0]))
+
+            elif mined_nonce > pending_transaction.nonce:
+                # the receipt of a just mined transaction may not be available yet, so give it a few polls
+                pending_transaction.nonce_used_polls += 1
+                if pending_transaction.nonce_used_polls >= self.NONCE_USED_POLLS:
+                    self.logger.warning(f"Nonce of transaction {pending_transaction.name()} has been used by another transaction")
+                    self._complete(pending_transaction, None)
+
+            else:
+                self._replace_if_needed(pending_transaction)
+
+    def _replace_if_needed(self, pending_transaction: PendingTransaction):
+        # with the node default gas price there is nothing to escalate
+        gas_price = self.gas_price.get_gas_price(int(time.time() - pending_transaction.started_at))
+        if gas_price is not None and gas_price >= pending_transaction.gas_price * self.MIN_GAS_PRICE_BUMP:
+            pending_transaction.gas_price = gas_price
+
+            try:
+                self._send(pending_transaction)
+            except Exception as e:
+                self.logger.warning(f"Failed to replace transaction {pending_transaction.name()}: {e}")
+
+    def _complete(self, pending_transaction: PendingTransaction, raw_receipt):
+        with self._lock:
+            self._pending.remove(pending_transaction)
+
+        if raw_receipt is None:
+            pending_transaction.future.set_result(None)
+            return
+
+        receipt = Receipt(raw_receipt)
+        if receipt.successful and pending_transaction.transact.result_function is not None:
+            try:
+                receipt.result = pending_transaction.transact.result_function(receipt)
+            except Exception as e:
+                self.logger.warning(f"Failed to read the result of transaction {pending_transaction.name()}: {e}")
+
+        self.logger.info(f"Transaction {pending_transaction.name()} was successful (tx_hash={receipt.transaction_hash})"
+                         if receipt.successful else
+                         f"Transaction {pending_transaction.name()} failed (tx_hash={receipt.transaction_hash})")
+
+        pending_transaction.future.set_result(receipt)
@@ -0,0 +1,290 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2017-2018 reverendus
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from typing import Optional, Tuple
+
+import numpy as np
+
+from market_maker_keeper.band import Bands
+from market_maker_keeper.limit import SideLimits
+from pymaker.numeric import Wad
+
+
+class WadArray:
+    """Exact vectorized representation of a list of `Wad` values.
+
+    `Wad` values do not fit in `int64`, so each of them is split into three 32-bit limbs kept
+    in separate `int64` arrays. This way values up to `2**96` (roughly 79 billion tokens)
+    can be compared, sorted and summed with NumPy without any loss of precision.
+
+    Attributes:
+        limbs: A `(3, n)` array of the most, middle and least significant limbs.
+    """
+
+    LIMB_BITS = 32
+    LIMB_MASK = (1 << 32) - 1
+    LIMIT = 1 << 96
+
+    def __init__(self, limbs: np.ndarray):
+        assert(isinstance(limbs, np.ndarray))
+
+        self.limbs = limbs
+
+    @staticmethod
+    def from_values(values: list) -> Optional['WadArray']:
+        """Creates a `WadArray` from `Wad.value` integers, or returns `None` if any of them does not fit."""
+        assert(isinstance(values, list))
+
+        if not all(type(value) is int and 0 <= value < WadArray.LIMIT for value in values):
+            return None
+
+        limbs = np.empty((3, len(values)), dtype=np.int64)
+        limbs[0] = [value >> 64 for value in values]
+        limbs[1] = [(value >> 32) & WadArray.LIMB_MASK for value in values]
+        limbs[2] = [value & WadArray.LIMB_MASK for value in values]
+
+        return WadArray(limbs)
+
+    def __len__(self) -> int:
+        return self.limbs.shape[1]
+
+    def take(self, indices: np.ndarray) -> 'WadArray':
+        return WadArray(self.limbs[:, indices])
+
+    def greater_than(self, value: int) -> np.ndarray:
+        """Returns a boolean mask of the elements greater than `value`."""
+        assert(isinstance(value, int))
+
+        if value < 0:
+            return np.ones(len(self), dtype=bool)
+
+        if value >= self.LIMIT:
+            return np.zeros(len(self), dtype=bool)
+
+        high, middle, low = self.limbs
+        value_high, value_middle, value_low = value >> 64, (value >> 32) & self.LIMB_MASK, value & self.LIMB_MASK
+
+        return (high > value_high) | ((high == value_high) & ((middle > value_middle) |
+                                                              ((middle == value_middle) & (low > value_low))))
+
+    def argsort(self, descending: bool) -> np.ndarray:
+        """Returns indices sorting the elements, keeping the original order of equal elements (like `sorted()`)."""
+        high, middle, low = self.limbs
+
+        if descending:
+            return np.lexsort((-low, -middle, -high))
+        else:
+            return np.lexsort((low, middle, high))
+
+    def cumulative_sum(self) -> 'WadArray':
+        """Returns running totals of the elements. Exact for up to `2**31` elements."""
+        high, middle, low = np.cumsum(self.limbs, axis=1)
+
+        carry = low >> self.LIMB_BITS
+        low = low & self.LIMB_MASK
+        middle = middle + carry
+
+        carry = middle >> self.LIMB_BITS
+        middle = middle & self.LIMB_MASK
+        high = high + carry
+
+        return WadArray(np.array([high, middle, low]))
+
+    def sum(self) -> int:
+        """Returns the total of the elements as an integer. Exact for up to `2**31` elements."""
+        high, middle, low = self.limbs.sum(axis=1)
+
+        return (int(high) << 64) + (int(middle) << 32) + int(low)
+
+
+class VectorizedOrders:
+    """Orders on one side of the book, loaded into NumPy arrays and assigned to bands.
+
+    Attributes:
+        orders: The orders.
+        prices: `WadArray` of order prices, as seen by the bands.
+        band_indices: Index of the band each order belongs to, `-1` for orders outside all bands.
+    """
+
+    def __init__(self, orders: list, prices: WadArray, band_indices: np.ndarray):
+        assert(isinstance(orders, list))
+        assert(isinstance(prices, WadArray))
+        assert(isinstance(band_indices, np.ndarray))
+
+        self.orders = orders
+        self.prices = prices
+        self.band_indices = band_indices
+
+        self._amounts = {}
+
+    def amounts(self, amount: str) -> Optional[WadArray]:
+        """Returns `WadArray` of order `amount`s (`remaining_sell_amount` or `remaining_buy_amount`).
+
+        Amounts are loaded on first use, `None` is returned if any of them can not be represented.
+        """
+        if amount not in self._amounts:
+            self._amounts[amount] = WadArray.from_values([getattr(order, amount).value for order in self.orders])
+
+        return self._amounts[amount]
+
+    def indices_in_band(self, band_index: int) -> np.ndarray:
+        return np.flatnonzero(self.band_indices == band_index)
+
+
+class VectorizedBands(Bands):
+    """`Bands` evaluated with vectorized NumPy operations, for keepers maintaining thousands of orders.
+
+    Order prices and amounts are loaded into `WadArray`s once per side and keeper cycle. Band membership,
+    band totals and the selection of excessive orders are then calculated for all orders at once instead of
+    with per-order `Wad` arithmetic. All values are represented exactly, so the orders to cancel and the
+    new orders to place are exactly the same as the ones calculated by `Bands`. Sides having orders which
+    do not fit in a `WadArray` get calculated by `Bands` itself.
+
+    `VectorizedBands.read()` can be used everywhere `Bands.read()` is used.
+    """
+
+    def __init__(self, buy_bands: list, buy_limits: SideLimits, sell_bands: list, sell_limits: SideLimits):
+        super().__init__(buy_bands=buy_bands, buy_limits=buy_limits, sell_bands=sell_bands, sell_limits=sell_limits)
+
+        self._vectorized_orders = {}
+
+    def _vectorize(self, orders: list, bands: list, target_price: Wad) -> Optional[VectorizedOrders]:
+        """Loads orders into NumPy arrays and assigns them to bands.
+
+        The result is cached in the same way as in `_assign_orders()`.
+        """
+        assert(isinstance(orders, list))
+        assert(isinstance(bands, list))
+        assert(isinstance(target_price, Wad))
+
+        cached = self._vectorized_orders.get(id(bands))
+        if cached is not None:
+            cached_bands, cached_target_price, cached_orders, cached_result = cached
+            if cached_bands is bands \
+                    and cached_target_price == target_price \
+                    and len(cached_orders) == len(orders) \
+                    and all(cached_order is order for cached_order, order in zip(cached_orders, orders)):
+                return cached_result
+
+        if len(bands) > 0:
+            prices = WadArray.from_values([bands[0].order_price(order).value for order in orders])
+        else:
+            prices = WadArray.from_values([])
+
+        if prices is not None:
+            band_indices = np.full(len(orders), -1, dtype=np.int64)
+            for index, band in enumerate(bands):
+                lower, upper = band.boundaries(target_price)
+                band_indices[prices.greater_than(lower.value) & ~prices.greater_than(upper.value)] = index
+
+            result = VectorizedOrders(orders, prices, band_indices)
+        else:
+            result = None
+
+        self._vectorized_orders[id(bands)] = (bands, target_price, tuple(orders), result)
+
+        return result
+
+    def _assign_orders(self, orders: list, bands: list, target_price: Wad) -> Tuple[list, list]:
+        vectorized_orders = self._vectorize(orders, bands, target_price)
+        if vectorized_orders is None:
+            return super()._assign_orders(orders, bands, target_price)
+
+        orders_in_bands = [[orders[index] for index in vectorized_orders.indices_in_band(band_index)]
+                           for band_index in range(len(bands))]
+        orders_outside_bands = [orders[index] for index in vectorized_orders.indices_in_band(-1)]
+
+        return orders_in_bands, orders_outside_bands
+
+    def _total_amounts(self, orders: list, bands: list, target_price: Wad, amount: str) -> list:
+        vectorized_orders = self._vectorize(orders, bands, target_price)
+        amounts = vectorized_orders.amounts(amount) if vectorized_orders is not None else None
+        if amounts is None:
+            return super()._total_amounts(orders, bands, target_price, amount)
+
+        return [Wad(amounts.take(vectorized_orders.indices_in_band(band_index)).sum())
+                for band_index in range(len(bands))]
+
+    def _excessive_sell_orders(self, our_sell_orders: list, target_price: Wad):
+        return self._excessive_orders(our_sell_orders, self.sell_bands, target_price)
+
+    def _excessive_buy_orders(self, our_buy_orders: list, target_price: Wad):
+        return self._excessive_orders(our_buy_orders, self.buy_bands, target_price)
+
+    def _excessive_orders(self, orders: list, bands: list, target_price: Wad):
+        """Return orders which need to be cancelled to bring total amounts within all `bands` below maximums.
+
+        Follows `Band.excessive_orders()`: orders in each band get sorted and then the longest prefix
+        of them which does not exceed the maximum band amount is kept, all remaining orders get cancelled.
+        """
+        assert(isinstance(orders, list))
+        assert(isinstance(bands, list))
+        assert(isinstance(target_price, Wad))
+
+        vectorized_orders = self._vectorize(orders, bands, target_price)
+        amounts = vectorized_orders.amounts('remaining_sell_amount') if vectorized_orders is not None else None
+
+        for band_index, band in enumerate(bands):
+            if amounts is None:
+                orders_in_band, _ = super()._assign_orders(orders, bands, target_price)
+                yield from band.excessive_orders(orders_in_band[band_index], target_price, band == bands[0], band == bands[-1])
+                continue
+
+            indices = vectorized_orders.indices_in_band(band_index)
+            band_amounts = amounts.take(indices)
+            orders_total = band_amounts.sum()
+            if orders_total <= band.max_amount.value:
+                continue
+
+            orders_in_band = [orders[index] for index in indices]
+            sorting = self._excessive_orders_sorting(vectorized_orders.prices.take(indices), band_amounts, band, target_price,
+                                                     band == bands[0], band == bands[-1])
+            if sorting is None:
+                yield from band.excessive_orders(orders_in_band, target_price, band == bands[0], band == bands[-1])
+                continue
+
+            # Amounts are never negative, so running totals only grow and orders can be removed
+            # from the end until the total amount stops being greater than `maxAmount` at once.
+            orders_to_leave_count = np.count_nonzero(~band_amounts.take(sorting).cumulative_sum().greater_than(band.max_amount.value))
+            orders_to_leave = [orders_in_band[index] for index in sorting[:orders_to_leave_count]]
+
+            result = set(orders_in_band) - set(orders_to_leave)
+            band._log_excessive_orders(Wad(orders_total), result)
+
+            yield from result
+
+    @staticmethod
+    def _excessive_orders_sorting(prices: WadArray, amounts: WadArray, band, target_price: Wad,
+                                  is_first_band: bool, is_last_band: bool) -> Optional[np.ndarray]:
+        """Return the order in which `Band.excessive_orders()` sorts orders in a band, or `None` if it can not be vectorized.
+
+        The first and the last band sort orders by their distance from `target_price`. As long as the band lies
+        entirely on one side of `target_price`, sorting by distance is the same as sorting by price.
+        """
+        if is_first_band or is_last_band:
+            lower, upper = band.boundaries(target_price)
+            if upper <= target_price:
+                prices_descending = is_last_band and not is_first_band
+            elif lower >= target_price:
+                prices_descending = is_first_band
+            else:
+                return None
+
+            return prices.argsort(descending=prices_descending)
+
+        else:
+            return amounts.argsort(descending=True)
@@ -0,0 +1,304 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2017-2018 reverendus
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import json
+import logging
+import threading
+import time
+from base64 import b64encode
+from typing import Optional
+from urllib.parse import urlparse
+
+import websocket
+
+from market_maker_keeper.capture import CaptureWriter
+from market_maker_keeper.decoding import MessageDecoder
+from market_maker_keeper.util import sanitize_url
+
+
+class WebSocketSubscription:
+    """One logical subscription on a `WebSocketConnection`.
+
+    The subscription receives the messages of the channels listed in the `args` of its `open_event`
+    (i.e. `{"op": "subscribe", "args": ["spot/ticker:ETH-USDT"]}`), with `data` narrowed down to the
+    entries of these channels. A subscription without an `open_event`, or with one the channels can
+    not be read from, receives all messages with `data`. Messages without a `table` can not be routed
+    to channels, so they get passed to every subscription.
+
+    Attributes:
+        open_event: Message sent to the server every time the connection opens, `None` if there is none.
+        on_message: Function called with every message routed to this subscription, as a dictionary.
+        source: Name of the subscription in capture files, see `CaptureWriter`.
+    """
+
+    def __init__(self, open_event: Optional[str], on_message, source: str = ''):
+        assert(isinstance(open_event, str) or (open_event is None))
+        assert(callable(on_message))
+        assert(isinstance(source, str))
+
+        self.open_event = open_event
+        self.on_message = on_message
+        self.source = source
+        self.channels = self._read_channels(open_event)
+        self.tables = {channel.split(':')[0] for channel in self.channels} if self.channels is not None else None
+
+    @staticmethod
+    def _read_channels(open_event: Optional[str]) -> Optional[set]:
+        try:
+            args = json.loads(open_event)['args']
+            return set(args) if isinstance(args, list) and len(args) > 0 else None
+        except:
+            return None
+
+    def route(self, message: dict) -> Optional[dict]:
+        """Returns the part of `message` this subscription is interested in, or `None` if there is none."""
+        if self.channels is None:
+            return message
+
+        if 'table' not in message:
+            return message
+
+        table = message['table']
+        if table not in self.tables:
+            return None
+
+        data = [entry for entry in message['data']
+                if not isinstance(entry, dict) or 'instrument_id' not in entry
+                or f"{table}:{entry['instrument_id']}" in self.channels]
+
+        if len(data) == 0:
+            return None
+        elif len(data) == len(message['data']):
+            return message
+        else:
+            return {**message, 'data': data}
+
+
+class WebSocketConnection:
+    """A WebSocket connection shared by all subscriptions to the same endpoint.
+
+    The connection is kept open by one background thread, which reconnects with an exponential
+    backoff (starting at `reconnect_delay` seconds, up to `max_reconnect_delay` seconds) and takes
+    care of pings. Every time the connection opens, the `open_event` of each subscription gets sent
+    (once, even if many subscriptions share it). Each message gets decompressed and decoded only once,
+    by `decoder`, then routed to the subscriptions interested in it. See `WebSocketSubscription`.
+
+    Attributes:
+        ws_url: Address of the WebSocket endpoint.
+        reconnect_delay: Initial delay (in seconds) before reconnecting after the connection got closed.
+        max_reconnect_delay: Maximum delay (in seconds) before reconnecting.
+        decoder: The `MessageDecoder` turning frames into dictionaries.
+        capture: The `CaptureWriter` recording messages routed to the subscriptions, `None` if they are not recorded.
+    """
+
+    logger = logging.getLogger()
+
+    def __init__(self, ws_url: str, reconnect_delay: int, max_reconnect_delay: int = 60,
+                 decoder: Optional[MessageDecoder] = None):
+        assert(isinstance(ws_url, str))
+        assert(isinstance(reconnect_delay, int))
+        assert(isinstance(max_reconnect_delay, int))
+        assert(isinstance(decoder, MessageDecoder) or (decoder is None))
+
+        self.ws_url = ws_url
+        self.reconnect_delay = reconnect_delay
+        self.max_reconnect_delay = max(reconnect_delay, max_reconnect_delay)
+        self.decoder = decoder if decoder is not None else MessageDecoder()
+        self.capture = None
+
+        self._header = self._get_header(self.ws_url)
+        self._sanitized_url = sanitize_url(self.ws_url)
+        self._lock = threading.Lock()
+        self._subscriptions = []
+        self._ws = None
+        self._connected = False
+        self._thread = None
+
+    @staticmethod
+    def _get_header(ws_url: str):
+        parsed_url = urlparse(ws_url)
+
+        if parsed_url.username is not None and parsed_url.password is not None:
+            basic_header = b64encode(bytes(parsed_url.username + ":" + parsed_url.password, "utf-8")).decode("utf-8")
+            return ["Authorization: Basic %s" % basic_header]
+        return None
+
+    def subscribe(self, subscription: WebSocketSubscription):
+        """Adds a subscription, sending its `open_event` straight away if the connection is already open."""
+        assert(isinstance(subscription, WebSocketSubscription))
+
+        with self._lock:
+            already_sent = subscription.open_event in self._open_events()
+            self._subscriptions.append(subscription)
+            ws = self._ws if self._connected else None
+
+        if ws is not None and subscription.open_event and not already_sent:
+            self._send(ws, subscription.open_event)
+
+    def start(self):
+        """Starts the background thread keeping the connection open, unless it has been started already."""
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._background_run, daemon=True)
+                self._thread.start()
+
+    def _open_events(self) -> list:
+        return list(dict.fromkeys(subscription.open_event for subscription in self._subscriptions
+                                  if subscription.open_event))
+
+    def _background_run(self):
+        delay = self.reconnect_delay
+        while True:
+            ws = websocket.WebSocketApp(url=self.ws_url,
+                                        header=self._header,
+                                        on_message=self._on_message,
+                                        on_error=self._on_error,
+                                        on_open=self._on_open,
+                                        on_close=self._on_close)
+            ws.run_forever(ping_interval=15, ping_timeout=10)
+
+            # back off only if the connection could not be established, not after a regular disconnection
+            with self._lock:
+                was_connected = self._connected
+                self._connected = False
+                self._ws = None
+
+            delay = self.reconnect_delay if was_connected else min(delay * 2, self.max_reconnect_delay)
+            time.sleep(delay)
+
+    def _on_open(self, ws):
+        self.logger.info(f"WebSocket '{self._sanitized_url}' connected")
+
+        with self._lock:
+            self._ws = ws
+            self._connected = True
+            open_events = self._open_events()
+
+        for open_event in open_events:
+            self._send(ws, open_event)
+
+    def _send(self, ws, open_event: str):
+        try:
+            ws.send(open_event)
+            self.logger.info(f"WebSocket '{self._sanitized_url}' sent {open_event}")
+        except Exception as e:
+            self.logger.warning(f"WebSocket '{self._sanitized_url}' failed to send {open_event} ({e})")
+
+    def _on_close(self, ws):
+        self.logger.info(f"WebSocket '{self._sanitized_url}' disconnected")
+
+    def _on_error(self, ws, error):
+        self.logger.info(f"WebSocket '{self._sanitized_url}' error: '{error}'")
+
+    def _on_message(self, ws, message):
+        try:
+            message_dict = self.decoder.decode(message)
+        except:
+            self.logger.warning(f"WebSocket '{self._sanitized_url}' received invalid message: '{message}'")
+            return
+
+        if not isinstance(message_dict, dict) or 'data' not in message_dict:
+            self.logger.debug(f"ReceivedMsg '{message_dict}', do nothing")
+            return
+
+        # formatting the message is expensive, so it only happens if it is going to be logged
+        if self.logger.isEnabledFor(logging.DEBUG):
+            self.logger.debug(f"WebSocket '{self._sanitized_url}' received message: '{message_dict}'")
+
+        with self._lock:
+            subscriptions = list(self._subscriptions)
+
+        receive_time = time.time()
+        captured_sources = set()
+
+        for subscription in subscriptions:
+            try:
+                routed_message = subscription.route(message_dict)
+                if routed_message is None:
+                    continue
+
+                if self.capture is not None and subscription.source not in captured_sources:
+                    self.capture.write(subscription.source, routed_message, receive_time)
+                    captured_sources.add(subscription.source)
+
+                subscription.on_message(routed_message)
+            except Exception as e:
+                self.logger.warning(f"WebSocket '{self._sanitized_url}' failed to process message: '{message_dict}' ({e})")
+
+
+class WebSocketConnectionManager:
+    """Hands out one `WebSocketConnection` per endpoint, so all feeds of a process pointing to the same
+    endpoint share one socket and one background thread.
+
+    Attributes:
+        json_backend: Name of the JSON library the connections decode messages with, see `json_backend()`.
+    """
+
+    _default = None
+    _default_lock = threading.Lock()
+
+    def __init__(self, json_backend: Optional[str] = None):
+        self.json_backend = json_backend
+        self.capture = None
+        self._connections = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def default(cls) -> 'WebSocketConnectionManager':
+        with cls._default_lock:
+            if cls._default is None:
+                cls._default = cls()
+
+            return cls._default
+
+    def capture_with(self, capture: CaptureWriter):
+        """Records all messages received by the subscriptions of all connections, see `CaptureWriter`."""
+        assert(isinstance(capture, CaptureWriter))
+
+        with self._lock:
+            self.capture = capture
+            for connection in self._connections.values():
+                connection.capture = capture
+
+    def connection(self, ws_url: str, reconnect_delay: int) -> WebSocketConnection:
+        """Returns the connection to `ws_url`, creating and starting it if it does not exist yet."""
+        assert(isinstance(ws_url, str))
+        assert(isinstance(reconnect_delay, int))
+
+        with self._lock:
+            if ws_url not in self._connections:
+                self._connections[ws_url] = WebSocketConnection(ws_url, reconnect_delay,
+                                                                decoder=MessageDecoder(self.json_backend))
+                self._connections[ws_url].capture = self.capture
+
+            connection = self._connections[ws_url]
+
+        connection.start()
+        return connection
+
+    def subscribe(self, ws_url: str, open_event: Optional[str], on_message, reconnect_delay: int = 5) -> WebSocketConnection:
+        """Subscribes `on_message` to `open_event` on the shared connection to `ws_url`."""
+        connection = self.connection(ws_url, reconnect_delay)
+        connection.subscribe(WebSocketSubscription(open_event, on_message, source=capture_source(ws_url, open_event)))
+
+        return connection
+
+
+def capture_source(ws_url: str, open_event: Optional[str]) -> str:
+    """Name of a subscription in capture files: its address (without credentials), followed by `#` and
+    the `open_event` if there is one. Same as the argument the feed has been configured with."""
+    return sanitize_url(ws_url) + (f"#{open_event}" if open_event else '')
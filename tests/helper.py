@@ -17,7 +17,13 @@
 
 import sys
 from contextlib import contextmanager
+from http.server import HTTPServer
 from io import StringIO
+from socketserver import ThreadingMixIn
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
 
 
 def args(arguments: str) -> list:
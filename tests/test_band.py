@@ -15,9 +15,11 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
-from market_maker_keeper.band import Bands
+import random
+
+from market_maker_keeper.band import Bands, BuyBand, SellBand
 from market_maker_keeper.feed import EmptyFeed, FixedFeed
-from market_maker_keeper.limit import History
+from market_maker_keeper.limit import History, SideLimits, SideHistory
 from market_maker_keeper.price_feed import Price
 from market_maker_keeper.reloadable_config import ReloadableConfig
 from tests.band_config import BandConfig
@@ -25,9 +27,10 @@ from pymaker.numeric import Wad
 
 
 class FakeOrder:
-    def __init__(self, amount: Wad, price: Wad):
+    def __init__(self, amount: Wad, price: Wad, order_id: int = None):
         self.amount = amount
         self.price = price
+        self.order_id = order_id
 
     @property
     def sell_to_buy_price(self) -> Wad:
@@ -161,6 +164,110 @@ class TestBands:
         # then
         assert(orders_to_cancel == [buy_order, sell_order])
 
+    def test_should_assign_orders_to_the_same_bands_as_band_includes(self):
+        # given
+        def band_dict(min_margin: float, max_margin: float) -> dict:
+            return {'minMargin': min_margin, 'avgMargin': (min_margin + max_margin) / 2, 'maxMargin': max_margin,
+                    'minAmount': 1, 'avgAmount': 2, 'maxAmount': 3, 'dustCutoff': 0}
+
+        margins = [0.005 * i for i in range(0, 21)]
+        buy_bands = [BuyBand(band_dict(margins[i], margins[i+1])) for i in range(0, 20)]
+        sell_bands = [SellBand(band_dict(margins[i], margins[i+1])) for i in range(0, 20)]
+        bands = Bands(buy_bands, SideLimits([], SideHistory()), sell_bands, SideLimits([], SideHistory()))
+
+        # and
+        target_price = Wad.from_number(100)
+        orders = [FakeOrder(Wad.from_number(1), Wad.from_number(random.choice([round(random.uniform(85, 115), 2),
+                                                                                 float(random.choice(margins)) * 100 + 100,
+                                                                                 100 - float(random.choice(margins)) * 100])))
+                  for _ in range(0, 500)]
+
+        for side_bands in [buy_bands, sell_bands]:
+            # when
+            orders_in_bands, orders_outside_bands = bands._assign_orders(orders, side_bands, target_price)
+
+            # then
+            for band, orders_in_band in zip(side_bands, orders_in_bands):
+                assert orders_in_band == [order for order in orders if band.includes(order, target_price)]
+
+            assert orders_outside_bands == [order for order in orders
+                                            if not any(band.includes(order, target_price) for band in side_bands)]
+
+    def test_should_replace_orders_leaving_bands_in_one_reconciliation(self, tmpdir):
+        # given
+        config = BandConfig.sample_config(tmpdir)
+        bands = self.create_bands(config)
+
+        # and
+        sell_order = FakeOrder(Wad.from_number(7.5), Wad.from_number(208), order_id=1)
+
+        # when
+        price = Price(buy_price=None, sell_price=Wad.from_number(220))
+        reconciliation = bands.reconcile([], [sell_order], Wad(0), Wad(0), price)
+
+        # then
+        assert(reconciliation.cancellations == [sell_order])
+        assert(reconciliation.new_orders == [])
+        assert(len(reconciliation.orders_after_cancellations) == 1)
+        assert(reconciliation.orders_after_cancellations[0].is_sell is True)
+        assert(reconciliation.orders_after_cancellations[0].price == Wad.from_number(228.8))
+        assert(Wad(0) < reconciliation.orders_after_cancellations[0].pay_amount <= Wad.from_number(7.5))
+
+    def test_should_place_new_orders_straight_away_if_the_balance_covers_them(self, tmpdir):
+        # given
+        config = BandConfig.sample_config(tmpdir)
+        bands = self.create_bands(config)
+
+        # and
+        sell_order = FakeOrder(Wad.from_number(7.5), Wad.from_number(208), order_id=1)
+
+        # when
+        price = Price(buy_price=None, sell_price=Wad.from_number(220))
+        reconciliation = bands.reconcile([], [sell_order], Wad(0), Wad.from_number(100), price)
+
+        # then
+        assert(reconciliation.cancellations == [sell_order])
+        assert(len(reconciliation.new_orders) == 1)
+        assert(reconciliation.orders_after_cancellations == [])
+
+    def test_should_keep_orders_within_bands_in_reconciliation(self, tmpdir):
+        # given
+        config = BandConfig.sample_config(tmpdir)
+        bands = self.create_bands(config)
+
+        # and
+        sell_order = FakeOrder(Wad.from_number(7.5), Wad.from_number(208), order_id=1)
+
+        # when
+        price = Price(buy_price=None, sell_price=Wad.from_number(200))
+        reconciliation = bands.reconcile([], [sell_order], Wad(0), Wad.from_number(100), price)
+
+        # then
+        assert(reconciliation.cancellations == [])
+        assert(reconciliation.new_orders == [])
+
+    def test_should_only_cancel_in_reconciliation_if_asked_to(self, tmpdir):
+        # given
+        config = BandConfig.sample_config(tmpdir)
+        bands = self.create_bands(config)
+
+        # and
+        sell_order = FakeOrder(Wad.from_number(7.5), Wad.from_number(208), order_id=1)
+        price = Price(buy_price=None, sell_price=Wad.from_number(220))
+
+        # when
+        reconciliation = bands.reconcile([], [sell_order], Wad(0), Wad(0), price, place_new_orders=False)
+        # then
+        assert(reconciliation.cancellations == [sell_order])
+        assert(reconciliation.new_orders == [])
+
+        # when
+        reconciliation = bands.reconcile([], [sell_order], Wad(0), Wad(0), price, reuse_cancelled_balances=False)
+        # then
+        assert(reconciliation.cancellations == [sell_order])
+        assert(reconciliation.new_orders == [])
+        assert(reconciliation.missing_sell_amount == Wad.from_number(7.5))
+
     @staticmethod
     def create_bands(config_file):
         config = ReloadableConfig(str(config_file))
@@ -0,0 +1,96 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2017-2018 reverendus
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from market_maker_keeper.capture import CaptureWriter, read_capture
+from market_maker_keeper.websocket_connection import WebSocketConnection, WebSocketSubscription
+from tests.test_websocket_connection import deflate, subscribe_event, ticker
+
+
+class TestCapture:
+    def test_should_read_what_has_been_written(self, tmpdir):
+        # given
+        filename = str(tmpdir.join("capture.gz"))
+        capture = CaptureWriter(filename)
+
+        # when
+        capture.write('ws://feed1', {'data': [1]}, 1000.5)
+        capture.write('ws://feed2', {'data': [2]}, 1001.0)
+        capture.close()
+
+        # then
+        assert [(record.time, record.source, record.message) for record in read_capture(filename)] == \
+               [(1000.5, 'ws://feed1', {'data': [1]}), (1001.0, 'ws://feed2', {'data': [2]})]
+        assert [record.message for record in read_capture(filename, {'ws://feed2'})] == [{'data': [2]}]
+
+    def test_should_append_to_existing_captures(self, tmpdir):
+        # given
+        filename = str(tmpdir.join("capture.gz"))
+        for receive_time in [1.0, 2.0]:
+            capture = CaptureWriter(filename)
+            capture.write('ws://feed', {'data': []}, receive_time)
+            capture.close()
+
+        # expect
+        assert [record.time for record in read_capture(filename)] == [1.0, 2.0]
+
+    def test_should_read_captures_which_have_not_been_closed(self, tmpdir):
+        # given
+        filename = str(tmpdir.join("capture.gz"))
+        capture = CaptureWriter(filename, flush_interval=0)
+        capture.write('ws://feed', {'data': []}, 1.0)
+        capture.write('ws://feed', {'data': []}, 2.0)
+
+        # expect
+        assert [record.time for record in read_capture(filename)] == [1.0, 2.0]
+
+    def test_should_read_captures_of_runs_which_have_been_killed(self, tmpdir):
+        # given
+        filename = str(tmpdir.join("capture.gz"))
+        killed_captures = []
+        for receive_time in [1.0, 2.0, 3.0]:
+            capture = CaptureWriter(filename, flush_interval=0)
+            capture.write('ws://feed', {'data': [receive_time] * 10000}, receive_time)
+            capture.write('ws://feed', {'data': []}, receive_time + 0.5)
+            killed_captures.append(capture)
+
+        # when
+        capture = CaptureWriter(filename)
+        capture.write('ws://feed', {'data': []}, 4.0)
+        capture.close()
+
+        # then
+        assert [record.time for record in read_capture(filename)] == [1.0, 1.5, 2.0, 2.5, 3.0, 3.5, 4.0]
+
+    def test_should_capture_messages_routed_to_subscriptions(self, tmpdir):
+        # given
+        filename = str(tmpdir.join("capture.gz"))
+        connection = WebSocketConnection('wss://okex', 5)
+        connection.capture = CaptureWriter(filename)
+        for _ in range(2):
+            connection.subscribe(WebSocketSubscription(subscribe_event('spot/ticker:ETH-USDT'), lambda message: None,
+                                                       source='eth'))
+
+        # when
+        connection._on_message(None, deflate({'table': 'spot/ticker', 'data': [ticker('ETH-USDT', '100'),
+                                                                               ticker('BTC-USDT', '4000')]}))
+        connection.capture.close()
+
+        # then
+        records = list(read_capture(filename))
+        assert len(records) == 1
+        assert records[0].source == 'eth'
+        assert records[0].message['data'] == [ticker('ETH-USDT', '100')]
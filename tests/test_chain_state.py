@@ -0,0 +1,191 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2018 reverendus
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import json
+import threading
+from http.server import BaseHTTPRequestHandler
+
+import pytest
+from web3 import Web3, HTTPProvider
+
+from market_maker_keeper.chain_state import BlockStateCache, JsonRpcBatch, OASIS_IS_CLOSED
+from pymaker import Address
+from pymaker.deployment import Deployment
+from pymaker.numeric import Wad
+from pymaker.token import DSToken
+from tests.helper import ThreadingHTTPServer
+
+
+class FakeNode:
+    def __init__(self):
+        self.block_number = 100
+        self.requests = []
+
+        node = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                payload = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+                node.requests.append(payload)
+
+                if isinstance(payload, list):
+                    response = [node.respond(item) for item in reversed(payload)]
+                else:
+                    response = node.respond(payload)
+
+                body = json.dumps(response).encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def respond(self, item: dict) -> dict:
+        if item['method'] == 'eth_blockNumber':
+            return {'jsonrpc': '2.0', 'id': item['id'], 'result': hex(self.block_number)}
+        elif item['method'] == 'eth_getBalance':
+            return {'jsonrpc': '2.0', 'id': item['id'], 'result': hex(self.block_number * 10)}
+        elif item['method'] == 'eth_call' and item['params'][0]['data'] == OASIS_IS_CLOSED:
+            return {'jsonrpc': '2.0', 'id': item['id'], 'result': '0x' + '0' * 64}
+        elif item['method'] == 'eth_call':
+            return {'jsonrpc': '2.0', 'id': item['id'], 'result': '0x' + hex(self.block_number)[2:].rjust(64, '0')}
+        else:
+            return {'jsonrpc': '2.0', 'id': item['id'], 'error': {'code': -32601, 'message': 'Method not found'}}
+
+    def batches(self) -> list:
+        return list(filter(lambda payload: isinstance(payload, list), self.requests))
+
+    def shutdown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def node():
+    node = FakeNode()
+    yield node
+    node.shutdown()
+
+
+class TestBlockStateCache:
+    our_address = Address('0x0000000000000000000000000000000000000001')
+    token = Address('0x0000000000000000000000000000000000000002')
+    market = Address('0x0000000000000000000000000000000000000003')
+
+    def cache(self, node: FakeNode) -> BlockStateCache:
+        cache = BlockStateCache(Web3(HTTPProvider(node.url)), self.our_address)
+        cache.track_balance(self.token)
+        cache.track_call('is_closed', self.market, OASIS_IS_CLOSED)
+        return cache
+
+    def test_should_read_the_whole_state_in_one_batch_request(self, node):
+        # given
+        cache = self.cache(node)
+
+        # when
+        state = cache.get()
+
+        # then
+        assert state.block_number == 100
+        assert state.eth_balance == Wad(1000)
+        assert state.balance(self.token) == Wad(100)
+        assert state.call('is_closed') == 0
+
+        # and
+        assert len(node.batches()) == 1
+        assert [call['method'] for call in node.batches()[0]] == ['eth_getBalance', 'eth_call', 'eth_call']
+        assert all(call['params'][-1] == hex(100) for call in node.batches()[0])
+
+    def test_should_read_the_state_again_only_when_a_new_block_gets_mined(self, node):
+        # given
+        cache = self.cache(node)
+
+        # when
+        for _ in range(5):
+            cache.get()
+
+        # then
+        assert len(node.batches()) == 1
+
+        # when
+        node.block_number = 101
+        state = cache.get()
+
+        # then
+        assert state.balance(self.token) == Wad(101)
+        assert len(node.batches()) == 2
+
+    def test_should_not_ask_for_the_block_number_if_already_known(self, node):
+        # given
+        cache = self.cache(node)
+
+        # when
+        state = cache.get(block_number=100)
+
+        # then
+        assert state.block_number == 100
+        assert node.requests == node.batches()
+
+    def test_should_call_cached_functions_once_per_block(self, node):
+        # given
+        cache = self.cache(node)
+        calls = []
+
+        def our_orders():
+            calls.append(1)
+            return ['order']
+
+        # when
+        results = [cache.cached('our_orders', our_orders) for _ in range(3)]
+        node.block_number = 101
+        results.append(cache.cached('our_orders', our_orders))
+
+        # then
+        assert results == [['order']] * 4
+        assert len(calls) == 2
+
+    def test_should_fail_if_any_call_in_the_batch_fails(self, node):
+        # given
+        batch = JsonRpcBatch(Web3(HTTPProvider(node.url)))
+        batch.add('eth_blockNumber', [])
+        batch.add('eth_unknownMethod', [])
+
+        # expect
+        with pytest.raises(ValueError):
+            batch.execute()
+
+    def test_should_read_the_state_one_call_at_a_time_without_http(self, deployment: Deployment):
+        # given
+        cache = BlockStateCache(deployment.web3, deployment.our_address)
+        cache.track_balance(deployment.sai.address)
+        cache.track_call('is_closed', deployment.otc.address, OASIS_IS_CLOSED)
+
+        # when
+        DSToken(web3=deployment.web3, address=deployment.sai.address).mint(Wad.from_number(10)).transact()
+        state = cache.get()
+
+        # then
+        assert state.block_number == deployment.web3.eth.blockNumber
+        assert state.balance(deployment.sai.address) == deployment.sai.balance_of(deployment.our_address)
+        assert state.call('is_closed') == 0
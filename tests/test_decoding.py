@@ -0,0 +1,64 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2017-2018 reverendus
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import datetime
+import json
+import sys
+import zlib
+
+import pytest
+
+from market_maker_keeper.decoding import MessageDecoder, json_backend, parse_timestamp
+
+
+def strptime_timestamp(value: str) -> float:
+    return (datetime.datetime.strptime(value, '%Y-%m-%dT%H:%M:%S.%fZ') - datetime.datetime(1970, 1, 1)).total_seconds()
+
+
+class TestParseTimestamp:
+    @pytest.mark.parametrize('value', ['2019-01-06T07:05:00.123Z', '2019-01-06T07:05:00.1Z', '2019-01-06T23:59:59.999999Z',
+                                       '1970-01-01T00:00:00.000Z', '2020-02-29T12:00:00.5Z', '2038-01-19T03:14:08.000001Z'])
+    def test_should_parse_the_same_way_as_strptime(self, value):
+        assert parse_timestamp(value) == strptime_timestamp(value)
+
+    @pytest.mark.parametrize('value', ['2019-01-06T07:05:00Z', '2019-01-06T24:05:00.123Z', '2019-01-06T07:05:00.+12Z',
+                                       '2019-02-30T07:05:00.123Z', '2019-01-06 07:05:00.123Z', ''])
+    def test_should_reject_invalid_timestamps(self, value):
+        with pytest.raises(ValueError):
+            parse_timestamp(value)
+
+
+class TestMessageDecoder:
+    def test_should_decode_compressed_and_text_frames(self):
+        # given
+        decoder = MessageDecoder('json')
+        compressor = zlib.compressobj(wbits=-zlib.MAX_WBITS)
+        frame = compressor.compress(json.dumps({'table': 'spot/ticker'}).encode()) + compressor.flush()
+
+        # expect
+        assert decoder.decode(frame) == {'table': 'spot/ticker'}
+        assert decoder.decode('{"table": "spot/ticker"}') == {'table': 'spot/ticker'}
+
+    def test_should_fail_if_the_json_backend_is_not_installed(self, monkeypatch):
+        # given
+        monkeypatch.setitem(sys.modules, 'orjson', None)
+        monkeypatch.setitem(sys.modules, 'ujson', None)
+
+        # expect
+        assert json_backend() is json.loads
+        with pytest.raises(ImportError):
+            json_backend('orjson')
@@ -0,0 +1,110 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2018 reverendus
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from market_maker_keeper.gas import GasOracle, LocalGasStation, SmartGasPrice
+from pymaker import Address
+from pymaker.deployment import Deployment
+from pymaker.gas import FixedGasPrice
+from pymaker.numeric import Wad
+
+GWEI = 1000000000
+
+
+class TestSmartGasPrice:
+    def test_should_escalate_from_the_fast_gas_price(self):
+        # given
+        gas_station = LocalGasStation(20*GWEI)
+        gas_price = SmartGasPrice(GasOracle(gas_station))
+
+        # when
+        gas_price.gas_oracle.refresh()
+
+        # then
+        assert gas_price.get_gas_price(0) == 22*GWEI
+        assert gas_price.get_gas_price(59) == 22*GWEI
+        assert gas_price.get_gas_price(61) == 32*GWEI
+        assert gas_price.get_gas_price(300) == 72*GWEI
+        assert gas_price.get_gas_price(3600) == 72*GWEI
+
+    def test_should_use_the_default_schedule_if_the_feed_is_down(self):
+        # given
+        gas_price = SmartGasPrice(GasOracle(LocalGasStation(None)))
+
+        # when
+        gas_price.gas_oracle.refresh()
+
+        # then
+        assert gas_price.get_gas_price(0) == 50*GWEI
+        assert gas_price.get_gas_price(120) == 70*GWEI
+        assert gas_price.get_gas_price(3600) == 100*GWEI
+
+    def test_should_follow_fast_gas_price_updates(self):
+        # given
+        gas_station = LocalGasStation(20*GWEI)
+        gas_price = SmartGasPrice(GasOracle(gas_station))
+        gas_price.gas_oracle.refresh()
+
+        # when
+        gas_station.price = 40*GWEI
+        gas_price.gas_oracle.refresh()
+
+        # then
+        assert gas_price.get_gas_price(0) == 44*GWEI
+
+    def test_should_keep_the_last_fast_gas_price_until_it_expires(self):
+        # given
+        gas_station = LocalGasStation(20*GWEI)
+        gas_oracle = GasOracle(gas_station, expiry=600)
+        gas_oracle.refresh()
+
+        # when
+        gas_station.price = None
+        gas_oracle.refresh()
+
+        # then
+        assert gas_oracle.fast_price() == 20*GWEI
+
+        # when
+        gas_oracle._updated_at -= 601
+
+        # then
+        assert gas_oracle.fast_price() is None
+
+
+class TestGasOracle:
+    def test_should_calculate_the_fast_gas_price_from_recent_blocks(self, deployment: Deployment):
+        # given
+        gas_oracle = GasOracle(LocalGasStation(None), deployment.web3, blocks=3)
+
+        # when
+        for gas_price in [7*GWEI, 5*GWEI, 6*GWEI]:
+            deployment.sai.transfer(Address(deployment.web3.eth.accounts[1]), Wad(0)).transact(gas_price=FixedGasPrice(gas_price))
+
+        gas_oracle.refresh()
+
+        # then
+        assert gas_oracle.fast_price() == 7*GWEI
+
+    def test_should_prefer_the_gas_station(self, deployment: Deployment):
+        # given
+        gas_oracle = GasOracle(LocalGasStation(30*GWEI), deployment.web3)
+
+        # when
+        gas_oracle.refresh()
+
+        # then
+        assert gas_oracle.fast_price() == 30*GWEI
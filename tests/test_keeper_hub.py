@@ -0,0 +1,157 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2017-2018 reverendus
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import argparse
+import json
+from argparse import Namespace
+
+import pytest
+
+from market_maker_keeper.band import Bands
+from market_maker_keeper.feed import FixedFeed
+from market_maker_keeper.keeper_hub import KeeperHub
+from market_maker_keeper.multi_pair_keeper import MultiPairKeeper
+from market_maker_keeper.order_book import OrderBookManager
+from market_maker_keeper.vectorized_band import VectorizedBands
+
+
+class FakeKeeper:
+    def __init__(self, args: list, hub: KeeperHub):
+        self.args = args
+        self.hub = hub
+        self.spread_feed = hub.spread_feed(Namespace(spread_feed=None, spread_feed_expiry=3600))
+        self.api = hub.shared(('fake-api', args[args.index('--api-key') + 1]), lambda: object())
+
+
+class TestKeeperHub:
+    def test_should_create_shared_resources_only_once(self):
+        # given
+        hub = KeeperHub()
+        created = []
+
+        # when
+        first = hub.shared(('api', 'key1'), lambda: created.append('key1') or object())
+        second = hub.shared(('api', 'key1'), lambda: created.append('key1') or object())
+        third = hub.shared(('api', 'key2'), lambda: created.append('key2') or object())
+
+        # then
+        assert first is second
+        assert first is not third
+        assert created == ['key1', 'key2']
+
+    def test_should_share_feeds_with_the_same_arguments(self):
+        # given
+        hub = KeeperHub()
+
+        # when
+        feed1 = hub.control_feed(Namespace(control_feed=None, control_feed_expiry=86400))
+        feed2 = hub.control_feed(Namespace(control_feed=None, control_feed_expiry=86400))
+        feed3 = hub.control_feed(Namespace(control_feed=None, control_feed_expiry=60))
+
+        # then
+        assert isinstance(feed1, FixedFeed)
+        assert feed1 is feed2
+        assert feed1 is not feed3
+
+    def test_should_share_the_default_executor(self):
+        # given
+        hub = KeeperHub(max_workers=3)
+
+        # when
+        default1 = hub.executor()
+        default2 = hub.executor()
+        sequential = hub.executor(('gopax', 'key1'), max_workers=1)
+
+        # then
+        assert default1 is default2
+        assert default1._max_workers == 3
+        assert sequential is not default1
+        assert sequential._max_workers == 1
+
+    def test_should_select_the_bands_engine(self):
+        # given
+        parser = argparse.ArgumentParser()
+        KeeperHub.add_bands_arguments(parser)
+
+        # expect
+        assert KeeperHub.bands_engine(parser.parse_args([])) is Bands
+        assert KeeperHub.bands_engine(parser.parse_args(['--bands-engine', 'python'])) is Bands
+        assert KeeperHub.bands_engine(parser.parse_args(['--bands-engine', 'numpy'])) is VectorizedBands
+
+    def test_should_log_limits_to_the_files_selected(self, tmpdir):
+        # given
+        parser = argparse.ArgumentParser()
+        KeeperHub.add_bands_arguments(parser)
+        prefix = str(tmpdir.join("mkr_eth"))
+
+        # when
+        history = KeeperHub.history(parser.parse_args(['--limits-log', prefix]))
+
+        # then
+        assert history.buy_history.log_file == f"{prefix}-buy.log"
+        assert history.sell_history.log_file == f"{prefix}-sell.log"
+
+        # and
+        assert KeeperHub.history(parser.parse_args([])).buy_history.log_file is None
+
+
+class TestOrderBookManagerListeners:
+    def test_should_notify_all_listeners(self):
+        # given
+        order_book_manager = OrderBookManager(refresh_frequency=1, executor=KeeperHub().executor())
+        notifications = []
+
+        # when
+        order_book_manager.on_update(lambda: notifications.append(1))
+        order_book_manager.on_update(lambda: notifications.append(2))
+        order_book_manager._report_order_book_updated()
+
+        # then
+        assert notifications == [1, 2]
+
+
+class TestMultiPairKeeper:
+    def test_should_merge_common_and_pair_arguments(self):
+        # when
+        arguments = MultiPairKeeper.keeper_arguments({'api-key': 'key', 'price-feed-expiry': 60, 'debug': False},
+                                                     'mkr_eth', {'price-feed-expiry': 30, 'config': 'mkr.json'},
+                                                     debug=True)
+
+        # then
+        assert arguments == ['--api-key', 'key', '--price-feed-expiry', '30', '--debug',
+                             '--config', 'mkr.json', '--pair', 'mkr_eth']
+
+    def test_should_create_one_keeper_per_pair_with_one_hub(self, monkeypatch):
+        # given
+        monkeypatch.setitem(MultiPairKeeper.KEEPERS, 'fake', 'tests.test_keeper_hub.FakeKeeper')
+        config = json.loads('{"keeper": "fake", "arguments": {"api-key": "key1"},'
+                            ' "pairs": {"mkr_eth": {}, "dai_eth": null, "mkr_dai": {"api-key": "key2"}}}')
+        hub = KeeperHub()
+
+        # when
+        keepers = MultiPairKeeper.create_keepers(config, hub)
+
+        # then
+        assert [keeper.args[-1] for keeper in keepers] == ['mkr_eth', 'dai_eth', 'mkr_dai']
+        assert all(keeper.hub is hub for keeper in keepers)
+        assert keepers[0].spread_feed is keepers[2].spread_feed
+        assert keepers[0].api is keepers[1].api
+        assert keepers[0].api is not keepers[2].api
+
+    def test_should_reject_unknown_keepers(self):
+        with pytest.raises(ValueError):
+            MultiPairKeeper.keeper_class('unknown')
@@ -15,6 +15,9 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import random
+import time
+
 import pytest
 
 from market_maker_keeper.limit import SideLimits, SideHistory
@@ -113,3 +116,71 @@ class TestLimits:
         assert sample_limits.available_limit(self.time_zero + 60*60*7) == Wad.from_number(0)
         assert sample_limits.available_limit(self.time_zero + 60*60*8) == Wad.from_number(0)
         assert sample_limits.available_limit(self.time_zero + 60*60*9) == Wad.from_number(0)
+
+    def test_limits_are_the_same_as_when_calculated_from_all_items(self):
+        # given
+        generator = random.Random(1)
+        side_history = SideHistory()
+        side_limits = SideLimits([{'amount': 100, 'period': '1h'},
+                                  {'amount': 500, 'period': '1d'}], side_history)
+        items = []
+
+        def expected_available_limit(timestamp: int) -> Wad:
+            return Wad.min(*[Wad.max(Wad.from_number(amount) - sum([item[1] for item in items
+                                                                     if timestamp - seconds < item[0] <= timestamp], Wad(0)), Wad(0))
+                             for amount, seconds in [(100, 3600), (500, 86400)]])
+
+        # expect
+        timestamp = self.time_zero
+        for _ in range(0, 500):
+            timestamp += generator.choice([0, 1, 60, 600, 3600])
+            item_timestamp = timestamp - generator.choice([0, 0, 0, 30])
+            amount = Wad.from_number(generator.randint(1, 20))
+
+            side_limits.use_limit(item_timestamp, amount)
+            items.append((item_timestamp, amount))
+
+            for query_timestamp in [timestamp, timestamp + 1, timestamp - 1, timestamp + 3600]:
+                assert side_limits.available_limit(query_timestamp) == expected_available_limit(query_timestamp)
+
+    def test_old_items_get_evicted(self, sample_limits):
+        # when
+        for hour in range(0, 100):
+            sample_limits.use_limit(self.time_zero + hour * 60 * 60, Wad.from_number(1))
+
+        # then
+        assert len(sample_limits.side_history.get_items()) == 24
+        assert sample_limits.available_limit(self.time_zero + 99 * 60 * 60) == Wad.from_number(99)
+
+    def test_periods_of_removed_limits_are_not_retained(self):
+        # given
+        side_history = SideHistory()
+        SideLimits([{'amount': 500, 'period': '1d'}], side_history)
+
+        # when
+        side_limits = SideLimits([{'amount': 100, 'period': '1h'}], side_history)
+        for hour in range(0, 5):
+            side_limits.use_limit(self.time_zero + hour * 60 * 60, Wad.from_number(1))
+
+        # then
+        assert len(side_history.get_items()) == 1
+        assert side_limits.available_limit(self.time_zero + 4 * 60 * 60) == Wad.from_number(99)
+
+    def test_limits_survive_restarts_if_log_file_configured(self, tmpdir):
+        # given
+        log_file = str(tmpdir.join("buy_history.log"))
+        side_limits = SideLimits([{'amount': 100, 'period': '1h'}], SideHistory(log_file=log_file))
+        timestamp = int(time.time())
+
+        # when
+        side_limits.use_limit(timestamp - 2 * 7 * 86400, Wad.from_number(50))
+        side_limits.use_limit(timestamp, Wad.from_number(5))
+        side_limits.use_limit(timestamp, Wad.from_number(10))
+
+        # and
+        restarted_side_limits = SideLimits([{'amount': 100, 'period': '1h'}], SideHistory(log_file=log_file))
+
+        # then
+        assert restarted_side_limits.available_limit(timestamp) == Wad.from_number(85)
+        assert len(restarted_side_limits.side_history.get_items()) == 2
+        assert len(open(log_file).readlines()) == 2
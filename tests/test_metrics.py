@@ -0,0 +1,225 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2017-2018 reverendus
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import argparse
+import threading
+import time
+import urllib.request
+
+import pytest
+
+from market_maker_keeper.band import NewOrder, SellBand
+from market_maker_keeper.metrics import LatencyHistogram, Metrics, MetricsMixin, SamplingProfiler, timed_stage
+from market_maker_keeper.order_book import OrderBookManager
+from market_maker_keeper.price_feed import FixedPriceFeed
+from market_maker_keeper.replay import InlineExecutor
+from market_maker_keeper.simulated_exchange import SimulatedExchange
+from pymaker.numeric import Wad
+
+
+class FakeFeed:
+    def __init__(self, timestamp: float):
+        self.timestamp = timestamp
+
+    def get(self):
+        return {}, self.timestamp
+
+
+class FakeMarketMakerKeeper(MetricsMixin):
+    def __init__(self, args: list, metrics: Metrics):
+        parser = argparse.ArgumentParser()
+        parser.add_argument("--pair", type=str)
+        self.add_metrics_arguments(parser)
+        self.arguments = parser.parse_args(args)
+
+        self.exchange = SimulatedExchange('eth_dai', {'eth': Wad.from_number(100), 'dai': Wad.from_number(1000)})
+        self.price_feed = FixedPriceFeed(Wad.from_number(10))
+        self.spread_feed = FakeFeed(time.time() - 5)
+        self.control_feed = FakeFeed(0)
+        self.order_book_manager = OrderBookManager(refresh_frequency=1, executor=InlineExecutor())
+        self.exchange.attach(self.order_book_manager)
+        self.band = SellBand({'minMargin': 0.05, 'avgMargin': 0.1, 'maxMargin': 0.15, 'minAmount': 1.0,
+                              'avgAmount': 5.0, 'maxAmount': 10.0, 'dustCutoff': 0.0})
+
+        Metrics._default = metrics
+        self.enable_metrics()
+
+    def synchronize_orders(self):
+        self.order_book_manager.refresh_order_book()
+        self.order_book_manager.get_order_book()
+        price = self.price_feed.get_price()
+        self.place_orders([NewOrder(is_sell=True, price=price.sell_price, amount=Wad.from_number(1),
+                                    pay_amount=Wad.from_number(1), buy_amount=price.sell_price,
+                                    band=self.band, confirm_function=lambda: None)])
+
+    def place_orders(self, new_orders):
+        for new_order in new_orders:
+            self.order_book_manager.place_order(lambda new_order=new_order: self.exchange.place_order(True, new_order.price, new_order.amount))
+
+
+@pytest.fixture
+def metrics():
+    default = Metrics._default
+    metrics = Metrics()
+    yield metrics
+
+    metrics.shutdown()
+    if metrics.profiler is not None:
+        metrics.profiler.stop()
+    Metrics._default = default
+
+
+class TestLatencyHistogram:
+    def test_should_return_percentiles_within_the_bucket_precision(self):
+        # given
+        histogram = LatencyHistogram()
+
+        # when
+        for value in range(1, 10001):
+            histogram.record(value / 1000.0)
+
+        # then
+        assert histogram.count == 10000
+        assert histogram.sum == pytest.approx(50005.0)
+        assert histogram.percentile(50) == pytest.approx(5.0, rel=1 / LatencyHistogram.SUB_BUCKETS)
+        assert histogram.percentile(99) == pytest.approx(9.9, rel=1 / LatencyHistogram.SUB_BUCKETS)
+        assert histogram.percentile(100) == 10.0
+
+    def test_should_record_small_values_exactly(self):
+        # given
+        histogram = LatencyHistogram()
+
+        # when
+        histogram.record(0.000017)
+        histogram.record(0.000042)
+
+        # then
+        assert histogram.percentile(50) == pytest.approx(0.000017)
+        assert histogram.percentile(100) == pytest.approx(0.000042)
+
+    def test_should_clamp_values_above_the_highest(self):
+        # given
+        histogram = LatencyHistogram(highest=1.0)
+
+        # when
+        histogram.record(5.0)
+
+        # then
+        assert histogram.percentile(100) == 1.0
+        assert LatencyHistogram().percentile(50) == 0.0
+
+
+class TestMetrics:
+    def test_should_render_histograms_as_prometheus_summaries(self, metrics):
+        # given
+        metrics.histogram('exchange_call_seconds', call='get_orders', pair='eth_dai').record(0.25)
+        metrics.histogram('exchange_call_seconds', call='place_order', pair='eth_dai').record(0.5)
+
+        # when
+        lines = metrics.render().splitlines()
+
+        # then
+        assert lines.count("# TYPE exchange_call_seconds summary") == 1
+        assert 'exchange_call_seconds{call="get_orders",pair="eth_dai",quantile="0.5"} 0.25' in lines
+        assert 'exchange_call_seconds_sum{call="place_order",pair="eth_dai"} 0.5' in lines
+        assert 'exchange_call_seconds_count{call="place_order",pair="eth_dai"} 1' in lines
+
+    def test_should_record_stages_only_inside_a_cycle(self, metrics):
+        # given
+        @timed_stage('some_stage')
+        def stage():
+            return 42
+
+        # when
+        result = stage()
+
+        # then
+        assert result == 42
+        assert metrics.render() == '\n'
+
+    def test_should_instrument_keepers(self, metrics):
+        # given
+        keeper = FakeMarketMakerKeeper(['--pair', 'eth_dai', '--profile-interval', '0.001'], metrics)
+
+        # when
+        for _ in range(3):
+            keeper.synchronize_orders()
+
+        # then
+        labels = {'keeper': 'fake', 'pair': 'eth_dai'}
+        for stage in ['synchronize_orders', 'get_order_book', 'get_price', 'place_orders']:
+            assert metrics.histogram('keeper_stage_seconds', stage=stage, **labels).count == 3
+        assert metrics.histogram('exchange_call_seconds', call='get_orders', **labels).count == 3
+        assert metrics.histogram('exchange_call_seconds', call='place_order', **labels).count == 3
+        assert metrics.histogram('keeper_feed_age_seconds', feed='spread', **labels).percentile(50) == pytest.approx(5, abs=1)
+        assert metrics.histogram('keeper_feed_age_seconds', feed='control', **labels).count == 0
+        assert len(keeper.exchange.get_orders()) == 3
+
+    def test_should_not_instrument_keepers_by_default(self, metrics):
+        # given
+        keeper = FakeMarketMakerKeeper(['--pair', 'eth_dai'], metrics)
+
+        # when
+        keeper.synchronize_orders()
+
+        # then
+        assert isinstance(keeper.price_feed, FixedPriceFeed)
+        assert metrics.render() == '\n'
+
+    def test_should_serve_metrics_over_http(self, metrics):
+        # given
+        metrics.histogram('keeper_stage_seconds', stage='bands_read').record(0.125)
+        metrics.serve(0, host='127.0.0.1')
+        port = list(metrics._servers.values())[0].server_address[1]
+
+        # when
+        body = urllib.request.urlopen(f"http://127.0.0.1:{port}/metrics", timeout=5).read().decode()
+
+        # then
+        assert 'keeper_stage_seconds_count{stage="bands_read"} 1' in body
+
+
+class TestSamplingProfiler:
+    def test_should_sample_active_threads_only(self):
+        # given
+        profiler = SamplingProfiler()
+        started = threading.Event()
+        finished = threading.Event()
+
+        def busy_cycle():
+            with profiler.active():
+                started.set()
+                finished.wait(5)
+
+        def idle():
+            finished.wait(5)
+
+        threading.Thread(target=busy_cycle).start()
+        threading.Thread(target=idle).start()
+        started.wait(5)
+
+        # when
+        profiler.sample()
+        profiler.sample()
+        finished.set()
+
+        # then
+        assert profiler.samples == 2
+        collapsed = profiler.collapsed()
+        assert 'busy_cycle' in collapsed
+        assert 'idle' not in collapsed
+        assert collapsed.endswith(" 2\n")
@@ -0,0 +1,104 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2017-2018 reverendus
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import random
+from decimal import Decimal, Context, ROUND_DOWN, DivisionByZero, InvalidOperation
+
+import pytest
+
+from futures_maker.numeric import Wad
+
+
+_context = Context(prec=1000, rounding=ROUND_DOWN)
+
+
+def decimal_from_number(number) -> int:
+    return int((Decimal(str(number)) * Decimal(10) ** 18).quantize(1, context=_context))
+
+
+def decimal_mul(a: int, b: int) -> int:
+    return int((Decimal(a) * Decimal(b) / (Decimal(10) ** Decimal(18))).quantize(1, context=_context))
+
+
+def decimal_mul_int(a: int, b: int) -> int:
+    return int((Decimal(a) * Decimal(b)).quantize(1, context=_context))
+
+
+def decimal_div(a: int, b: int) -> int:
+    return int((Decimal(a) * (Decimal(10) ** Decimal(18)) / Decimal(b)).quantize(1, context=_context))
+
+
+def random_values(seed: int, count: int) -> list:
+    generator = random.Random(seed)
+    values = [0, 1, -1, 10**18, -10**18, 10**18 - 1, 5 * 10**17, 2**128 - 1, 2**256 - 1, -(2**255)]
+    for _ in range(count):
+        magnitude = 10 ** generator.randint(0, 80)
+        values.append(generator.randint(-magnitude, magnitude))
+
+    return values
+
+
+class TestWad:
+    def test_should_multiply_exactly_like_decimal(self):
+        # given
+        values = random_values(1, 300)
+
+        # expect
+        for a in values:
+            for b in values[::7]:
+                assert (Wad(a) * Wad(b)).value == decimal_mul(a, b)
+                assert (Wad(a) * b).value == decimal_mul_int(a, b)
+
+    def test_should_divide_exactly_like_decimal(self):
+        # given
+        values = random_values(2, 300)
+
+        # expect
+        for a in values:
+            for b in values[::7]:
+                if b != 0:
+                    assert (Wad(a) / Wad(b)).value == decimal_div(a, b)
+
+    def test_should_round_half_even_like_decimal(self):
+        # given
+        ties = [10**28 + 5, 10**28 + 15, 10**29 + 50, 12345678901234567890123456785 * 10**5]
+
+        # expect
+        for a in ties:
+            assert (Wad(a) * 1).value == decimal_mul_int(a, 1)
+            assert (Wad(a) * Wad(10**18)).value == decimal_mul(a, 10**18)
+            assert (Wad(a) / Wad(2 * 10**18)).value == decimal_div(a, 2 * 10**18)
+
+    def test_should_raise_like_decimal_on_division_by_zero(self):
+        with pytest.raises(DivisionByZero):
+            Wad(1) / Wad(0)
+
+        with pytest.raises(InvalidOperation):
+            Wad(0) / Wad(0)
+
+    def test_should_create_from_numbers_exactly_like_decimal(self):
+        # given
+        generator = random.Random(3)
+        numbers = [0, 1, -1, 7, 2**256 - 1, 10**30 + 1,
+                   0.0, -0.0, 0.1, 0.3, 1.5, -2.75, 1e-05, 1.23456789e-17, 5e-19, 1.5e+20, 1e+22, -3.3e+40,
+                   Decimal('1.000000000000000000999'), '12.5']
+        numbers += [generator.uniform(-10**6, 10**6) for _ in range(500)]
+        numbers += [generator.randint(-10**40, 10**40) for _ in range(100)]
+
+        # expect
+        for number in numbers:
+            assert Wad.from_number(number).value == decimal_from_number(number)
@@ -0,0 +1,126 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2018 reverendus
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import json
+
+from market_maker_keeper.oasis_order_index import OasisOrderIndex
+from pymaker import Address
+from pymaker.approval import directly
+from pymaker.deployment import Deployment
+from pymaker.numeric import Wad
+from pymaker.token import DSToken
+
+
+class TestOasisOrderIndex:
+    @staticmethod
+    def prepare(deployment: Deployment):
+        DSToken(web3=deployment.web3, address=deployment.gem.address).mint(Wad.from_number(1000)).transact()
+        DSToken(web3=deployment.web3, address=deployment.sai.address).mint(Wad.from_number(1000)).transact()
+        deployment.gem.transfer(Address(deployment.web3.eth.accounts[1]), Wad.from_number(500)).transact()
+        deployment.sai.transfer(Address(deployment.web3.eth.accounts[1]), Wad.from_number(500)).transact()
+        deployment.otc.approve([deployment.gem, deployment.sai], directly())
+
+    @staticmethod
+    def as_other_account(deployment: Deployment, function):
+        deployment.web3.eth.defaultAccount = deployment.web3.eth.accounts[1]
+        try:
+            deployment.otc.approve([deployment.gem, deployment.sai], directly())
+            return function()
+        finally:
+            deployment.web3.eth.defaultAccount = deployment.web3.eth.accounts[0]
+
+    @staticmethod
+    def our_orders_on_chain(deployment: Deployment):
+        return sorted([(order.order_id, order.pay_amount, order.buy_amount) for order in deployment.otc.get_orders()
+                       if order.maker == deployment.our_address])
+
+    @staticmethod
+    def indexed_orders(index: OasisOrderIndex):
+        return sorted([(order.order_id, order.pay_amount, order.buy_amount) for order in index.get_orders()])
+
+    def test_should_follow_makes_takes_and_kills_of_our_orders(self, deployment: Deployment):
+        # given
+        self.prepare(deployment)
+        index = OasisOrderIndex(deployment.otc, deployment.our_address, confirmations=0)
+        assert index.get_orders() == []
+
+        # when
+        deployment.otc.make(deployment.gem.address, Wad.from_number(10), deployment.sai.address, Wad.from_number(5)).transact()
+        deployment.otc.make(deployment.gem.address, Wad.from_number(4), deployment.sai.address, Wad.from_number(4)).transact()
+        self.as_other_account(deployment, lambda: deployment.otc.make(deployment.sai.address, Wad.from_number(1),
+                                                                      deployment.gem.address, Wad.from_number(10)).transact())
+
+        # then
+        assert len(index.get_orders()) == 2
+        assert self.indexed_orders(index) == self.our_orders_on_chain(deployment)
+
+        # when
+        order_ids = sorted(order.order_id for order in index.get_orders())
+        self.as_other_account(deployment, lambda: deployment.otc.take(order_ids[0], Wad.from_number(4)).transact())
+        deployment.otc.kill(order_ids[1]).transact()
+
+        # then
+        assert self.indexed_orders(index) == [(order_ids[0], Wad.from_number(6), Wad.from_number(3))]
+        assert self.indexed_orders(index) == self.our_orders_on_chain(deployment)
+
+        # when
+        self.as_other_account(deployment, lambda: deployment.otc.take(order_ids[0], Wad.from_number(6)).transact())
+
+        # then
+        assert index.get_orders() == []
+
+    def test_should_replay_events_from_the_checkpoint_block(self, deployment: Deployment):
+        # given
+        self.prepare(deployment)
+        from_block = deployment.web3.eth.blockNumber
+        deployment.otc.make(deployment.gem.address, Wad.from_number(10), deployment.sai.address, Wad.from_number(5)).transact()
+        deployment.otc.make(deployment.sai.address, Wad.from_number(5), deployment.gem.address, Wad.from_number(12)).transact()
+
+        # when
+        index = OasisOrderIndex(deployment.otc, deployment.our_address, from_block=from_block, confirmations=0)
+
+        # then
+        assert len(index.get_orders()) == 2
+        assert self.indexed_orders(index) == self.our_orders_on_chain(deployment)
+
+    def test_should_persist_confirmed_orders_only(self, deployment: Deployment, tmpdir):
+        # given
+        self.prepare(deployment)
+        state_file = str(tmpdir.join('orders.json'))
+        index = OasisOrderIndex(deployment.otc, deployment.our_address, confirmations=2, state_file=state_file)
+        index.get_orders()
+
+        # when
+        deployment.otc.make(deployment.gem.address, Wad.from_number(10), deployment.sai.address, Wad.from_number(5)).transact()
+
+        # then
+        assert len(index.get_orders()) == 1
+        assert json.load(open(state_file))['orders'] == []
+
+        # when
+        deployment.gem.transfer(Address(deployment.web3.eth.accounts[1]), Wad.from_number(1)).transact()
+        deployment.gem.transfer(Address(deployment.web3.eth.accounts[1]), Wad.from_number(1)).transact()
+        index.get_orders()
+
+        # then
+        assert len(json.load(open(state_file))['orders']) == 1
+
+        # when
+        reloaded_index = OasisOrderIndex(deployment.otc, deployment.our_address, confirmations=2, state_file=state_file)
+
+        # then
+        assert self.indexed_orders(reloaded_index) == self.indexed_orders(index)
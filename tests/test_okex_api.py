@@ -0,0 +1,118 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2017-2018 reverendus
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import datetime
+import time
+
+from futures_maker.okex_api import OKExSwapApi
+
+
+class FakeResponse:
+    def __init__(self, data: dict):
+        self.data = data
+        self.ok = True
+        self.status_code = 200
+        self.reason = 'OK'
+        self.text = str(data)
+
+    def json(self):
+        return self.data
+
+
+class FakeSession:
+    def __init__(self, clock_offset: float):
+        self.clock_offset = clock_offset
+        self.requests = []
+
+    def get(self, url: str, headers: dict = None, timeout: int = None):
+        self.requests.append(('GET', url, headers))
+
+        if url.endswith('/api/general/v3/time'):
+            return FakeResponse({'epoch': f"{time.time() + self.clock_offset:.3f}"})
+        else:
+            return FakeResponse({'order_info': []})
+
+    def post(self, url: str, data: str = None, headers: dict = None, timeout: int = None):
+        self.requests.append(('POST', url, headers))
+        return FakeResponse({'result': True})
+
+
+class TestOKExSwapApi:
+    @staticmethod
+    def create_api(clock_offset: float, clock_sync_interval: int = 60) -> OKExSwapApi:
+        okex_api = OKExSwapApi(api_server='https://okex', api_key='key', secret_key='secret', passphrase='passphrase',
+                               timeout=10, clock_sync_interval=clock_sync_interval)
+        okex_api.session = FakeSession(clock_offset)
+
+        return okex_api
+
+    @staticmethod
+    def request_urls(okex_api: OKExSwapApi) -> list:
+        return [url for _, url, _ in okex_api.session.requests]
+
+    def test_should_read_the_server_time_only_once(self):
+        # given
+        okex_api = self.create_api(clock_offset=0.0)
+
+        # when
+        okex_api.get_orders('BTC-USD-SWAP')
+        okex_api.cancel_order('BTC-USD-SWAP', '1')
+        okex_api.cancel_order('BTC-USD-SWAP', '2')
+
+        # then
+        assert self.request_urls(okex_api) == ['https://okex/api/general/v3/time',
+                                               'https://okex/api/swap/v3/orders/BTC-USD-SWAP?status=0',
+                                               'https://okex/api/swap/v3/cancel_order/BTC-USD-SWAP/1',
+                                               'https://okex/api/swap/v3/cancel_order/BTC-USD-SWAP/2']
+
+    def test_should_sign_requests_with_the_server_time(self):
+        # given
+        okex_api = self.create_api(clock_offset=-30.0)
+
+        # when
+        okex_api.cancel_order('BTC-USD-SWAP', '1')
+
+        # then
+        _, _, headers = okex_api.session.requests[-1]
+        timestamp = datetime.datetime.strptime(headers['OK-ACCESS-TIMESTAMP'], '%Y-%m-%dT%H:%M:%S.%fZ')
+        timestamp = timestamp.replace(tzinfo=datetime.timezone.utc).timestamp()
+        assert abs(timestamp - (time.time() - 30.0)) < 1.0
+
+    def test_should_refresh_the_clock_offset_in_the_background(self):
+        # given
+        okex_api = self.create_api(clock_offset=0.0, clock_sync_interval=0)
+        okex_api.cancel_order('BTC-USD-SWAP', '1')
+
+        # when
+        okex_api.session.clock_offset = 10.0
+        okex_api.cancel_order('BTC-USD-SWAP', '2')
+        time.sleep(0.2)
+
+        # then
+        assert abs(okex_api._clock_offset - 10.0) < 1.0
+
+    def test_should_fall_back_to_the_local_clock_if_server_time_unavailable(self):
+        # given
+        okex_api = self.create_api(clock_offset=0.0)
+        okex_api.session.get = lambda url, headers=None, timeout=None: FakeResponse({})
+
+        # when
+        timestamp = okex_api._get_timestamp()
+
+        # then
+        assert okex_api._clock_offset == 0.0
+        assert timestamp.endswith('Z')
@@ -0,0 +1,227 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2017-2018 reverendus
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import threading
+import time
+
+from market_maker_keeper.order_book import OrderBookManager
+from market_maker_keeper.rate_limit import TokenBucket
+
+
+class FakeOrder:
+    def __init__(self, order_id: int):
+        self.order_id = order_id
+
+    def __repr__(self):
+        return f"FakeOrder({self.order_id})"
+
+
+class TestOrderBookManager:
+    @staticmethod
+    def order_ids(order_book) -> list:
+        return sorted(order.order_id for order in order_book.orders)
+
+    @staticmethod
+    def create_manager(orders: list) -> OrderBookManager:
+        order_book_manager = OrderBookManager(refresh_frequency=1)
+        order_book_manager.get_orders_with(lambda: list(orders))
+        order_book_manager.place_orders_with(lambda new_order: new_order)
+        order_book_manager.cancel_orders_with(lambda order: True)
+        order_book_manager.start()
+        order_book_manager.wait_for_order_book_refresh()
+
+        return order_book_manager
+
+    def test_should_return_the_same_snapshot_if_nothing_changed(self):
+        # given
+        order_book_manager = self.create_manager([FakeOrder(1), FakeOrder(2)])
+
+        # when
+        order_book_1 = order_book_manager.get_order_book()
+        order_book_2 = order_book_manager.get_order_book()
+
+        # then
+        assert order_book_1 is order_book_2
+        assert order_book_1.version == order_book_2.version
+        assert self.order_ids(order_book_1) == [1, 2]
+
+    def test_should_not_let_callers_modify_the_snapshot(self):
+        # given
+        order_book_manager = self.create_manager([FakeOrder(1), FakeOrder(2)])
+
+        # when
+        order_book_manager.get_order_book().orders.clear()
+
+        # then
+        assert self.order_ids(order_book_manager.get_order_book()) == [1, 2]
+
+    def test_should_amend_the_snapshot_with_placed_and_cancelled_orders(self):
+        # given
+        order_book_manager = self.create_manager([FakeOrder(1), FakeOrder(2)])
+        order_book_before = order_book_manager.get_order_book()
+
+        # when
+        order_book_manager.replace_orders([FakeOrder(1)], [FakeOrder(3)])
+        order_book_manager.wait_for_stable_order_book()
+
+        # then
+        order_book_after = order_book_manager.get_order_book()
+        assert order_book_after.version > order_book_before.version
+        assert self.order_ids(order_book_after) == [2, 3]
+
+    def test_should_not_duplicate_placed_orders_already_returned_by_the_refresh(self):
+        # given
+        order_book_manager = self.create_manager([FakeOrder(1), FakeOrder(2)])
+
+        # when
+        order_book_manager.place_orders([FakeOrder(2)])
+        order_book_manager.wait_for_stable_order_book()
+
+        # then
+        assert self.order_ids(order_book_manager.get_order_book()) == [1, 2]
+
+    def test_should_bring_the_order_back_if_cancellation_fails(self):
+        # given
+        order_book_manager = self.create_manager([FakeOrder(1), FakeOrder(2)])
+        order_book_manager.cancel_orders_with(lambda order: False)
+
+        # when
+        order_book_manager.replace_orders([FakeOrder(1)], [])
+        order_book_manager.wait_for_stable_order_book()
+
+        # then
+        assert self.order_ids(order_book_manager.get_order_book()) == [1, 2]
+
+    def test_should_place_orders_after_cancellations_only_once_they_are_confirmed(self):
+        # given
+        order_book_manager = self.create_manager([FakeOrder(1), FakeOrder(2)])
+        placed = []
+        order_book_manager.place_orders_with(lambda new_order: placed.append(new_order.order_id) or new_order)
+        order_book_manager.cancel_orders_with(lambda order: time.sleep(0.5) or True)
+
+        # when
+        order_book_manager.replace_orders([FakeOrder(1)], [FakeOrder(3)], [FakeOrder(4)])
+        time.sleep(0.2)
+
+        # then
+        assert placed == [3]
+        assert order_book_manager.get_order_book().orders_being_placed
+
+        # when
+        order_book_manager.wait_for_stable_order_book()
+
+        # then
+        assert placed == [3, 4]
+        assert self.order_ids(order_book_manager.get_order_book()) == [2, 3, 4]
+
+    def test_should_not_place_orders_after_cancellations_which_failed(self):
+        # given
+        order_book_manager = self.create_manager([FakeOrder(1), FakeOrder(2)])
+        order_book_manager.cancel_orders_with(lambda order: False)
+
+        # when
+        order_book_manager.replace_orders([FakeOrder(1)], [], [FakeOrder(4)])
+        order_book_manager.wait_for_stable_order_book()
+
+        # then
+        assert self.order_ids(order_book_manager.get_order_book()) == [1, 2]
+
+    def test_should_place_orders_after_cancellations_confirmed_on_both_sides_of_a_refresh(self):
+        # given
+        open_orders = [FakeOrder(1), FakeOrder(2), FakeOrder(3)]
+        order_book_manager = self.create_manager(open_orders)
+        placed = []
+        cancellations = {1: threading.Event(), 2: threading.Event()}
+
+        def cancel_order_function(order) -> bool:
+            cancellations[order.order_id].wait(5)
+            open_orders.remove(order)
+            return True
+
+        order_book_manager.place_orders_with(lambda new_order: placed.append(new_order.order_id) or new_order)
+        order_book_manager.cancel_orders_with(cancel_order_function)
+
+        # when
+        order_book_manager.replace_orders([open_orders[0], open_orders[1]], [], [FakeOrder(4)])
+        cancellations[1].set()
+        while order_book_manager.get_order_book().cancellations_in_flight > 1:
+            time.sleep(0.01)
+
+        # and
+        order_book_manager.refresh_order_book()
+        cancellations[2].set()
+        order_book_manager.wait_for_stable_order_book()
+
+        # then
+        assert placed == [4]
+        assert self.order_ids(order_book_manager.get_order_book()) == [3, 4]
+
+    def test_should_not_block_the_caller_when_cancelling_orders(self):
+        # given
+        order_book_manager = self.create_manager([FakeOrder(order_id) for order_id in range(0, 40)])
+
+        # when
+        started = time.time()
+        order_book_manager.cancel_orders(order_book_manager.get_order_book().orders)
+
+        # then
+        assert time.time() - started < 1.0
+        assert order_book_manager.get_order_book().orders == []
+        assert order_book_manager.get_order_book().orders_being_cancelled
+        assert order_book_manager.get_order_book().cancellations_queued > 0
+
+    def test_should_respect_the_cancel_rate_limit(self):
+        # given
+        order_book_manager = OrderBookManager(refresh_frequency=1, cancel_rate_limit=TokenBucket(rate=10.0, capacity=5))
+        order_book_manager.get_orders_with(lambda: [FakeOrder(order_id) for order_id in range(0, 10)])
+        order_book_manager.cancel_orders_with(lambda order: True)
+        order_book_manager.start()
+        order_book_manager.wait_for_order_book_refresh()
+
+        # when
+        started = time.time()
+        order_book_manager.cancel_orders(order_book_manager.get_order_book().orders)
+        order_book_manager.wait_for_order_cancellation()
+
+        # then
+        assert 0.4 <= time.time() - started < 2.0
+        assert order_book_manager.get_order_book().cancellations_in_flight == 0
+
+    def test_should_cancel_orders_in_batches_if_configured(self):
+        # given
+        batches = []
+        open_orders = [FakeOrder(order_id) for order_id in range(0, 5)]
+
+        def cancel_orders_function(orders: list) -> list:
+            batches.append(len(orders))
+            cancelled_order_ids = [order.order_id for order in orders if order.order_id != 3]
+            open_orders[:] = [order for order in open_orders if order.order_id not in cancelled_order_ids]
+            return cancelled_order_ids
+
+        order_book_manager = OrderBookManager(refresh_frequency=1, cancel_rate_limit=TokenBucket(rate=1.0, capacity=1))
+        order_book_manager.get_orders_with(lambda: list(open_orders))
+        order_book_manager.cancel_orders_in_batches_with(cancel_orders_function, batch_size=10)
+        order_book_manager.start()
+        order_book_manager.wait_for_order_book_refresh()
+
+        # when
+        order_book_manager.cancel_orders(order_book_manager.get_order_book().orders)
+        order_book_manager.wait_for_stable_order_book()
+
+        # then
+        assert batches == [5]
+        assert self.order_ids(order_book_manager.get_order_book()) == [3]
@@ -0,0 +1,150 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2017-2018 reverendus
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import threading
+import time
+
+from futures_maker.numeric import Wad
+from futures_maker.order_executor import OrderExecutor, PendingOrder
+from futures_maker.strategy import Strategy
+
+
+class FakeOrder:
+    def __init__(self, order_id: str, status: int):
+        self.order_id = order_id
+        self.status = status
+
+
+class FakeOKExSwapApi:
+    def __init__(self, place_delay: float = 0.0, time_out: bool = False):
+        self.place_delay = place_delay
+        self.time_out = time_out
+        self.placed_orders = {}
+        self.released = threading.Event()
+        self.released.set()
+
+    def place_order(self, instrument_id: str, type: int, price: Wad, size: Wad, client_oid: str = None) -> str:
+        self.released.wait()
+        time.sleep(self.place_delay)
+
+        order_id = str(len(self.placed_orders) + 1)
+        self.placed_orders[client_oid] = FakeOrder(order_id, 0)
+
+        if self.time_out:
+            raise Exception("Read timed out")
+
+        return order_id
+
+    def get_order(self, instrument_id: str, order_id: str):
+        for client_oid, order in self.placed_orders.items():
+            if order_id in [client_oid, order.order_id]:
+                return order
+
+        raise Exception("Order does not exist")
+
+
+class TestOrderExecutor:
+    @staticmethod
+    def wait_for(condition):
+        deadline = time.time() + 5
+        while not condition() and time.time() < deadline:
+            time.sleep(0.01)
+
+    def test_should_not_block_the_caller(self):
+        # given
+        api = FakeOKExSwapApi(place_delay=1.0)
+        order_executor = OrderExecutor(api)
+
+        # when
+        started = time.time()
+        order = order_executor.place_order('BTC-USD-SWAP', Strategy.ENTER_LONG, Wad.from_number(100), Wad.from_number(1))
+
+        # then
+        assert time.time() - started < 0.5
+        assert order.state == PendingOrder.PENDING
+        assert order_executor.has_active_order('BTC-USD-SWAP', Strategy.ENTER_LONG)
+        assert not order_executor.has_active_order('BTC-USD-SWAP', Strategy.ENTER_SHORT)
+
+    def test_should_call_ack_and_fill_callbacks(self):
+        # given
+        api = FakeOKExSwapApi()
+        order_executor = OrderExecutor(api)
+        acks, fills = [], []
+
+        # when
+        order = order_executor.place_order('BTC-USD-SWAP', Strategy.ENTER_LONG, Wad.from_number(100), Wad.from_number(1),
+                                           on_ack=acks.append, on_fill=fills.append)
+        self.wait_for(lambda: order.state == PendingOrder.OPEN)
+
+        # then
+        assert acks == [order]
+        assert order.order_id == '1'
+
+        # when
+        api.placed_orders[order.client_oid].status = 2
+        order_executor.check_fills()
+
+        # then
+        assert fills == [order]
+        assert order.state == PendingOrder.FILLED
+        assert order_executor.active_orders() == []
+
+    def test_should_find_the_order_by_client_oid_if_placement_timed_out(self):
+        # given
+        api = FakeOKExSwapApi(time_out=True)
+        order_executor = OrderExecutor(api)
+
+        # when
+        order = order_executor.place_order('BTC-USD-SWAP', Strategy.ENTER_LONG, Wad.from_number(100), Wad.from_number(1))
+        self.wait_for(lambda: order.state != PendingOrder.PENDING)
+
+        # then
+        assert order.state == PendingOrder.OPEN
+        assert order.order_id == '1'
+        assert len(api.placed_orders) == 1
+
+    def test_should_fail_the_order_if_it_was_not_placed(self):
+        # given
+        api = FakeOKExSwapApi()
+        api.place_order = lambda *args, **kwargs: -1
+        order_executor = OrderExecutor(api)
+        failures = []
+
+        # when
+        order = order_executor.place_order('BTC-USD-SWAP', Strategy.ENTER_LONG, Wad.from_number(100), Wad.from_number(1),
+                                           on_failure=failures.append)
+        self.wait_for(lambda: order.state != PendingOrder.PENDING)
+
+        # then
+        assert order.state == PendingOrder.FAILED
+        assert failures == [order]
+
+    def test_should_let_the_strategy_skip_duplicate_entries(self):
+        # given
+        api = FakeOKExSwapApi()
+        api.released.clear()
+        strategy = Strategy('BTC-USD-SWAP')
+        strategy.set_executor(OrderExecutor(api))
+
+        # when
+        strategy.place_order(Strategy.ENTER_LONG, Wad.from_number(100), Wad.from_number(1))
+
+        # then
+        assert strategy.has_active_order(Strategy.ENTER_LONG)
+
+        # cleanup
+        api.released.set()
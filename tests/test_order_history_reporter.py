@@ -0,0 +1,173 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2017-2018 reverendus
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import gzip
+import json
+import os
+import threading
+from http.server import BaseHTTPRequestHandler
+
+import pytest
+
+from market_maker_keeper.order_history_reporter import OrderHistoryReporter
+from pymaker.numeric import Wad
+from tests.helper import ThreadingHTTPServer
+
+
+class FakeOrder:
+    def __init__(self, amount: float, price: float):
+        self.remaining_buy_amount = Wad.from_number(amount)
+        self.remaining_sell_amount = Wad.from_number(amount)
+        self.sell_to_buy_price = Wad.from_number(price)
+        self.buy_to_sell_price = Wad.from_number(price)
+
+
+class FakeEndpoint:
+    def __init__(self):
+        self.reports = []
+        self.encodings = []
+        self.connections = set()
+        self.status = 200
+        self.received = threading.Event()
+        self.release = threading.Event()
+        self.release.set()
+
+        endpoint = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_POST(self):
+                endpoint.received.set()
+                endpoint.release.wait(5)
+                body = self.rfile.read(int(self.headers['Content-Length']))
+                if self.headers.get('Content-Encoding') == 'gzip':
+                    body = gzip.decompress(body)
+
+                if endpoint.status == 200:
+                    endpoint.reports.append(json.loads(body))
+                    endpoint.encodings.append(self.headers.get('Content-Encoding'))
+                    endpoint.connections.add(self.client_address)
+
+                self.send_response(endpoint.status)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}/orders"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def shutdown(self):
+        self.release.set()
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def endpoint():
+    endpoint = FakeEndpoint()
+    yield endpoint
+    endpoint.shutdown()
+
+
+class TestOrderHistoryReporter:
+    def test_should_report_orders_through_one_session(self, endpoint):
+        # given
+        reporter = OrderHistoryReporter(endpoint.url, 0)
+        reporter.enable_gzip()
+
+        # when
+        for _ in range(3):
+            reporter.report_orders([FakeOrder(1, 100)], [FakeOrder(2, 110)])
+            assert reporter.wait(5)
+
+        # then
+        assert len(endpoint.reports) == 3
+        assert endpoint.reports[0]['orders'] == [{'amount': '1.000000000000000000', 'price': '100.000000000000000000', 'type': 'buy'},
+                                                 {'amount': '2.000000000000000000', 'price': '110.000000000000000000', 'type': 'sell'}]
+        assert endpoint.encodings == ['gzip'] * 3
+        assert len(endpoint.connections) == 1
+
+    def test_should_coalesce_snapshots_while_the_endpoint_is_slow(self, endpoint):
+        # given
+        reporter = OrderHistoryReporter(endpoint.url, 0)
+        endpoint.release.clear()
+        reporter.report_orders([FakeOrder(1, 100)], [])
+        assert endpoint.received.wait(5)
+
+        # when
+        for amount in range(2, 6):
+            reporter.report_orders([FakeOrder(amount, 100)], [])
+        endpoint.release.set()
+        assert reporter.wait(5)
+
+        # then
+        assert [report['orders'][0]['amount'] for report in endpoint.reports] == ['1.000000000000000000', '5.000000000000000000']
+        assert reporter.dropped == 3
+
+    def test_should_report_deltas_against_the_last_successful_report(self, endpoint):
+        # given
+        reporter = OrderHistoryReporter(endpoint.url, 0)
+        reporter.enable_delta_encoding()
+        reporter.report_orders([FakeOrder(1, 100), FakeOrder(1, 99)], [])
+        assert reporter.wait(5)
+
+        # when
+        endpoint.status = 500
+        reporter.report_orders([FakeOrder(1, 100)], [])
+        assert reporter.wait(5)
+        endpoint.status = 200
+        reporter.report_orders([FakeOrder(1, 100)], [FakeOrder(3, 120)])
+        assert reporter.wait(5)
+
+        # then
+        assert len(endpoint.reports) == 2
+        delta = endpoint.reports[1]
+        assert delta['base'] == endpoint.reports[0]['timestamp']
+        assert delta['added'] == [{'amount': '3.000000000000000000', 'price': '120.000000000000000000', 'type': 'sell'}]
+        assert delta['removed'] == [{'amount': '1.000000000000000000', 'price': '99.000000000000000000', 'type': 'buy'}]
+
+    def test_should_spool_reports_while_the_endpoint_is_down(self, endpoint, tmpdir):
+        # given
+        spool_file = str(tmpdir.join('spool.jsonl'))
+        reporter = OrderHistoryReporter(endpoint.url, 0)
+        reporter.enable_delta_encoding()
+        reporter.enable_spooling(spool_file)
+
+        # when
+        endpoint.status = 503
+        for amount in [1, 2]:
+            reporter.report_orders([FakeOrder(amount, 100)], [])
+            assert reporter.wait(5)
+
+        # then
+        assert endpoint.reports == []
+        assert len(open(spool_file).readlines()) == 2
+
+        # when
+        endpoint.status = 200
+        reporter.report_orders([FakeOrder(3, 100)], [])
+        assert reporter.wait(5)
+
+        # then
+        assert [report['orders'][0]['amount'] for report in endpoint.reports] == ['1.000000000000000000',
+                                                                                  '2.000000000000000000',
+                                                                                  '3.000000000000000000']
+        assert not os.path.exists(spool_file)
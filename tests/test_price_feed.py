@@ -15,13 +15,17 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import threading
 import time
+from argparse import Namespace
 from typing import Optional
 from typing import Tuple
 
 from market_maker_keeper.feed import Feed
+import pytest
+
 from market_maker_keeper.price_feed import PriceFeed, BackupPriceFeed, AveragePriceFeed, Price, WebSocketPriceFeed, \
-    ReversePriceFeed
+    ReversePriceFeed, CachedPriceFeed, FixedPriceFeed, PriceFeedFactory
 from pymaker.numeric import Wad
 
 
@@ -45,6 +49,35 @@ class FakePriceFeed(PriceFeed):
         self.price = price
 
 
+class FakeSourcePriceFeed(FakePriceFeed):
+    def __init__(self, price: Optional[float] = None, age: Optional[float] = None, volume: Optional[float] = None,
+                 variance: Optional[float] = None):
+        super().__init__()
+        self.price = Wad.from_number(price) if price is not None else None
+        self._timestamp = time.time() - age if age is not None else None
+        self._volume = volume
+        self._variance = variance
+        self.fail = False
+        self.release = threading.Event()
+        self.release.set()
+
+    def get_price(self) -> Price:
+        self.release.wait()
+        if self.fail:
+            raise Exception("Source unavailable")
+
+        return super().get_price()
+
+    def timestamp(self) -> Optional[float]:
+        return self._timestamp
+
+    def volume(self) -> Optional[float]:
+        return self._volume
+
+    def variance(self) -> Optional[float]:
+        return self._variance
+
+
 class TestWebSocketPriceFeed:
     def test_should_handle_no_price(self):
         # when
@@ -149,6 +182,114 @@ class TestAveragePriceFeed:
         assert average_price_feed.get_price().sell_price == Wad.from_number(14.0)
 
 
+    def test_median(self):
+        # given
+        average_price_feed = AveragePriceFeed([FakeSourcePriceFeed(10), FakeSourcePriceFeed(11), FakeSourcePriceFeed(50)],
+                                              mode='median')
+
+        # expect
+        assert average_price_feed.get_price().buy_price == Wad.from_number(11)
+
+        # when
+        average_price_feed.feeds.append(FakeSourcePriceFeed(12))
+
+        # then
+        assert average_price_feed.get_price().sell_price == Wad.from_number(11.5)
+
+    def test_volume_weighted(self):
+        # given
+        average_price_feed = AveragePriceFeed([FakeSourcePriceFeed(10, volume=300), FakeSourcePriceFeed(20, volume=100),
+                                               FakeSourcePriceFeed(1000)], mode='volume-weighted')
+
+        # expect
+        assert average_price_feed.get_price().buy_price == Wad.from_number(12.5)
+
+        # and
+        assert AveragePriceFeed([FakeSourcePriceFeed(10), FakeSourcePriceFeed(20)],
+                                mode='volume-weighted').get_price().buy_price == Wad.from_number(15)
+
+    def test_should_ignore_stale_and_unstable_feeds(self):
+        # given
+        average_price_feed = AveragePriceFeed([FakeSourcePriceFeed(10, age=1), FakeSourcePriceFeed(20, age=120),
+                                               FakeSourcePriceFeed(30, variance=0.5), FakeSourcePriceFeed(12)],
+                                              max_age=60, max_variance=0.01)
+
+        # expect
+        assert average_price_feed.get_price().buy_price == Wad.from_number(11)
+
+
+class TestCachedPriceFeed:
+    def test_should_return_last_good_price_without_waiting_for_the_source(self):
+        # given
+        source = FakeSourcePriceFeed(10)
+        cached_price_feed = CachedPriceFeed(source, refresh_frequency=3600)
+        cached_price_feed.refresh()
+
+        # when
+        source.release.clear()
+        source.set_price(Wad.from_number(11))
+        started = time.time()
+
+        # then
+        assert cached_price_feed.get_price().buy_price == Wad.from_number(10)
+        assert time.time() - started < 0.1
+
+        # when
+        source.release.set()
+        cached_price_feed.refresh()
+
+        # then
+        assert cached_price_feed.get_price().buy_price == Wad.from_number(11)
+        assert cached_price_feed.variance() > 0
+
+    def test_should_keep_last_good_price_until_it_expires(self):
+        # given
+        source = FakeSourcePriceFeed(10)
+        cached_price_feed = CachedPriceFeed(source, refresh_frequency=3600, expiry=60)
+        cached_price_feed.refresh()
+
+        # when
+        source.fail = True
+        cached_price_feed.refresh()
+
+        # then
+        assert cached_price_feed.get_price().sell_price == Wad.from_number(10)
+
+        # when
+        cached_price_feed._timestamp = time.time() - 61
+
+        # then
+        assert cached_price_feed.get_price().sell_price is None
+
+    def test_should_drop_price_when_the_source_has_none(self):
+        # given
+        source = FakeSourcePriceFeed(10)
+        cached_price_feed = CachedPriceFeed(source, refresh_frequency=3600)
+        cached_price_feed.refresh()
+
+        # when
+        source.set_price(None)
+        cached_price_feed.refresh()
+
+        # then
+        assert cached_price_feed.get_price().buy_price is None
+
+    def test_should_be_used_by_composite_feeds(self):
+        # given
+        sources = [FakeSourcePriceFeed(10), FakeSourcePriceFeed(20)]
+        backup_price_feed = BackupPriceFeed(sources, refresh_frequency=3600)
+        for feed in backup_price_feed.feeds:
+            feed.refresh()
+
+        # when
+        sources[0].release.clear()
+
+        # then
+        assert all(isinstance(feed, CachedPriceFeed) for feed in backup_price_feed.feeds)
+        assert backup_price_feed.get_price().buy_price == Wad.from_number(10)
+        sources[0].release.set()
+
+
 class TestReversePriceFeed:
     def test_no_values(self):
         # given
@@ -223,3 +364,60 @@ class TestBackupPriceFeed:
         # then
         assert backup_price_feed.get_price().buy_price is None
         assert backup_price_feed.get_price().sell_price is None
+
+    def test_should_skip_stale_feeds(self):
+        # given
+        backup_price_feed = BackupPriceFeed([FakeSourcePriceFeed(10, age=120), FakeSourcePriceFeed(20, age=5)], max_age=60)
+
+        # expect
+        assert backup_price_feed.get_price().buy_price == Wad.from_number(20)
+        assert backup_price_feed.timestamp() == backup_price_feed.feeds[1].timestamp()
+
+
+class TestPriceFeedFactory:
+    @staticmethod
+    def create_price_feed(price_feed: str) -> PriceFeed:
+        return PriceFeedFactory().create_price_feed(Namespace(price_feed=price_feed, price_feed_expiry=120, setzer_http_sources=False))
+
+    @staticmethod
+    def refresh(price_feed: PriceFeed):
+        for feed in price_feed.feeds:
+            feed.refresh()
+
+    def test_should_not_refresh_a_single_price_feed_in_the_background(self):
+        # when
+        price_feed = self.create_price_feed("fixed:200")
+
+        # then
+        assert isinstance(price_feed, BackupPriceFeed)
+        assert isinstance(price_feed.feeds[0], FixedPriceFeed)
+        assert price_feed.get_price().buy_price == Wad.from_number(200)
+
+    def test_should_refresh_backup_price_feeds_in_the_background(self):
+        # when
+        price_feed = self.create_price_feed("fixed:200;fixed:300")
+        self.refresh(price_feed)
+
+        # then
+        assert isinstance(price_feed, BackupPriceFeed)
+        assert all(isinstance(feed, CachedPriceFeed) for feed in price_feed.feeds)
+        assert price_feed.max_age == 120
+        assert price_feed.get_price().buy_price == Wad.from_number(200)
+
+    def test_should_average_price_feeds_with_options(self):
+        # when
+        price_feed = self.create_price_feed("median,max-age=30,max-variance=0.0001,refresh-frequency=5:fixed:100;fixed:200;fixed:400")
+        self.refresh(price_feed)
+
+        # then
+        assert isinstance(price_feed, AveragePriceFeed)
+        assert price_feed.mode == 'median'
+        assert price_feed.max_age == 30.0
+        assert price_feed.max_variance == 0.0001
+        assert all(feed.refresh_frequency == 5.0 for feed in price_feed.feeds)
+        assert price_feed.get_price().buy_price == Wad.from_number(200)
+
+    def test_should_fail_on_unknown_options(self):
+        # expect
+        with pytest.raises(Exception):
+            self.create_price_feed("mean,max-speed=3:fixed:100;fixed:200")
@@ -0,0 +1,56 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2017-2018 reverendus
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import time
+
+from market_maker_keeper.rate_limit import TokenBucket
+
+
+class TestTokenBucket:
+    def test_should_allow_a_burst_up_to_capacity(self):
+        # given
+        token_bucket = TokenBucket(rate=1.0, capacity=3)
+
+        # expect
+        assert token_bucket.try_acquire() == 0.0
+        assert token_bucket.try_acquire() == 0.0
+        assert token_bucket.try_acquire() == 0.0
+        assert token_bucket.try_acquire() > 0.0
+
+    def test_should_refill_tokens_over_time(self):
+        # given
+        token_bucket = TokenBucket(rate=20.0, capacity=1)
+        assert token_bucket.try_acquire() == 0.0
+        assert token_bucket.try_acquire() > 0.0
+
+        # when
+        time.sleep(0.1)
+
+        # then
+        assert token_bucket.try_acquire() == 0.0
+
+    def test_acquire_should_wait_for_tokens(self):
+        # given
+        token_bucket = TokenBucket(rate=10.0, capacity=1)
+        token_bucket.acquire()
+
+        # when
+        started = time.time()
+        token_bucket.acquire()
+
+        # then
+        assert time.time() - started >= 0.05
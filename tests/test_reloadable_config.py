@@ -15,7 +15,11 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
-from unittest.mock import MagicMock
+import os
+import time
+from unittest.mock import MagicMock, patch
+
+import _jsonnet
 
 from market_maker_keeper.reloadable_config import ReloadableConfig
 
@@ -138,6 +142,24 @@ class TestReloadableConfig:
         assert config["firstValueMultiplied"] == 36.0
         assert config["secondValueMultiplied"] == 9.0
 
+    def test_should_report_reloading_due_to_imported_file_changed(self, tmpdir):
+        # given
+        self.write_global_config(tmpdir, 17.0, 11.0)
+        reloadable_config = ReloadableConfig(self.write_importing_config(tmpdir))
+        reloadable_config.get_config({})
+
+        # when
+        self.write_global_config(tmpdir, 18.0, 11.0)
+        modification_time = time.time() + 10
+        os.utime(str(tmpdir.join("global_config.json")), (modification_time, modification_time))
+
+        with patch.object(reloadable_config.logger, 'info') as info:
+            config = reloadable_config.get_config({})
+
+        # then
+        assert config["firstValueMultiplied"] == 36.0
+        info.assert_called_once_with(f"Reloaded configuration from '{reloadable_config.filename}' (due to imported file changed)")
+
     def test_should_import_spreads(self, tmpdir):
         # given
         spread_feed = {
@@ -188,3 +210,106 @@ class TestReloadableConfig:
         # [no log message that the config was reloaded gets generated]
         # [as it was only parsed again]
         assert reloadable_config.logger.info.call_count == 1
+
+    def test_should_not_evaluate_the_config_again_if_nothing_changed(self, tmpdir):
+        # given
+        reloadable_config = ReloadableConfig(self.write_advanced_config(tmpdir, "b"))
+
+        # when
+        with patch('_jsonnet.evaluate_snippet', wraps=_jsonnet.evaluate_snippet) as evaluate_snippet:
+            config_1 = reloadable_config.get_config({"buySpread": "0.1"})
+            config_2 = reloadable_config.get_config({"buySpread": "0.1"})
+            config_3 = reloadable_config.get_config({"buySpread": "0.1000000001"})
+
+        # then
+        assert evaluate_snippet.call_count == 1
+        assert config_1 is config_2
+        assert config_1 is config_3
+
+    def test_should_return_the_same_object_if_the_output_did_not_change(self, tmpdir):
+        # given
+        reloadable_config = ReloadableConfig(self.write_advanced_config(tmpdir, "b"))
+
+        # when
+        config_1 = reloadable_config.get_config({"buySpread": "0.1"})
+        config_2 = reloadable_config.get_config({"buySpread": "0.2"})
+
+        # then
+        assert config_1 is config_2
+
+    def test_should_evict_least_recently_used_configs(self, tmpdir):
+        # given
+        reloadable_config = ReloadableConfig(self.write_advanced_config(tmpdir, "b"), cache_size=2)
+
+        # when
+        for spread in ["0.1", "0.2", "0.3", "0.4"]:
+            reloadable_config.get_config({"buySpread": spread})
+
+        # then
+        assert len(reloadable_config._cache) == 2
+
+    def test_should_parse_the_config_only_if_it_changed(self, tmpdir):
+        # given
+        reloadable_config = ReloadableConfig(self.write_advanced_config(tmpdir, "b"))
+        parse_function = MagicMock(side_effect=lambda config: dict(config))
+
+        # when
+        parsed_1 = reloadable_config.get_parsed_config({}, parse_function)
+        parsed_2 = reloadable_config.get_parsed_config({}, parse_function)
+
+        # then
+        assert parse_function.call_count == 1
+        assert parsed_1 is parsed_2
+
+        # when
+        self.write_advanced_config(tmpdir, "z")
+        parsed_3 = reloadable_config.get_parsed_config({}, parse_function)
+
+        # then
+        assert parse_function.call_count == 2
+        assert parsed_3["a"] == "z"
+
+    def test_should_notify_about_config_changes(self, tmpdir):
+        # given
+        reloadable_config = ReloadableConfig(self.write_advanced_config(tmpdir, "b"), watch_interval=0.05)
+        on_update = MagicMock()
+        reloadable_config.on_update(on_update)
+        reloadable_config.get_config({})
+
+        # when
+        time.sleep(0.2)
+
+        # then
+        assert on_update.call_count == 0
+
+        # when
+        self.write_advanced_config(tmpdir, "z")
+        time.sleep(0.2)
+
+        # then
+        assert on_update.call_count > 0
+        assert reloadable_config.get_config({})["a"] == "z"
+
+    def test_should_stop_notifying_once_touched_imported_file_has_been_read(self, tmpdir):
+        # given
+        self.write_global_config(tmpdir, 17.0, 11.0)
+        reloadable_config = ReloadableConfig(self.write_importing_config(tmpdir), watch_interval=0.05)
+        on_update = MagicMock()
+        reloadable_config.on_update(on_update)
+        reloadable_config.get_config({})
+
+        # when
+        modification_time = time.time() + 10
+        os.utime(str(tmpdir.join("global_config.json")), (modification_time, modification_time))
+        time.sleep(0.2)
+
+        # then
+        assert on_update.call_count > 0
+        assert reloadable_config.get_config({})["firstValueMultiplied"] == 34.0
+
+        # when
+        on_update.reset_mock()
+        time.sleep(0.2)
+
+        # then
+        assert on_update.call_count == 0
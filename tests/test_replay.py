@@ -0,0 +1,123 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2017-2018 reverendus
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import datetime
+import time
+
+import pytest
+
+from futures_maker.replay import StrategyReplay
+from market_maker_keeper.capture import CaptureRecord
+from market_maker_keeper.replay import BandsReplay, SimulatedClock
+from pymaker.numeric import Wad
+from tests.band_config import BandConfig
+
+
+def timestamp(seconds: float) -> str:
+    return (datetime.datetime(1970, 1, 1) + datetime.timedelta(seconds=seconds)).strftime('%Y-%m-%dT%H:%M:%S.%fZ')
+
+
+def price_records(prices: list, start: float = 1546758300.0) -> list:
+    return [CaptureRecord(time=start + index, source='ws://price', message={'data': [{'price': str(price),
+                                                                                     'timestamp': timestamp(start + index)}]})
+            for index, price in enumerate(prices)]
+
+
+def okex_record(seconds: float, table: str, data: dict) -> CaptureRecord:
+    return CaptureRecord(time=seconds, source='wss://okex', message={'table': table, 'data': [data]})
+
+
+class TestSimulatedClock:
+    def test_should_replace_the_time_only_while_installed(self):
+        # given
+        clock = SimulatedClock(1000.0)
+
+        # expect
+        with clock.installed():
+            assert time.time() == 1000.0
+            clock.advance_to(1500.0)
+            assert time.time() == 1500.0
+
+        assert time.time() > 1500000000
+
+
+class TestBandsReplay:
+    def replay(self, tmpdir) -> BandsReplay:
+        return BandsReplay(config=str(BandConfig.sample_config(tmpdir)), pair='eth_dai',
+                           balances={'eth': Wad.from_number(20), 'dai': Wad.from_number(200)}, price_feed='ws://price')
+
+    def test_should_place_orders_and_fill_them_as_the_price_moves(self, tmpdir):
+        # given
+        replay = self.replay(tmpdir)
+
+        # when
+        result = replay.run(price_records([1.0] * 10 + [0.9] * 10 + [1.1] * 10))
+
+        # then
+        assert result.records == 30
+        assert result.cycles == 30
+        assert result.simulated_time == 29.0
+        assert result.statistics['orders placed'] >= 2
+        assert result.statistics['orders filled'] >= 2
+        assert result.pnl > Wad(0)
+
+    def test_should_be_deterministic(self, tmpdir):
+        # given
+        records = price_records([1.0, 1.01, 0.97, 0.95, 0.99, 1.04, 1.06, 1.03, 1.0, 0.98] * 5)
+
+        # when
+        first = self.replay(tmpdir).run(records)
+        second = self.replay(tmpdir).run(records)
+
+        # then
+        assert first.pnl == second.pnl
+        assert first.statistics == second.statistics
+
+
+class TestStrategyReplay:
+    @staticmethod
+    def ticker(seconds: float, best_bid: float, best_ask: float) -> CaptureRecord:
+        return okex_record(seconds, 'swap/ticker', {'instrument_id': 'ETH-USD-SWAP', 'last': str(best_bid),
+                                                    'best_bid': str(best_bid), 'best_ask': str(best_ask),
+                                                    'timestamp': timestamp(seconds)})
+
+    @staticmethod
+    def candle(seconds: float, open: float, close: float, volume: float) -> CaptureRecord:
+        return okex_record(seconds, 'spot/candle60s', {'instrument_id': 'ETH-USDT',
+                                                       'candle': [timestamp(seconds), str(open), str(max(open, close)),
+                                                                  str(min(open, close)), str(close), str(volume)]})
+
+    def test_should_enter_and_exit_a_long_position(self):
+        # given
+        replay = StrategyReplay('ETH-USD-SWAP', sync_interval=12.0)
+        start = 1546758300.0
+        records = [self.ticker(start, 99.9, 100.1),
+                   self.candle(start + 1, 100.0, 100.5, 3000),
+                   self.ticker(start + 2, 99.9, 100.0),
+                   self.candle(start + 3, 100.5, 100.5, 3000),
+                   self.ticker(start + 4, 108.0, 108.1),
+                   self.ticker(start + 5, 108.0, 108.1)]
+
+        # when
+        result = replay.run(records)
+
+        # then
+        assert result.statistics['orders placed'] == 2
+        assert result.statistics['orders filled'] == 2
+        assert replay.strategy.is_enter_long is False
+        assert float(result.pnl) == pytest.approx(100 * (108.0 - 100.1))
+        assert replay.strategy.enter_long_info[2] == datetime.datetime(1970, 1, 1) + datetime.timedelta(seconds=start + 4)
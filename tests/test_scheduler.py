@@ -0,0 +1,104 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2017-2018 reverendus
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import time
+
+from market_maker_keeper.feed import Feed
+from market_maker_keeper.scheduler import ReactiveScheduler
+
+
+class FakeFeed(Feed):
+    def __init__(self):
+        self.on_update_function = None
+
+    def on_update(self, on_update_function):
+        self.on_update_function = on_update_function
+
+
+class TestReactiveScheduler:
+    def setup_method(self):
+        self.invocations = []
+
+    def function(self):
+        self.invocations.append(time.time())
+
+    def test_should_not_run_before_the_watchdog_starts_it(self):
+        # given
+        feed = FakeFeed()
+        scheduler = ReactiveScheduler(self.function, min_interval=0.05, max_interval=10)
+        scheduler.listen_to(feed)
+
+        # when
+        feed.on_update_function()
+        time.sleep(0.2)
+
+        # then
+        assert self.invocations == []
+
+    def test_should_run_on_update_and_coalesce_updates(self):
+        # given
+        feed = FakeFeed()
+        scheduler = ReactiveScheduler(self.function, min_interval=0.2, max_interval=10)
+        scheduler.listen_to(feed)
+        scheduler.watchdog()
+        time.sleep(0.1)
+        assert len(self.invocations) == 1
+
+        # when
+        for _ in range(0, 10):
+            feed.on_update_function()
+        time.sleep(0.5)
+
+        # then
+        assert len(self.invocations) == 2
+        assert self.invocations[1] - self.invocations[0] >= 0.2
+
+    def test_watchdog_should_trigger_if_nothing_happened_for_too_long(self):
+        # given
+        scheduler = ReactiveScheduler(self.function, min_interval=0.01, max_interval=0.1)
+        scheduler.watchdog()
+        time.sleep(0.05)
+
+        # when
+        scheduler.watchdog()
+        time.sleep(0.05)
+        # then
+        assert len(self.invocations) == 1
+
+        # when
+        time.sleep(0.1)
+        scheduler.watchdog()
+        time.sleep(0.05)
+        # then
+        assert len(self.invocations) == 2
+
+    def test_should_not_run_after_being_stopped(self):
+        # given
+        feed = FakeFeed()
+        scheduler = ReactiveScheduler(self.function, min_interval=0.01, max_interval=10)
+        scheduler.listen_to(feed)
+        scheduler.watchdog()
+        time.sleep(0.05)
+
+        # when
+        scheduler.stop()
+        feed.on_update_function()
+        scheduler.watchdog()
+        time.sleep(0.1)
+
+        # then
+        assert len(self.invocations) == 1
@@ -0,0 +1,152 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2017-2018 reverendus
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler
+
+import pytest
+
+from market_maker_keeper.price_feed import SetzerPriceFeed
+from market_maker_keeper.setzer import HTTP_SOURCES, Setzer, SetzerDaemon
+from pymaker.numeric import Wad
+from tests.helper import ThreadingHTTPServer
+
+
+class FakeSetzer(Setzer):
+    def __init__(self, prices: dict):
+        super().__init__()
+        self.prices = prices
+        self.calls = []
+
+    def price(self, source: str) -> Wad:
+        self.calls.append(source)
+        if self.prices.get(source) is None:
+            raise ValueError(f"Unknown source {source}")
+
+        return Wad.from_number(self.prices[source])
+
+
+def wait_for(condition, timeout: float = 5.0):
+    deadline = time.time() + timeout
+    while not condition():
+        assert time.time() < deadline
+        time.sleep(0.01)
+
+
+@pytest.fixture
+def ticker_server():
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            body = json.dumps({'last': '123.45'}).encode()
+            self.send_response(200)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_address[1]}/ticker"
+
+    server.shutdown()
+    server.server_close()
+
+
+class TestSetzer:
+    def test_should_kill_setzer_after_timeout(self, tmpdir):
+        # given
+        command = tmpdir.join('setzer')
+        command.write("#!/bin/sh\nexec sleep 5\n")
+        command.chmod(0o755)
+        setzer = Setzer(command=str(command), timeout=0.1)
+
+        # expect
+        with pytest.raises(ValueError, match="Timed out"):
+            setzer.price('kraken')
+
+
+class TestSetzerDaemon:
+    def test_should_fetch_each_source_once_for_all_feeds(self):
+        # given
+        setzer = FakeSetzer({'kraken': 100, 'gemini': 102})
+        setzer_daemon = SetzerDaemon(setzer=setzer, http_sources={})
+
+        # when
+        feeds = [SetzerPriceFeed('kraken', 120, setzer_daemon),
+                 SetzerPriceFeed('kraken', 120, setzer_daemon),
+                 SetzerPriceFeed('gemini', 120, setzer_daemon)]
+        wait_for(lambda: all(feed.get_price().buy_price is not None for feed in feeds))
+
+        # then
+        assert [feed.get_price().buy_price for feed in feeds] == [Wad.from_number(100), Wad.from_number(100), Wad.from_number(102)]
+        assert sorted(setzer.calls) == ['gemini', 'kraken']
+
+    def test_should_refresh_relative_to_expiry(self):
+        # given
+        setzer = FakeSetzer({'kraken': 100})
+        setzer_daemon = SetzerDaemon(setzer=setzer, http_sources={})
+
+        # when
+        setzer_daemon.subscribe('kraken', 0.2)
+        wait_for(lambda: len(setzer.calls) >= 3)
+
+        # then
+        price, timestamp = setzer_daemon.price('kraken')
+        assert price == Wad.from_number(100)
+        assert time.time() - timestamp < 0.2
+
+    def test_should_retry_failed_sources(self):
+        # given
+        setzer = FakeSetzer({'kraken': None})
+        setzer_daemon = SetzerDaemon(setzer=setzer, http_sources={})
+        setzer_daemon.subscribe('kraken', 120)
+        wait_for(lambda: len(setzer.calls) == 1)
+
+        # when
+        setzer.prices['kraken'] = 100
+        wait_for(lambda: setzer_daemon.price('kraken')[0] is not None)
+
+        # then
+        assert setzer_daemon.price('kraken')[0] == Wad.from_number(100)
+        assert len(setzer.calls) == 2
+
+    def test_should_fetch_http_sources_without_running_setzer(self, ticker_server):
+        # given
+        setzer = FakeSetzer({})
+        setzer_daemon = SetzerDaemon(setzer=setzer, http_sources={'gemini': (ticker_server, lambda data: data['last'])})
+
+        # expect
+        assert setzer_daemon.fetch('gemini') == Wad.from_number(123.45)
+        assert setzer.calls == []
+
+    def test_should_run_setzer_for_all_sources_unless_http_sources_enabled(self):
+        # given
+        setzer = FakeSetzer({'gemini': 102})
+        setzer_daemon = SetzerDaemon(setzer=setzer)
+
+        # expect
+        assert setzer_daemon.fetch('gemini') == Wad.from_number(102)
+        assert setzer.calls == ['gemini']
+
+        # and
+        assert SetzerDaemon.default().http_sources == {}
+        assert SetzerDaemon.default(http_sources=True).http_sources == HTTP_SOURCES
+        assert SetzerDaemon.default() is not SetzerDaemon.default(http_sources=True)
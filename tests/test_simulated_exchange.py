@@ -0,0 +1,146 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2017-2018 reverendus
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import pytest
+
+from market_maker_keeper.band import NewOrder, SellBand
+from market_maker_keeper.order_book import OrderBookManager
+from market_maker_keeper.rate_limit import TokenBucket
+from market_maker_keeper.replay import InlineExecutor
+from market_maker_keeper.simulated_exchange import SimulatedExchange, SimulatedExchangeError
+from pymaker.numeric import Wad
+
+
+def exchange(**kwargs) -> SimulatedExchange:
+    return SimulatedExchange('eth_dai', {'eth': Wad.from_number(100), 'dai': Wad.from_number(1000)}, **kwargs)
+
+
+class TestSimulatedExchange:
+    def test_should_fill_orders_in_price_time_priority(self):
+        # given
+        simulated_exchange = exchange()
+        first = simulated_exchange.place_order(False, Wad.from_number(9), Wad.from_number(10))
+        second = simulated_exchange.place_order(False, Wad.from_number(9), Wad.from_number(10))
+        best = simulated_exchange.place_order(False, Wad.from_number(9.5), Wad.from_number(10))
+
+        # when
+        fills = simulated_exchange.take(True, Wad.from_number(15))
+
+        # then
+        assert fills == [(best, Wad.from_number(10)), (first, Wad.from_number(5))]
+        assert simulated_exchange.get_orders() == [first, second]
+        assert first.remaining_amount == Wad.from_number(5)
+        assert simulated_exchange.balances == {'eth': Wad.from_number(115), 'dai': Wad.from_number(1000 - 95 - 45)}
+
+    def test_should_not_take_orders_beyond_the_limit_price(self):
+        # given
+        simulated_exchange = exchange()
+        near = simulated_exchange.place_order(True, Wad.from_number(11), Wad.from_number(10))
+        simulated_exchange.place_order(True, Wad.from_number(12), Wad.from_number(10))
+
+        # when
+        fills = simulated_exchange.take(False, Wad.from_number(15), limit_price=Wad.from_number(11.5))
+
+        # then
+        assert fills == [(near, Wad.from_number(10))]
+        assert simulated_exchange.orders_filled == 1
+
+    def test_should_match_crossed_orders_only(self):
+        # given
+        simulated_exchange = exchange()
+        buy = simulated_exchange.place_order(False, Wad.from_number(9), Wad.from_number(10))
+        sell = simulated_exchange.place_order(True, Wad.from_number(11), Wad.from_number(10))
+
+        # when
+        filled = simulated_exchange.match(Wad.from_number(8.5))
+
+        # then
+        assert filled == [buy]
+        assert simulated_exchange.get_orders() == [sell]
+
+    def test_should_lock_balances_of_open_orders(self):
+        # given
+        simulated_exchange = exchange()
+        order = simulated_exchange.place_order(False, Wad.from_number(9), Wad.from_number(100))
+
+        # expect
+        assert simulated_exchange.get_balances()['dai'] == Wad.from_number(100)
+        with pytest.raises(SimulatedExchangeError):
+            simulated_exchange.place_order(False, Wad.from_number(9), Wad.from_number(100))
+
+        # when
+        simulated_exchange.cancel_order(order.order_id)
+
+        # then
+        assert simulated_exchange.get_balances()['dai'] == Wad.from_number(1000)
+        assert simulated_exchange.cancel_order(order.order_id) is False
+
+    def test_should_fail_requests_at_the_error_rate(self):
+        # given
+        simulated_exchange = exchange(error_rate=0.5, seed=1)
+
+        # when
+        failures = 0
+        for _ in range(200):
+            try:
+                simulated_exchange.get_orders()
+            except SimulatedExchangeError:
+                failures += 1
+
+        # then
+        assert 70 < failures < 130
+        assert simulated_exchange.failed_requests == failures
+        assert simulated_exchange.requests == 200
+
+    def test_should_reject_requests_above_the_rate_limit(self):
+        # given
+        simulated_exchange = exchange(rate_limit=TokenBucket(rate=0.001, capacity=2))
+        simulated_exchange.get_orders()
+        simulated_exchange.get_balances()
+
+        # expect
+        with pytest.raises(SimulatedExchangeError, match="Rate limit"):
+            simulated_exchange.get_orders()
+
+    def test_should_plug_into_order_book_manager(self):
+        # given
+        simulated_exchange = exchange()
+        order_book_manager = OrderBookManager(refresh_frequency=1, executor=InlineExecutor())
+        simulated_exchange.attach(order_book_manager)
+        band = SellBand({'minMargin': 0.05, 'avgMargin': 0.1, 'maxMargin': 0.15, 'minAmount': 1.0, 'avgAmount': 5.0,
+                         'maxAmount': 10.0, 'dustCutoff': 0.0})
+
+        # when
+        order_book_manager.place_orders([NewOrder(is_sell=True, price=Wad.from_number(11), amount=Wad.from_number(5),
+                                                  pay_amount=Wad.from_number(5), buy_amount=Wad.from_number(55),
+                                                  band=band, confirm_function=lambda: None)])
+        order_book_manager.refresh_order_book()
+
+        # then
+        order_book = order_book_manager.get_order_book()
+        assert len(order_book.orders) == 1
+        assert order_book.orders[0].amount == Wad.from_number(5)
+        assert order_book.balances['eth'] == Wad.from_number(95)
+
+        # when
+        order_book_manager.cancel_orders(order_book.orders)
+        order_book_manager.dispatch_cancellations()
+        order_book_manager.refresh_order_book()
+
+        # then
+        assert order_book_manager.get_order_book().orders == []
+        assert simulated_exchange.orders_cancelled == 1
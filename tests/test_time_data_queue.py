@@ -0,0 +1,91 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2017-2018 reverendus
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import pytest
+
+from futures_maker.time_data_queue import TimeSeriesData
+
+
+def candle_message(table: str, minute: int, open: float, close: float, volume: float) -> dict:
+    return {'table': table, 'data': [{'instrument_id': 'ETH-USD-SWAP',
+                                      'candle': [f"2019-01-06T{minute // 60:02d}:{minute % 60:02d}:00.000Z",
+                                                 str(open), str(max(open, close)), str(min(open, close)), str(close),
+                                                 str(volume), str(volume / open)]}]}
+
+
+class TestTimeSeriesData:
+    def test_should_keep_only_the_last_candles(self):
+        # given
+        time_series_data = TimeSeriesData('ETH-USD-SWAP', 5)
+
+        # when
+        for minute in range(0, 12):
+            time_series_data.push(candle_message('swap/candle60s', minute, 100.0, 100.0 + minute, minute))
+
+        # then
+        view = time_series_data.candles[60].view()
+        assert list(view['close']) == [107.0, 108.0, 109.0, 110.0, 111.0]
+        assert str(view['timestamp'][0]) == '2019-01-06T00:07:00.000'
+        assert time_series_data.candles[60].volume == pytest.approx(7 + 8 + 9 + 10 + 11)
+
+    def test_should_replace_the_candle_in_progress(self):
+        # given
+        time_series_data = TimeSeriesData('ETH-USD-SWAP', 5)
+        time_series_data.push(candle_message('swap/candle60s', 0, 100.0, 101.0, 10))
+
+        # when
+        time_series_data.push(candle_message('swap/candle60s', 1, 100.0, 101.0, 10))
+        time_series_data.push(candle_message('swap/candle60s', 1, 100.0, 102.0, 15))
+
+        # then
+        view = time_series_data.candles[60].view()
+        assert list(view['close']) == [101.0, 102.0]
+        assert time_series_data.candles[60].volume == pytest.approx(25)
+
+    def test_should_keep_granularities_apart(self):
+        # given
+        time_series_data = TimeSeriesData('ETH-USD-SWAP', 5)
+
+        # when
+        time_series_data.push(candle_message('swap/candle60s', 0, 100.0, 101.0, 10))
+        time_series_data.push(candle_message('swap/candle300s', 0, 100.0, 105.0, 50))
+        time_series_data.push(candle_message('swap/ticker', 0, 100.0, 105.0, 50))
+
+        # then
+        assert time_series_data.candles[60].size == 1
+        assert time_series_data.candles[300].size == 1
+        assert time_series_data.candles[900].size == 0
+
+    def test_should_find_candles_by_percent(self):
+        # given
+        time_series_data = TimeSeriesData('ETH-USD-SWAP', 10)
+        for minute, close in enumerate([100.5, 103.0, 99.0, 101.0]):
+            time_series_data.push(candle_message('swap/candle60s', minute, 100.0, close, 1))
+
+        # expect
+        assert time_series_data.max_percent_row()['close'] == 103.0
+        assert list(time_series_data.filter_percent(0.007)['close']) == [103.0, 101.0]
+        assert time_series_data.max_percent_row(900) is None
+
+    def test_should_not_let_callers_modify_the_candles(self):
+        # given
+        time_series_data = TimeSeriesData('ETH-USD-SWAP', 10)
+        time_series_data.push(candle_message('swap/candle60s', 0, 100.0, 101.0, 1))
+
+        # expect
+        with pytest.raises(ValueError):
+            time_series_data.candles[60].view()['close'][0] = 0.0
@@ -0,0 +1,67 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2018 reverendus
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from concurrent.futures import ThreadPoolExecutor
+
+from market_maker_keeper.transaction_pipeline import TransactionPipeline
+from pymaker.approval import directly
+from pymaker.deployment import Deployment
+from pymaker.gas import FixedGasPrice
+from pymaker.numeric import Wad
+from pymaker.token import DSToken
+
+
+class TestTransactionPipeline:
+    @staticmethod
+    def prepare(deployment: Deployment):
+        DSToken(web3=deployment.web3, address=deployment.gem.address).mint(Wad.from_number(1000)).transact()
+        DSToken(web3=deployment.web3, address=deployment.sai.address).mint(Wad.from_number(1000)).transact()
+        deployment.otc.approve([deployment.gem, deployment.sai], directly())
+
+    def test_should_send_transactions_concurrently_with_consecutive_nonces(self, deployment: Deployment):
+        # given
+        self.prepare(deployment)
+        pipeline = TransactionPipeline(deployment.web3, deployment.our_address, FixedGasPrice(20000000000), poll_interval=0.1)
+        nonce = deployment.web3.eth.getTransactionCount(deployment.our_address.address)
+
+        # when
+        with ThreadPoolExecutor(max_workers=5) as executor:
+            receipts = list(executor.map(lambda amount: pipeline.transact(deployment.otc.make(deployment.gem.address, Wad.from_number(amount),
+                                                                                              deployment.sai.address, Wad.from_number(amount))),
+                                         range(1, 6)))
+
+        # then
+        assert all(receipt.successful for receipt in receipts)
+        assert sorted(receipt.result for receipt in receipts) == sorted(order.order_id for order in deployment.otc.get_orders())
+        assert sorted(deployment.web3.eth.getTransaction(receipt.transaction_hash)['nonce'] for receipt in receipts) == list(range(nonce, nonce + 5))
+        assert pipeline.pending() == 0
+
+    def test_should_recover_the_nonce_after_transactions_sent_by_other_means(self, deployment: Deployment):
+        # given
+        self.prepare(deployment)
+        pipeline = TransactionPipeline(deployment.web3, deployment.our_address, FixedGasPrice(20000000000), poll_interval=0.1)
+        assert pipeline.transact(deployment.otc.make(deployment.gem.address, Wad.from_number(1),
+                                                     deployment.sai.address, Wad.from_number(1))).successful
+
+        # when
+        deployment.otc.make(deployment.gem.address, Wad.from_number(2), deployment.sai.address, Wad.from_number(2)).transact()
+        receipt = pipeline.transact(deployment.otc.make(deployment.gem.address, Wad.from_number(3),
+                                                        deployment.sai.address, Wad.from_number(3)))
+
+        # then
+        assert receipt.successful
+        assert len(deployment.otc.get_orders()) == 3
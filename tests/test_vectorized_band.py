@@ -0,0 +1,163 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2017-2018 reverendus
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import random
+
+import numpy as np
+
+from market_maker_keeper.band import Bands, BuyBand, SellBand
+from market_maker_keeper.feed import EmptyFeed, FixedFeed
+from market_maker_keeper.limit import History, SideLimits, SideHistory
+from market_maker_keeper.price_feed import Price
+from market_maker_keeper.reloadable_config import ReloadableConfig
+from market_maker_keeper.vectorized_band import VectorizedBands, WadArray
+from tests.band_config import BandConfig
+from pymaker.numeric import Wad
+
+
+class FakeOrder:
+    def __init__(self, order_id: int, amount: Wad, price: Wad):
+        self.order_id = order_id
+        self.amount = amount
+        self.price = price
+
+    @property
+    def sell_to_buy_price(self) -> Wad:
+        return self.price
+
+    @property
+    def buy_to_sell_price(self) -> Wad:
+        return self.price
+
+    @property
+    def remaining_sell_amount(self) -> Wad:
+        return self.amount
+
+    @property
+    def remaining_buy_amount(self) -> Wad:
+        return self.amount * Wad.from_number(2)
+
+
+class TestWadArray:
+    def test_should_compare_sort_and_sum_exactly(self):
+        # given
+        values = [0, 1, 2**32 - 1, 2**32, 2**64 - 1, 2**64, 2**96 - 1] + [random.randrange(0, 2**96) for _ in range(0, 200)]
+        wad_array = WadArray.from_values(values)
+
+        # expect
+        for value in [-1, 0, 2**32, 2**64 - 1, 2**96] + values[::10]:
+            assert list(wad_array.greater_than(value)) == [element > value for element in values]
+
+        assert [values[index] for index in wad_array.argsort(descending=False)] == sorted(values)
+        assert [values[index] for index in wad_array.argsort(descending=True)] == sorted(values, reverse=True)
+        assert wad_array.sum() == sum(values)
+        assert wad_array.take(np.array([1, 3, 5])).sum() == values[1] + values[3] + values[5]
+
+    def test_should_not_represent_values_which_do_not_fit(self):
+        assert WadArray.from_values([1, -1]) is None
+        assert WadArray.from_values([1, 2**96]) is None
+
+
+class TestVectorizedBands:
+    @staticmethod
+    def band_dict(min_margin: float, max_margin: float, max_amount: float) -> dict:
+        return {'minMargin': min_margin, 'avgMargin': (min_margin + max_margin) / 2, 'maxMargin': max_margin,
+                'minAmount': max_amount / 3, 'avgAmount': max_amount / 2, 'maxAmount': max_amount, 'dustCutoff': 0.5}
+
+    def create_both_bands(self, generator: random.Random) -> tuple:
+        margins = [0.005 * i for i in range(0, 11)]
+        buy_bands = [BuyBand(self.band_dict(margins[i], margins[i+1], generator.choice([10, 20, 35]))) for i in range(0, 10)]
+        sell_bands = [SellBand(self.band_dict(margins[i], margins[i+1], generator.choice([10, 20, 35]))) for i in range(0, 10)]
+
+        return Bands(buy_bands, SideLimits([], SideHistory()), sell_bands, SideLimits([], SideHistory())), \
+               VectorizedBands(buy_bands, SideLimits([], SideHistory()), sell_bands, SideLimits([], SideHistory()))
+
+    @staticmethod
+    def create_orders(generator: random.Random, count: int, center: float) -> list:
+        return [FakeOrder(order_id,
+                          Wad.from_number(generator.choice([1, 2, 2.5, round(generator.uniform(0, 10), 3)])),
+                          Wad.from_number(generator.choice([round(generator.uniform(center * 0.93, center * 1.07), 2),
+                                                            round(center + center * 0.005 * generator.randint(-12, 12), 4)])))
+                  for order_id in range(0, count)]
+
+    @staticmethod
+    def describe(new_orders: list, bands: Bands) -> list:
+        all_bands = bands.buy_bands + bands.sell_bands
+        return [(new_order.is_sell, new_order.price, new_order.amount, new_order.pay_amount, new_order.buy_amount,
+                 all_bands.index(new_order.band)) for new_order in new_orders]
+
+    def test_should_cancel_the_same_orders_as_bands(self):
+        generator = random.Random(1)
+
+        for _ in range(0, 20):
+            # given
+            bands, vectorized_bands = self.create_both_bands(generator)
+            buy_orders = self.create_orders(generator, 400, 100)
+            sell_orders = self.create_orders(generator, 400, 100)
+            price = Price(buy_price=Wad.from_number(100), sell_price=Wad.from_number(100))
+
+            # when
+            orders_to_cancel = bands.cancellable_orders(buy_orders, sell_orders, price)
+            vectorized_orders_to_cancel = vectorized_bands.cancellable_orders(buy_orders, sell_orders, price)
+
+            # then
+            assert len(orders_to_cancel) > 0
+            assert set(vectorized_orders_to_cancel) == set(orders_to_cancel)
+            assert len(vectorized_orders_to_cancel) == len(orders_to_cancel)
+
+    def test_should_create_the_same_new_orders_as_bands(self):
+        generator = random.Random(2)
+
+        for _ in range(0, 20):
+            # given
+            bands, vectorized_bands = self.create_both_bands(generator)
+            buy_orders = self.create_orders(generator, 30, 100)
+            sell_orders = self.create_orders(generator, 30, 100)
+            price = Price(buy_price=Wad.from_number(100), sell_price=Wad.from_number(100))
+            seed = generator.randint(0, 1000)
+
+            # when
+            np.random.seed(seed)
+            new_orders = bands.new_orders(buy_orders, sell_orders, Wad.from_number(500), Wad.from_number(50), price)
+            np.random.seed(seed)
+            vectorized_new_orders = vectorized_bands.new_orders(buy_orders, sell_orders, Wad.from_number(500), Wad.from_number(50), price)
+
+            # then
+            assert len(new_orders[0]) > 0
+            assert self.describe(vectorized_new_orders[0], vectorized_bands) == self.describe(new_orders[0], bands)
+            assert vectorized_new_orders[1:] == new_orders[1:]
+
+    def test_should_fall_back_to_bands_for_values_which_do_not_fit(self):
+        # given
+        bands, vectorized_bands = self.create_both_bands(random.Random(3))
+        orders = [FakeOrder(1, Wad(2**100), Wad.from_number(99.8)), FakeOrder(2, Wad.from_number(1), Wad.from_number(99.7))]
+        price = Price(buy_price=Wad.from_number(100), sell_price=Wad.from_number(100))
+
+        # expect
+        assert vectorized_bands.cancellable_orders(orders, [], price) == bands.cancellable_orders(orders, [], price)
+
+    def test_should_be_read_from_the_config(self, tmpdir):
+        # given
+        config = ReloadableConfig(str(BandConfig.sample_config(tmpdir)))
+
+        # when
+        bands = VectorizedBands.read(config, EmptyFeed(), FixedFeed({'canBuy': True, 'canSell': True}), History())
+
+        # then
+        assert isinstance(bands, VectorizedBands)
+        assert len(bands.buy_bands) == 1
+        assert len(bands.sell_bands) == 1
@@ -0,0 +1,129 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2017-2018 reverendus
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import json
+import zlib
+
+from market_maker_keeper.feed import WebSocketFeed
+from market_maker_keeper.websocket_connection import WebSocketConnection, WebSocketConnectionManager, \
+    WebSocketSubscription
+
+
+def deflate(message: dict) -> bytes:
+    compress = zlib.compressobj(wbits=-zlib.MAX_WBITS)
+    return compress.compress(json.dumps(message).encode()) + compress.flush()
+
+
+def ticker(instrument_id: str, price: str) -> dict:
+    return {'instrument_id': instrument_id, 'last': price, 'timestamp': '2019-01-06T07:05:00.000Z'}
+
+
+def subscribe_event(*channels) -> str:
+    return json.dumps({'op': 'subscribe', 'args': list(channels)})
+
+
+class FakeWebSocket:
+    def __init__(self):
+        self.sent = []
+
+    def send(self, message: str):
+        self.sent.append(message)
+
+
+class NotConnectingManager(WebSocketConnectionManager):
+    def connection(self, ws_url: str, reconnect_delay: int) -> WebSocketConnection:
+        with self._lock:
+            return self._connections.setdefault(ws_url, WebSocketConnection(ws_url, reconnect_delay))
+
+
+class TestWebSocketConnection:
+    def test_should_route_messages_to_subscribed_channels(self):
+        # given
+        connection = WebSocketConnection('wss://okex', 5)
+        eth, btc, all = [], [], []
+        connection.subscribe(WebSocketSubscription(subscribe_event('spot/ticker:ETH-USDT'), eth.append))
+        connection.subscribe(WebSocketSubscription(subscribe_event('spot/ticker:BTC-USDT'), btc.append))
+        connection.subscribe(WebSocketSubscription(None, all.append))
+
+        # when
+        connection._on_message(None, deflate({'table': 'spot/ticker', 'data': [ticker('ETH-USDT', '100'),
+                                                                               ticker('BTC-USDT', '4000')]}))
+        connection._on_message(None, deflate({'table': 'spot/ticker', 'data': [ticker('MKR-USDT', '500')]}))
+        connection._on_message(None, deflate({'event': 'subscribe', 'channel': 'spot/ticker:ETH-USDT'}))
+
+        # then
+        assert [entry['last'] for message in eth for entry in message['data']] == ['100']
+        assert [entry['last'] for message in btc for entry in message['data']] == ['4000']
+        assert len(all) == 2
+
+    def test_should_pass_messages_without_table_to_all_subscriptions(self):
+        # given
+        connection = WebSocketConnection('wss://feed', 5)
+        eth, all = [], []
+        connection.subscribe(WebSocketSubscription(subscribe_event('spot/ticker:ETH-USDT'), eth.append))
+        connection.subscribe(WebSocketSubscription(None, all.append))
+
+        # when
+        connection._on_message(None, json.dumps({'data': [ticker('BTC-USDT', '4000')]}))
+
+        # then
+        assert [entry['last'] for message in eth for entry in message['data']] == ['4000']
+        assert [entry['last'] for message in all for entry in message['data']] == ['4000']
+
+    def test_should_send_each_open_event_once(self):
+        # given
+        connection = WebSocketConnection('wss://okex', 5)
+        connection.subscribe(WebSocketSubscription(subscribe_event('spot/ticker:ETH-USDT'), lambda message: None))
+        connection.subscribe(WebSocketSubscription(subscribe_event('spot/ticker:ETH-USDT'), lambda message: None))
+        ws = FakeWebSocket()
+
+        # when
+        connection._on_open(ws)
+        connection.subscribe(WebSocketSubscription(subscribe_event('spot/ticker:BTC-USDT'), lambda message: None))
+
+        # then
+        assert ws.sent == [subscribe_event('spot/ticker:ETH-USDT'), subscribe_event('spot/ticker:BTC-USDT')]
+
+    def test_should_share_connections_to_the_same_endpoint(self):
+        # given
+        manager = NotConnectingManager()
+
+        # when
+        feed1 = WebSocketFeed('wss://okex#' + subscribe_event('spot/ticker:ETH-USDT'), 5, manager)
+        feed2 = WebSocketFeed('wss://okex#' + subscribe_event('spot/ticker:BTC-USDT'), 5, manager)
+        feed3 = WebSocketFeed('wss://other', 5, manager)
+
+        # then
+        assert feed1.connection is feed2.connection
+        assert feed1.connection is not feed3.connection
+
+    def test_should_update_feeds_with_their_own_entries(self):
+        # given
+        manager = NotConnectingManager()
+        feed1 = WebSocketFeed('wss://okex#' + subscribe_event('spot/ticker:ETH-USDT'), 5, manager)
+        feed2 = WebSocketFeed('wss://okex#' + subscribe_event('spot/ticker:BTC-USDT'), 5, manager)
+        updates = []
+        feed1.on_update(lambda: updates.append('eth'))
+
+        # when
+        feed1.connection._on_message(None, deflate({'table': 'spot/ticker', 'data': [ticker('ETH-USDT', '100')]}))
+
+        # then
+        assert feed1.get()[0]['last'] == '100'
+        assert feed1.get()[1] == 1546758300.0
+        assert feed2.get() == ({}, 0.0)
+        assert updates == ['eth']